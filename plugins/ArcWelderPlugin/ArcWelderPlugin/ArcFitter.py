@@ -0,0 +1,437 @@
+# Copyright (c) 2022 Aldo Hoeben / fieldOfView
+# The ArcWelderPlugin for Cura is released under the terms of the AGPLv3 or higher.
+
+import math
+import re
+
+import numpy
+
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+
+class ArcFitter:
+    """Converts runs of G0/G1 moves to G2/G3 arcs, in case ArcWelder can not be run.
+
+    The fitter takes the same options as the ArcWelder console application and
+    follows the same rules: every point and every segment midpoint of the
+    original path must lie within half the resolution of the arc, the length
+    of the arc may differ from the length of the path by at most the path
+    tolerance, and the radius is limited by the maximum radius and, with
+    firmware compensation, by the minimum number of segments per circle.
+
+    Runs of moves are collected per layer and fitted greedily from their
+    start; the length of each arc is found with an exponential and binary
+    search, checking all points of a candidate arc at once with numpy.
+    """
+
+    _option_regex = re.compile(r"^-(\w)(?:=(.*))?$")
+    _decimals_regex = re.compile(r"[XYZ]-?\d*\.(\d+)|E-?\d*\.(\d+)")
+
+    _min_segments = 3
+
+    def __init__(self, arguments: List[str]) -> None:
+        options = {}  # type: Dict[str, Optional[str]]
+        for argument in arguments:
+            match = self._option_regex.match(argument)
+            if match:
+                options[match.group(1)] = match.group(2)
+
+        self._max_radius = float(options.get("m") or 9999)
+        self._path_tolerance = float(options.get("t") or 0.05)
+        self._resolution = float(options.get("r") or 0.05)
+        self._xyz_precision = int(options.get("x") or 3)
+        self._e_precision = int(options.get("e") or 5)
+        self._extrusion_rate_variance = float(options.get("v") or 0)
+        self._max_gcode_length = int(options.get("c") or 0)
+        self._mm_per_arc_segment = float(options.get("s") or 0)
+        self._min_arc_segments = int(options.get("a") or 0)
+        self._allow_3d_arcs = "z" in options
+        self._allow_dynamic_precision = "d" in options
+        self._allow_travel_arcs = "y" in options
+        self._g90_influences_extruder = "g" in options
+
+        self._aborted = False
+        self._reset()
+
+    def abort(self) -> None:
+        """Stops processing after the current layer."""
+        self._aborted = True
+
+    def process(
+        self,
+        gcode_list: List[str],
+        progress: Optional[Callable[[float], None]] = None,
+    ) -> Optional[List[str]]:
+        """Returns the layers with arcs, None if aborted; arcs never span layers."""
+        self._reset()
+        self._aborted = False
+
+        total_length = max(1, sum(len(layer) for layer in gcode_list))
+        processed_length = 0
+        result = []  # type: List[str]
+        for layer in gcode_list:
+            if self._aborted:
+                return None
+            result.append(self._processLayer(layer))
+
+            processed_length += len(layer)
+            if progress:
+                progress(processed_length / total_length)
+
+        if result:
+            result[0] = self._getHeader() + result[0]
+        return result
+
+    def _reset(self) -> None:
+        self._position = [None, None, None]  # type: List[Optional[float]]
+        self._e = 0.0  # type: Optional[float]
+        self._xyz_relative = False
+        self._e_relative = False
+
+        self._output_xyz_precision = self._xyz_precision
+        self._output_e_precision = self._e_precision
+
+    def _getHeader(self) -> str:
+        return "\n".join([
+            "; Postprocessed by the ArcWelderPlugin arc fitter",
+            "; resolution=%.2fmm" % self._resolution,
+            "; path_tolerance=%.1f%%" % (self._path_tolerance * 100),
+            "; max_radius=%.2fmm" % self._max_radius,
+            "; default_xyz_precision=%d" % self._xyz_precision,
+            "; default_e_precision=%d" % self._e_precision,
+            "; extrusion_rate_variance_percent=%.1f%%" % (self._extrusion_rate_variance * 100),
+            "", "",
+        ])
+
+    def _processLayer(self, layer: str) -> str:
+        output = []  # type: List[str]
+        run = _Run()
+
+        for line in layer.split("\n"):
+            if self._allow_dynamic_precision:
+                self._updatePrecision(line)
+
+            segment = self._parseSegment(line)
+            if run.lines and (segment is None or not run.accepts(segment)):
+                self._flushRun(run, output)
+                run = _Run()
+            if segment is None:
+                output.append(line)
+                self._updateState(line)
+                continue
+
+            if not run.lines:
+                run.start(self._position, self._e, self._e_relative)
+            run.add(line, segment)
+            self._position = [segment.x, segment.y, segment.z]
+            self._e = segment.absolute_e
+
+        if run.lines:
+            self._flushRun(run, output)
+        return "\n".join(output)
+
+    def _parseSegment(self, line: str) -> Optional["_Segment"]:
+        """Returns the end of a move that can be part of an arc."""
+        command = line[:3]
+        if command != "G1 " and command != "G0 ":
+            return None
+        if command == "G0 " and not self._allow_travel_arcs:
+            return None
+        if ";" in line or self._xyz_relative or None in self._position:
+            return None
+
+        x, y, z = self._position
+        e_delta = 0.0
+        feedrate = None
+        has_xy = False
+        for parameter in line[3:].split():
+            axis = parameter[0]
+            try:
+                value = float(parameter[1:])
+            except ValueError:
+                return None
+            if axis == "X":
+                x = value
+                has_xy = True
+            elif axis == "Y":
+                y = value
+                has_xy = True
+            elif axis == "Z":
+                if value != z and not self._allow_3d_arcs:
+                    return None
+                z = value
+            elif axis == "E":
+                if self._e_relative:
+                    e_delta = value
+                elif self._e is None:
+                    return None
+                else:
+                    e_delta = value - self._e
+            elif axis == "F":
+                feedrate = value
+            else:
+                return None
+
+        if not has_xy or (x == self._position[0] and y == self._position[1]):
+            return None
+        if e_delta < 0 or (e_delta == 0 and not self._allow_travel_arcs):
+            return None
+
+        absolute_e = self._e + e_delta if self._e is not None else None
+        return _Segment(command, x, y, z, e_delta, absolute_e, feedrate)
+
+    def _updateState(self, line: str) -> None:
+        parameters = line.split(";", 1)[0].split()
+        if not parameters:
+            return
+        command = parameters[0]
+
+        if command == "G90":
+            self._xyz_relative = False
+            if self._g90_influences_extruder:
+                self._e_relative = False
+        elif command == "G91":
+            self._xyz_relative = True
+            if self._g90_influences_extruder:
+                self._e_relative = True
+        elif command == "M82":
+            self._e_relative = False
+        elif command == "M83":
+            self._e_relative = True
+        elif command == "G28":
+            self._position = [None, None, None]
+        elif command in ("G0", "G1", "G2", "G3", "G92"):
+            if command == "G92" and len(parameters) == 1:
+                parameters = ["G92", "X0", "Y0", "Z0", "E0"]
+            for parameter in parameters[1:]:
+                axis = parameter[:1]
+                try:
+                    value = float(parameter[1:])
+                except ValueError:
+                    continue
+                if axis and axis in "XYZ":
+                    index = "XYZ".index(axis)
+                    if command == "G92" or not self._xyz_relative:
+                        self._position[index] = value
+                    elif self._position[index] is not None:
+                        self._position[index] += value
+                elif axis == "E":
+                    if command == "G92" or not self._e_relative:
+                        self._e = value
+                    elif self._e is not None:
+                        self._e += value
+
+    def _updatePrecision(self, line: str) -> None:
+        for xyz_decimals, e_decimals in self._decimals_regex.findall(line.split(";", 1)[0]):
+            if xyz_decimals:
+                self._output_xyz_precision = max(self._output_xyz_precision, len(xyz_decimals))
+            else:
+                self._output_e_precision = max(self._output_e_precision, len(e_decimals))
+
+    def _flushRun(self, run: "_Run", output: List[str]) -> None:
+        points = run.getPoints()
+        last = len(run.lines)
+        start = 0
+        while start < last:
+            arc = self._findArc(points, start, last)
+            if arc is None:
+                output.append(run.lines[start])
+                start += 1
+                continue
+            end, arc_line = arc
+            output.append(arc_line)
+            start = end
+
+    def _findArc(self, points: "_Points", start: int, last: int) -> Optional[Tuple[int, str]]:
+        """Returns the end and the g-code of the longest arc found from a point of the run."""
+        end = start + self._min_segments
+        if end > last:
+            return None
+        best = self._fitArc(points, start, end)
+        if best is None:
+            return None
+        best_end = end
+
+        # grow the arc exponentially until it fails, then search for the longest arc in between
+        failed_end = None
+        while best_end < last:
+            end = min(last, start + 2 * (best_end - start))
+            arc_line = self._fitArc(points, start, end)
+            if arc_line is None:
+                failed_end = end
+                break
+            best, best_end = arc_line, end
+        if failed_end is not None:
+            low, high = best_end, failed_end
+            while high - low > 1:
+                end = (low + high) // 2
+                arc_line = self._fitArc(points, start, end)
+                if arc_line is None:
+                    high = end
+                else:
+                    best, best_end = arc_line, end
+                    low = end
+
+        return best_end, best
+
+    def _fitArc(self, points: "_Points", start: int, end: int) -> Optional[str]:
+        """Returns the g-code of an arc through points start..end, None if they do not form an arc."""
+        x = points.x[start:end + 1]
+        y = points.y[start:end + 1]
+        half_resolution = self._resolution / 2
+
+        # circle through the first, middle and last point, relative to the first point
+        middle = (end - start + 1) // 2
+        bx, by = x[middle] - x[0], y[middle] - y[0]
+        cx, cy = x[-1] - x[0], y[-1] - y[0]
+        determinant = 2 * (bx * cy - by * cx)
+        if abs(determinant) < 1e-12:
+            return None
+        b_squared = bx * bx + by * by
+        c_squared = cx * cx + cy * cy
+        i = (cy * b_squared - by * c_squared) / determinant
+        j = (bx * c_squared - cx * b_squared) / determinant
+        radius = math.hypot(i, j)
+        if radius > self._max_radius:
+            return None
+        if self._mm_per_arc_segment > 0 and self._min_arc_segments > 0:
+            if 2 * math.pi * radius / self._mm_per_arc_segment < self._min_arc_segments:
+                return None
+
+        center_x, center_y = x[0] + i, y[0] + j
+        vx = x - center_x
+        vy = y - center_y
+        if numpy.abs(numpy.hypot(vx, vy) - radius).max() > half_resolution:
+            return None
+        midpoint_distance = numpy.hypot((vx[:-1] + vx[1:]) / 2, (vy[:-1] + vy[1:]) / 2)
+        if numpy.abs(midpoint_distance - radius).max() > half_resolution:
+            return None
+
+        # all segments must turn the same way, and the arc must not close
+        angles = numpy.arctan2(vx[:-1] * vy[1:] - vy[:-1] * vx[1:], vx[:-1] * vx[1:] + vy[:-1] * vy[1:])
+        counter_clockwise = bool(angles[0] > 0)
+        if not ((angles > 0).all() if counter_clockwise else (angles < 0).all()):
+            return None
+        sweep = abs(float(angles.sum()))
+        if sweep >= 2 * math.pi - 1e-6:
+            return None
+
+        lengths = points.lengths[start:end]
+        path_length = float(lengths.sum())
+        if abs(radius * sweep - path_length) > self._path_tolerance * path_length:
+            return None
+
+        e_deltas = points.e_deltas[start:end]
+        if points.extruding and self._extrusion_rate_variance > 0:
+            rates = e_deltas / lengths
+            if numpy.abs(rates - rates[0]).max() > self._extrusion_rate_variance * rates[0]:
+                return None
+
+        z = points.z[start:end + 1]
+        z_changes = z[-1] != z[0]
+        if z_changes:
+            # helical arcs climb steadily
+            expected_z = z[0] + (z[-1] - z[0]) * numpy.concatenate(([0], numpy.cumsum(lengths))) / path_length
+            if numpy.abs(z - expected_z).max() > half_resolution:
+                return None
+
+        xyz_format = "%%.%df" % self._output_xyz_precision
+        e_format = "%%.%df" % self._output_e_precision
+        parameters = [
+            "G3" if counter_clockwise else "G2",
+            "X" + xyz_format % x[-1],
+            "Y" + xyz_format % y[-1],
+        ]
+        if z_changes:
+            parameters.append("Z" + xyz_format % z[-1])
+        parameters.append("I" + xyz_format % i)
+        parameters.append("J" + xyz_format % j)
+        if points.extruding:
+            if points.e_relative:
+                parameters.append("E" + e_format % e_deltas.sum())
+            else:
+                parameters.append("E" + e_format % points.absolute_e[end])
+        if start == 0 and points.feedrate is not None:
+            parameters.append("F" + ("%f" % points.feedrate).rstrip("0").rstrip("."))
+
+        arc_line = " ".join(parameters)
+        if self._max_gcode_length > 0 and len(arc_line) > self._max_gcode_length:
+            return None
+        return arc_line
+
+
+class _Points:
+    """Columns of the points of a run; point 0 is where the run starts."""
+
+    def __init__(self, run: "_Run") -> None:
+        self.x = numpy.array(run.x)
+        self.y = numpy.array(run.y)
+        self.z = numpy.array(run.z)
+        self.e_deltas = numpy.array(run.e_deltas)
+        self.absolute_e = run.absolute_e
+        self.lengths = numpy.hypot(numpy.diff(self.x), numpy.diff(self.y))
+
+        self.extruding = run.extruding
+        self.e_relative = run.e_relative
+        self.feedrate = run.feedrate
+
+
+class _Segment(NamedTuple):
+    command: str
+    x: float
+    y: float
+    z: float
+    e_delta: float
+    absolute_e: Optional[float]
+    feedrate: Optional[float]
+
+    @property
+    def extruding(self) -> bool:
+        return self.e_delta > 0
+
+
+class _Run:
+    """Consecutive moves that may be replaced by arcs."""
+
+    def __init__(self) -> None:
+        self.lines = []  # type: List[str]
+        self.x = []  # type: List[float]
+        self.y = []  # type: List[float]
+        self.z = []  # type: List[float]
+        self.e_deltas = []  # type: List[float]
+        self.absolute_e = []  # type: List[Optional[float]]
+
+        self.extruding = False
+        self.e_relative = False
+        self.command = ""
+        self.feedrate = None  # type: Optional[float]
+
+    def start(self, position: List[Optional[float]], e: Optional[float], e_relative: bool) -> None:
+        self.x.append(position[0])
+        self.y.append(position[1])
+        self.z.append(position[2])
+        self.absolute_e.append(e)
+        self.e_relative = e_relative
+
+    def accepts(self, segment: _Segment) -> bool:
+        """A feedrate change, or a change between extruding and travelling, starts a new run."""
+        return (
+            segment.feedrate is None
+            and segment.extruding == self.extruding
+            and segment.command == self.command
+        )
+
+    def add(self, line: str, segment: _Segment) -> None:
+        if not self.lines:
+            self.extruding = segment.extruding
+            self.command = segment.command
+            self.feedrate = segment.feedrate
+        self.lines.append(line)
+        self.x.append(segment.x)
+        self.y.append(segment.y)
+        self.z.append(segment.z)
+        self.e_deltas.append(segment.e_delta)
+        self.absolute_e.append(segment.absolute_e)
+
+    def getPoints(self) -> _Points:
+        return _Points(self)
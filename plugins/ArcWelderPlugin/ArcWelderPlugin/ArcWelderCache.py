@@ -0,0 +1,94 @@
+# Copyright (c) 2022 Aldo Hoeben / fieldOfView
+# The ArcWelderPlugin for Cura is released under the terms of the AGPLv3 or higher.
+
+import hashlib
+import os
+import tempfile
+
+from UM.Logger import Logger
+
+from typing import List, Optional
+
+
+class ArcWelderCache:
+    """On-disk cache of processed g-code, least recently used entries go first.
+
+    Entries are keyed by a hash of the g-code and the ArcWelder arguments, so
+    sending the same slice again with the same settings skips ArcWelder. The
+    modification time of an entry is its last use.
+    """
+
+    layer_separator = ";ARCWELDERPLUGIN_GCODELIST_SEPARATOR\n"
+
+    _extension = ".gcode"
+
+    def __init__(self, cache_path: str, size_limit: int) -> None:
+        self._cache_path = cache_path
+        self._size_limit = size_limit  # in bytes
+
+    def getKey(self, gcode_list: List[str], key_arguments: List[str]) -> str:
+        """Returns the key for processing the layers with the given arguments."""
+        key_hash = hashlib.sha256()
+        key_hash.update("\0".join(key_arguments).encode("utf-8"))
+        for layer in gcode_list:
+            key_hash.update(b"\0")
+            key_hash.update(layer.encode("utf-8"))
+        return key_hash.hexdigest()
+
+    def get(self, key: str) -> Optional[List[str]]:
+        path = self._getPath(key)
+        try:
+            with open(path, "r", encoding="utf-8", newline="") as cache_file:
+                result_gcode = cache_file.read()
+            os.utime(path)
+        except OSError:
+            return None
+
+        Logger.log("d", "Using cached ArcWelder result %s", key)
+        return result_gcode.split(self.layer_separator)
+
+    def put(self, key: str, gcode_list: List[str]) -> None:
+        try:
+            os.makedirs(self._cache_path, exist_ok=True)
+            file_descriptor, temporary_path = tempfile.mkstemp(dir=self._cache_path)
+            try:
+                with os.fdopen(file_descriptor, "w", encoding="utf-8", newline="") as cache_file:
+                    for index, layer in enumerate(gcode_list):
+                        if index > 0:
+                            cache_file.write(self.layer_separator)
+                        cache_file.write(layer)
+                os.replace(temporary_path, self._getPath(key))
+            except:
+                os.remove(temporary_path)
+                raise
+        except OSError:
+            Logger.logException("w", "Could not store ArcWelder result in the cache")
+            return
+
+        self._evict()
+
+    def _evict(self) -> None:
+        entries = []
+        total_size = 0
+        for entry in os.scandir(self._cache_path):
+            if not entry.name.endswith(self._extension):
+                continue
+            try:
+                entry_stat = entry.stat()
+            except OSError:
+                continue
+            entries.append((entry_stat.st_mtime, entry_stat.st_size, entry.path))
+            total_size += entry_stat.st_size
+
+        entries.sort()
+        for _, size, path in entries:
+            if total_size <= self._size_limit:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total_size -= size
+
+    def _getPath(self, key: str) -> str:
+        return os.path.join(self._cache_path, key + self._extension)
@@ -0,0 +1,377 @@
+# Copyright (c) 2022 Aldo Hoeben / fieldOfView
+# The ArcWelderPlugin for Cura is released under the terms of the AGPLv3 or higher.
+
+import codecs
+import locale
+import os
+import re
+import subprocess
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from UM.Job import Job
+from UM.Logger import Logger
+from UM.Platform import Platform
+
+from .ArcFitter import ArcFitter
+from .ArcWelderCache import ArcWelderCache
+
+from typing import Dict, List, Optional, Set
+
+
+class ArcWelderJob(Job):
+    """Runs ArcWelder on the layers of a plate in the background.
+
+    The result is the list of processed layers, or None if ArcWelder failed or
+    the job was aborted.
+
+    Where the platform has /dev/stdin and /dev/stdout, the layers are streamed
+    through pipes and the result is split into layers while ArcWelder writes
+    it; progress then follows the amount of g-code fed to ArcWelder. On Windows
+    the g-code makes a round trip through a temporary file and progress is
+    parsed from the output of ArcWelder.
+
+    Large plates are split at layer boundaries into parts that are processed
+    by concurrent ArcWelder processes. Each part after the first starts with a
+    preamble that restores the positioning modes, the position and the
+    extruder position at its start, so arcs are fitted as they would be in a
+    single run; the preamble is dropped from the output.
+
+    If an arc fitter is given, it processes the layers in-process instead of
+    ArcWelder.
+
+    If a cache is given, a result stored for the same g-code and arguments is
+    used instead of running ArcWelder, and new results are stored in it.
+    """
+
+    layer_separator = ";ARCWELDERPLUGIN_GCODELIST_SEPARATOR\n"
+
+    # ArcWelder logs to stdout, which carries the g-code when streaming
+    _streaming_arguments = ["-l=CRITICAL", "-p=NONE", "/dev/stdin", "/dev/stdout"]
+
+    _read_size = 1 << 16
+
+    # plates are not split into parts smaller than this (in characters)
+    _minimum_part_size = 1 << 22
+
+    _mode_regex = re.compile(r"^(G9[01]|M8[23])\b", re.MULTILINE)
+
+    _progress_regex = re.compile(r"percent_complete:\s*(\d+(?:\.\d+)?)|(\d+(?:\.\d+)?)\s*%")
+
+    def __init__(
+        self,
+        gcode_list: List[str],
+        command_arguments: List[str],
+        cache: Optional[ArcWelderCache] = None,
+        cache_arguments: Optional[List[str]] = None,
+        process_count: int = 1,
+        arc_fitter: Optional[ArcFitter] = None,
+    ) -> None:
+        super().__init__()
+
+        self._gcode_list = gcode_list
+        self._command_arguments = command_arguments
+        self._cache = cache
+        # everything besides the g-code that determines the result, the executable path is not part of it
+        self._cache_arguments = cache_arguments if cache_arguments is not None else command_arguments[1:]
+        self._process_count = max(1, process_count)
+        self._arc_fitter = arc_fitter
+
+        self._processes = set()  # type: Set[subprocess.Popen]
+        self._aborted = False
+
+        self._lock = threading.Lock()
+        self._part_lengths = []  # type: List[int]
+        self._part_progress = []  # type: List[float]
+        self._last_percent = -1
+
+    def abort(self) -> None:
+        """Stops ArcWelder; the job finishes without a result."""
+        with self._lock:
+            self._aborted = True
+            processes = list(self._processes)
+        if self._arc_fitter:
+            self._arc_fitter.abort()
+        for process in processes:
+            if process.poll() is None:
+                Logger.log("d", "Stopping ArcWelder")
+                process.terminate()
+
+    def isAborted(self) -> bool:
+        return self._aborted
+
+    def run(self) -> None:
+        cache_key = None
+        if self._cache:
+            cache_key = self._cache.getKey(self._gcode_list, self._cache_arguments)
+            result = self._cache.get(cache_key)
+            if result is not None:
+                self.setResult(result)
+                return
+
+        parts = self._splitParts() if not self._arc_fitter else [self._gcode_list]
+        self._part_lengths = [max(1, sum(len(layer) for layer in layers)) for layers in parts]
+        self._part_progress = [0.0] * len(parts)
+
+        if self._arc_fitter:
+            Logger.log("d", "Fitting arcs without ArcWelder")
+            result = self._arc_fitter.process(
+                self._gcode_list, lambda fraction: self._reportProgress(0, fraction)
+            )
+            if result is None:
+                Logger.log("i", "ArcWelder was cancelled")
+        elif len(parts) == 1:
+            result = self._processPart(0, parts[0])
+        else:
+            Logger.log("d", "Running %d ArcWelder processes", len(parts))
+            with ThreadPoolExecutor(max_workers=len(parts)) as executor:
+                part_results = list(executor.map(self._processPart, range(len(parts)), parts))
+            if any(part_result is None for part_result in part_results):
+                result = None
+            else:
+                # the first layer of each part after the first is the preamble
+                result = part_results[0]
+                for part_result in part_results[1:]:
+                    result.extend(part_result[1:])
+
+        if result is None:
+            return
+        self.setResult(result)
+
+        if self._cache:
+            self._cache.put(cache_key, result)
+
+    def _splitParts(self) -> List[List[str]]:
+        """Splits the layers into parts for concurrent processes, with a preamble before each part but the first."""
+        total_length = sum(len(layer) for layer in self._gcode_list)
+        part_count = min(self._process_count, total_length // self._minimum_part_size)
+        if part_count < 2:
+            return [self._gcode_list]
+
+        g90_influences_extruder = "-g" in self._command_arguments
+
+        parts = []  # type: List[List[str]]
+        start = 0
+        preamble = None  # type: Optional[str]
+        length = 0
+        # last positioning mode commands before the current layer, in the order they appeared
+        modes = []  # type: List[str]
+        for index, layer in enumerate(self._gcode_list):
+            if index > start and length >= total_length * (len(parts) + 1) / part_count:
+                next_preamble = self._getPreamble(index, modes, g90_influences_extruder)
+                if next_preamble is not None:
+                    layers = self._gcode_list[start:index]
+                    parts.append([preamble] + layers if preamble is not None else layers)
+                    start = index
+                    preamble = next_preamble
+            length += len(layer)
+
+            if any(command in layer for command in ("G90", "G91", "M82", "M83")):
+                for command in self._mode_regex.findall(layer):
+                    modes = [mode for mode in modes if mode[0] != command[0]] + [command]
+
+        layers = self._gcode_list[start:]
+        parts.append([preamble] + layers if preamble is not None else layers)
+        return parts
+
+    def _getPreamble(self, index: int, modes: List[str], g90_influences_extruder: bool) -> Optional[str]:
+        """Returns g-code that sets up ArcWelder like the layers before a layer would, None if no part can start there.
+
+        The layers before the layer are scanned backwards for the last known
+        coordinates. Coordinates from before a positioning mode command are not
+        used, since the moves before it may have been relative.
+        """
+        if "G91" in modes:
+            return None
+        e_modes = [mode for mode in modes if mode[0] == "M" or g90_influences_extruder]
+        e_relative = e_modes[-1:] == ["M83"]
+
+        values = {}  # type: Dict[str, str]
+        open_axes = {"X", "Y", "Z"} if e_relative else {"X", "Y", "Z", "E"}
+        for layer in reversed(self._gcode_list[:index]):
+            for line in reversed(layer.split("\n")):
+                parameters = line.split(";", 1)[0].split()
+                if not parameters:
+                    continue
+                command = parameters[0]
+
+                if command in ("G90", "G91"):
+                    open_axes -= {"X", "Y", "Z", "E"} if g90_influences_extruder else {"X", "Y", "Z"}
+                elif command in ("M82", "M83"):
+                    open_axes.discard("E")
+                elif command in ("G0", "G1", "G2", "G3", "G92"):
+                    if command == "G92" and len(parameters) == 1:
+                        parameters = ["G92", "X0", "Y0", "Z0", "E0"]
+                    for parameter in parameters[1:]:
+                        axis = parameter[:1]
+                        if axis in open_axes and parameter[1:]:
+                            values[axis] = parameter[1:]
+                            open_axes.discard(axis)
+
+                if not open_axes:
+                    break
+            else:
+                continue
+            break
+
+        preamble = [";ARCWELDERPLUGIN_PREAMBLE"] + modes
+        if values:
+            preamble.append("G92 " + " ".join(axis + values[axis] for axis in "XYZE" if axis in values))
+        return "\n".join(preamble) + "\n"
+
+    def _processPart(self, part: int, gcode_list: List[str]) -> Optional[List[str]]:
+        if Platform.isWindows():
+            return self._runWithFile(part, gcode_list)
+        else:
+            return self._runWithPipes(part, gcode_list)
+
+    def _runWithPipes(self, part: int, gcode_list: List[str]) -> Optional[List[str]]:
+        command_arguments = self._command_arguments + self._streaming_arguments
+        Logger.log(
+            "d",
+            "Running ArcWelder with the following options: %s" % command_arguments,
+        )
+        # stderr is only read after the output, so it goes to a file instead of a pipe that could fill up
+        with tempfile.TemporaryFile() as error_file:
+            process = self._startProcess(
+                command_arguments,
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=error_file,
+            )
+            if process is None:
+                return None
+
+            writer = threading.Thread(target=self._writeLayers, args=(part, gcode_list, process.stdin), daemon=True)
+            writer.start()
+
+            # split the output on the separators as it arrives, like str.split() on the whole output would
+            result = []  # type: List[str]
+            decoder = codecs.getincrementaldecoder("utf-8")()
+            pending = ""
+            while True:
+                data = process.stdout.read(self._read_size)
+                pending += decoder.decode(data, final=not data)
+                layers = pending.split(self.layer_separator)
+                pending = layers.pop()
+                result.extend(layers)
+                if not data:
+                    break
+            result.append(pending)
+
+            writer.join()
+            finished = self._finishProcess(process)
+
+            error_file.seek(0)
+            error_output = error_file.read().decode(locale.getpreferredencoding(), errors="replace")
+            if error_output:
+                Logger.log("d", error_output)
+
+        if not finished:
+            return None
+        return result
+
+    def _writeLayers(self, part: int, gcode_list: List[str], stream) -> None:
+        written_length = 0
+        separator = self.layer_separator.encode("utf-8")
+        try:
+            for index, layer in enumerate(gcode_list):
+                if index > 0:
+                    stream.write(separator)
+                stream.write(layer.encode("utf-8"))
+
+                written_length += len(layer)
+                self._reportProgress(part, written_length / self._part_lengths[part])
+        except (BrokenPipeError, ValueError):
+            # ArcWelder stopped reading; its exit code tells what happened
+            pass
+        finally:
+            try:
+                stream.close()
+            except BrokenPipeError:
+                pass
+
+    def _runWithFile(self, part: int, gcode_list: List[str]) -> Optional[List[str]]:
+        file_descriptor, temporary_path = tempfile.mkstemp()
+        Logger.log("d", "Using temporary file %s", temporary_path)
+
+        try:
+            with os.fdopen(file_descriptor, "w", encoding="utf-8") as temporary_file:
+                temporary_file.write(self.layer_separator.join(gcode_list))
+
+            if not self._runArcWelder(part, self._command_arguments + [temporary_path]):
+                return None
+
+            with open(temporary_path, "r", encoding="utf-8") as temporary_file:
+                result_gcode = temporary_file.read()
+            return result_gcode.split(self.layer_separator)
+        finally:
+            os.remove(temporary_path)
+
+    def _runArcWelder(self, part: int, command_arguments: List[str]) -> bool:
+        Logger.log(
+            "d",
+            "Running ArcWelder with the following options: %s" % command_arguments,
+        )
+
+        if Platform.isWindows():
+            startupinfo = subprocess.STARTUPINFO()
+            startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
+        else:
+            startupinfo = None
+        process = self._startProcess(
+            command_arguments,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            startupinfo=startupinfo,
+        )
+        if process is None:
+            return False
+
+        encoding = locale.getpreferredencoding()
+        process_output = []  # type: List[str]
+        for output_line in process.stdout:
+            output_line = output_line.decode(encoding, errors="replace")
+            process_output.append(output_line)
+
+            match = self._progress_regex.search(output_line)
+            if match:
+                self._reportProgress(part, float(match.group(1) or match.group(2)) / 100)
+
+        Logger.log("d", "".join(process_output))
+
+        return self._finishProcess(process)
+
+    def _startProcess(self, command_arguments: List[str], **kwargs) -> Optional[subprocess.Popen]:
+        with self._lock:
+            if self._aborted:
+                return None
+            process = subprocess.Popen(command_arguments, **kwargs)
+            self._processes.add(process)
+        return process
+
+    def _finishProcess(self, process: subprocess.Popen) -> bool:
+        return_code = process.wait()
+        with self._lock:
+            self._processes.discard(process)
+
+        if self._aborted:
+            Logger.log("i", "ArcWelder was cancelled")
+            return False
+        if return_code != 0:
+            Logger.log("e", "ArcWelder exited with code %d", return_code)
+            return False
+        return True
+
+    def _reportProgress(self, part: int, fraction: float) -> None:
+        with self._lock:
+            self._part_progress[part] = min(1.0, fraction)
+            processed_length = sum(
+                length * progress for length, progress in zip(self._part_lengths, self._part_progress)
+            )
+            percent = int(100 * processed_length / sum(self._part_lengths))
+            if percent == self._last_percent:
+                return
+            self._last_percent = percent
+        self.progress.emit(self, percent)
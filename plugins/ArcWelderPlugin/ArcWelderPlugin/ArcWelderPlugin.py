@@ -3,7 +3,6 @@
 
 from collections import OrderedDict
 import json
-import tempfile
 import os
 import stat
 import subprocess
@@ -17,8 +16,21 @@ from UM.Settings.DefinitionContainer import DefinitionContainer
 from UM.Settings.ContainerRegistry import ContainerRegistry
 from UM.Logger import Logger
 from UM.Platform import Platform
+from UM.PluginRegistry import PluginRegistry
+from UM.PluginError import PluginNotFoundError
+from UM.Message import Message
+from UM.Resources import Resources
 
-from typing import Dict, List, Any
+from .ArcFitter import ArcFitter
+from .ArcWelderCache import ArcWelderCache
+from .ArcWelderJob import ArcWelderJob
+
+try:
+    from PyQt6.QtCore import QEventLoop
+except ImportError:
+    from PyQt5.QtCore import QEventLoop
+
+from typing import Dict, List, Any, Optional
 
 
 class ArcWelderPlugin(Extension):
@@ -29,6 +41,10 @@ class ArcWelderPlugin(Extension):
 
         self._i18n_catalog = None
 
+        self._job = None  # type: Optional[ArcWelderJob]
+        self._message = None  # type: Optional[Message]
+        self._event_loop = None  # type: Optional[QEventLoop]
+
         settings_definition_path = os.path.join(
             os.path.dirname(os.path.abspath(__file__)), "arcwelder_settings.def.json"
         )
@@ -61,33 +77,62 @@ class ArcWelderPlugin(Extension):
                 )  # Make sure we have the rights to run this.
             except:
                 Logger.logException("e", "Could modify rights of ArcWelder executable")
-                return
 
         if Platform.isWindows():
             startupinfo = subprocess.STARTUPINFO()
             startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
         else:
             startupinfo = None
-        version_output = subprocess.check_output(
-            [self._arcwelder_path, "--version"], startupinfo=startupinfo
-        ).decode(locale.getpreferredencoding())
-
-        match = re.search("version: (.*)", version_output)
-        if match:
-            Logger.log("d", "Using ArcWelder %s" % match.group(1))
+        try:
+            version_output = subprocess.check_output(
+                [self._arcwelder_path, "--version"], startupinfo=startupinfo
+            ).decode(locale.getpreferredencoding())
+        except (OSError, subprocess.CalledProcessError):
+            # eg a missing binary, or a file system that does not allow running it
+            Logger.logException("w", "Could not run ArcWelder, arcs will be fitted by the plugin instead")
+            version_output = None
+
+        # ArcWelder is not used if it can not be run
+        self._use_arc_fitter = version_output is None
+
+        match = re.search("version: (.*)", version_output) if version_output else None
+        if self._use_arc_fitter:
+            self._arcwelder_version = "ArcFitter"
+        elif match:
+            self._arcwelder_version = match.group(1).strip()
+            Logger.log("d", "Using ArcWelder %s" % self._arcwelder_version)
         else:
+            self._arcwelder_version = ""
             Logger.log("w", "Could not determine ArcWelder version")
 
         self._application.getPreferences().addPreference(
             "arcwelderplugin/settings_made_visible", False
         )
+        # maximum size of the cache of processed g-code in MB, 0 disables the cache
+        self._application.getPreferences().addPreference(
+            "arcwelderplugin/cache_size", 200
+        )
+        # number of concurrent ArcWelder processes for large plates, 0 uses one per processor core
+        self._application.getPreferences().addPreference(
+            "arcwelderplugin/processes", 0
+        )
 
         ContainerRegistry.getInstance().containerLoadComplete.connect(
             self._onContainerLoadComplete
         )
-        self._application.getOutputDeviceManager().writeStarted.connect(
-            self._filterGcode
-        )
+        self._application.pluginsLoaded.connect(self._onPluginsLoaded)
+
+    def _onPluginsLoaded(self) -> None:
+        gcode_model = self._getGcodeModel()
+        if gcode_model:
+            # ArcWelder runs once, after all other post-processing of the fused g-code pass
+            gcode_model.registerTransform(
+                "ArcWelderPlugin", 1000, external=self._filterPlate
+            )
+        else:
+            self._application.getOutputDeviceManager().writeStarted.connect(
+                self._filterGcode
+            )
 
     def _onContainerLoadComplete(self, container_id: str) -> None:
         if not ContainerRegistry.getInstance().isLoaded(container_id):
@@ -172,19 +217,25 @@ class ArcWelderPlugin(Extension):
                 children.extend(self._getAllSettingKeys(definition[key]["children"]))
         return children
 
-    def _filterGcode(self, output_device):
-        scene = self._application.getController().getScene()
+    def _getGcodeModel(self) -> Optional[Any]:
+        # The shared g-code model is optional; without it ArcWelder connects to writeStarted itself
+        try:
+            return PluginRegistry.getInstance().getPluginObject("GcodeModel")
+        except PluginNotFoundError:
+            return None
 
+    def _getCommandArguments(self) -> Optional[List[str]]:
+        # ArcWelder arguments for the current settings, without the file to process; None if disabled
         global_container_stack = self._application.getGlobalContainerStack()
         if not global_container_stack:
-            return
+            return None
 
         arcwelder_enable = global_container_stack.getProperty(
             "arcwelder_enable", "value"
         )
         if not arcwelder_enable:
             Logger.log("d", "ArcWelder is not enabled")
-            return
+            return None
 
         maximum_radius = global_container_stack.getProperty(
             "arcwelder_maximum_radius", "value"
@@ -229,6 +280,43 @@ class ArcWelderPlugin(Extension):
             global_container_stack.getProperty("arcwelder_max_gcode_length", "value")
         )
 
+        command_arguments = [
+            self._arcwelder_path,
+            "-m=%f" % maximum_radius,
+            "-t=%f" % path_tolerance,
+            "-r=%f" % resolution,
+            "-x=%d" % default_xyz_precision,
+            "-e=%d" % default_e_precision,
+            "-v=%f" % extrusion_rate_variance,
+            "-c=%d" % max_gcode_length
+        ]
+
+        if firmware_compensation:
+            command_arguments.extend(
+                ["-s=%f" % mm_per_arc_segment, "-a=%d" % min_arc_segment]
+            )
+
+        if allow_3d_arcs:
+            command_arguments.append("-z")
+
+        if allow_dynamic_precision:
+            command_arguments.append("-d")
+
+        if allow_travel_arcs:
+            command_arguments.append("-y")
+
+        if g90_influences_extruder:
+            command_arguments.append("-g")
+
+        return command_arguments
+
+    def _filterGcode(self, output_device):
+        scene = self._application.getController().getScene()
+
+        command_arguments = self._getCommandArguments()
+        if command_arguments is None:
+            return
+
         # If the scene does not have a gcode, do nothing
         gcode_dict = getattr(scene, "gcode_dict", {})
         if not gcode_dict:  # this also checks for an empty dict
@@ -236,89 +324,170 @@ class ArcWelderPlugin(Extension):
             return
 
         dict_changed = False
+        for plate_id in list(gcode_dict):
+            dict_changed = (
+                self._processPlate(gcode_dict, plate_id, command_arguments)
+                or dict_changed
+            )
 
-        layer_separator = ";ARCWELDERPLUGIN_GCODELIST_SEPARATOR\n"
-        processed_marker = ";ARCWELDERPROCESSED\n"
+        if dict_changed and getattr(scene, "gcode_dict", None) is gcode_dict:
+            setattr(scene, "gcode_dict", gcode_dict)
 
-        for plate_id in gcode_dict:
-            gcode_list = gcode_dict[plate_id]
-            if len(gcode_list) < 2:
-                Logger.log("w", "Plate %s does not contain any layers", plate_id)
-                continue
-
-            if processed_marker in gcode_list[0]:
-                Logger.log("d", "Plate %s has already been processed", plate_id)
-                continue
-
-            if len(gcode_list) > 0:
-                # remove header from gcode, so we can put it back in front after processing
-                header = gcode_list.pop(0)
-            else:
-                header = ""
-            joined_gcode = layer_separator.join(gcode_list)
-
-            file_descriptor, temporary_path = tempfile.mkstemp()
-            Logger.log("d", "Using temporary file %s", temporary_path)
-
-            with os.fdopen(file_descriptor, "w", encoding="utf-8") as temporary_file:
-                temporary_file.write(joined_gcode)
-
-            command_arguments = [
-                self._arcwelder_path,
-                "-m=%f" % maximum_radius,
-                "-t=%f" % path_tolerance,
-                "-r=%f" % resolution,
-                "-x=%d" % default_xyz_precision,
-                "-e=%d" % default_e_precision,
-                "-v=%f" % extrusion_rate_variance,
-                "-c=%d" % max_gcode_length
-            ]
+    def _filterPlate(self, plate_id: int) -> None:
+        scene = self._application.getController().getScene()
 
-            if firmware_compensation:
-                command_arguments.extend(
-                    ["-s=%f" % mm_per_arc_segment, "-a=%d" % min_arc_segment]
-                )
+        command_arguments = self._getCommandArguments()
+        if command_arguments is None:
+            return
 
-            if allow_3d_arcs:
-                command_arguments.append("-z")
+        gcode_dict = getattr(scene, "gcode_dict", {})
+        if plate_id not in gcode_dict:
+            return
 
-            if allow_dynamic_precision:
-                command_arguments.append("-d")
+        if (
+            self._processPlate(gcode_dict, plate_id, command_arguments)
+            and getattr(scene, "gcode_dict", None) is gcode_dict
+        ):
+            setattr(scene, "gcode_dict", gcode_dict)
 
-            if allow_travel_arcs:
-                command_arguments.append("-y")
+    def _processPlate(
+        self,
+        gcode_dict: Dict[int, List[str]],
+        plate_id: int,
+        command_arguments: List[str],
+    ) -> bool:
+        processed_marker = ";ARCWELDERPROCESSED\n"
 
-            if g90_influences_extruder:
-                command_arguments.append("-g")
+        gcode_list = gcode_dict[plate_id]
+        if len(gcode_list) < 2:
+            Logger.log("w", "Plate %s does not contain any layers", plate_id)
+            return False
 
-            command_arguments.append(temporary_path)
+        if processed_marker in gcode_list[0]:
+            Logger.log("d", "Plate %s has already been processed", plate_id)
+            return False
 
-            Logger.log(
-                "d",
-                "Running ArcWelder with the following options: %s" % command_arguments,
+        if self._job is not None:
+            Logger.log("w", "ArcWelder is already running, skipping plate %s", plate_id)
+            self._showNotWeldedMessage(
+                "ArcWelder was still processing another plate, so plate %s was sent without arcs." % plate_id
             )
+            return False
+
+        # the header is not processed, so it can be put back in front after processing
+        header = gcode_list[0]
+        original_gcode_list = gcode_list
+
+        result = self._runJob(
+            ArcWelderJob(
+                gcode_list[1:],
+                command_arguments,
+                self._getCache(),
+                [self._arcwelder_version] + command_arguments[1:],
+                self._getProcessCount(),
+                ArcFitter(command_arguments[1:]) if self._use_arc_fitter else None,
+            )
+        )
+        if result is None:
+            return False
 
-            if Platform.isWindows():
-                startupinfo = subprocess.STARTUPINFO()
-                startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
-            else:
-                startupinfo = None
-            process_output = subprocess.check_output(
-                command_arguments, startupinfo=startupinfo
-            ).decode(locale.getpreferredencoding())
-
-            Logger.log("d", process_output)
-
-            with open(temporary_path, "r", encoding="utf-8") as temporary_file:
-                result_gcode = temporary_file.read()
-            os.remove(temporary_path)
-
-            gcode_list = result_gcode.split(layer_separator)
-            if header != "":
-                gcode_list.insert(0, header)  # add header back in front
-            gcode_list[0] += processed_marker
-            gcode_dict[plate_id] = gcode_list
-            dict_changed = True
+        # the interface keeps running while the job runs, so the plate may have been sliced or processed again
+        scene = self._application.getController().getScene()
+        if (
+            getattr(scene, "gcode_dict", None) is not gcode_dict
+            or gcode_dict.get(plate_id) is not original_gcode_list
+            or original_gcode_list[0] != header
+            or processed_marker in original_gcode_list[0]
+        ):
+            Logger.log("w", "Plate %s changed while ArcWelder was running, dropping the result", plate_id)
+            self._showNotWeldedMessage(
+                "Plate %s changed while ArcWelder was running, so it was not processed with ArcWelder." % plate_id
+            )
+            return False
+
+        gcode_list = result
+        if header != "":
+            gcode_list.insert(0, header)  # add header back in front
+        gcode_list[0] += processed_marker
+        gcode_dict[plate_id] = gcode_list
+        return True
+
+    def _showNotWeldedMessage(self, text: str) -> None:
+        Message(
+            text,
+            title="ArcWelder",
+            message_type=Message.MessageType.WARNING,
+        ).show()
+
+    def _getCache(self) -> Optional[ArcWelderCache]:
+        try:
+            cache_size = float(
+                self._application.getPreferences().getValue("arcwelderplugin/cache_size")
+            )
+        except (TypeError, ValueError):
+            cache_size = 0
+        if cache_size <= 0:
+            return None
+
+        return ArcWelderCache(
+            os.path.join(Resources.getDataStoragePath(), "arcwelder_cache"),
+            int(cache_size * 1024 * 1024),
+        )
 
-        if dict_changed:
-            setattr(scene, "gcode_dict", gcode_dict)
+    def _getProcessCount(self) -> int:
+        try:
+            process_count = int(
+                self._application.getPreferences().getValue("arcwelderplugin/processes")
+            )
+        except (TypeError, ValueError):
+            process_count = 0
+        if process_count <= 0:
+            process_count = os.cpu_count() or 1
+        return process_count
+
+    def _runJob(self, job: ArcWelderJob) -> Optional[List[str]]:
+        # The upload waits for the g-code, so wait for the job in a local event loop that keeps the interface responsive
+        self._job = job
+
+        self._message = Message(
+            "Processing g-code with ArcWelder...",
+            lifetime=0,
+            dismissable=False,
+            progress=-1,
+            title="ArcWelder",
+        )
+        self._message.addAction(
+            "cancel", "Cancel", "", "Send the g-code without arcs."
+        )
+        self._message.actionTriggered.connect(self._onMessageActionTriggered)
+        self._message.show()
+
+        self._event_loop = QEventLoop()
+        job.progress.connect(self._onJobProgress)
+        job.finished.connect(self._onJobFinished)
+        job.start()
+        if not job.isFinished():
+            self._event_loop.exec()
+
+        self._message.hide()
+        self._message = None
+        self._event_loop = None
+        self._job = None
+
+        if job.isAborted():
+            Logger.log("i", "ArcWelder was cancelled, the g-code is left unchanged")
+        elif job.getResult() is None:
+            Logger.log("e", "ArcWelder failed, the g-code is left unchanged")
+        return job.getResult()
+
+    def _onJobProgress(self, job: ArcWelderJob, percent: float) -> None:
+        if self._message:
+            self._message.setProgress(percent)
+
+    def _onJobFinished(self, job: ArcWelderJob) -> None:
+        if self._event_loop:
+            self._event_loop.quit()
+
+    def _onMessageActionTriggered(self, message: Message, action: str) -> None:
+        if action == "cancel" and self._job is not None:
+            self._job.abort()
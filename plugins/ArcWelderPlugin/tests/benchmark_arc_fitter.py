@@ -0,0 +1,136 @@
+# Copyright (c) 2022 Aldo Hoeben / fieldOfView
+# The ArcWelderPlugin for Cura is released under the terms of the AGPLv3 or higher.
+
+"""Compares the built-in arc fitter with the bundled ArcWelder.
+
+Usage: python benchmark_arc_fitter.py [file.gcode] [--layers N] [--runs N] [--arcwelder PATH]
+
+Without a file, a reference print of circles, random arcs and infill is generated. A file is
+split into layers at its ";LAYER:" lines. Both are run with the same arguments; the
+best time of the runs, the throughput and the size of the output are reported.
+"""
+
+import argparse
+import importlib.util
+import math
+import os
+import random
+import shutil
+import stat
+import subprocess
+import sys
+import tempfile
+import time
+
+from typing import List, Tuple
+
+plugin_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "ArcWelderPlugin")
+
+# the fitter does not need Cura, but the __init__ of the plugin does
+_spec = importlib.util.spec_from_file_location("ArcFitter", os.path.join(plugin_path, "ArcFitter.py"))
+_module = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(_module)
+ArcFitter = _module.ArcFitter
+
+layer_separator = ";ARCWELDERPLUGIN_GCODELIST_SEPARATOR\n"
+arguments = ["-m=9999", "-t=0.05", "-r=0.05"]
+
+
+def _referenceLayers(layer_count: int) -> List[str]:
+    """A cylinder, random full and partial arcs and zigzag infill on every layer."""
+    rng = random.Random(0)
+    layers = [";FLAVOR:Marlin\nG28\nG90\nM82\nG92 E0\n"]
+    e = 0.0
+    for layer_nr in range(layer_count):
+        lines = [";LAYER:%d" % layer_nr, "G0 F6000 X120 Y100 Z%.1f" % (0.2 * (layer_nr + 1))]
+        arcs = [(100.0, 100.0, 20.0, 0.0, 2 * math.pi, 90)]
+        for _ in range(rng.randint(2, 6)):
+            sweep = rng.choice([2 * math.pi, rng.uniform(0.3, 6)]) * rng.choice([1, -1])
+            arcs.append((rng.uniform(50, 200), rng.uniform(50, 200), rng.uniform(2, 40), rng.uniform(0, 2 * math.pi), sweep, max(3, int(rng.randint(12, 120) * abs(sweep) / (2 * math.pi)))))
+        for cx, cy, radius, start_angle, sweep, steps in arcs:
+            x, y = cx + radius * math.cos(start_angle), cy + radius * math.sin(start_angle)
+            lines.append("G0 F6000 X%.3f Y%.3f" % (x, y))
+            lines.append("G1 F2100 E%.5f" % e)
+            for step in range(1, steps + 1):
+                next_x, next_y = cx + radius * math.cos(start_angle + sweep * step / steps), cy + radius * math.sin(start_angle + sweep * step / steps)
+                e += math.hypot(next_x - x, next_y - y) * 0.0332
+                lines.append("G1 X%.3f Y%.3f E%.5f" % (next_x, next_y, e))
+                x, y = next_x, next_y
+            lines.append("G1 F2100 E%.5f" % (e - 0.8))
+        lines.append("G0 F6000 X20 Y20")
+        for row in range(40):
+            e += 50 * 0.0332
+            lines.append("G1 F2400 X%.3f Y%.3f E%.5f" % (20 + (row % 2) * 50, 20 + row * 0.4, e))
+        lines.append(";TIME_ELAPSED:%d" % layer_nr)
+        layers.append("\n".join(lines) + "\n")
+    layers.append(";End of Gcode\nM104 S0\n")
+    return layers
+
+
+def _readLayers(path: str) -> List[str]:
+    with open(path, "r", encoding="utf-8") as gcode_file:
+        layers = [""]
+        for line in gcode_file:
+            if line.startswith(";LAYER:"):
+                layers.append("")
+            layers[-1] += line
+    return layers
+
+
+def _bestTime(function, runs: int) -> Tuple[float, List[str]]:
+    best_time = None
+    for _ in range(runs):
+        start_time = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - start_time
+        best_time = elapsed if best_time is None else min(best_time, elapsed)
+    return best_time, result
+
+
+def _runArcWelder(executable_path: str, layers: List[str], temp_dir: str) -> List[str]:
+    input_path = os.path.join(temp_dir, "input.gcode")
+    output_path = os.path.join(temp_dir, "output.gcode")
+    with open(input_path, "w", encoding="utf-8") as input_file:
+        input_file.write(layer_separator.join(layers))
+    subprocess.run([executable_path] + arguments + [input_path, output_path], capture_output=True, check=True)
+    with open(output_path, "r", encoding="utf-8") as output_file:
+        return output_file.read().split(layer_separator)
+
+
+def _report(name: str, seconds: float, line_count: int, input_size: int, layers: List[str]) -> None:
+    output_size = sum(len(layer) for layer in layers)
+    print("%-10s %8.2f s %10.0f lines/s %7.2f MB/s   output %10d bytes (%.1f%% of the input)" % (
+        name, seconds, line_count / seconds, input_size / seconds / 1e6, output_size, 100.0 * output_size / input_size
+    ))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description = "Compares the built-in arc fitter with the bundled ArcWelder.")
+    parser.add_argument("gcode", nargs = "?", help = "g-code file to process, instead of the generated reference print")
+    parser.add_argument("--layers", type = int, default = 1000, help = "layers of the generated reference print")
+    parser.add_argument("--runs", type = int, default = 3, help = "runs of each, the best time is reported")
+    parser.add_argument("--arcwelder", help = "ArcWelder executable, instead of the bundled linux binary")
+    options = parser.parse_args()
+
+    layers = _readLayers(options.gcode) if options.gcode else _referenceLayers(options.layers)
+    line_count = sum(layer.count("\n") for layer in layers)
+    input_size = sum(len(layer) for layer in layers)
+    print("input      %d layers, %d lines, %d bytes" % (len(layers), line_count, input_size))
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        bundled_path = options.arcwelder or os.path.join(plugin_path, "bin", "linux", "ArcWelder")
+        # the bundled binary is not executable in a checkout
+        executable_path = os.path.join(temp_dir, "ArcWelder")
+        shutil.copy(bundled_path, executable_path)
+        os.chmod(executable_path, os.stat(executable_path).st_mode | stat.S_IXUSR)
+
+        arcwelder_time, arcwelder_layers = _bestTime(lambda: _runArcWelder(executable_path, layers, temp_dir), options.runs)
+        fitter_time, fitter_layers = _bestTime(lambda: ArcFitter(arguments).process(layers), options.runs)
+
+    _report("ArcWelder", arcwelder_time, line_count, input_size, arcwelder_layers)
+    _report("ArcFitter", fitter_time, line_count, input_size, fitter_layers)
+    print("the arc fitter takes %.1fx the time of ArcWelder" % (fitter_time / arcwelder_time))
+
+
+if __name__ == "__main__":
+    main()
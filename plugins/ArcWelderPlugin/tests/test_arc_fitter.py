@@ -0,0 +1,197 @@
+# Copyright (c) 2022 Aldo Hoeben / fieldOfView
+# The ArcWelderPlugin for Cura is released under the terms of the AGPLv3 or higher.
+
+import math
+import os
+import platform
+import random
+import shutil
+import stat
+import subprocess
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ArcWelderPlugin.ArcFitter import ArcFitter
+
+from typing import List
+
+
+layer_separator = ";ARCWELDERPLUGIN_GCODELIST_SEPARATOR\n"
+arguments = ["-m=9999", "-t=0.05", "-r=0.05"]
+
+
+def _circleLayers(layer_count: int, relative: bool) -> List[str]:
+    """Full circles in both directions and zigzag infill, like a sliced cylinder."""
+    layers = [";FLAVOR:Marlin\nG28\nG90\n" + ("M83\n" if relative else "M82\n") + "G92 E0\n"]
+    e = 0.0
+    for layer_nr in range(layer_count):
+        lines = [";LAYER:%d" % layer_nr, "G0 F6000 X120 Y100 Z%.1f" % (0.2 * (layer_nr + 1))]
+        for cx, cy, radius, segments in ((100, 100, 20, 90), (150, 60, 7.5, 40), (60, 150, 3, 17)):
+            lines.append("G0 F6000 X%.3f Y%.3f" % (cx + radius, cy))
+            lines.append("G1 F2100 E%.5f" % (0.8 if relative else e))
+            x, y = cx + radius, cy
+            for segment in range(1, segments + 1):
+                angle = 2 * math.pi * segment / segments * (1 if layer_nr % 2 else -1)
+                next_x, next_y = cx + radius * math.cos(angle), cy + radius * math.sin(angle)
+                e_delta = math.hypot(next_x - x, next_y - y) * 0.0332
+                e += e_delta
+                lines.append("G1 X%.3f Y%.3f E%.5f" % (next_x, next_y, e_delta if relative else e))
+                x, y = next_x, next_y
+            lines.append("G1 F2100 E%.5f" % (-0.8 if relative else e - 0.8))
+        lines.append("G0 F6000 X20 Y20")
+        for row in range(10):
+            e += 50 * 0.0332
+            lines.append("G1 F2400 X%.3f Y%.3f E%.5f" % (20 + (row % 2) * 50, 20 + row * 0.4, 50 * 0.0332 if relative else e))
+        lines.append(";TIME_ELAPSED:%d" % layer_nr)
+        layers.append("\n".join(lines) + "\n")
+    layers.append(";End of Gcode\nM104 S0\n")
+    return layers
+
+
+def _randomLayers(layer_count: int, relative: bool, seed: int) -> List[str]:
+    """Full and partial arcs of random size and resolution, followed by straight lines."""
+    rng = random.Random(seed)
+    layers = [";FLAVOR:Marlin\nG28\nG90\n" + ("M83\n" if relative else "M82\n") + "G92 E0\n"]
+    e = 0.0
+    for layer_nr in range(layer_count):
+        lines = [";LAYER:%d" % layer_nr, "G0 F6000 X100 Y100 Z%.1f" % (0.2 * (layer_nr + 1))]
+        for _ in range(rng.randint(2, 6)):
+            cx, cy = rng.uniform(50, 200), rng.uniform(50, 200)
+            radius = rng.uniform(2, 40)
+            start_angle = rng.uniform(0, 2 * math.pi)
+            sweep = rng.choice([2 * math.pi, rng.uniform(0.3, 6)]) * rng.choice([1, -1])
+            steps = max(3, int(rng.randint(12, 120) * abs(sweep) / (2 * math.pi)))
+
+            x, y = round(cx + radius * math.cos(start_angle), 3), round(cy + radius * math.sin(start_angle), 3)
+            lines.append("G0 F6000 X%.3f Y%.3f" % (x, y))
+            lines.append("G1 F2100 E%.5f" % (0.8 if relative else e))
+            points = [(cx + radius * math.cos(start_angle + sweep * step / steps), cy + radius * math.sin(start_angle + sweep * step / steps)) for step in range(1, steps + 1)]
+            points += [(x + rng.uniform(-20, 20), y + rng.uniform(-20, 20)) for _ in range(rng.randint(0, 3))]
+            feedrate = "F%d " % rng.choice([1200, 1800, 2400])
+            for next_x, next_y in points:
+                e_delta = math.hypot(next_x - x, next_y - y) * 0.0332
+                e += e_delta
+                lines.append("G1 %sX%.3f Y%.3f E%.5f" % (feedrate, next_x, next_y, e_delta if relative else e))
+                x, y, feedrate = round(next_x, 3), round(next_y, 3), ""
+            lines.append("G1 F2100 E%.5f" % (-0.8 if relative else e - 0.8))
+        lines.append(";TIME_ELAPSED:%d" % layer_nr)
+        layers.append("\n".join(lines) + "\n")
+    layers.append(";End of Gcode\nM104 S0\n")
+    return layers
+
+
+def _parameters(line: str) -> dict:
+    return {parameter[0]: float(parameter[1:]) for parameter in line.split(";")[0].split()[1:]}
+
+
+def _code(layers: List[str]) -> List[str]:
+    return [line for layer in layers for line in layer.split("\n") if not line.startswith(";")]
+
+
+@pytest.fixture(scope="module")
+def arcwelder(tmp_path_factory):
+    """The bundled ArcWelder for this platform, skipped if it can not be run here."""
+    if sys.platform != "linux" or platform.machine() not in ("x86_64", "AMD64"):
+        pytest.skip("no bundled ArcWelder for this platform")
+    bundled_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "ArcWelderPlugin", "bin", "linux", "ArcWelder")
+    executable_path = str(tmp_path_factory.mktemp("arcwelder") / "ArcWelder")
+    shutil.copy(bundled_path, executable_path)
+    os.chmod(executable_path, os.stat(executable_path).st_mode | stat.S_IXUSR)
+
+    def run(layers: List[str], tmp_path) -> List[str]:
+        input_path, output_path = str(tmp_path / "input.gcode"), str(tmp_path / "output.gcode")
+        with open(input_path, "w", encoding="utf-8") as input_file:
+            input_file.write(layer_separator.join(layers))
+        try:
+            subprocess.run([executable_path] + arguments + [input_path, output_path], capture_output=True, check=True)
+        except OSError:
+            pytest.skip("the bundled ArcWelder can not be run here")
+        with open(output_path, "r", encoding="utf-8") as output_file:
+            return output_file.read().split(layer_separator)
+    return run
+
+
+@pytest.mark.parametrize("relative", [False, True])
+def test_same_arcs_as_arcwelder_on_regular_circles(arcwelder, tmp_path, relative):
+    layers = _circleLayers(6, relative)
+
+    expected = arcwelder(layers, tmp_path)
+    fitted = ArcFitter(arguments).process(layers)
+
+    assert len(fitted) == len(layers)
+    assert _code(fitted) == _code(expected)
+
+
+@pytest.mark.parametrize("seed", [0, 1])
+def test_output_size_close_to_arcwelder(arcwelder, tmp_path, seed):
+    # ArcWelder may pick a slightly different circle for irregular runs, so only the result size is compared
+    layers = _randomLayers(15, False, seed)
+
+    expected_size = sum(len(line) for line in _code(arcwelder(layers, tmp_path)))
+    fitted_size = sum(len(line) for line in _code(ArcFitter(arguments).process(layers)))
+
+    assert abs(fitted_size - expected_size) < 0.02 * expected_size
+
+
+@pytest.mark.parametrize("relative", [False, True])
+def test_arcs_follow_the_replaced_moves(relative):
+    layers = _randomLayers(10, relative, 2)
+    fitted = ArcFitter(arguments).process(layers)
+
+    half_resolution = 0.025 + 0.001  # three decimals in the output
+    arc_count = 0
+    for layer, fitted_layer in zip(layers[1:], fitted[1:]):
+        original_lines = layer.split("\n")
+        fitted_lines = fitted_layer.split("\n")
+        position = {}
+        index = 0
+        for line in fitted_lines:
+            if not line.startswith(("G2 ", "G3 ")):
+                # lines that are not replaced by arcs are kept as they are
+                assert line == original_lines[index]
+                index += 1
+                if line.startswith(("G0 ", "G1 ")):
+                    position.update(_parameters(line))
+                continue
+
+            arc = _parameters(line)
+            center = (position["X"] + arc["I"], position["Y"] + arc["J"])
+            radius = math.hypot(arc["I"], arc["J"])
+            points = [(position["X"], position["Y"])]
+            e_total = 0.0
+            while not points[1:] or "%.3f %.3f" % points[-1] != "%.3f %.3f" % (arc["X"], arc["Y"]):
+                move = _parameters(original_lines[index])
+                points.append((move["X"], move["Y"]))
+                e_total += move["E"]
+                position.update(move)
+                index += 1
+            arc_count += 1
+
+            assert len(points) > 3
+            for x, y in points:
+                assert abs(math.hypot(x - center[0], y - center[1]) - radius) <= half_resolution
+            for (x, y), (next_x, next_y) in zip(points, points[1:]):
+                assert abs(math.hypot((x + next_x) / 2 - center[0], (y + next_y) / 2 - center[1]) - radius) <= half_resolution
+            if relative:
+                assert arc["E"] == pytest.approx(e_total, abs=1e-4)
+            else:
+                assert arc["E"] == position["E"]
+        assert index == len(original_lines)
+
+    assert arc_count > 10
+
+
+def test_header_and_abort():
+    layers = _circleLayers(2, False)
+    fitter = ArcFitter(arguments)
+
+    fitted = fitter.process(layers)
+    assert fitted[0].startswith("; Postprocessed by the ArcWelderPlugin arc fitter\n")
+    assert fitted[0].endswith(layers[0])
+
+    progress = []
+    assert fitter.process(layers, lambda fraction: (progress.append(fraction), fitter.abort())) is None
+    assert progress == [pytest.approx(len(layers[0]) / sum(len(layer) for layer in layers))]
@@ -0,0 +1,83 @@
+# Copyright (c) 2022 Aldo Hoeben / fieldOfView
+# The ArcWelderPlugin for Cura is released under the terms of the AGPLv3 or higher.
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ArcWelderPlugin.ArcWelderCache import ArcWelderCache
+from ArcWelderPlugin.ArcWelderJob import ArcWelderJob
+
+
+def _setLastUse(cache, key, timestamp):
+    os.utime(cache._getPath(key), (timestamp, timestamp))
+
+
+def test_results_round_trip(tmp_path):
+    cache = ArcWelderCache(str(tmp_path), 1 << 20)
+    layers = [";FLAVOR:Marlin\r\n", ";LAYER:0\nG2 X10 Y10 I5 J0 E1\n", ""]
+    key = cache.getKey(layers, ["-m=0.05"])
+
+    assert cache.get(key) is None
+    cache.put(key, layers)
+
+    assert cache.get(key) == layers
+    assert [entry.name for entry in os.scandir(str(tmp_path))] == [key + ".gcode"]
+
+
+def test_keys_depend_on_layers_and_arguments(tmp_path):
+    cache = ArcWelderCache(str(tmp_path), 1 << 20)
+    layers = [";LAYER:0\nG1 X1 E1\n", ";LAYER:1\nG1 X2 E2\n"]
+
+    key = cache.getKey(layers, ["-m=0.05"])
+
+    assert cache.getKey(list(layers), ["-m=0.05"]) == key
+    assert cache.getKey(layers, ["-m=0.1"]) != key
+    assert cache.getKey(layers, ["-m=0.05", "-z"]) != key
+    # moving text across a layer boundary changes the key
+    assert cache.getKey([layers[0] + ";LAYER:1\n", "G1 X2 E2\n"], ["-m=0.05"]) != key
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    layer = "G1 X1 E1\n" * 100
+    cache = ArcWelderCache(str(tmp_path), 2 * len(layer) + 10)
+
+    keys = ["%064d" % index for index in range(3)]
+    cache.put(keys[0], [layer])
+    _setLastUse(cache, keys[0], 1000)
+    cache.put(keys[1], [layer])
+    _setLastUse(cache, keys[1], 2000)
+
+    # using the oldest entry makes the other one the least recently used
+    assert cache.get(keys[0]) == [layer]
+
+    cache.put(keys[2], [layer])
+
+    assert cache.get(keys[1]) is None
+    assert cache.get(keys[0]) == [layer]
+    assert cache.get(keys[2]) == [layer]
+
+
+def test_eviction_ignores_other_files(tmp_path):
+    other_path = tmp_path / "notes.txt"
+    other_path.write_text("x" * 1000)
+    cache = ArcWelderCache(str(tmp_path), 100)
+
+    cache.put("a" * 64, ["G1 X1 E1\n" * 20])
+
+    assert other_path.exists()
+    assert cache.get("a" * 64) is None
+
+
+def test_job_uses_a_cached_result(tmp_path):
+    cache = ArcWelderCache(str(tmp_path), 1 << 20)
+    layers = [";LAYER:0\nG1 X1 E1\n"]
+    command_arguments = [str(tmp_path / "missing-ArcWelder"), "-m=0.05"]
+    cached = [";LAYER:0\nG2 X1 Y1 I1 J0 E1\n"]
+    cache.put(cache.getKey(layers, command_arguments[1:]), cached)
+
+    job = ArcWelderJob(layers, command_arguments, cache=cache)
+    job.run()
+
+    assert job.getResult() == cached
@@ -0,0 +1,127 @@
+# Copyright (c) 2022 Aldo Hoeben / fieldOfView
+# The ArcWelderPlugin for Cura is released under the terms of the AGPLv3 or higher.
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ArcWelderPlugin.ArcWelderPlugin import ArcWelderPlugin
+
+
+class _Scene:
+    pass
+
+
+class _Controller:
+    def __init__(self, scene):
+        self._scene = scene
+
+    def getScene(self):
+        return self._scene
+
+
+class _Application:
+    def __init__(self, scene):
+        self._controller = _Controller(scene)
+
+    def getController(self):
+        return self._controller
+
+
+def _createPlugin(scene, run_job):
+    # the settings of the plugin are not needed to process a plate
+    plugin = ArcWelderPlugin.__new__(ArcWelderPlugin)
+    plugin._application = _Application(scene)
+    plugin._getCommandArguments = lambda: ["ArcWelder", "-m=9999"]
+    plugin._job = None
+    plugin._arcwelder_version = "test"
+    plugin._use_arc_fitter = False
+    plugin._getCache = lambda: None
+    plugin._getProcessCount = lambda: 1
+    plugin._runJob = run_job
+    plugin.messages = []
+    plugin._showNotWeldedMessage = plugin.messages.append
+    return plugin
+
+
+def _gcodeList():
+    return [";FLAVOR:Marlin\n", ";LAYER:0\nG1 X1 Y1 E1\nG1 X2 Y1 E2\n", ";End of Gcode\n"]
+
+
+def _welded():
+    return [";LAYER:0\nG2 X2 Y1 I1 J0 E2\n", ";End of Gcode\n"]
+
+
+def test_result_replaces_the_plate():
+    scene = _Scene()
+    scene.gcode_dict = {0: _gcodeList()}
+    plugin = _createPlugin(scene, lambda job: _welded())
+
+    plugin._filterPlate(0)
+
+    assert scene.gcode_dict[0] == [";FLAVOR:Marlin\n;ARCWELDERPROCESSED\n"] + _welded()
+    assert plugin.messages == []
+
+
+def test_result_is_dropped_when_the_plate_is_sliced_again():
+    scene = _Scene()
+    scene.gcode_dict = {0: _gcodeList()}
+    new_gcode_list = [";FLAVOR:Marlin\n", ";LAYER:0\nG1 X5 Y5 E1\n", ";End of Gcode\n"]
+
+    def reslice(job):
+        scene.gcode_dict[0] = new_gcode_list
+        return _welded()
+
+    plugin = _createPlugin(scene, reslice)
+    plugin._filterPlate(0)
+
+    assert scene.gcode_dict[0] is new_gcode_list
+    assert new_gcode_list == [";FLAVOR:Marlin\n", ";LAYER:0\nG1 X5 Y5 E1\n", ";End of Gcode\n"]
+    assert len(plugin.messages) == 1
+
+
+def test_result_is_dropped_when_the_scene_gets_new_gcode():
+    scene = _Scene()
+    scene.gcode_dict = {0: _gcodeList()}
+    new_gcode_dict = {0: [";FLAVOR:Marlin\n", ";LAYER:0\nG1 X5 Y5 E1\n"]}
+
+    def reslice(job):
+        scene.gcode_dict = new_gcode_dict
+        return _welded()
+
+    plugin = _createPlugin(scene, reslice)
+    plugin._filterGcode(None)
+
+    assert scene.gcode_dict is new_gcode_dict
+    assert new_gcode_dict[0] == [";FLAVOR:Marlin\n", ";LAYER:0\nG1 X5 Y5 E1\n"]
+    assert len(plugin.messages) == 1
+
+
+def test_result_is_dropped_when_the_plate_was_processed_meanwhile():
+    scene = _Scene()
+    gcode_list = _gcodeList()
+    scene.gcode_dict = {0: gcode_list}
+
+    def processElsewhere(job):
+        gcode_list[0] += ";ARCWELDERPROCESSED\n"
+        return _welded()
+
+    plugin = _createPlugin(scene, processElsewhere)
+    plugin._filterPlate(0)
+
+    assert scene.gcode_dict[0] is gcode_list
+    assert gcode_list[1] == ";LAYER:0\nG1 X1 Y1 E1\nG1 X2 Y1 E2\n"
+    assert len(plugin.messages) == 1
+
+
+def test_plate_is_skipped_while_another_job_runs():
+    scene = _Scene()
+    scene.gcode_dict = {0: _gcodeList()}
+    plugin = _createPlugin(scene, lambda job: _welded())
+    plugin._job = object()
+
+    plugin._filterPlate(0)
+
+    assert scene.gcode_dict[0] == _gcodeList()
+    assert len(plugin.messages) == 1
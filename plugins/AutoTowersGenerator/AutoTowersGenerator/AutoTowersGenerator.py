@@ -16,6 +16,7 @@ from UM.Extension import Extension
 from UM.Logger import Logger
 from UM.Message import Message
 from UM.PluginRegistry import PluginRegistry
+from UM.PluginError import PluginNotFoundError
 
 from UM.i18n import i18nCatalog
 from UM.Resources import Resources
@@ -28,6 +29,14 @@ from . import MeshImporter
 from .PluginSettings import PluginSettings
 from .OpenScadInterface import OpenScadInterface
 from .OpenScadJob import OpenScadJob
+from .OpenScadBatchJob import OpenScadBatchJob
+from .StlCache import StlCache
+
+# The native tower generator relies on optional packages, so it may not be available
+try:
+    from . import TowerMeshGenerator
+except ImportError:
+    TowerMeshGenerator = None
 
 from .Controllers.BedLevelPatternContoller import BedLevelPatternController
 from .Controllers.FanTowerController import FanTowerController
@@ -70,6 +79,9 @@ class AutoTowersGenerator(QObject, Extension):
         # Keep track of the currently active tower controller
         self._currentTowerController = None
 
+        # Keep track of the custom towers to generate together, None when towers aren't being collected for a batch
+        self._towerBatch = None
+
         # Update the view when the main window is changed so the "remove" button is always visible when enabled
         CuraApplication.getInstance().mainWindowChanged.connect(self._displayRemoveAutoTowerButton)
 
@@ -121,6 +133,22 @@ class AutoTowersGenerator(QObject, Extension):
 
 
 
+    @cached_property
+    def _stlCacheDir(self)->str:
+        ''' Returns the directory where generated STL files are cached '''
+
+        return os.path.join(Resources.getDataStoragePath(), 'autotowers_cache')
+
+
+
+    @cached_property
+    def _meshCacheDir(self)->str:
+        ''' Returns the directory where the converted meshes of the preset STL files are cached '''
+
+        return os.path.join(Resources.getDataStoragePath(), 'autotowers_cache', 'meshes')
+
+
+
     @cached_property
     def _pluginSettingsFilePath(self)->str:
         ''' Returns the path to the plugin settings file '''
@@ -169,6 +197,26 @@ class AutoTowersGenerator(QObject, Extension):
 
 
 
+    @cached_property
+    def _stlCache(self)->StlCache:
+        ''' Provides lazy instantiation of the cache of generated STL files '''
+
+        sizeLimit = self._pluginSettings.GetValue('stl cache size', 200) * 1024 * 1024 # in MB
+        return StlCache(self._stlCacheDir, sizeLimit)
+
+
+
+    @property
+    def _gcodeModel(self):
+        ''' Returns the shared g-code model from the GcodeModel plugin, or None if it isn't installed '''
+
+        try:
+            return PluginRegistry.getInstance().getPluginObject('GcodeModel')
+        except PluginNotFoundError:
+            return None
+
+
+
     @cached_property
     def _gcodeProcessedMarker(self)->str:
         return f';{self._pluginName}: Post-processed by {self._pluginName} version {self.pluginVersion}'
@@ -315,8 +363,13 @@ class AutoTowersGenerator(QObject, Extension):
             controller = self._retrieveTowerController(controllerClass)
             self.addMenuItem(controller.name, lambda controllerClass=controllerClass: self._generateAutoTower(controllerClass))
 
-        # Add a menu item for modifying plugin settings
+        # Add menu items for generating several custom towers at once
         self.addMenuItem(' ', lambda: None)
+        self.addMenuItem(catalog.i18nc("@menu", "Start Tower Batch"), lambda: self._startTowerBatch())
+        self.addMenuItem(catalog.i18nc("@menu", "Generate Tower Batch"), lambda: self._generateTowerBatch())
+
+        # Add a menu item for modifying plugin settings
+        self.addMenuItem('  ', lambda: None)
         self.addMenuItem(catalog.i18nc("@menu", "Settings"), lambda: self._displayPluginSettingsDialog())
 
 
@@ -326,7 +379,114 @@ class AutoTowersGenerator(QObject, Extension):
 
         # Generate the auto tower
         currentTowerController = self._retrieveTowerController(controllerClass)
-        currentTowerController.generate(customizable=self._openScadInterface.OpenScadPathValid)
+        customizable = self._openScadInterface.OpenScadPathValid or self._canGenerateNatively(getattr(controllerClass, '_openScadFilename', None))
+        currentTowerController.generate(customizable=customizable)
+
+
+
+    def _startTowerBatch(self)->None:
+        ''' Start collecting custom towers to be generated together '''
+
+        self._towerBatch = []
+
+        message = catalog.i18nc("@msg", "Custom towers will be added to the batch until \"Generate Tower Batch\" is selected")
+        Message(message, title=self._pluginName, lifetime=8).show()
+
+
+
+    def _generateTowerBatch(self)->None:
+        ''' Generate the custom towers in the batch, running several OpenSCAD processes at once
+            Each tower is stored in the STL cache and the first one is imported into the scene '''
+
+        towerBatch = self._towerBatch if self._towerBatch is not None else []
+        self._towerBatch = None
+
+        if len(towerBatch) == 0:
+            Message(catalog.i18nc("@msg", "No custom towers have been added to the batch"), title=self._pluginName, message_type=Message.MessageType.WARNING).show()
+            return
+
+        # Towers that have been generated before are taken from the STL cache
+        stlFilePaths = []
+        stlCacheKeys = []
+        stlSpecs = []
+        stlSpecIndices = []
+        for index, (controller, towerName, openScadFilename, openScadParameters, postProcessingCallback) in enumerate(towerBatch):
+            openScadFilePath = os.path.join(self._openScadSourcePath, openScadFilename)
+            generateNatively = self._canGenerateNatively(openScadFilename)
+            stlCacheKey = self._stlCache.GetKey(openScadFilePath, openScadParameters, 'native' if generateNatively else 'openscad')
+            cachedStlFilePath = self._stlCache.Get(stlCacheKey)
+            if cachedStlFilePath is not None:
+                stlFilePaths.append(cachedStlFilePath)
+            else:
+                stlFilePath = os.path.join(self._tempDir, f'custom_autotower_{index}.stl')
+                if os.path.isfile(stlFilePath):
+                    os.remove(stlFilePath)
+                stlFilePaths.append(stlFilePath)
+
+                # Towers that can be generated without OpenSCAD don't need to wait for it
+                if generateNatively and self._generateStlNatively(openScadFilePath, openScadParameters, stlFilePath):
+                    self._stlCache.Put(stlCacheKey, stlFilePath)
+                else:
+                    stlCacheKey = self._stlCache.GetKey(openScadFilePath, openScadParameters, 'openscad')
+                    stlSpecs.append((openScadFilePath, openScadParameters, stlFilePath))
+                    stlSpecIndices.append(index)
+            stlCacheKeys.append(stlCacheKey)
+
+        commandResults = [''] * len(towerBatch)
+        if len(stlSpecs) > 0:
+            if not self._openScadInterface.OpenScadPathValid:
+                Message(catalog.i18nc("@msg", "The OpenSCAD path is invalid"), title=self._pluginName, message_type=Message.MessageType.ERROR).show()
+                return
+
+            # Report the progress of each tower in a single message
+            towerStatus = [catalog.i18nc("@msg", "generating") if index in stlSpecIndices else catalog.i18nc("@msg", "cached") for index in range(len(towerBatch))]
+            progressMessage = Message('', title=self._pluginName, lifetime=0, dismissable=False, progress=0)
+            finishedCount = 0
+            def updateProgress(finishedIndices):
+                nonlocal finishedCount
+                for specIndex in finishedIndices:
+                    index = stlSpecIndices[specIndex]
+                    towerStatus[index] = catalog.i18nc("@msg", "done") if os.path.isfile(stlFilePaths[index]) else catalog.i18nc("@msg", "failed")
+                    finishedCount += 1
+                progressMessage.setText('\n'.join([f'{towerBatch[index][1]}: {towerStatus[index]}' for index in range(len(towerBatch))]))
+                progressMessage.setProgress(100 * finishedCount / len(stlSpecs))
+                CuraApplication.getInstance().processEvents()
+            updateProgress([])
+            progressMessage.show()
+
+            # Generate the STL files
+            workerCount = self._pluginSettings.GetValue('batch worker count', max(1, (os.cpu_count() or 1) // 2))
+            job = OpenScadBatchJob(self._openScadInterface, stlSpecs, workerCount, updateProgress)
+            job.run()
+            progressMessage.hide()
+
+            for specIndex, index in enumerate(stlSpecIndices):
+                commandResults[index] = job.commandResults[specIndex]
+
+        # Store the new STL files in the cache and report the towers that could not be generated
+        generatedIndices = []
+        for index in range(len(towerBatch)):
+            if os.path.isfile(stlFilePaths[index]):
+                if index in stlSpecIndices:
+                    self._stlCache.Put(stlCacheKeys[index], stlFilePaths[index])
+                generatedIndices.append(index)
+            else:
+                openScadFilename = towerBatch[index][2]
+                errorMessage = f'{catalog.i18nc("@msg", "Failed to generate")} "{stlFilePaths[index]}" {catalog.i18nc("@msg", "from")} "{openScadFilename}"\n{catalog.i18nc("@msg", "Command output was")}\n"{commandResults[index]}"'
+                Message(errorMessage, title = self._pluginName, message_type=Message.MessageType.ERROR).show()
+                Logger.log('e', errorMessage)
+
+        if len(generatedIndices) == 0:
+            return
+
+        # Only one tower can be post-processed at a time, so the first tower is imported and the others can be loaded from the cache
+        if len(generatedIndices) > 1:
+            message = catalog.i18nc("@msg", "The following towers are ready to be generated without running OpenSCAD again :\n")
+            message += '\n'.join([towerBatch[index][1] for index in generatedIndices[1:]])
+            Message(message, title=self._pluginName, message_type=Message.MessageType.POSITIVE, lifetime=8).show()
+
+        controller, towerName, _, _, postProcessingCallback = towerBatch[generatedIndices[0]]
+        self._importStl(controller, towerName, stlFilePaths[generatedIndices[0]], postProcessingCallback)
 
 
 
@@ -335,7 +495,10 @@ class AutoTowersGenerator(QObject, Extension):
         
         # Stop listening for callbacks
         self._towerControllerPostProcessingCallback = None
-        Application.getInstance().getOutputDeviceManager().writeStarted.disconnect(self._postProcessCallback)
+        if self._gcodeModel is not None:
+            self._gcodeModel.unregisterTransform(self._pluginName)
+        else:
+            Application.getInstance().getOutputDeviceManager().writeStarted.disconnect(self._postProcessCallback)
         # BAK: 25 Nov 2022 - Removing these callbacks for now, because they're catching changes they shouldn't and removing towers inappropriately
         # CuraApplication.getInstance().getMachineManager().activeMachine.propertyChanged.disconnect(self._onPrintSettingChanged)
         # ExtruderManager.getInstance().getActiveExtruderStack().propertiesChanged.disconnect(self._onExtruderPrintSettingChanged)
@@ -409,22 +572,54 @@ class AutoTowersGenerator(QObject, Extension):
             return
 
         # Import the STL file into the scene
-        self._importStl(controller, towerName, stlFilePath, postProcessingCallback)
+        # Preset STL files are loaded over and over, so their converted meshes are cached
+        self._importStl(controller, towerName, stlFilePath, postProcessingCallback, meshCacheDir=self._meshCacheDir)
 
 
 
     def _generateStlCallback(self, controller, towerName, openScadFilename, openScadParameters, postProcessingCallback)->None:
         ''' This callback is called by the tower model controller after a tower has been configured to generate an STL model from an OpenSCAD file '''
 
-        # This could take up to a couple of minutes...
-        self._waitDialog.show()
-        CuraApplication.getInstance().processEvents() # Allow Cura to update itself periodically through this method
-        
-        # Compile the STL file name
+        # If towers are being collected for a batch, the tower is generated with the rest of the batch
+        if self._towerBatch is not None:
+            self._towerBatch.append((controller, towerName, openScadFilename, openScadParameters, postProcessingCallback))
+            message = f'{catalog.i18nc("@msg", "Added")} "{towerName}" {catalog.i18nc("@msg", "to the tower batch")} ({len(self._towerBatch)})'
+            Message(message, title=self._pluginName, lifetime=8).show()
+            return
+
         openScadFilePath = os.path.join(self._openScadSourcePath, openScadFilename)
+
+        # If this tower has been generated before with the same parameters, reuse the STL file from then
+        # Towers generated without OpenSCAD are not exactly the same, so they are cached separately
+        generateNatively = self._canGenerateNatively(openScadFilename)
+        stlCacheKey = self._stlCache.GetKey(openScadFilePath, openScadParameters, 'native' if generateNatively else 'openscad')
+        cachedStlFilePath = self._stlCache.Get(stlCacheKey)
+        if cachedStlFilePath is not None:
+            self._importStl(controller, towerName, cachedStlFilePath, postProcessingCallback)
+            return
+
+        # Compile the STL file name
         stlFilename = 'custom_autotower.stl'
         stlFilePath = os.path.join(self._tempDir, stlFilename)
 
+        # Generate the tower without OpenSCAD if possible
+        if generateNatively:
+            if self._generateStlNatively(openScadFilePath, openScadParameters, stlFilePath):
+                self._stlCache.Put(stlCacheKey, stlFilePath)
+                self._importStl(controller, towerName, stlFilePath, postProcessingCallback)
+                return
+
+            # OpenSCAD is used after all, it may have generated the tower before
+            stlCacheKey = self._stlCache.GetKey(openScadFilePath, openScadParameters, 'openscad')
+            cachedStlFilePath = self._stlCache.Get(stlCacheKey)
+            if cachedStlFilePath is not None:
+                self._importStl(controller, towerName, cachedStlFilePath, postProcessingCallback)
+                return
+
+        # This could take up to a couple of minutes...
+        self._waitDialog.show()
+        CuraApplication.getInstance().processEvents() # Allow Cura to update itself periodically through this method
+
         # Generate the STL file
         # Since it can take a while to generate the STL file, this is done in a separate thread to allow the GUI to remain responsive
         job = OpenScadJob(self._openScadInterface, openScadFilePath, openScadParameters, stlFilePath)
@@ -443,13 +638,50 @@ class AutoTowersGenerator(QObject, Extension):
             self._waitDialog.hide()
             return
 
+        # Keep a copy of the STL file for the next time this tower is generated
+        self._stlCache.Put(stlCacheKey, stlFilePath)
+
         # Import the STL file into the scene
         self._importStl(controller, towerName, stlFilePath, postProcessingCallback)
 
 
 
-    def _importStl(self, controller, towerName, stlFilePath, postProcessingCallback)->None:
-        ''' Imports an STL file into the scene '''
+    def _canGenerateNatively(self, openScadFilename)->bool:
+        ''' Returns true if the tower can be generated without running OpenSCAD '''
+
+        if TowerMeshGenerator is None or openScadFilename is None:
+            return False
+
+        if not self._pluginSettings.GetValue('native tower generation', True):
+            return False
+
+        return TowerMeshGenerator.CanGenerate(openScadFilename)
+
+
+
+    def _generateStlNatively(self, openScadFilePath, openScadParameters, stlFilePath)->bool:
+        ''' Generates an STL file without running OpenSCAD
+            Returns false if the tower can't be generated this way and OpenSCAD should be used instead '''
+
+        if not self._canGenerateNatively(os.path.basename(openScadFilePath)):
+            return False
+
+        try:
+            TowerMeshGenerator.GenerateStl(openScadFilePath, openScadParameters, stlFilePath)
+        except Exception as e:
+            Logger.log('w', f'Could not generate "{stlFilePath}" without OpenSCAD, falling back to OpenSCAD: {e}')
+            Logger.log('d', traceback.format_exc())
+            if os.path.isfile(stlFilePath):
+                os.remove(stlFilePath)
+            return False
+
+        return True
+
+
+
+    def _importStl(self, controller, towerName, stlFilePath, postProcessingCallback, meshCacheDir=None)->None:
+        ''' Imports an STL file into the scene
+            If a mesh cache directory is given, the converted mesh is cached there '''
 
         # Make sure any previous auto towers are removed
         self._removeAutoTower()
@@ -469,7 +701,7 @@ class AutoTowersGenerator(QObject, Extension):
         self._currentTowerController = controller
 
         # Import the STL file into the scene
-        self._autoTowerOperation = MeshImporter.ImportMesh(stlFilePath, name=self._pluginName)
+        self._autoTowerOperation = MeshImporter.ImportMesh(stlFilePath, name=self._pluginName, meshCacheDir=meshCacheDir)
         CuraApplication.getInstance().processEvents()
 
         # The dialog is no longer needed
@@ -501,7 +733,11 @@ class AutoTowersGenerator(QObject, Extension):
         self.autoTowerGeneratedChanged.emit()
 
         # Register the post-processing callback for this particular tower
-        Application.getInstance().getOutputDeviceManager().writeStarted.connect(self._postProcessCallback)
+        # With the GcodeModel plugin, the tower is processed first, ahead of the other post-processing plugins
+        if self._gcodeModel is not None:
+            self._gcodeModel.registerTransform(self._pluginName, 50, plate=self._postProcessPlate)
+        else:
+            Application.getInstance().getOutputDeviceManager().writeStarted.connect(self._postProcessCallback)
         self._towerControllerPostProcessingCallback = postProcessingCallback
 
         # Remove the model if the machine is changed
@@ -618,6 +854,24 @@ class AutoTowersGenerator(QObject, Extension):
             # If there is no g-code for the current build plate, there's nothing more to do
             return
 
+        self._postProcessGcode(gcode)
+
+
+
+    def _postProcessPlate(self, plate_id, gcodePlate)->None:
+        ''' Called by the GcodeModel plugin's post-processing scheduler for each build plate '''
+
+        # Only the g-code for the current build plate is post-processed
+        if plate_id != CuraApplication.getInstance().getMultiBuildPlateModel().activeBuildPlate:
+            return
+
+        self._postProcessGcode(gcodePlate)
+
+
+
+    def _postProcessGcode(self, gcode)->None:
+        ''' Runs the tower controller post-processing callback on the g-code of the current build plate '''
+
         try:      
             # Proceed if the g-code has not already been post-processed
             if self._gcodeProcessedMarker not in gcode[0]:
@@ -636,4 +890,3 @@ class AutoTowersGenerator(QObject, Extension):
         except IndexError:
             # This will be thrown if there is no gcode available
             pass
-        
\ No newline at end of file
@@ -42,6 +42,10 @@ class ControllerBase(QObject):
         self._pluginName = pluginName
         
         self._backedUpSettings = {}
+
+        # Setting properties that have been looked up since the container stacks last changed
+        self._cachedStacks = {}
+        self._cachedProperties = {}
     
 
 
@@ -66,13 +70,13 @@ class ControllerBase(QObject):
                 containerStack = self._getContainerStack(containerStackDescription)
 
                 # Look up the current value of the setting
-                currentValue = containerStack.getProperty(settingName, 'value')
+                currentValue = self._getCachedProperty(containerStack, settingName, 'value')
 
                 # If the current value does not match the recommended value
                 if currentValue != recommendedValue:
 
                     # Look up the display name of the setting and the current and recommended values
-                    settingDisplayName = containerStack.getProperty(settingName, 'label')
+                    settingDisplayName = self._getCachedProperty(containerStack, settingName, 'label')
                     currentValueDisplayName = self._getSettingValueDisplayName(containerStack, settingName, currentValue)
                     recommendedValueDisplayName = self._getSettingValueDisplayName(containerStack, settingName, recommendedValue)
 
@@ -135,16 +139,61 @@ class ControllerBase(QObject):
             message = f'Unrecognized container stack descriptor "{sourceDescription}"'
             raise TypeError(message)
 
+        self._watchContainerStack(sourceDescription, containerStack)
+
         return containerStack
 
 
 
+    def _getCachedProperty(self, containerStack, settingName, propertyName):
+        ''' Looks up a setting property, reusing the result until the container stacks change
+            Each getProperty call walks the whole container stack, so repeated lookups are expensive '''
+
+        key = (id(containerStack), settingName, propertyName)
+        try:
+            return self._cachedProperties[key]
+        except KeyError:
+            value = containerStack.getProperty(settingName, propertyName)
+            self._cachedProperties[key] = value
+            return value
+
+
+
+    def _watchContainerStack(self, sourceDescription: ContainerId, containerStack)->None:
+        ''' Invalidates the cached setting properties whenever the container stack changes
+            This also covers switching to a different machine or extruder '''
+
+        previousStack = self._cachedStacks.get(sourceDescription, None)
+        if previousStack is containerStack:
+            return
+
+        if not previousStack is None:
+            previousStack.propertyChanged.disconnect(self._onContainerStackChanged)
+            previousStack.containersChanged.disconnect(self._onContainerStackChanged)
+            self._cachedProperties = {}
+
+        self._cachedStacks[sourceDescription] = containerStack
+
+        if not containerStack is None:
+            containerStack.propertyChanged.connect(self._onContainerStackChanged)
+            containerStack.containersChanged.connect(self._onContainerStackChanged)
+
+
+
+    def _onContainerStackChanged(self, *args)->None:
+        ''' Discards the cached setting properties
+            Extruder settings can inherit from the global stack, so every cached property is discarded '''
+
+        self._cachedProperties = {}
+
+
+
     def _getSettingValueDisplayName(self, containerStack, settingName, settingValue)->str:
         ''' Looks up and returns the display name for a given setting value '''
 
         try:
             # Attempt to look up the display name of the value
-            settingOptions = containerStack.getProperty(settingName, 'options')
+            settingOptions = self._getCachedProperty(containerStack, settingName, 'options')
             displayName = settingOptions[settingValue]
         except (KeyError, TypeError):
             # As a last resort, just convert the setting value to a string
@@ -13,7 +13,8 @@ from UM.Resources import Resources
 from .ControllerBase import ControllerBase
 from ..Models.TempTowerModel import TempTowerModel
 
-# Import the script that does the actual post-processing
+# Import the scripts that do the actual post-processing
+from ..Postprocessing import MultiParameterTower_PostProcessing
 from ..Postprocessing import TempTower_PostProcessing
 
 Resources.addSearchPath(
@@ -66,6 +67,22 @@ class TempTowerController(ControllerBase):
         startTemp = self._dataModel.startTemp
         tempChange = self._dataModel.tempChange
 
+        # If the fan speed is changed as well, both are applied in a single pass
+        if self._dataModel.fanScheduleEnabled:
+            gcode = MultiParameterTower_PostProcessing.execute(
+                gcode=gcode,
+                base_height=baseHeight,
+                initial_layer_height=initialLayerHeight,
+                layer_height=layerHeight,
+                schedules=[
+                    ('Temperature', startTemp, tempChange, sectionHeight),
+                    ('Fan Speed', self._dataModel.startFanPercent, self._dataModel.fanPercentChange, sectionHeight),
+                ],
+                enable_lcd_messages=enable_lcd_messages,
+                enable_advanced_gcode_comments=enable_advanced_gcode_comments
+                )
+            return gcode
+
         # Call the post-processing script
         gcode = TempTower_PostProcessing.execute(
             gcode=gcode, 
@@ -122,6 +139,8 @@ class TempTowerController(ControllerBase):
 
         # Determine the tower name
         towerName = f'Custom Temp Tower - {startTemp}-{endTemp}x{tempChange}'
+        if self._dataModel.fanScheduleEnabled:
+            towerName += f' - Fan {self._dataModel.startFanPercent}x{self._dataModel.fanPercentChange}'
 
         # Send the filename and parameters to the model callback
         self._generateStlCallback(self, towerName, self._openScadFilename, openScadParameters, self.postProcess)
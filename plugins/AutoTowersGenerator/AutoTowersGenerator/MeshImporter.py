@@ -1,4 +1,8 @@
+import hashlib
 import math
+import os
+import tempfile
+import zipfile
 import numpy
 import trimesh
 
@@ -7,9 +11,13 @@ from cura.Scene.BuildPlateDecorator import BuildPlateDecorator
 from cura.Scene.CuraSceneNode import CuraSceneNode
 from cura.Scene.SliceableObjectDecorator import SliceableObjectDecorator
 
+from UM.Logger import Logger
 from UM.Mesh.MeshData import MeshData, calculateNormalsFromIndexedVertices
 from UM.Operations.AddSceneNodeOperation import AddSceneNodeOperation
 
+# Increase this if the way meshes are converted changes, so meshes cached by an older version are not used
+_meshCacheVersion = 1
+
 # This code was shamelessly stolen and refactored from the CalibrationShapes plugin
 # by 5@xes (https://github.com/5axes/Calibration-Shapes)
 # I don't pretend to have any idea how it works
@@ -17,10 +25,13 @@ from UM.Operations.AddSceneNodeOperation import AddSceneNodeOperation
 # The following comments are part of the original code:
 # Initial Source code from  fieldOfView
 # https://github.com/fieldOfView/Cura-SimpleShapes/blob/bac9133a2ddfbf1ca6a3c27aca1cfdd26e847221/SimpleShapes.py#L70
-def ImportMesh(meshFilePath, ext_pos = 0, name='') -> tuple:
+def ImportMesh(meshFilePath, ext_pos = 0, name='', meshCacheDir = None) -> tuple:
     # Read in the mesh
-    mesh = trimesh.load(meshFilePath)
-    mesh_data = _toMeshData(mesh)
+    # If a cache directory is given, the converted mesh is stored there and loaded directly the next time
+    if meshCacheDir is None:
+        mesh_data = _toMeshData(trimesh.load(meshFilePath))
+    else:
+        mesh_data = _loadCachedMeshData(meshFilePath, meshCacheDir)
 
     application = CuraApplication.getInstance()
     global_stack = application.getGlobalContainerStack()
@@ -68,24 +79,52 @@ def _toMeshData(tri_node: trimesh.base.Trimesh) -> MeshData:
 
     # Following Source code from fieldOfView
     # https://github.com/fieldOfView/Cura-SimpleShapes/blob/bac9133a2ddfbf1ca6a3c27aca1cfdd26e847221/SimpleShapes.py#L45
-    indices = []
-    vertices = []
-
-    index_count = 0
-    face_count = 0
-    for tri_face in tri_faces:
-        face = []
-        for tri_index in tri_face:
-            vertices.append(tri_vertices[tri_index])
-            face.append(index_count)
-            index_count += 1
-        indices.append(face)
-        face_count += 1
-
-    vertices = numpy.asarray(vertices, dtype=numpy.float32)
-    indices = numpy.asarray(indices, dtype=numpy.int32)
+    # Each face gets its own copy of its vertices
+    face_count = len(tri_faces)
+    vertices = numpy.asarray(tri_vertices, dtype=numpy.float32)[tri_faces].reshape(-1, 3)
+    indices = numpy.arange(face_count * 3, dtype=numpy.int32).reshape(-1, 3)
     normals = calculateNormalsFromIndexedVertices(vertices, indices, face_count)
 
     mesh_data = MeshData(vertices=vertices, indices=indices, normals=normals)
 
     return mesh_data
+
+
+
+def _loadCachedMeshData(meshFilePath, meshCacheDir) -> MeshData:
+    ''' Returns the mesh data for a mesh file, converting the file and caching the result if it hasn't been seen before
+        The cache is keyed by the contents of the mesh file, so an updated file is converted again '''
+
+    with open(meshFilePath, 'rb') as meshFile:
+        meshHash = hashlib.sha256(meshFile.read()).hexdigest()
+    cacheFilePath = os.path.join(meshCacheDir, f'{meshHash}_{_meshCacheVersion}.npz')
+
+    # The indices are not stored since every face has its own vertices
+    try:
+        with numpy.load(cacheFilePath) as cachedMesh:
+            vertices = cachedMesh['vertices']
+            normals = cachedMesh['normals']
+        indices = numpy.arange(len(vertices), dtype=numpy.int32).reshape(-1, 3)
+        return MeshData(vertices=vertices, indices=indices, normals=normals)
+    except (OSError, KeyError, ValueError, zipfile.BadZipFile):
+        pass
+
+    mesh_data = _toMeshData(trimesh.load(meshFilePath))
+
+    try:
+        os.makedirs(meshCacheDir, exist_ok=True)
+
+        # Write to a temporary file first so an interrupted write never looks like a valid entry
+        fileDescriptor, tempFilePath = tempfile.mkstemp(dir=meshCacheDir)
+        try:
+            with os.fdopen(fileDescriptor, 'wb') as tempFile:
+                numpy.savez(tempFile, vertices=mesh_data.getVertices(), normals=mesh_data.getNormals())
+            os.replace(tempFilePath, cacheFilePath)
+        except:
+            os.remove(tempFilePath)
+            raise
+
+    except OSError as e:
+        Logger.log('w', f'Could not cache the mesh for "{meshFilePath}": {e}')
+
+    return mesh_data
@@ -162,6 +162,49 @@ class TempTowerModel(ModelBase):
 
 
 
+    # The optional fan speed percentage for the first section of the tower
+    # The fan speed is only changed by the tower if this is not empty
+    _startFanPercentStr = ''
+
+    startFanPercentStrChanged = pyqtSignal()
+
+    def setStartFanPercentStr(self, value)->None:
+        self._startFanPercentStr = value
+        self.startFanPercentStrChanged.emit()
+
+    @pyqtProperty(str, notify=startFanPercentStrChanged, fset=setStartFanPercentStr)
+    def startFanPercentStr(self)->str:
+        return self._startFanPercentStr
+
+    @pyqtProperty(float, notify=startFanPercentStrChanged)
+    def startFanPercent(self)->float:
+        return float(self.startFanPercentStr)
+
+    @pyqtProperty(bool, notify=startFanPercentStrChanged)
+    def fanScheduleEnabled(self)->bool:
+        return self.startFanPercentStr != ''
+
+
+
+    # The amount to change the fan speed percentage between tower sections
+    _fanPercentChangeStr = '10'
+
+    fanPercentChangeStrChanged = pyqtSignal()
+
+    def setFanPercentChangeStr(self, value)->None:
+        self._fanPercentChangeStr = value
+        self.fanPercentChangeStrChanged.emit()
+
+    @pyqtProperty(str, notify=fanPercentChangeStrChanged, fset=setFanPercentChangeStr)
+    def fanPercentChangeStr(self)->str:
+        return self._fanPercentChangeStr
+
+    @pyqtProperty(float, notify=fanPercentChangeStrChanged)
+    def fanPercentChange(self)->float:
+        return float(self.fanPercentChangeStr)
+
+
+
     # The label to add to the tower
     _towerLabel = ''
 
@@ -0,0 +1,24 @@
+from UM.Job import Job
+
+
+
+class OpenScadBatchJob(Job):
+    '''A simple class used to generate several STL files at once using OpenSCAD
+
+    Up to workerCount OpenSCAD processes are run concurrently
+    The command output for each STL file is available in commandResults once the job has run'''
+
+    def __init__(self, openScadInterface, stlSpecs, workerCount, progressCallback):
+        super().__init__()
+        self._openScadInterface = openScadInterface
+        self._stlSpecs = stlSpecs
+        self._workerCount = workerCount
+        self._progressCallback = progressCallback
+        self.commandResults = []
+
+
+
+    def run(self) -> None:
+        '''Generate the STL files from their OpenSCAD files'''
+
+        self.commandResults = self._openScadInterface.GenerateStls(self._stlSpecs, self._workerCount, self._progressCallback)
@@ -1,3 +1,4 @@
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 import os
 import platform
 import shutil
@@ -16,15 +17,28 @@ class OpenScadInterface:
     def __init__(self, pluginName, tempDir):
         self.errorMessage = ''
         self._openScadPath = ''
+        self._openScadPathSetting = ''
         self._pluginName = pluginName
         self._openscad_version = ''
         self._tempDir = tempDir
 
+        # The result of the last OpenScad path validation and the path and modification time it applies to
+        self._validation = None
+
+        # The automatically determined OpenScad path
+        self._defaultOpenScadPath = None
+
 
 
     def SetOpenScadPath(self, openScadPath):
         ''' Manually assign the OpenScad path '''
 
+        # Validate the path again and determine the default path again if the setting has changed
+        if openScadPath != self._openScadPathSetting:
+            self._validation = None
+            self._defaultOpenScadPath = None
+
+        self._openScadPathSetting = openScadPath
         self._openScadPath = openScadPath
 
 
@@ -39,8 +53,10 @@ class OpenScadInterface:
     def OpenScadPath(self)->str:
         ''' Return the path to OpenScad - an attempt will be made to automatically determine it if needed '''
         if self._openScadPath == '' or self._openScadPath == 'openscad':
-            self._openScadPath = self._GetDefaultOpenScadPath()
-            Logger.log('e', f'default openscad path is "{self._openScadPath}"')
+            if self._defaultOpenScadPath is None:
+                self._defaultOpenScadPath = self._GetDefaultOpenScadPath()
+                Logger.log('e', f'default openscad path is "{self._defaultOpenScadPath}"')
+            self._openScadPath = self._defaultOpenScadPath
 
         return self._openScadPath
 
@@ -48,11 +64,20 @@ class OpenScadInterface:
 
     @property
     def OpenScadPathValid(self)->bool:
-        ''' Return true if the OpenScad path is valid '''
+        ''' Return true if the OpenScad path is valid
+            The result is reused until the path or the modification time of the executable changes '''
+
+        # Reuse the last result if the OpenScad executable hasn't changed since it was validated
+        command = self._OpenScadCommand
+        modificationTime = self._GetModificationTime(self.OpenScadPath)
+        if self._validation is not None and modificationTime is not None and self._validation[:2] == (command, modificationTime):
+            valid, self._openscad_version = self._validation[2:]
+            if not valid:
+                self._ForgetDefaultOpenScadPath()
+            return valid
 
         # Attempt to verify the OpenScad executable is valid by querying the OpenScad version number
-        command = f'{self._OpenScadCommand} -v'
-        response = subprocess.run(command, capture_output=True, text=True, shell=True).stderr.strip()
+        response = subprocess.run(f'{command} -v', capture_output=True, text=True, shell=True).stderr.strip()
         Logger.log('d', f'Checking for OpenSCAD returned the following response: "{response}"')
 
         # OpenScad is considered valid if it returns a response including the string 'OpenScad version'
@@ -63,6 +88,9 @@ class OpenScadInterface:
         else:
             self._openscad_version = ''
             Logger.log('d', 'The OpenSCAD path is not valid')
+            self._ForgetDefaultOpenScadPath()
+
+        self._validation = (command, modificationTime, valid, self._openscad_version)
 
         return valid
 
@@ -120,6 +148,43 @@ class OpenScadInterface:
 
 
 
+    def GenerateStls(self, stlSpecs, workerCount, progressCallback)->list:
+        '''Execute several OpenSCAD files concurrently to generate models
+           stlSpecs is a list of (inputFilePath, parameters, outputFilePath) tuples
+           No more than workerCount OpenSCAD processes are run at the same time
+           progressCallback is periodically called from the calling thread with the indices of the models that have just finished
+           Returns the command output for each model'''
+
+        commandResults = [''] * len(stlSpecs)
+
+        # The commands are built up front, since working around symlinks can copy files to the temp directory
+        commands = [self._GenerateOpenScadCommand(inputFilePath, parameters, outputFilePath) for inputFilePath, parameters, outputFilePath in stlSpecs]
+
+        # OpenSCAD does the work in its own processes, so threads are enough to run several of them at once
+        with ThreadPoolExecutor(max_workers=max(1, workerCount)) as executor:
+            pending = {}
+            for index, command in enumerate(commands):
+                Logger.log('d', f'Executing OpenSCAD command: {command}')
+                pending[executor.submit(subprocess.run, command, capture_output=True, text=True, shell=True)] = index
+
+            while pending:
+                done, _ = wait(pending.keys(), timeout=0.1, return_when=FIRST_COMPLETED)
+                finishedIndices = []
+                for future in done:
+                    index = pending.pop(future)
+                    try:
+                        commandResults[index] = future.result().stderr.strip()
+                    except OSError as e:
+                        commandResults[index] = str(e)
+                    finishedIndices.append(index)
+
+                # This is also called when nothing has finished, which gives the caller a chance to keep the GUI responsive
+                progressCallback(finishedIndices)
+
+        return commandResults
+
+
+
     def _GenerateOpenScadCommand(self, inputFilePath, parameters, outputFilePath):
         '''Generate an OpenSCAD command from an input file path, parameters, and output file path'''
 
@@ -159,10 +224,9 @@ class OpenScadInterface:
 
         # On Linux, check for openscad in the current path
         if system == "linux":
-            # If the 'which' command can find the openscad path, use the path directly
-            command = 'which openscad'
-            which_result = subprocess.run(command, capture_output=True, text=True, shell=True).stdout.strip()
-            if which_result != '':
+            # If openscad can be found in the path, use the path directly
+            which_result = shutil.which('openscad')
+            if which_result is not None:
                 openScadPath = which_result
 
         # This path for Macintosh was borrowed from Thopiekar's OpenSCAD Integration plugin (https://thopiekar.eu/cura/cad/openscad)
@@ -186,6 +250,32 @@ class OpenScadInterface:
 
 
 
+    def _ForgetDefaultOpenScadPath(self):
+        ''' Determine the default OpenScad path again the next time it is needed, in case OpenScad has been installed or moved since
+            This only applies if the OpenScad path has not been set manually '''
+
+        if self._openScadPathSetting == '' or self._openScadPathSetting == 'openscad':
+            self._defaultOpenScadPath = None
+            self._openScadPath = self._openScadPathSetting
+
+
+
+    def _GetModificationTime(self, path):
+        ''' Returns the modification time of the OpenScad executable, or None if it can't be found '''
+
+        path = path.strip('\"')
+        if not os.path.isabs(path):
+            path = shutil.which(path)
+            if path is None:
+                return None
+
+        try:
+            return os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+
+
+
     def _SymLinkWorkAround(self, filePath)->str:
         ''' OpenSCAD does not appear to handle files with a symlink directory anywhere in its path
           This method checks for this condition and copies the provided file to a temprary location, if needed
@@ -18,7 +18,9 @@
 #   This is more accurate if the section height cannot be evenly divided by the printing layer height
 # Version 3.1 - 28 Aug 2023:
 #   Add the option enable_advanced_gcode_comments to reduce the Gcode size
-__version__ = '3.1'
+# Version 3.2 - 18 Oct 2026:
+#   Process the gcode a layer at a time, recording changes to be applied in a single pass
+__version__ = '3.2'
 
 from UM.Logger import Logger
 
@@ -62,11 +64,11 @@ def execute(gcode, base_height:float, section_height:float, initial_layer_height
     # Keep track of whether a bridge has been completed
     after_bridge = False
 
-    # Iterate over each line in the g-code
-    for line_index, line, lines, start_of_new_section in Common.LayerEnumerate(gcode, base_height, section_height, initial_layer_height, layer_height, enable_advanced_gcode_comments):
+    # Iterate over each layer in the g-code
+    for layer in Common.LayerEnumerate(gcode, base_height, section_height, initial_layer_height, layer_height, enable_advanced_gcode_comments):
 
         # Handle each new tower section
-        if start_of_new_section:
+        if layer.start_of_new_section:
 
             # Increment the fan speed % for this tower section and convert from a range of 0-100 to 0-255
             current_fan_percent += fan_percent_change
@@ -74,45 +76,55 @@ def execute(gcode, base_height:float, section_height:float, initial_layer_height
 
             # Configure the new fan speed % in the gcode
             if enable_advanced_gcode_comments :
-                lines.insert(2, f'M106 S{current_fan_value} {Common.comment_prefix} setting fan speed to {current_fan_percent}% for the this tower section')
+                new_lines = [f'M106 S{current_fan_value} {Common.comment_prefix} setting fan speed to {current_fan_percent}% for the this tower section']
             else:
-                lines.insert(2, f'M106 S{current_fan_value}')
-                
+                new_lines = [f'M106 S{current_fan_value}']
+
             # Display the new the fan speed % on the printer's LCD
             if enable_lcd_messages:
-                lines.insert(3, f'M117 Speed {current_fan_percent}%')
                 if enable_advanced_gcode_comments :
-                    lines.insert(3, f'{Common.comment_prefix} Displaying "Speed {current_fan_percent}%" on the LCD')
+                    new_lines.append(f'{Common.comment_prefix} Displaying "Speed {current_fan_percent}%" on the LCD')
+                new_lines.append(f'M117 Speed {current_fan_percent}%')
 
-        # Handle fan speed changes in the gcode
-        if Common.IsFanSpeedChangeLine(line):
+            layer.InsertLines(2, new_lines)
 
-            # If this change is coming after a bridge has been printed or we don't need to maintain the bridge value
-            if after_bridge or not maintain_bridge_value:
-                
-                # Resume the tower section fan speed in the gcode
-                if enable_advanced_gcode_comments :
-                    lines[line_index] = f'M106 S{current_fan_value} {Common.comment_prefix} Resuming fan speed of {current_fan_percent}% after printing a bridge'
-                else :
-                    lines[line_index] = f'M106 S{current_fan_value}'
-              
-            # If this is the start of a bridge
-            else:
-                
-                # Mark the next fan speed change as coming after a bridge was printed
+        # Iterate over each line in the layer
+        for line_index, line in enumerate(layer.lines):
+
+            # The fan speed change inserted for a new tower section is handled like any other fan speed change,
+            # so the next fan speed change is treated as coming after a bridge
+            if line_index == 2 and layer.start_of_new_section:
                 after_bridge = True
-                
-        # If the fan is being turned off for the start of a bridge
-        elif Common.IsFanOffLine(line):
 
-            # Mark the next fan speed change as coming after a bridge was printed
-            after_bridge = True
+            # Handle fan speed changes in the gcode
+            if Common.IsFanSpeedChangeLine(line):
+
+                # If this change is coming after a bridge has been printed or we don't need to maintain the bridge value
+                if after_bridge or not maintain_bridge_value:
+
+                    # Resume the tower section fan speed in the gcode
+                    if enable_advanced_gcode_comments :
+                        layer.ReplaceLine(line_index, f'M106 S{current_fan_value} {Common.comment_prefix} Resuming fan speed of {current_fan_percent}% after printing a bridge')
+                    else :
+                        layer.ReplaceLine(line_index, f'M106 S{current_fan_value}')
+
+                # If this is the start of a bridge
+                else:
+
+                    # Mark the next fan speed change as coming after a bridge was printed
+                    after_bridge = True
+
+            # If the fan is being turned off for the start of a bridge
+            elif Common.IsFanOffLine(line):
+
+                # Mark the next fan speed change as coming after a bridge was printed
+                after_bridge = True
 
-        # If this line marks the start of a bridge
-        elif Common.IsStartOfBridge(line):
+            # If this line marks the start of a bridge
+            elif Common.IsStartOfBridge(line):
 
-            # Mark the next fan speed change as being the start of a bridge print
-            after_bridge = False
+                # Mark the next fan speed change as being the start of a bridge print
+                after_bridge = False
 
     Logger.log('d', 'AutoTowersGenerator completing FanTower post-processing')
 
@@ -0,0 +1,239 @@
+# Columnar tokenizer for post-processing large amounts of gcode
+#
+# Instead of classifying each line with strip() and substring tests, the gcode
+# is converted once into numpy arrays (one entry per line) that can be combined
+# into masks to select retractions, extrusions, extrusion mode changes, etc.
+#
+# Line i of the tokens corresponds to line i of text.split('\n'), so indices
+# taken from the masks can be used directly on the split lines.
+
+import numpy
+
+
+# Lookup tables for classifying bytes
+def _ByteTable(characters:bytes):
+    table = numpy.zeros(256, dtype=bool)
+    table[numpy.frombuffer(characters, dtype=numpy.uint8)] = True
+    return table
+
+# Bytes that can appear in a number
+_number_table = _ByteTable(b'0123456789.+-')
+
+# Bytes removed by str.strip() (other than the newlines that separate the lines)
+_whitespace_table = _ByteTable(b' \t\r\x0b\x0c')
+
+_newline = ord('\n')
+_semicolon = ord(';')
+_dot = ord('.')
+_minus = ord('-')
+_plus = ord('+')
+_zero = ord('0')
+
+# Numbers with up to this many digits are converted exactly, as their digits divided by a power of ten
+# Both are exactly representable as floats, so the division is rounded the same way as float() rounds
+_exact_digit_count = 15
+_powers_of_ten = 10 ** numpy.arange(_exact_digit_count + 1, dtype=numpy.int64)
+
+
+
+class GcodeTokens:
+    ''' Per-line arrays describing a block of gcode
+
+        Values(letter) returns the value of the first parameter with that letter before the comment of each line,
+        NaN if absent. A column is only converted to floats when it is first used. '''
+
+    def __init__(self, text:str):
+        # Non-ASCII characters can only appear in comments; replacing them with '?' keeps byte offsets equal to string offsets
+        # A newline is added at the end, so every line ends with one
+        self._buffer = numpy.frombuffer(text.encode('ascii', 'replace') + b'\n', dtype=numpy.uint8)
+        buffer = self._buffer
+
+        # Locate the lines
+        self._newlines = numpy.flatnonzero(buffer == _newline)
+        self._line_starts = numpy.concatenate(([0], self._newlines[:-1] + 1))
+        self.line_count = len(self._line_starts)
+
+        # Locate the comments, the values of the parameters are only read before them
+        semicolons = numpy.flatnonzero(buffer == _semicolon)
+        comment_lines = self._LineOf(semicolons)
+        is_first = numpy.ones(len(semicolons), dtype=bool)
+        is_first[1:] = comment_lines[1:] != comment_lines[:-1]
+        self._code_ends = self._newlines.copy()
+        self._code_ends[comment_lines[is_first]] = semicolons[is_first]
+
+        # Locate the text of each line without surrounding whitespace
+        # Cura hardly ever indents lines or leaves trailing spaces, so only a few lines take more than one step
+        self._stripped_starts = self._line_starts.copy()
+        self._stripped_ends = self._newlines.copy()
+        lines = numpy.arange(self.line_count)
+        while len(lines) > 0:
+            lines = lines[self._stripped_starts[lines] < self._stripped_ends[lines]]
+            lines = lines[_whitespace_table[buffer[self._stripped_starts[lines]]]]
+            self._stripped_starts[lines] += 1
+        lines = numpy.arange(self.line_count)
+        while len(lines) > 0:
+            lines = lines[self._stripped_starts[lines] < self._stripped_ends[lines]]
+            lines = lines[_whitespace_table[buffer[self._stripped_ends[lines] - 1]]]
+            self._stripped_ends[lines] -= 1
+
+        self._first_bytes = buffer[self._stripped_starts]
+
+        self._columns = {}
+        self._starts_with_masks = {}
+        self._contains_masks = {}
+
+
+
+    @property
+    def e(self):
+        return self.Values('E')
+
+
+
+    def Values(self, letter:str):
+        ''' Returns the column of values of a parameter, NaN where a line does not have it '''
+        column = self._columns.get(letter)
+        if column is None:
+            column = self._LoadColumn(ord(letter))
+            self._columns[letter] = column
+        return column
+
+
+
+    def StartsWith(self, prefix:str):
+        ''' Mask of the lines for which line.strip().startswith(prefix) is true '''
+        mask = self._starts_with_masks.get(prefix)
+        if mask is None:
+            # The first character of an empty line is its newline, which does not match
+            needle = prefix.encode('ascii')
+            lines = numpy.flatnonzero(self._first_bytes == needle[0])
+            lines = lines[self._stripped_ends[lines] - self._stripped_starts[lines] >= len(needle)]
+            for index, character in enumerate(needle[1:], 1):
+                lines = lines[self._buffer[self._stripped_starts[lines] + index] == character]
+            mask = numpy.zeros(self.line_count, dtype=bool)
+            mask[lines] = True
+            self._starts_with_masks[prefix] = mask
+        return mask
+
+
+
+    def Contains(self, text:str):
+        ''' Mask of the lines for which "text in line" is true, comments included '''
+        mask = self._contains_masks.get(text)
+        if mask is None:
+            needle = text.encode('ascii')
+            matches = self._buffer == needle[0]
+            for index, character in enumerate(needle[1:], 1):
+                matches[:-index] &= self._buffer[index:] == character
+                matches[-index:] = False
+
+            # A match can not span lines, since the text has no newline
+            mask = numpy.logical_or.reduceat(matches, self._line_starts)
+            self._contains_masks[text] = mask
+        return mask
+
+
+
+    # Vectorized equivalents of the line tests in PostProcessingCommon
+
+    def RetractLines(self):
+        return self.StartsWith('G1') & self.Contains('F') & self.Contains('E') & ~self.Contains('X') & ~self.Contains('Y') & ~self.Contains('Z')
+
+    def ExtrusionLines(self):
+        return self.StartsWith('G1') & self.Contains('X') & self.Contains('Y') & self.Contains('E')
+
+    def RelativeInstructionLines(self):
+        return self.StartsWith('G91') | self.StartsWith('M83')
+
+    def AbsoluteInstructionLines(self):
+        return self.StartsWith('G90') | self.StartsWith('M82')
+
+    def ResetExtruderLines(self):
+        return self.StartsWith('G92') & self.Contains('E0')
+
+
+
+    def _LoadColumn(self, letter:int):
+        ''' Converts the values of a parameter into a column '''
+        buffer = self._buffer
+
+        # The values are the numbers that follow the letter in the code; only the first one in a line counts
+        starts = numpy.flatnonzero(buffer == letter) + 1
+        starts = starts[_number_table[buffer[starts]]]
+        lines = self._LineOf(starts)
+        in_code = starts < self._code_ends[lines]
+        starts, lines = starts[in_code], lines[in_code]
+        is_first = numpy.ones(len(lines), dtype=bool)
+        is_first[1:] = lines[1:] != lines[:-1]
+        starts, lines = starts[is_first], lines[is_first]
+
+        # Find the end of each number, they are only a few characters long
+        lengths = numpy.zeros(len(starts), dtype=numpy.int64)
+        numbers = numpy.arange(len(starts))
+        while len(numbers) > 0:
+            numbers = numbers[_number_table[buffer[starts[numbers] + lengths[numbers]]]]
+            lengths[numbers] += 1
+
+        # Gather the text of the numbers and convert them all at once
+        offsets = numpy.cumsum(lengths) - lengths
+        number_bytes = buffer[numpy.repeat(starts - offsets, lengths) + numpy.arange(offsets[-1] + lengths[-1] if len(lengths) > 0 else 0)]
+
+        column = numpy.full(self.line_count, numpy.nan)
+        column[lines] = _ParseNumbers(number_bytes, offsets, lengths)
+        return column
+
+
+
+    def _LineOf(self, positions):
+        ''' Returns the line number of each byte position '''
+        return numpy.searchsorted(self._newlines, positions)
+
+
+
+def _ParseNumbers(number_bytes, number_starts, number_lengths):
+    ''' Converts the numbers in the concatenated text of all numbers, with the given offsets and lengths, to floats
+        NaN for text that is not a valid number (e.g. "-" or "1.2.3") '''
+    if len(number_starts) == 0:
+        return numpy.zeros(0)
+    number_ends = number_starts + number_lengths
+
+    # The digits are added up as integers, each multiplied by the power of ten of its place
+    # The place of a digit is the number of digits that follow it in the same number
+    is_digit = number_bytes >= _zero
+    digit_totals = numpy.concatenate(([0], numpy.cumsum(is_digit, dtype=numpy.int32)))
+    digit_counts = digit_totals[number_ends] - digit_totals[number_starts]
+    following_digit_counts = numpy.repeat(digit_totals[number_ends], number_lengths) - digit_totals[1:]
+    digit_values = (number_bytes - _zero) * _powers_of_ten[numpy.minimum(following_digit_counts, _exact_digit_count)]
+    digit_values[~is_digit] = 0
+    value_totals = numpy.concatenate(([0], numpy.cumsum(digit_values)))
+    values = (value_totals[number_ends] - value_totals[number_starts]).astype(numpy.float64)
+
+    # The digits after the decimal point make the divisor
+    dot_offsets = numpy.flatnonzero(number_bytes == _dot)
+    dot_numbers = numpy.searchsorted(number_starts, dot_offsets, side='right') - 1
+    decimal_counts = numpy.zeros(len(number_starts), dtype=numpy.int32)
+    decimal_counts[dot_numbers] = following_digit_counts[dot_offsets]
+    values /= 10.0 ** decimal_counts
+
+    # A number needs a digit, at most one decimal point and a sign only as its first character
+    sign_offsets = numpy.flatnonzero((number_bytes == _minus) | (number_bytes == _plus))
+    sign_numbers = numpy.searchsorted(number_starts, sign_offsets, side='right') - 1
+    is_valid = (digit_counts > 0) & (numpy.bincount(dot_numbers, minlength=len(number_starts)) <= 1)
+    is_valid[sign_numbers[sign_offsets != number_starts[sign_numbers]]] = False
+    negative_numbers = sign_numbers[number_bytes[sign_offsets] == _minus]
+    values[negative_numbers] = -values[negative_numbers]
+    values[~is_valid] = numpy.nan
+
+    # Numbers with more digits are rare, they are converted one at a time
+    for index in numpy.flatnonzero(is_valid & (digit_counts > _exact_digit_count)):
+        values[index] = float(number_bytes[number_starts[index]:number_ends[index]].tobytes())
+
+    return values
+
+
+
+def TokenizeGcode(gcode) -> GcodeTokens:
+    ''' Tokenizes a gcode string (a layer, or a whole plate joined together) or a list of lines '''
+    if isinstance(gcode, str):
+        return GcodeTokens(gcode)
+    return GcodeTokens('\n'.join(gcode))
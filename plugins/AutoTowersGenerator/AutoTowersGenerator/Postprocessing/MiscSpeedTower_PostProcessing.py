@@ -21,7 +21,11 @@
 #   (Contributed by "Hello1024" on Github)
 # Version 3.2 - 28 Aug 2023:
 #   Add the option enable_advanced_gcode_comments to reduce the Gcode size
-__version__ = '3.2'
+# Version 3.3 - 18 Oct 2026:
+#   Process the gcode a layer at a time, recording changes to be applied in a single pass
+# Version 3.4 - 18 Oct 2026:
+#   Fixed the junction command not being added without advanced gcode comments
+__version__ = '3.4'
 
 from UM.Logger import Logger
 
@@ -56,11 +60,11 @@ def execute(gcode, base_height: float, section_height: float, initial_layer_heig
     # Start at the requested starting speed
     current_speed = start_speed - speed_change # The current speed will be corrected when the first section is encountered
 
-    # Iterate over each line in the g-code
-    for line_index, line, lines, start_of_new_section in Common.LayerEnumerate(gcode, base_height, section_height, initial_layer_height, layer_height, enable_advanced_gcode_comments):
+    # Iterate over each layer in the g-code
+    for layer in Common.LayerEnumerate(gcode, base_height, section_height, initial_layer_height, layer_height, enable_advanced_gcode_comments):
 
         # Handle each new tower section
-        if start_of_new_section:
+        if layer.start_of_new_section:
             
             # Increment the speed for this tower section
             current_speed += speed_change
@@ -90,7 +94,7 @@ def execute(gcode, base_height: float, section_height: float, initial_layer_heig
                 if enable_advanced_gcode_comments :
                     command_line = f'M205 J{float(current_speed):.3f} {Common.comment_prefix} setting junction value to {float(current_speed):.3f} for this tower section'
                 else:
-                    ommand_line = f'M205 J{float(current_speed):.3f}'
+                    command_line = f'M205 J{float(current_speed):.3f}'
                 lcd_line1 = f'M117 JCN J{float(current_speed):.3f}'
                 lcd_line2 = f'{Common.comment_prefix} Displaying "JCN J{float(current_speed):.3f}" on the LCD'
 
@@ -110,7 +114,7 @@ def execute(gcode, base_height: float, section_height: float, initial_layer_heig
                 else:
                     command_line = f'M572 D0 S{float(current_speed):.3f}'
                 lcd_line1 = f'M117 PRS {float(current_speed):.3f}'
-                lcd_line2 = f'{Common.comment_prefix}  Displaying "PRS {float(current_speed):.3f}" on the LCD'
+                lcd_line2 = f'{Common.comment_prefix} Displaying "PRS {float(current_speed):.3f}" on the LCD'
 
             # Handle unrecognized tower types
             else:  
@@ -118,13 +122,15 @@ def execute(gcode, base_height: float, section_height: float, initial_layer_heig
                 break
 
             # Configure the new speed in the gcode
-            lines.insert(2, command_line)
+            new_lines = [command_line]
 
             # Display the new speed on the printer's LCD
             if enable_lcd_messages:
-                lines.insert(3, lcd_line1)
                 if enable_advanced_gcode_comments :
-                    lines.insert(3, lcd_line2)
+                    new_lines.append(lcd_line2)
+                new_lines.append(lcd_line1)
+
+            layer.InsertLines(2, new_lines)
 
     Logger.log('d', f'AutoTowersGenerator completing {tower_type} SpeedTower post-processing')
 
@@ -0,0 +1,665 @@
+# This script applies a list of parameter schedules to the gcode in a single pass
+# Each schedule changes one parameter (temperature, fan speed, flow rate, etc) by a fixed amount every
+# section height, so towers that vary several parameters at once can be post-processed together
+# The handling of each parameter matches the single-parameter tower scripts, a schedule on its own produces the same
+# gcode as the script for that parameter (apart from the settings documented at the start of the gcode)
+#
+# Version 1.0 - 18 Oct 2026:
+#   Initial version
+__version__ = '1.0'
+
+import re
+
+from UM.Logger import Logger
+
+from . import PostProcessingCommon as Common
+
+
+
+def execute(gcode, base_height:float, initial_layer_height:float, layer_height:float, schedules, enable_lcd_messages:bool, enable_advanced_gcode_comments:bool):
+    ''' Post-process gcode sliced by Cura
+        Each schedule is a tuple of (parameter, start value, value change, section height), optionally followed by
+            a dictionary of options for the parameter (e.g. the reference speed of a print speed schedule)
+        Each parameter can only be scheduled once, and only one of the scheduled parameters can modify
+            the extrusion positions (flow rate or retraction distance) '''
+
+    # Log the post-processing settings
+    Logger.log('d', f'Beginning Multi-Parameter Tower post-processing script version {__version__}')
+    Logger.log('d', f'Base height = {base_height} mm')
+    Logger.log('d', f'Initial printed layer height = {initial_layer_height}')
+    Logger.log('d', f'Printed layer height = {layer_height} mm')
+    for schedule in schedules:
+        Logger.log('d', f'Schedule = {_DescribeSchedule(schedule)}')
+    Logger.log('d', f'Enable LCD messages = {enable_lcd_messages}')
+    Logger.log('d', f'Advanced Gcode Comments = {enable_advanced_gcode_comments}')
+
+    # Document the settings in the g-code
+    gcode[0] += f'{Common.comment_prefix} Multi-Parameter Tower post-processing script version {__version__}\n'
+    gcode[0] += f'{Common.comment_prefix} Base height = {base_height} mm\n'
+    gcode[0] += f'{Common.comment_prefix} Initial printed layer height = {initial_layer_height} mm\n'
+    gcode[0] += f'{Common.comment_prefix} Printed layer height = {layer_height} mm\n'
+    for schedule in schedules:
+        gcode[0] += f'{Common.comment_prefix} Schedule = {_DescribeSchedule(schedule)}\n'
+    gcode[0] += f'{Common.comment_prefix} Enable LCD messages = {enable_lcd_messages}\n'
+    gcode[0] += f'{Common.comment_prefix} Advanced Gcode comments = {enable_advanced_gcode_comments}\n'
+
+    # Create the objects that apply the schedules to the gcode
+    parameter_schedules = _CreateSchedules(schedules, base_height, enable_lcd_messages, enable_advanced_gcode_comments)
+
+    # Only the schedules that modify lines need to look at each line
+    line_processors = [parameter_schedule.ProcessLine for parameter_schedule in parameter_schedules if parameter_schedule.processes_lines]
+
+    # The sections of each schedule are named in the comments if there are several schedules
+    name_sections = len(parameter_schedules) > 1
+
+    # Iterate over each layer in the g-code
+    # Each schedule keeps track of its own tower sections, so the layers are enumerated without sections
+    for layer in Common.LayerEnumerate(gcode, base_height, None, initial_layer_height, layer_height, enable_advanced_gcode_comments):
+
+        # Only the layers that start with a ";LAYER:" line raise the print height, the gcode before them is yielded as a layer of its own
+        printed_layer = len(layer.lines) > 0 and Common.layer_regex.match(layer.lines[0]) is not None
+
+        # Determine which schedules start a new tower section with this layer
+        for parameter_schedule in parameter_schedules:
+            parameter_schedule.start_of_new_section = printed_layer and parameter_schedule.section_tracker.Update(layer.height)
+
+        # Comment the start of the tower sections in the gcode
+        if enable_advanced_gcode_comments:
+            for parameter_schedule in parameter_schedules:
+                if parameter_schedule.start_of_new_section:
+                    section_name = f'{parameter_schedule.parameter.lower()} tower section' if name_sections else 'tower section'
+                    layer.InsertLines(1, [f'{Common.comment_prefix} Starting {section_name} number {parameter_schedule.section_tracker.section_number} at Cura layer number {layer.layer_number + 1} (which is labeled as layer {layer.layer_number} in this gcode file)'])
+
+        # Configure the new values for the tower sections
+        for parameter_schedule in parameter_schedules:
+            if parameter_schedule.start_of_new_section:
+                parameter_schedule.StartSection(layer)
+
+        # Iterate over each line in the layer
+        # Each schedule decides what to do based on the original line and modifies the line as changed by the previous schedules
+        if line_processors:
+            for line_index, line in enumerate(layer.lines):
+                new_line = line
+                for ProcessLine in line_processors:
+                    new_line = ProcessLine(layer, line_index, line, new_line)
+
+                # Replace the original line with the post-processed line
+                if new_line is not line:
+                    layer.ReplaceLine(line_index, new_line)
+
+    # Complete the schedules
+    for parameter_schedule in parameter_schedules:
+        parameter_schedule.Finish(gcode)
+
+    Logger.log('d', 'AutoTowersGenerator completing Multi-Parameter Tower post-processing')
+
+    return gcode
+
+
+
+class _Schedule:
+    ''' Applies the schedule of a single parameter to the gcode
+        The value of the parameter changes by a fixed amount at the start of each tower section '''
+
+    # True for schedules that need to look at each line of the gcode
+    processes_lines = False
+
+    # True for schedules that modify the extrusion positions
+    modifies_extrusion = False
+
+    def __init__(self, parameter:str, start_value:float, value_change:float, section_tracker, options:dict, enable_lcd_messages:bool, enable_advanced_gcode_comments:bool):
+        self.parameter = parameter
+        self.section_tracker = section_tracker
+        self.start_of_new_section = False
+        self._options = options
+        self._value_change = value_change
+        self._enable_lcd_messages = enable_lcd_messages
+        self._enable_advanced_gcode_comments = enable_advanced_gcode_comments
+
+        # The current value will be corrected when the first section is encountered
+        self._current_value = start_value - value_change
+
+
+
+    def StartSection(self, layer):
+        ''' Updates the value for a new tower section and configures it in the first layer of the section '''
+        self._current_value += self._value_change
+        layer.InsertLines(2, self._SectionLines())
+
+
+
+    def ProcessLine(self, layer, line_index:int, original_line:str, line:str) -> str:
+        ''' Returns the post-processed version of a line
+            The original line is used to decide how to process the line, since other schedules may already have modified it '''
+        return line
+
+
+
+    def Finish(self, gcode):
+        ''' Called once all the layers have been processed '''
+        pass
+
+
+
+    def _SectionLines(self) -> list:
+        ''' Returns the lines that configure the current value at the start of a tower section '''
+        return []
+
+
+
+    def _LcdLines(self, message:str, commented_message:str=None) -> list:
+        ''' Returns the lines that display a message on the printer's LCD, if enabled
+            The comment quotes commented_message instead of the message if it is given '''
+        if not self._enable_lcd_messages:
+            return []
+
+        if self._enable_advanced_gcode_comments:
+            return [f'{Common.comment_prefix} Displaying "{commented_message or message}" on the LCD', f'M117 {message}']
+        return [f'M117 {message}']
+
+
+
+class _CommandSchedule(_Schedule):
+    ''' A parameter that is set by a single command at the start of each tower section '''
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        self._command, self._description, self._lcd_message = _commands[self.parameter]
+
+
+
+    def _SectionLines(self) -> list:
+        # Configure the new value in the gcode
+        if self._enable_advanced_gcode_comments:
+            new_lines = [f'{self._command(self._current_value)} {Common.comment_prefix} setting {self._description(self._current_value)} for this tower section']
+        else:
+            new_lines = [self._command(self._current_value)]
+
+        # Display the new value on the printer's LCD
+        return new_lines + self._LcdLines(self._lcd_message(self._current_value))
+
+
+
+class _TemperatureSchedule(_Schedule):
+    ''' Sets the temperature for each tower section and waits for it to be reached '''
+
+    def _SectionLines(self) -> list:
+        current_temp = self._current_value
+
+        # Configure the new temperature in the gcode
+        if self._enable_advanced_gcode_comments:
+            new_lines = [f'M104 S{current_temp} {Common.comment_prefix} setting temperature to {current_temp} C for this tower section']
+        else:
+            new_lines = [f'M104 S{current_temp}']
+
+        # Display the new temperature on the printer's LCD
+        new_lines += self._LcdLines(f'TMP {current_temp} C')
+
+        # Wait for the new temperature to be reached
+        if self._enable_advanced_gcode_comments:
+            new_lines.append(f'M109 S{current_temp} {Common.comment_prefix} Wait for the temperature to be reached')
+        else:
+            new_lines.append(f'M109 S{current_temp}')
+
+        return new_lines
+
+
+
+class _FanSpeedSchedule(_Schedule):
+    ''' Sets the fan speed percentage for each tower section
+        Option "maintain_bridge_value": keep the fan speed Cura uses for bridges (defaults to False, like the fan tower) '''
+
+    processes_lines = True
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        self._maintain_bridge_value = self._options.get('maintain_bridge_value', False)
+
+        # Store the current fan value (0-255)
+        self._current_fan_value = int((self._current_value * 255) / 100)
+
+        # Keep track of whether a bridge has been completed
+        self._after_bridge = False
+
+
+
+    def _SectionLines(self) -> list:
+        current_fan_percent = self._current_value
+
+        # Convert the fan speed from a range of 0-100 to 0-255
+        self._current_fan_value = int((current_fan_percent * 255) / 100)
+
+        # Configure the new fan speed % in the gcode
+        if self._enable_advanced_gcode_comments:
+            new_lines = [f'M106 S{self._current_fan_value} {Common.comment_prefix} setting fan speed to {current_fan_percent}% for the this tower section']
+        else:
+            new_lines = [f'M106 S{self._current_fan_value}']
+
+        # Display the new the fan speed % on the printer's LCD
+        return new_lines + self._LcdLines(f'Speed {current_fan_percent}%')
+
+
+
+    def ProcessLine(self, layer, line_index:int, original_line:str, line:str) -> str:
+        # The fan speed change inserted for a new tower section is handled like any other fan speed change,
+        # so the next fan speed change is treated as coming after a bridge
+        if line_index == 2 and self.start_of_new_section:
+            self._after_bridge = True
+
+        # Handle fan speed changes in the gcode
+        if Common.IsFanSpeedChangeLine(original_line):
+
+            # If this change is coming after a bridge has been printed or we don't need to maintain the bridge value
+            if self._after_bridge or not self._maintain_bridge_value:
+
+                # Resume the tower section fan speed in the gcode
+                if self._enable_advanced_gcode_comments:
+                    return f'M106 S{self._current_fan_value} {Common.comment_prefix} Resuming fan speed of {self._current_value}% after printing a bridge'
+                return f'M106 S{self._current_fan_value}'
+
+            # If this is the start of a bridge, mark the next fan speed change as coming after a bridge was printed
+            self._after_bridge = True
+
+        # If the fan is being turned off for the start of a bridge, mark the next fan speed change as coming after a bridge was printed
+        elif Common.IsFanOffLine(original_line):
+            self._after_bridge = True
+
+        # If this line marks the start of a bridge, mark the next fan speed change as being the start of a bridge print
+        elif Common.IsStartOfBridge(original_line):
+            self._after_bridge = False
+
+        return line
+
+
+
+class _FlowRateSchedule(_Schedule):
+    ''' Modifies the extrusion of each tower section to achieve a flow rate percentage
+        Option "relative_extrusion": whether relative extrusion is used at the start of the gcode (defaults to False)
+        Option "reference_flow_rate": the flow rate percentage the gcode was sliced with (defaults to 100) '''
+
+    processes_lines = True
+    modifies_extrusion = True
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        self._relative_extrusion = self._options.get('relative_extrusion', False)
+        self._reference_flow_rate = self._options.get('reference_flow_rate', 100)
+
+        # Keep track of the original and updated absolute extrusion positions
+        self._reference_extrusion_position = None
+        self._updated_extrusion_position = None
+
+
+
+    def _SectionLines(self) -> list:
+        current_flow_rate = self._current_value
+
+        # Document the new flow rate in the gcode
+        if self._enable_advanced_gcode_comments:
+            new_lines = [f'{Common.comment_prefix} Using flow rate {current_flow_rate}% for this tower section']
+        else:
+            new_lines = []
+
+        # Display the new flow rate on the printer's LCD
+        return new_lines + self._LcdLines(f'FLOW {current_flow_rate:.1f}%')
+
+
+
+    def ProcessLine(self, layer, line_index:int, original_line:str, line:str) -> str:
+        current_flow_rate = self._current_value
+        reference_flow_rate = self._reference_flow_rate
+
+        # Record if relative extrusion is now being used
+        if Common.IsRelativeInstructionLine(original_line):
+            self._relative_extrusion = True
+
+        # Record if absolute extrusion is now being used
+        elif Common.IsAbsoluteInstructionLine(original_line):
+            self._relative_extrusion = False
+
+            # The absolute extrusion position data will need to be redetermined
+            self._reference_extrusion_position = None
+            self._updated_extrusion_position = None
+
+        # Handle resetting the extruder position
+        elif Common.IsResetExtruderLine(original_line) and not self._relative_extrusion:
+
+            # Reset the recorded extrusion positions to 0
+            self._reference_extrusion_position = 0
+            self._updated_extrusion_position = 0
+
+        # Handle extrusion or retraction lines that need to be processed
+        # All extrusion commands will need to be modified to achieve the requested flow rate
+        # Absolute retraction commands will need to modified to account for flow rate extrusion changes
+        # Relative retraction commands can be left unchanged
+        elif Common.IsExtrusionLine(original_line) or (Common.IsRetractLine(original_line) and not self._relative_extrusion):
+
+            # Determine the current extrusion position
+            position_search_results = _extrusion_position_regex.search(line.split(';')[0])
+            if not position_search_results:
+                return line
+            original_extrusion_position_string = position_search_results.group(1)
+            original_extrusion_position = float(original_extrusion_position_string)
+
+            # If the absolute filament reference extrusion position hasn't been read yet, read it from this command
+            if self._reference_extrusion_position is None and not self._relative_extrusion:
+                self._reference_extrusion_position = original_extrusion_position
+                self._updated_extrusion_position = original_extrusion_position
+
+            # Handle absolute retraction commands
+            elif Common.IsRetractLine(original_line):
+
+                # Determine how far the filament is being extruded or retracted
+                original_extruded_distance = original_extrusion_position - self._reference_extrusion_position
+
+                # Update the referenced extrusion positions
+                self._reference_extrusion_position = original_extrusion_position
+                self._updated_extrusion_position += original_extruded_distance
+
+                # Update the gcode line
+                line = line.replace(f'E{original_extrusion_position_string}', f'E{self._updated_extrusion_position:.5f}')
+                if self._enable_advanced_gcode_comments:
+                    if original_extruded_distance < 0:
+                        line += f' {Common.comment_prefix} Retracting {-original_extruded_distance:.5f} mm of filament'
+                    else:
+                        line += f' {Common.comment_prefix} Extruding {original_extruded_distance:.5f} mm of filament to reverse the last retraction'
+
+            # Handle relative extrusion commands
+            # With relative extrusion, the "extrusion position" is simply the distance of filament being extruded
+            # Only positive extrusion (filament being pushed out) is modified to achieve the requested flow rate
+            elif self._relative_extrusion:
+                original_extruded_distance = original_extrusion_position
+                if original_extruded_distance > 0:
+
+                    # Update the extruded distance to reflect the current flow rate
+                    nominal_extruded_distance = original_extruded_distance / (reference_flow_rate / 100) # Correct for the reference flow rate
+                    updated_extruded_distance = nominal_extruded_distance * (current_flow_rate / 100) # Convert to the current flow rate
+
+                    # Update the gcode line
+                    line = line.replace(f'E{original_extrusion_position_string}', f'E{updated_extruded_distance:.5f}')
+                    if self._enable_advanced_gcode_comments:
+                        line += f' {Common.comment_prefix} Extruding {updated_extruded_distance:.5f} mm of filament to achieve a {current_flow_rate}% flow rate (originally {original_extruded_distance:.5f} mm at {reference_flow_rate}% flow rate)'
+
+            # Handle absolute extrusion commands
+            # This is more complicated than relative extrusion since we need to keep track of how much
+            # filament the script originally extruded and how much our modifications are extruding
+            else:
+
+                # Calculate how much filament is being extruded by the script
+                original_extruded_distance = original_extrusion_position - self._reference_extrusion_position
+
+                # Update the referenced extrusion position
+                self._reference_extrusion_position = original_extrusion_position
+
+                # Update the extruded distance to reflect the current flow rate
+                nominal_extruded_distance = original_extruded_distance / (reference_flow_rate / 100) # Correct for the reference flow rate
+                updated_extruded_distance = nominal_extruded_distance * (current_flow_rate / 100) # Convert to the current flow rate
+                self._updated_extrusion_position += updated_extruded_distance
+
+                # Update the gcode line
+                line = line.replace(f'E{original_extrusion_position_string}', f'E{self._updated_extrusion_position:.5f}')
+                if self._enable_advanced_gcode_comments:
+                    line += f' {Common.comment_prefix} Extruding {updated_extruded_distance:.5f} mm of filament to achieve a {current_flow_rate}% flow rate (originally {original_extruded_distance:.5f} mm at {reference_flow_rate}% flow rate)'
+
+        return line
+
+
+
+class _PrintSpeedSchedule(_Schedule):
+    ''' Mimics a print speed setting for each tower section by changing the feedrate percentage
+        Option "reference_speed": the print speed the gcode was sliced with (required) '''
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        self._reference_speed = self._options['reference_speed']
+
+        # Keep track of when the first section is encountered
+        self._first_section = True
+
+
+
+    def StartSection(self, layer):
+        super().StartSection(layer)
+
+        # Backup the feedrate percentage before the first tower section
+        if self._first_section:
+            self._first_section = False
+            if self._enable_advanced_gcode_comments:
+                layer.InsertLines(1, [f'M220 B {Common.comment_prefix} Backing up the current feedrate percentage'])
+            else:
+                layer.InsertLines(1, ['M220 B'])
+
+
+
+    def _SectionLines(self) -> list:
+        current_speed = self._current_value
+        reference_speed = self._reference_speed
+
+        # Calculate the new feedrate percentage
+        feedrate_percentage = current_speed / reference_speed * 100
+
+        if self._enable_advanced_gcode_comments:
+            # Document the new speed in the gcode
+            new_lines = [f'{Common.comment_prefix} Print speed for this tower section is {current_speed:.1f} mm/s']
+
+            # Command the new feedrate percentage in the gcode
+            new_lines.append(f'M220 S{feedrate_percentage:.2f} {Common.comment_prefix} Setting the feedrate percentage to {feedrate_percentage:.2f}% to mimic a print speed setting change from {reference_speed}mm/s to {current_speed} mm/s')
+        else:
+            new_lines = [f'M220 S{feedrate_percentage:.2f}']
+
+        # Display the new print speed on the printer's LCD
+        return new_lines + self._LcdLines(f'SPD {current_speed:.1f} mm/s', f'SPD {current_speed:.1f}')
+
+
+
+    def Finish(self, gcode):
+        # Restore the backed-up feedrate percentage
+        last_layer_index = len(gcode) - Common.trailing_inserted_layer_count - 1
+        if self._enable_advanced_gcode_comments:
+            gcode[last_layer_index] += f'M220 S100 {Common.comment_prefix} Setting the feedrate percentage to 100% in case the restore command does not work\n'
+            gcode[last_layer_index] += f'M220 R {Common.comment_prefix} Restoring the backed-up feedrate percentage\n'
+        else:
+            gcode[last_layer_index] += 'M220 S100\n'
+            gcode[last_layer_index] += 'M220 R\n'
+
+
+
+class _RetractSpeedSchedule(_Schedule):
+    ''' Changes the speed of the retractions in each tower section '''
+
+    processes_lines = True
+
+    def _SectionLines(self) -> list:
+        current_retract_speed = self._current_value
+
+        # Document the new retraction speed in the gcode
+        new_lines = [f'{Common.comment_prefix} Using a retraction speed of {current_retract_speed} mm/s for this tower section']
+
+        # Display the new retraction value on the printer's LCD
+        return new_lines + self._LcdLines(f'SPD {current_retract_speed:.1f} mm/s', f'SPD {current_retract_speed:.1f}')
+
+
+
+    def ProcessLine(self, layer, line_index:int, original_line:str, line:str) -> str:
+        current_retract_speed = self._current_value
+
+        # Retraction commands need to be modified to match the requested speed
+        if Common.IsRetractLine(original_line):
+
+            # Determine the current retraction speed
+            speed_search_results = _speed_regex.search(line.split(';')[0])
+            if speed_search_results:
+                original_speed_string = speed_search_results.group(1)
+
+                # Update the line with the new retraction speed
+                line = line.replace(f'F{original_speed_string}', f'F{int(current_retract_speed * 60)}')
+                if self._enable_advanced_gcode_comments:
+                    line += f' {Common.comment_prefix} Changed retraction speed to {current_retract_speed} mm/s ({current_retract_speed * 60} mm/min)' # Speed value must be specified as mm/min for the gcode
+
+        return line
+
+
+
+class _RetractDistanceSchedule(_Schedule):
+    ''' Changes the distance of the retractions in each tower section
+        Option "relative_extrusion": whether relative extrusion is used at the start of the gcode (defaults to False) '''
+
+    processes_lines = True
+    modifies_extrusion = True
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        self._relative_extrusion = self._options.get('relative_extrusion', False)
+
+        # Keep track of the absolute retraction position
+        self._reference_extrusion_position = None
+
+
+
+    def _SectionLines(self) -> list:
+        current_retract_distance = self._current_value
+
+        # Document the new retraction value in the gcode
+        new_lines = [f'{Common.comment_prefix} Using a retraction distance of {current_retract_distance} mm for this tower section']
+
+        # Display the new retraction value on the printer's LCD
+        return new_lines + self._LcdLines(f'DST {current_retract_distance:.1f} mm', f'DST {current_retract_distance:.1f}')
+
+
+
+    def ProcessLine(self, layer, line_index:int, original_line:str, line:str) -> str:
+        current_retract_distance = self._current_value
+
+        # Record if relative extrusion is now being used
+        if Common.IsRelativeInstructionLine(original_line):
+            self._relative_extrusion = True
+
+        # Record if absolute extrusion is now being used
+        elif Common.IsAbsoluteInstructionLine(original_line):
+            self._relative_extrusion = False
+
+            # The absolute extrusion position data is irrelevant in this mode
+            self._reference_extrusion_position = None
+
+        # Handle resetting the extruder position
+        elif Common.IsResetExtruderLine(original_line):
+            self._reference_extrusion_position = 0
+
+        # Handle extrusion and retraction lines
+        elif Common.IsExtrusionLine(original_line) or Common.IsRetractLine(original_line):
+
+            # Determine the current extrusion position
+            position_search_results = _extrusion_position_regex.search(line.split(';')[0])
+            if not position_search_results:
+                return line
+            original_extrusion_position_string = position_search_results.group(1)
+            original_extrusion_position = float(original_extrusion_position_string)
+
+            # Record the first reference position
+            if self._reference_extrusion_position is None and not self._relative_extrusion:
+                self._reference_extrusion_position = original_extrusion_position
+
+            # For extrusion commands, the absolute extrusion position just needs to be updated
+            elif Common.IsExtrusionLine(original_line):
+                if not self._relative_extrusion:
+                    self._reference_extrusion_position = original_extrusion_position
+
+            # Relative retraction is fairly simple since the filament position doesn't need to be tracked
+            # The original retraction distance is just the "extrusion position" in this case
+            elif self._relative_extrusion:
+
+                # Update actual retraction lines (filament being pulled in)
+                if original_extrusion_position < 0:
+                    line = line.replace(f'E{original_extrusion_position_string}', f'E{-current_retract_distance:.5f}')
+                    if self._enable_advanced_gcode_comments:
+                        line += f' {Common.comment_prefix} Retracting {-current_retract_distance:.5f} mm of filament using relative positioning'
+
+                # Update filament extrusion (reversing the previous retraction)
+                else:
+                    line = line.replace(f'E{original_extrusion_position_string}', f'E{current_retract_distance:.5f}')
+                    if self._enable_advanced_gcode_comments:
+                        line += f' {Common.comment_prefix} Extruding {current_retract_distance:.5f} mm of filament using relative positioning to reverse the previous retraction'
+
+            # Absolute retraction needs to take into account the current absolute filament position
+            # Update actual retraction lines (filament being pulled in)
+            elif original_extrusion_position < self._reference_extrusion_position:
+                updated_extrusion_position = self._reference_extrusion_position - current_retract_distance
+                line = line.replace(f'E{original_extrusion_position_string}', f'E{updated_extrusion_position:.5f}')
+                if self._enable_advanced_gcode_comments:
+                    line += f' {Common.comment_prefix} Retracting {current_retract_distance:.5f} mm of filament using absolute positioning'
+
+            # Since the extrusion reversing the previous retraction is just returning the filament to the previous position,
+            # the original line will work unchanged
+            elif self._enable_advanced_gcode_comments:
+                line += f' {Common.comment_prefix} Extruding {current_retract_distance:.5f} mm of filament using absolute positioning to reverse the previous retraction'
+
+        return line
+
+
+
+def _CreateSchedules(schedules, base_height:float, enable_lcd_messages:bool, enable_advanced_gcode_comments:bool) -> list:
+    ''' Creates the objects that apply each schedule, leaving out the schedules that cannot be applied '''
+
+    parameter_schedules = []
+    for schedule in schedules:
+        parameter, start_value, value_change, section_height = schedule[:4]
+        options = schedule[4] if len(schedule) > 4 else {}
+
+        # Make sure the schedule can be applied
+        schedule_class = _schedule_classes.get(parameter)
+        if schedule_class is None:
+            Logger.log('e', f'MultiParameterTower_PostProcessing: unrecognized parameter "{parameter}"')
+            continue
+
+        if parameter in [parameter_schedule.parameter for parameter_schedule in parameter_schedules]:
+            Logger.log('e', f'MultiParameterTower_PostProcessing: "{parameter}" is scheduled more than once')
+            continue
+
+        if schedule_class.modifies_extrusion and any(parameter_schedule.modifies_extrusion for parameter_schedule in parameter_schedules):
+            Logger.log('e', f'MultiParameterTower_PostProcessing: "{parameter}" cannot be combined with another parameter that modifies the extrusion')
+            continue
+
+        section_tracker = Common.SectionTracker(base_height, section_height)
+        try:
+            parameter_schedules.append(schedule_class(parameter, start_value, value_change, section_tracker, options, enable_lcd_messages, enable_advanced_gcode_comments))
+        except KeyError as e:
+            Logger.log('e', f'MultiParameterTower_PostProcessing: the option {e} is required for "{parameter}"')
+
+    return parameter_schedules
+
+
+
+def _DescribeSchedule(schedule) -> str:
+    ''' Returns a description of a schedule for documenting it '''
+    parameter, start_value, value_change, section_height = schedule[:4]
+    description = f'{parameter} starting at {start_value} and changing by {value_change} every {section_height} mm'
+    if len(schedule) > 4 and schedule[4]:
+        description += f' ({", ".join(f"{name} = {value}" for name, value in schedule[4].items())})'
+    return description
+
+
+
+# The regexes to use when searching for the extrusion position and speed in a line
+_extrusion_position_regex = re.compile(r'E([-+]?\d*\.?\d+)')
+_speed_regex = re.compile(r'F([-+]?\d*\.?\d+)')
+
+# The parameters that are set by a single command at the start of each tower section
+# Each entry has functions returning the command, a description of the setting and the LCD message for a value
+_commands = {
+    'Acceleration': (lambda value: f'M204 S{int(value)}', lambda value: f'acceleration to {int(value)} mm/s/s', lambda value: f'ACC S{int(value)} mm/s/s'),
+    'Jerk': (lambda value: f'M205 X{int(value)} Y{int(value)}', lambda value: f'jerk speed to {int(value)} mm/s', lambda value: f'JRK X{int(value)} Y{int(value)}'),
+    'Junction': (lambda value: f'M205 J{float(value):.3f}', lambda value: f'junction value to {float(value):.3f}', lambda value: f'JCN J{float(value):.3f}'),
+    'Marlin Linear': (lambda value: f'M900 K{float(value):.3f}', lambda value: f'Marlin linear value to {float(value):.3f}', lambda value: f'LIN {float(value):.3f}'),
+    'RepRap Pressure': (lambda value: f'M572 D0 S{float(value):.3f}', lambda value: f'RepRap pressure value to {float(value):.3f}', lambda value: f'PRS {float(value):.3f}'),
+}
+
+# The class that applies the schedule of each parameter
+_schedule_classes = {
+    'Temperature': _TemperatureSchedule,
+    'Fan Speed': _FanSpeedSchedule,
+    'Flow Rate': _FlowRateSchedule,
+    'Print Speed': _PrintSpeedSchedule,
+    'Retract Speed': _RetractSpeedSchedule,
+    'Retract Distance': _RetractDistanceSchedule,
+    **{parameter: _CommandSchedule for parameter in _commands},
+}
@@ -16,56 +16,139 @@ initial_inserted_layer_count = 2
 # The number of layers that are automatically inserted into the gcode after the printed layers
 trailing_inserted_layer_count = 2
 
+# The regex to use when searching for new layers
+layer_regex = re.compile(r';LAYER:(\d+)\s*')
+
+
+
+class TowerLayer:
+    ''' A layer of gcode yielded by LayerEnumerate
+
+        lines: the lines of the layer that are to be post-processed (do not modify this list)
+        height: the print height of the layer, 0 before the first layer
+        layer_number: the layer number in the gcode (Cura's "Layer 0" is 0), None before the first layer
+        start_of_new_section: True if a new tower section starts with this layer
+        section_number: the number of the tower section, 0 before the first section
+        plate_line_index: the index of the first line of the layer in the lines of the whole gcode (the clumps
+            joined with newlines), before any changes
+
+        Changes to the lines are recorded with InsertLines and ReplaceLine, which take the original index
+        of a line in the layer. They are applied in a single rebuild of the gcode once the iteration has
+        moved past the layer. '''
+
+    def __init__(self, lines, first_line_index:int, height:float, layer_number, start_of_new_section:bool, section_number:int, plate_line_index:int, insertions:dict, replacements:dict):
+        self.lines = lines
+        self.height = height
+        self.layer_number = layer_number
+        self.start_of_new_section = start_of_new_section
+        self.section_number = section_number
+        self.plate_line_index = plate_line_index
+
+        self._first_line_index = first_line_index
+        self._insertions = insertions
+        self._replacements = replacements
+
+
+
+    def InsertLines(self, line_index:int, new_lines):
+        ''' Inserts lines before the line with the given index (or after the last line if the index is len(lines))
+            Lines inserted at the same index keep the order in which they were inserted '''
+        if new_lines:
+            self._insertions.setdefault(self._first_line_index + line_index, []).extend(new_lines)
+
+
+
+    def ReplaceLine(self, line_index:int, new_line:str):
+        ''' Replaces the line with the given index '''
+        self._replacements[self._first_line_index + line_index] = new_line
+
+
+
+class SectionTracker:
+    ''' Keeps track of the tower sections as the print height increases
+        The first section starts above the base height and a new one starts every section_height after that '''
+
+    def __init__(self, base_height:float, section_height:float):
+        # Convert the heights to decimal numbers for better mathematical accuracy
+        self._base_height = Decimal(str(base_height))
+        self._section_height = Decimal(str(section_height))
+
+        # Keep track of where the next section should start
+        self._next_section_start_height = self._base_height
+
+        # Keep track of the tower section number
+        self.section_number = 0
+
+
+
+    def Update(self, print_height) -> bool:
+        ''' Returns True if a new tower section starts with the layer at the given print height
+            This must be called once for each printed layer '''
+        print_height = Decimal(str(print_height))
+
+        # Layers aren't processed until after the base has been printed
+        if print_height > self._base_height and print_height > self._next_section_start_height:
+
+            # Update the starting height of the next tower section
+            self._next_section_start_height += self._section_height
+
+            # Increment the tower section number
+            self.section_number += 1
+            return True
+
+        return False
+
 
 
 def LayerEnumerate(gcode, base_height:float, section_height:float, initial_layer_height:float, layer_height:float, enable_advanced_gcode_comments:bool):
-    ''' Iterates over the lines in the gcode that is passed in 
-        skipping Cura's comment layer and the user-specified start gcode 
-        and ignoring post-printing layers '''
+    ''' Iterates over the layers in the gcode that is passed in, yielding a TowerLayer for each one
+        Lines after the end of the printed gcode in a "clump" are not included in its layers
+        The lines of a clump before its first ";LAYER:" line are yielded as a layer of their own
+        If section_height is None, tower sections are not tracked '''
 
     # Convert the heights to decimal numbers for better mathematical accuracy
-    base_height = Decimal(str(base_height))
-    section_height = Decimal(str(section_height))
     initial_layer_height = Decimal(str(initial_layer_height))
     layer_height = Decimal(str(layer_height))
 
-    # Keep track of whether a line marks the start of a new layer
-    start_of_new_section = False
-    
     # Keep track of the current print height
     current_print_height = Decimal('0')
 
-    # Keep track of where the next section should start
-    next_section_start_height = base_height
+    # Keep track of the tower sections
+    section_tracker = SectionTracker(base_height, section_height) if section_height is not None else None
 
     # Keep track of the current gcode layer number
-    layer_number = 0
-
-    # The regex to use when searching for new layers
-    layer_regex = re.compile(r';LAYER:(\d+)\s*')
+    layer_number = None
 
     # Keep track of the tower section number
     tower_section_number = 0
 
+    # Keep track of the index of the first line of each clump in the whole gcode
+    clump_line_index = 0
+
+    # The gcode may be a plate from the GcodeModel plugin, which keeps the split lines shared with other plugins
+    use_gcode_model = hasattr(gcode, 'getLines')
+
     # Iterate over each "clump" of gcode
-    for clump_index, clump in enumerate(gcode):
+    for clump_index in range(len(gcode)):
 
         # Split the layer into lines
-        lines = clump.split('\n')
+        lines = gcode.getLines(clump_index) if use_gcode_model else gcode[clump_index].split('\n')
 
-        # Iterate over each line in the layer
-        for line_index, line in enumerate(lines):
+        # Locate the layers and the end of the gcode that needs to be processed
+        layer_line_indices, end_line_index = _FindLayerLines(lines)
+        layer_start_indices = [0] + [line_index for line_index, _ in layer_line_indices if line_index > 0]
+        layer_numbers = dict(layer_line_indices)
 
-            # Check if this line marks the end of the gcode that needs to be processed
-            if IsEndOfGcodeLine(line):
-                gcode[clump_index] = f'{comment_prefix} post-processing complete\n' + clump
-                break
+        # The edits for all the layers in the clump
+        insertions = {}
+        replacements = {}
 
-            # Check if this line really does mark the start of a new layer in the gcode
-            match = re.match(layer_regex, line)
-            if match:
+        for layer_start_index, layer_end_index in zip(layer_start_indices, layer_start_indices[1:] + [end_line_index]):
+            start_of_new_section = False
+
+            if layer_start_index in layer_numbers:
                 # Extract the layer number
-                layer_number = int(match.group(1))
+                layer_number = layer_numbers[layer_start_index]
 
                 # Increment the print height
                 if current_print_height == 0:
@@ -73,40 +156,65 @@ def LayerEnumerate(gcode, base_height:float, section_height:float, initial_layer
                 else:
                     current_print_height += layer_height
 
-                # Don't process layers until after the base has been printed
-                if current_print_height <= base_height:
-                    continue
-
                 # Determine if this is the start of a new tower section
-                if current_print_height > next_section_start_height:
-                    
+                if section_tracker is not None and section_tracker.Update(current_print_height):
+
                     # Indicate this is the start of a new tower section
                     start_of_new_section = True
+                    tower_section_number = section_tracker.section_number
 
-                    # Update the starting height of the next tower section
-                    next_section_start_height += section_height
-
-                    # Increment the tower section number
-                    tower_section_number += 1
-                    
                     # Comment the start of the tower section in the gcode
                     cura_layer_number = layer_number + 1
                     if enable_advanced_gcode_comments :
-                        lines[line_index] = line + f'\n{comment_prefix} Starting tower section number {tower_section_number} at Cura layer number {cura_layer_number} (which is labeled as layer {layer_number} in this gcode file)'
-                    
-                # If this is not the start of a new tower section
-                else:
-                    # Indicate this is NOT the start of a new tower section
-                    start_of_new_section = False
-
-            # Yield the values for this line
-            yield line_index, line, lines, start_of_new_section
-
-            # Once the first line in a new tower section has been processed, remove the new section indicator
-            start_of_new_section = False
-
-        # Reassemble the clump
-        gcode[clump_index] = '\n'.join(lines)
+                        insertions[layer_start_index + 1] = [f'{comment_prefix} Starting tower section number {tower_section_number} at Cura layer number {cura_layer_number} (which is labeled as layer {layer_number} in this gcode file)']
+
+            # Yield the layer
+            layer_lines = lines[layer_start_index:layer_end_index]
+            yield TowerLayer(layer_lines, layer_start_index, float(current_print_height), layer_number, start_of_new_section, tower_section_number, clump_line_index + layer_start_index, insertions, replacements)
+
+        clump_line_index += len(lines)
+
+        # Rebuild the clump if any of its layers were changed
+        if insertions or replacements:
+            lines = _ApplyEdits(lines, insertions, replacements)
+            if use_gcode_model:
+                gcode.setLines(clump_index, lines)
+            else:
+                gcode[clump_index] = '\n'.join(lines)
+
+
+
+def _FindLayerLines(lines):
+    ''' Returns the (line index, layer number) of the ";LAYER:" lines, and the index of the line that marks the end of
+        the gcode to process (or the number of lines) '''
+    layer_line_indices = []
+    for line_index, line in enumerate(lines):
+        if line.startswith(';'):
+            if line.startswith(';LAYER:'):
+                match = layer_regex.match(line)
+                if match:
+                    layer_line_indices.append((line_index, int(match.group(1))))
+            elif line.startswith(';TIME_ELAPSED:'):
+                return layer_line_indices, line_index
+        elif line[:1].isspace() and IsEndOfGcodeLine(line):
+            return layer_line_indices, line_index
+    return layer_line_indices, len(lines)
+
+
+
+def _ApplyEdits(lines, insertions:dict, replacements:dict):
+    ''' Returns the lines with the insertions and replacements made, copying the unchanged lines in slices '''
+    new_lines = []
+    copied_line_count = 0
+    for line_index in sorted(insertions.keys() | replacements.keys()):
+        new_lines += lines[copied_line_count:line_index]
+        new_lines += insertions.get(line_index, [])
+        copied_line_count = line_index
+        if line_index in replacements:
+            new_lines.append(replacements[line_index])
+            copied_line_count += 1
+    new_lines += lines[copied_line_count:]
+    return new_lines
 
 
 
@@ -30,7 +30,9 @@
 #   Unfortunately, this is still not a completely accurate demonstration of the different print speeds
 # Version 2.2 - 28 Aug 2023:
 #   Add the option enable_advanced_gcode_comments to reduce the Gcode size
-__version__ = '2.2'
+# Version 2.3 - 18 Oct 2026:
+#   Process the gcode a layer at a time, recording changes to be applied in a single pass
+__version__ = '2.3'
 
 from UM.Logger import Logger
 
@@ -76,11 +78,11 @@ def execute(gcode, base_height:float, section_height:float, initial_layer_height
     # Keep track of when the first section is encountered
     first_section = True
 
-    # Iterate over each line in the g-code
-    for line_index, line, lines, start_of_new_section in Common.LayerEnumerate(gcode, base_height, section_height, initial_layer_height, layer_height, enable_advanced_gcode_comments):
+    # Iterate over each layer in the g-code
+    for layer in Common.LayerEnumerate(gcode, base_height, section_height, initial_layer_height, layer_height, enable_advanced_gcode_comments):
 
         # Handle each new section
-        if start_of_new_section:
+        if layer.start_of_new_section:
 
             # Increment the speed for the new tower section
             current_speed += speed_change
@@ -90,23 +92,25 @@ def execute(gcode, base_height:float, section_height:float, initial_layer_height
 
             if enable_advanced_gcode_comments :
                 # Document the new speed in the gcode
-                lines.insert(2, f'{Common.comment_prefix} Print speed for this tower section is {current_speed:.1f} mm/s')
+                new_lines = [f'{Common.comment_prefix} Print speed for this tower section is {current_speed:.1f} mm/s']
 
                 # Command the new feedrate percentage in the gcode
-                lines.insert(3, f'M220 S{feedrate_percentage:.2f} {Common.comment_prefix} Setting the feedrate percentage to {feedrate_percentage:.2f}% to mimic a print speed setting change from {reference_speed}mm/s to {current_speed} mm/s')
+                new_lines.append(f'M220 S{feedrate_percentage:.2f} {Common.comment_prefix} Setting the feedrate percentage to {feedrate_percentage:.2f}% to mimic a print speed setting change from {reference_speed}mm/s to {current_speed} mm/s')
 
                 # Display the new print speed on the printer's LCD
                 if enable_lcd_messages:
-                    lines.insert(4, f'M117 SPD {current_speed:.1f} mm/s')
-                    lines.insert(4, f'{Common.comment_prefix} Displaying "SPD {current_speed:.1f}" on the LCD')
+                    new_lines.append(f'{Common.comment_prefix} Displaying "SPD {current_speed:.1f}" on the LCD')
+                    new_lines.append(f'M117 SPD {current_speed:.1f} mm/s')
             else:
 
                 # Command the new feedrate percentage in the gcode
-                lines.insert(2, f'M220 S{feedrate_percentage:.2f}')
+                new_lines = [f'M220 S{feedrate_percentage:.2f}']
 
                 # Display the new print speed on the printer's LCD
                 if enable_lcd_messages:
-                    lines.insert(3, f'M117 SPD {current_speed:.1f} mm/s')
+                    new_lines.append(f'M117 SPD {current_speed:.1f} mm/s')
+
+            layer.InsertLines(2, new_lines)
 
                     
             # Handle the first tower section
@@ -115,9 +119,9 @@ def execute(gcode, base_height:float, section_height:float, initial_layer_height
 
                 # Backup the feedrate percentage
                 if enable_advanced_gcode_comments :
-                    lines.insert(1, f'M220 B {Common.comment_prefix} Backing up the current feedrate percentage')
+                    layer.InsertLines(1, [f'M220 B {Common.comment_prefix} Backing up the current feedrate percentage'])
                 else :
-                    lines.insert(1, f'M220 B')
+                    layer.InsertLines(1, [f'M220 B'])
     
     # Restore the backed-up feedrate percentage
     last_layer_index = len(gcode) - Common.trailing_inserted_layer_count - 1
@@ -24,15 +24,28 @@
 #   This script has been simplified to focus solely on retraction distance
 # Version 4.1 - 28 Aug 2023:
 #   Add the option enable_advanced_gcode_comments to reduce the Gcode size
-__version__ = '4.1'
-
+# Version 4.2 - 18 Oct 2026:
+#   Process the gcode a layer at a time, recording changes to be applied in a single pass
+# Version 4.3 - 18 Oct 2026:
+#   Track the extrusion position of a whole layer at once using GcodeTokenizer instead of searching each line
+# Version 4.4 - 18 Oct 2026:
+#   Track the extrusion position of the whole gcode at once, tower layers are too short to tokenize one at a time
+__version__ = '4.4'
+
+from bisect import bisect_left
 import re 
 
+import numpy
+
 from UM.Logger import Logger
 from UM.Application import Application
 
+from . import GcodeTokenizer
 from . import PostProcessingCommon as Common
 
+# The regex to use when searching for the extrusion position in a line
+_extrusion_position_regex = re.compile(r'E([-+]?\d*\.?\d+)')
+
 
 
 def execute(gcode, base_height:float, section_height:float, initial_layer_height:float, layer_height:float, relative_extrusion:bool, start_retract_distance:float, retract_distance_change:float, enable_lcd_messages:bool, enable_advanced_gcode_comments:bool):
@@ -64,114 +77,168 @@ def execute(gcode, base_height:float, section_height:float, initial_layer_height
     # Start at the requested starting retraction value
     current_retract_distance = start_retract_distance - retract_distance_change # The current retract value will be corrected when the first section is encountered
     
-    # Keep track of the absolute retraction position throughout the script
-    reference_extrusion_position = None
+    # Determine the extrusion mode and reference extrusion position of every retraction line in the gcode at once
+    retraction_lines, retraction_relative_extrusion, retraction_reference_extrusion_positions = _TrackExtrusion(gcode, relative_extrusion)
 
-    # Iterate over each line in the g-code
-    for line_index, line, lines, start_of_new_section in Common.LayerEnumerate(gcode, base_height, section_height, initial_layer_height, layer_height, enable_advanced_gcode_comments):
+    # Iterate over each layer in the g-code
+    for layer in Common.LayerEnumerate(gcode, base_height, section_height, initial_layer_height, layer_height, enable_advanced_gcode_comments):
 
         # Handle each new tower section
-        if start_of_new_section:
+        if layer.start_of_new_section:
 
             # Update the retraction value for the new tower section
             current_retract_distance += retract_distance_change
 
             # Document the new retraction value in the gcode
-            lines.insert(2, f'{Common.comment_prefix} Using a retraction distance of {current_retract_distance} mm for this tower section')
+            new_lines = [f'{Common.comment_prefix} Using a retraction distance of {current_retract_distance} mm for this tower section']
 
             # Display the new retraction value on the printer's LCD
             if enable_lcd_messages:
-                lines.insert(3, f'M117 DST {current_retract_distance:.1f} mm')
                 if enable_advanced_gcode_comments :
-                    lines.insert(3, f'{Common.comment_prefix} Displaying "DST {current_retract_distance:.1f}" on the LCD')
+                    new_lines.append(f'{Common.comment_prefix} Displaying "DST {current_retract_distance:.1f}" on the LCD')
+                new_lines.append(f'M117 DST {current_retract_distance:.1f} mm')
 
-        # Record if relative extrusion is now being used
-        if Common.IsRelativeInstructionLine(line):
-            relative_extrusion = True
+            layer.InsertLines(2, new_lines)
 
-        # Record if absolute extrusion is now being used
-        elif Common.IsAbsoluteInstructionLine(line):
-            relative_extrusion = False
+        # Update the retraction lines in the layer
+        first_retraction = bisect_left(retraction_lines, layer.plate_line_index)
+        last_retraction = bisect_left(retraction_lines, layer.plate_line_index + len(layer.lines))
+        for retraction_index in range(first_retraction, last_retraction):
+            line_index = retraction_lines[retraction_index] - layer.plate_line_index
+            line_relative_extrusion = retraction_relative_extrusion[retraction_index]
+            line_reference_extrusion_position = retraction_reference_extrusion_positions[retraction_index]
+            line = layer.lines[line_index]
 
-            # The absolute extrusion position data is irrelevant in this mode
-            reference_extrusion_position = None
+            # Determine the original extrusion position as it is written in the line
+            original_extrusion_position_string = _extrusion_position_regex.search(line.split(';')[0]).group(1)
+            original_extrusion_position = float(original_extrusion_position_string)
 
-        # Handle resetting the extruder position
-        elif Common.IsResetExtruderLine(line):
+            # Relative retraction is fairly simple since the filament position doesn't need to be tracked
+            if line_relative_extrusion:
 
-            # Reset the recorded extrusion position to 0
-            reference_extrusion_position = 0
+                # The original retraction distance is just the "extrusion position" in this case
+                original_retraction_distance = original_extrusion_position
 
-        # Handle extrusion and retraction lines
-        elif Common.IsExtrusionLine(line) or Common.IsRetractLine(line):
+                # Update actual retraction lines (filament being pulled in)
+                if original_retraction_distance < 0:
 
-            # Determine the current extrusion position
-            position_search_results = re.search(r'E([-+]?\d*\.?\d+)', line.split(';')[0])
-            if position_search_results:
-                original_extrusion_position_string = position_search_results.group(1)
-                original_extrusion_position = float(original_extrusion_position_string)
+                    # Update the line with the new retraction distance
+                    new_line = line.replace(f'E{original_extrusion_position_string}', f'E{-current_retract_distance:.5f}')
+                    if enable_advanced_gcode_comments :
+                        new_line += f' {Common.comment_prefix} Retracting {-current_retract_distance:.5f} mm of filament using relative positioning'
 
-                # Record the first reference position
-                if reference_extrusion_position is None and not relative_extrusion:
-                    reference_extrusion_position = original_extrusion_position
+                # Update filament extrusion (reversing the previous retraction)
+                else:
 
-                # For extrusion commands, the absolute extrusion position just needs to be updated
-                elif Common.IsExtrusionLine(line) and not relative_extrusion:
-                    reference_extrusion_position = original_extrusion_position
+                    # Update the line with the new retraction distance
+                    new_line = line.replace(f'E{original_extrusion_position_string}', f'E{current_retract_distance:.5f}')
+                    if enable_advanced_gcode_comments :
+                        new_line += f' {Common.comment_prefix} Extruding {current_retract_distance:.5f} mm of filament using relative positioning to reverse the previous retraction'
 
-                # Retraction commands need to be processed to achieve the requested retraction distance
-                elif Common.IsRetractLine(line):
+            # Absolute retraction needs to take into account the current absolute filament position
+            else:
 
-                    # Relative retraction is fairly simple since the filament position doesn't need to be tracked
-                    if relative_extrusion:
+                # Update actual retraction lines (filament being pulled in)
+                if original_extrusion_position < line_reference_extrusion_position:
 
-                        # The original retraction distance is just the "extrusion position" in this case
-                        original_retraction_distance = original_extrusion_position
+                    # Determine the new position given the desired retraction distance for this section
+                    updated_extrusion_position = line_reference_extrusion_position - current_retract_distance
+                    new_line = line.replace(f'E{original_extrusion_position_string}', f'E{updated_extrusion_position:.5f}')
+                    if enable_advanced_gcode_comments :
+                        new_line += f' {Common.comment_prefix} Retracting {current_retract_distance:.5f} mm of filament using absolute positioning'
 
-                        # Update actual retraction lines (filament being pulled in)
-                        if original_retraction_distance < 0:
+                # Update filament extrusion (reversing the previous retraction)
+                # Since the extrusion is just returning the filament to the previous position, the original line will work unchanged
+                else:
 
-                            # Update the line with the new retraction distance
-                            new_line = line.replace(f'E{original_extrusion_position_string}', f'E{-current_retract_distance:.5f}')
-                            if enable_advanced_gcode_comments :
-                                new_line += f' {Common.comment_prefix} Retracting {-current_retract_distance:.5f} mm of filament using relative positioning'
+                    # Just comment the line for informational purposes
+                    if enable_advanced_gcode_comments :
+                        new_line = line + f' {Common.comment_prefix} Extruding {current_retract_distance:.5f} mm of filament using absolute positioning to reverse the previous retraction'
+                    else :
+                        new_line = line
 
-                        # Update filament extrusion (reversing the previous retraction)
-                        else:
+            # Replace the original line with the post-processed line
+            layer.ReplaceLine(line_index, new_line)
 
-                            # Update the line with the new retraction distance
-                            new_line = line.replace(f'E{original_extrusion_position_string}', f'E{current_retract_distance:.5f}')
-                            if enable_advanced_gcode_comments :
-                                new_line += f' {Common.comment_prefix} Extruding {current_retract_distance:.5f} mm of filament using relative positioning to reverse the previous retraction'
+            # Leave the original line commented out in the gcode for reference
+            #lines.insert(line_index, f';{line} {Common.comment_prefix} This is the original line before it was modified')
 
-                    # Absolute retraction needs to take into account the current absolute filament position
-                    else:
+    Logger.log('d', f'AutoTowersGenerator completing RetractTower (distance) post-processing')
 
-                        # Update actual retraction lines (filament being pulled in)
-                        if original_extrusion_position < reference_extrusion_position:
+    return gcode
 
-                            # Determine the new position given the desired retraction distance for this section
-                            updated_extrusion_position = reference_extrusion_position - current_retract_distance
-                            new_line = line.replace(f'E{original_extrusion_position_string}', f'E{updated_extrusion_position:.5f}')
-                            if enable_advanced_gcode_comments :
-                                new_line += f' {Common.comment_prefix} Retracting {current_retract_distance:.5f} mm of filament using absolute positioning'
 
-                        # Update filament extrusion (reversing the previous retraction)
-                        # Since the extrusion is just returning the filament to the previous position, the original line will work unchanged
-                        else:
 
-                            # Just comment the line for informational purposes
-                            if enable_advanced_gcode_comments :
-                                new_line = line + f' {Common.comment_prefix} Extruding {current_retract_distance:.5f} mm of filament using absolute positioning to reverse the previous retraction'
-                            else :
-                                new_line = line
-                                
-                    # Replace the original line with the post-processed line
-                    lines[line_index] = new_line
+def _TrackExtrusion(gcode, relative_extrusion:bool):
+    ''' Determines the extrusion mode and the absolute reference extrusion position for every line in the gcode
+
+        Lines are numbered in the lines of the whole gcode, like TowerLayer.plate_line_index
+        Returns the line numbers of the retraction lines to be updated along with the extrusion mode and reference
+        extrusion position in effect at each of them '''
+
+    clumps = list(gcode)
+    text = '\n'.join(clumps)
+    tokens = GcodeTokenizer.TokenizeGcode(text)
+
+    # The lines after the end of the printed gcode in a clump are not part of any layer, so they are left out
+    clump_starts = numpy.cumsum([0] + [clump.count('\n') + 1 for clump in clumps])
+    end_lines = numpy.append(numpy.flatnonzero(tokens.StartsWith(';TIME_ELAPSED:')), tokens.line_count)
+    first_end_lines = numpy.minimum(end_lines[numpy.searchsorted(end_lines, clump_starts[:-1])], clump_starts[1:])
+    boundaries = numpy.zeros(tokens.line_count + 1, dtype=numpy.int32)
+    numpy.add.at(boundaries, first_end_lines, 1)
+    numpy.add.at(boundaries, clump_starts[1:], -1)
+    layer_lines = numpy.cumsum(boundaries[:-1]) == 0
+
+    # Only the first matching test applies to each line
+    relative_lines = tokens.RelativeInstructionLines() & layer_lines
+    absolute_lines = tokens.AbsoluteInstructionLines() & layer_lines & ~relative_lines
+    reset_lines = tokens.ResetExtruderLines() & layer_lines & ~relative_lines & ~absolute_lines
+    other_lines = layer_lines & ~(relative_lines | absolute_lines | reset_lines)
+    extrusion_lines = tokens.ExtrusionLines() & other_lines
+    retract_lines = tokens.RetractLines() & other_lines
+
+    # The tokenizer does not parse malformed values (e.g. "E1.2.3"), so those lines are searched the same way as before
+    extrusion_positions = tokens.e.copy()
+    malformed_lines = numpy.flatnonzero((extrusion_lines | retract_lines) & numpy.isnan(extrusion_positions))
+    if len(malformed_lines) > 0:
+        lines = text.split('\n')
+        for line_index in malformed_lines:
+            position_search_results = _extrusion_position_regex.search(lines[line_index].split(';')[0])
+            if position_search_results:
+                extrusion_positions[line_index] = float(position_search_results.group(1))
 
-                    # Leave the original line commented out in the gcode for reference
-                    #lines.insert(line_index, f';{line} {Common.comment_prefix} This is the original line before it was modified')
+    # Lines without an extrusion position are left alone
+    extrusion_lines &= ~numpy.isnan(extrusion_positions)
+    retract_lines &= ~numpy.isnan(extrusion_positions)
 
-    Logger.log('d', f'AutoTowersGenerator completing RetractTower (distance) post-processing')
+    # The extrusion mode of each line is set by the last relative or absolute instruction before it
+    line_relative_extrusion = _LastValueBefore(relative_lines | absolute_lines, relative_lines, relative_extrusion, inclusive=True)
 
-    return gcode
+    # The reference position is cleared by absolute instructions, zeroed by extruder resets and moved by absolute extrusions
+    # NaN stands for an unknown reference position, which is how the gcode starts
+    reference_positions = numpy.where(absolute_lines, numpy.nan, numpy.where(reset_lines, 0.0, extrusion_positions))
+    reference_lines = absolute_lines | reset_lines | (extrusion_lines & ~line_relative_extrusion)
+
+    # An absolute retraction also records the reference position if it is unknown, which only affects the first one
+    # after the reference position was cleared
+    line_reference_positions = _LastValueBefore(reference_lines, reference_positions, numpy.nan)
+    recording_lines = numpy.flatnonzero(retract_lines & ~line_relative_extrusion & numpy.isnan(line_reference_positions))
+    _, first_recording_indices = numpy.unique(numpy.searchsorted(numpy.flatnonzero(reference_lines), recording_lines, side='right'), return_index=True)
+    reference_lines[recording_lines[first_recording_indices]] = True
+    retract_lines[recording_lines[first_recording_indices]] = False
+    line_reference_positions = _LastValueBefore(reference_lines, reference_positions, numpy.nan)
+
+    retraction_lines = numpy.flatnonzero(retract_lines)
+    return retraction_lines.tolist(), line_relative_extrusion[retraction_lines].tolist(), line_reference_positions[retraction_lines].tolist()
+
+
+
+def _LastValueBefore(mask, values, initial_value, inclusive=False):
+    ''' Returns, for each line, the value of the last line selected by the mask before it (or at it if inclusive), or the initial value '''
+
+    selected_lines = numpy.flatnonzero(mask)
+    if len(selected_lines) == 0:
+        return numpy.full(len(mask), initial_value)
+
+    selected_indices = numpy.searchsorted(selected_lines, numpy.arange(len(mask)), side='right' if inclusive else 'left') - 1
+    return numpy.where(selected_indices >= 0, values[selected_lines[selected_indices]], initial_value)
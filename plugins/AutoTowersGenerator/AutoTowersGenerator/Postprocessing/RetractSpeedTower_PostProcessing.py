@@ -24,7 +24,9 @@
 #   This script has been simplified to focus solely on retraction speed
 # Version 4.1 - 28 Aug 2023:
 #   Add the option enable_advanced_gcode_comments to reduce the Gcode size
-__version__ = '4.1'
+# Version 4.2 - 18 Oct 2026:
+#   Process the gcode a layer at a time, recording changes to be applied in a single pass
+__version__ = '4.2'
 
 import re 
 
@@ -62,43 +64,48 @@ def execute(gcode, base_height:float, section_height:float, initial_layer_height
     # Start at the requested starting retraction value
     current_retract_speed = start_retract_speed - retract_speed_change # The current retract value will be corrected when the first section is encountered
 
-    # Iterate over each line in the g-code
-    for line_index, line, lines, start_of_new_section in Common.LayerEnumerate(gcode, base_height, section_height, initial_layer_height, layer_height, enable_advanced_gcode_comments):
+    # Iterate over each layer in the g-code
+    for layer in Common.LayerEnumerate(gcode, base_height, section_height, initial_layer_height, layer_height, enable_advanced_gcode_comments):
 
         # Handle each new tower section
-        if start_of_new_section:
+        if layer.start_of_new_section:
 
             # Update the retraction value for the new tower section
             current_retract_speed += retract_speed_change
 
             # Document the new retraction speed in the gcode
-            lines.insert(2, f'{Common.comment_prefix} Using a retraction speed of {current_retract_speed} mm/s for this tower section')
+            new_lines = [f'{Common.comment_prefix} Using a retraction speed of {current_retract_speed} mm/s for this tower section']
 
             # Display the new retraction value on the printer's LCD
             if enable_lcd_messages:
-                lines.insert(3, f'M117 SPD {current_retract_speed:.1f} mm/s')
                 if enable_advanced_gcode_comments :
-                    lines.insert(3, f'{Common.comment_prefix} Displaying "SPD {current_retract_speed:.1f}" on the LCD')
+                    new_lines.append(f'{Common.comment_prefix} Displaying "SPD {current_retract_speed:.1f}" on the LCD')
+                new_lines.append(f'M117 SPD {current_retract_speed:.1f} mm/s')
 
-        # Handle retraction commands
-        # Retraction commands need to be modified to match the requested speed
-        elif Common.IsRetractLine(line):
+            layer.InsertLines(2, new_lines)
 
-            # Determine the current retraction speed
-            speed_search_results = re.search(r'F([-+]?\d*\.?\d+)', line.split(';')[0])
-            if speed_search_results:
-                original_speed_string = speed_search_results.group(1)
+        # Iterate over each line in the layer
+        for line_index, line in enumerate(layer.lines):
 
-                # Update the line with the new retraction speed
-                new_line = line.replace(f'F{original_speed_string}', f'F{int(current_retract_speed * 60)}')
-                if enable_advanced_gcode_comments :
-                    new_line += f' {Common.comment_prefix} Changed retraction speed to {current_retract_speed} mm/s ({current_retract_speed * 60} mm/min)' # Speed value must be specified as mm/min for the gcode'
+            # Handle retraction commands
+            # Retraction commands need to be modified to match the requested speed
+            if Common.IsRetractLine(line):
+
+                # Determine the current retraction speed
+                speed_search_results = re.search(r'F([-+]?\d*\.?\d+)', line.split(';')[0])
+                if speed_search_results:
+                    original_speed_string = speed_search_results.group(1)
+
+                    # Update the line with the new retraction speed
+                    new_line = line.replace(f'F{original_speed_string}', f'F{int(current_retract_speed * 60)}')
+                    if enable_advanced_gcode_comments :
+                        new_line += f' {Common.comment_prefix} Changed retraction speed to {current_retract_speed} mm/s ({current_retract_speed * 60} mm/min)' # Speed value must be specified as mm/min for the gcode'
 
-                # Replace the original line with the post-processed line
-                lines[line_index] = new_line
+                    # Replace the original line with the post-processed line
+                    layer.ReplaceLine(line_index, new_line)
 
-                # Leave the original line commented out in the gcode for reference
-                #lines.insert(line_index, f';{line} {Common.comment_prefix} This is the original line before it was modified')
+                    # Leave the original line commented out in the gcode for reference
+                    #lines.insert(line_index, f';{line} {Common.comment_prefix} This is the original line before it was modified')
 
     Logger.log('d', f'AutoTowersGenerator completing Retract Tower (speed) post-processing')
 
@@ -18,7 +18,9 @@
 #   Add the option enable_advanced_gcode_comments to reduce the Gcode size
 # Version 3.2 - 10 Sep 2023:
 #   Prevent the temperature from being changed within a tower section
-__version__ = '3.2'
+# Version 3.3 - 18 Oct 2026:
+#   Process the gcode a layer at a time, recording changes to be applied in a single pass
+__version__ = '3.3'
 
 from UM.Logger import Logger
 
@@ -53,37 +55,34 @@ def execute(gcode, base_height:float, section_height:float, initial_layer_height
     # Start at the selected starting temperature
     current_temp = start_temp - temp_change # The current temp will be incremented when the first section is encountered
 
-    # Iterate over each line in the g-code
-    for line_index, line, lines, start_of_new_section in Common.LayerEnumerate(gcode, base_height, section_height, initial_layer_height, layer_height, enable_advanced_gcode_comments):
+    # Iterate over each layer in the g-code
+    for layer in Common.LayerEnumerate(gcode, base_height, section_height, initial_layer_height, layer_height, enable_advanced_gcode_comments):
 
         # Handle each new tower section
-        if start_of_new_section:
+        if layer.start_of_new_section:
 
             # Increment the temperature for this new tower section
             current_temp += temp_change
 
             # Configure the new temperature in the gcode
             if enable_advanced_gcode_comments :
-                lines.insert(2, f'M109 S{current_temp} {Common.comment_prefix} Wait for the temperature to be reached')
-                lines.insert(2, f'M104 S{current_temp} {Common.comment_prefix} setting temperature to {current_temp} C for this tower section')
+                new_lines = [f'M104 S{current_temp} {Common.comment_prefix} setting temperature to {current_temp} C for this tower section']
             else :
-                lines.insert(2, f'M109 S{current_temp}')
-                lines.insert(2, f'M104 S{current_temp}')
+                new_lines = [f'M104 S{current_temp}']
 
             # Display the new temperature on the printer's LCD
             if enable_lcd_messages:
-                lines.insert(3, f'M117 TMP {current_temp} C')
                 if enable_advanced_gcode_comments :
-                    lines.insert(3, f'{Common.comment_prefix} Displaying "TMP {current_temp} C" on the LCD')
+                    new_lines.append(f'{Common.comment_prefix} Displaying "TMP {current_temp} C" on the LCD')
+                new_lines.append(f'M117 TMP {current_temp} C')
 
-        # Handle lines within each section
-        else:
-            if Common.IsTemperatureChangeLine(line):
-                # Comment out the line
-                new_line = f';{line}'
-                if enable_advanced_gcode_comments:
-                    new_line += f' {Common.comment_prefix} preventing a temperature change within the tower section'
-                lines[line_index] = line
+            # Wait for the new temperature to be reached
+            if enable_advanced_gcode_comments :
+                new_lines.append(f'M109 S{current_temp} {Common.comment_prefix} Wait for the temperature to be reached')
+            else :
+                new_lines.append(f'M109 S{current_temp}')
+
+            layer.InsertLines(2, new_lines)
 
     Logger.log('d', 'AutoTowersGenerator completing Temp Tower post-processing')
     
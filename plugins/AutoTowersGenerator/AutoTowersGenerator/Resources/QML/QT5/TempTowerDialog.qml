@@ -165,6 +165,41 @@ UM.Dialog
                     if (dataModel.towerDescription != text) dataModel.towerDescription = text
                 }
             }
+            // Starting fan speed
+            Label
+            {
+                text: catalog.i18nc("@label", "Starting Fan Speed %")
+            }
+            TextField
+            {
+                Layout.preferredWidth: numberInputWidth
+                validator: RegExpValidator { regExp: /([0-9]*(\.[0-9]+)?)?/ }
+                text: dataModel.startFanPercentStr
+
+                onTextChanged: 
+                {
+                    if (dataModel.startFanPercentStr != text) dataModel.startFanPercentStr = text
+                }
+            }
+
+            // Fan speed change
+            Label
+            {
+                text: catalog.i18nc("@label", "Fan Speed % Change")
+                visible: dataModel.fanScheduleEnabled
+            }
+            TextField
+            {
+                Layout.preferredWidth: numberInputWidth
+                validator: RegExpValidator { regExp: /[+-]?[0-9]*(\.[0-9]+)?/ }
+                text: dataModel.fanPercentChangeStr
+                visible: dataModel.fanScheduleEnabled
+
+                onTextChanged: 
+                {
+                    if (dataModel.fanPercentChangeStr != text) dataModel.fanPercentChangeStr = text
+                }
+            }
         }
     }
 
@@ -228,6 +228,63 @@ UM.Dialog
                 text: catalog.i18nc("@tooltip", "An optional label to carve up the left side of the tower.<p>This can be used, for example, to identify the purpose of the tower or the material being printed.")
                 visible: tower_description_mouse_area.containsMouse
             }
+            // Starting fan speed
+            UM.Label
+            {
+                text: catalog.i18nc("@label", "Starting Fan Speed %")
+                MouseArea 
+                {
+                    id: starting_fan_speed_mouse_area
+                    anchors.fill: parent
+                    hoverEnabled: true
+                }
+            }
+            Cura.TextField
+            {
+                Layout.preferredWidth: numberInputWidth
+                validator: RegularExpressionValidator { regularExpression: /([0-9]*(\.[0-9]+)?)?/ }
+                text: dataModel.startFanPercentStr
+
+                onTextChanged:
+                {
+                    if (dataModel.startFanPercentStr != text) dataModel.startFanPercentStr = text
+                }
+            }
+            UM.ToolTip
+            {
+                text: catalog.i18nc("@tooltip", "An optional fan speed percentage for the first section of the tower, to test temperatures and fan speeds together.<p>Leave this empty to print the tower with the fan speeds set in Cura.")
+                visible: starting_fan_speed_mouse_area.containsMouse
+            }
+
+            // Fan speed change
+            UM.Label
+            {
+                text: catalog.i18nc("@label", "Fan Speed % Change")
+                visible: dataModel.fanScheduleEnabled
+                MouseArea 
+                {
+                    id: fan_speed_change_mouse_area
+                    anchors.fill: parent
+                    hoverEnabled: true
+                }
+            }
+            Cura.TextField
+            {
+                Layout.preferredWidth: numberInputWidth
+                validator: RegularExpressionValidator { regularExpression: /[+-]?[0-9]*(\.[0-9]+)?/ }
+                text: dataModel.fanPercentChangeStr
+                visible: dataModel.fanScheduleEnabled
+
+                onTextChanged:
+                {
+                    if (dataModel.fanPercentChangeStr != text) dataModel.fanPercentChangeStr = text
+                }
+            }
+            UM.ToolTip
+            {
+                text: catalog.i18nc("@tooltip", "The amount to change the fan speed percentage between sections.<p>The fan speed changes along with the temperature, so make sure the fan speed of the last section is between 0% and 100%.")
+                visible: fan_speed_change_mouse_area.containsMouse
+            }
        }
     }
 
@@ -0,0 +1,109 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+from UM.Logger import Logger
+
+
+
+class StlCache:
+    ''' An on-disk cache of the STL files generated by OpenSCAD or the native tower generator
+        Entries are keyed by the generator, the contents of the OpenSCAD file and the parameters passed to it,
+        so generating the same tower twice only runs the generator once
+        The least recently used entries are removed once the cache grows beyond its size limit '''
+
+    _extension = '.stl'
+
+
+
+    def __init__(self, cacheDir, sizeLimit):
+        self._cacheDir = cacheDir
+        self._sizeLimit = sizeLimit # in bytes
+
+
+
+    def GetKey(self, openScadFilePath, parameters, generator)->str:
+        ''' Returns the key for generating an STL file from an OpenSCAD file with the given parameters
+            The generator ('native' or 'openscad') is part of the key, since their STL files are not identical '''
+
+        keyHash = hashlib.sha256()
+        keyHash.update(generator.encode('utf-8'))
+        keyHash.update(b'\0')
+        with open(openScadFilePath, 'rb') as openScadFile:
+            keyHash.update(openScadFile.read())
+        keyHash.update(b'\0')
+        keyHash.update(json.dumps(parameters, sort_keys=True, default=str).encode('utf-8'))
+        return keyHash.hexdigest()
+
+
+
+    def Get(self, key):
+        ''' Returns the path to the cached STL file for the key, or None if it isn't cached '''
+
+        stlFilePath = self._GetPath(key)
+        try:
+            # Record the use of the entry in its modification time
+            os.utime(stlFilePath)
+        except OSError:
+            return None
+
+        Logger.log('d', f'Using cached STL file "{stlFilePath}"')
+        return stlFilePath
+
+
+
+    def Put(self, key, stlFilePath)->None:
+        ''' Stores a copy of a generated STL file in the cache '''
+
+        try:
+            os.makedirs(self._cacheDir, exist_ok=True)
+
+            # Copy to a temporary file first so an interrupted copy never looks like a valid entry
+            fileDescriptor, tempFilePath = tempfile.mkstemp(dir=self._cacheDir)
+            os.close(fileDescriptor)
+            try:
+                shutil.copyfile(stlFilePath, tempFilePath)
+                os.replace(tempFilePath, self._GetPath(key))
+            except:
+                os.remove(tempFilePath)
+                raise
+
+        except OSError as e:
+            Logger.log('w', f'Could not store "{stlFilePath}" in the STL cache: {e}')
+            return
+
+        self._Evict()
+
+
+
+    def _Evict(self)->None:
+        ''' Removes the least recently used entries until the cache fits within its size limit '''
+
+        entries = []
+        totalSize = 0
+        for entry in os.scandir(self._cacheDir):
+            if not entry.name.endswith(self._extension):
+                continue
+            try:
+                entryStat = entry.stat()
+            except OSError:
+                continue
+            entries.append((entryStat.st_mtime, entryStat.st_size, entry.path))
+            totalSize += entryStat.st_size
+
+        entries.sort()
+        for _, size, path in entries:
+            if totalSize <= self._sizeLimit:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            totalSize -= size
+
+
+
+    def _GetPath(self, key)->str:
+        return os.path.join(self._cacheDir, key + self._extension)
@@ -0,0 +1,286 @@
+# Generates tower models directly with trimesh instead of rendering them with OpenSCAD
+#
+# The towers are built from prisms that only touch each other, so no CSG is needed
+# Labels are carved by cutting the glyph outlines out of the faces they are engraved into
+# Only the towers listed in _generators can be generated this way - everything else still needs OpenSCAD
+
+from functools import lru_cache
+import importlib
+import json
+import math
+import os
+import re
+
+import numpy
+import shapely.affinity
+import shapely.geometry
+import shapely.ops
+import trimesh
+
+from UM.Logger import Logger
+
+
+
+# The outlines of the glyphs used to carve labels into the towers
+_glyphFilePath = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Resources', 'Fonts', 'DejaVuSans-Bold.json')
+
+# OpenSCAD scales fonts so that "size" is roughly the height of a capital letter
+_openScadFontScale = 100 / 72
+
+# Matches the parameter assignments at the top of an OpenSCAD file
+_parameterRegex = re.compile(r'^(\w+)\s*=\s*(.+?);', re.MULTILINE)
+
+# trimesh can only extrude outlines if one of these packages is installed to triangulate them
+_triangulationModules = ['mapbox_earcut', 'manifold3d', 'triangle']
+
+
+
+def _FindTriangulationModule():
+    ''' Returns the name of a triangulation package trimesh can use, or None if none is installed '''
+
+    for moduleName in _triangulationModules:
+        try:
+            importlib.import_module(moduleName)
+        except ImportError:
+            continue
+        return moduleName
+
+    Logger.log('w', f'None of {", ".join(_triangulationModules)} is installed, so towers can only be generated with OpenSCAD')
+    return None
+
+_triangulationModule = _FindTriangulationModule()
+
+
+
+def CanGenerate(openScadFilename)->bool:
+    ''' Returns true if the tower described by the OpenSCAD file can be generated without OpenSCAD '''
+
+    return _triangulationModule is not None and openScadFilename in _generators
+
+
+
+def GenerateStl(openScadFilePath, parameters, stlFilePath)->None:
+    ''' Generates an STL file for an OpenSCAD file with the given parameters
+        Parameters that are not given take their default values from the OpenSCAD file '''
+
+    openScadParameters = _ReadOpenScadParameters(openScadFilePath)
+    openScadParameters.update(parameters)
+
+    generator = _generators[os.path.basename(openScadFilePath)]
+    mesh = generator(openScadParameters)
+    mesh.export(stlFilePath)
+
+    Logger.log('d', f'Generated "{stlFilePath}" with {len(mesh.faces)} faces without OpenSCAD')
+
+
+
+def _GenerateTempTower(parameters):
+    ''' Builds the model described by temptower.scad '''
+
+    startingValue = float(parameters['Starting_Value'])
+    endingValue = float(parameters['Ending_Value'])
+    valueChange = float(parameters['Value_Change'])
+    baseHeight = float(parameters['Base_Height'])
+    sectionHeight = float(parameters['Section_Height'])
+    wallThickness = float(parameters['Wall_Thickness'])
+
+    # The values calculated by the OpenSCAD file
+    valueChangeCorrected = abs(valueChange) if endingValue > startingValue else -abs(valueChange)
+    sectionCount = math.ceil(abs(endingValue - startingValue) / abs(valueChange) + 1)
+    cubeSize = sectionHeight
+    capSize = cubeSize - wallThickness
+    capHeight = wallThickness
+    bridgeThickness = wallThickness
+    supportSize = cubeSize / 2
+    towerWidth = cubeSize * float(parameters['Tower_Width_Multiplier'])
+    baseExtension = wallThickness * 4
+    baseWidth = towerWidth + baseExtension * 2
+    baseLength = cubeSize + baseExtension * 2
+    labelDepth = wallThickness / 2
+    hollowSize = cubeSize - wallThickness * 3
+    segmentCount = int(parameters['Render_Quality_Value'])
+
+    leftColumnX = -towerWidth / 2 + cubeSize / 2
+    rightColumnX = towerWidth / 2 - cubeSize / 2
+
+    # The tower label runs up the outside of the left columns and the column label is on the front of the first right column
+    towerLabel = _LayoutText(parameters['Tower_Label'], cubeSize * float(parameters['Tower_Label_Height_Multiplier']), 'left', [0, 1, 1, 0, 0, cubeSize / 2])
+    columnLabel = _LayoutText(parameters['Column_Label'], cubeSize * float(parameters['Column_Label_Height_Multiplier']), 'center', [0, 1, 1, 0, cubeSize / 2, rightColumnX])
+
+    meshes = [_Box((-baseWidth / 2, -baseLength / 2, 0), (baseWidth / 2, baseLength / 2, baseHeight))]
+
+    for section in range(sectionCount):
+        z = baseHeight + section * sectionHeight
+
+        # Label the section on the front of the left column
+        sectionLabel = None
+        if _ParseBool(parameters['Label_Sections']):
+            value = startingValue + valueChangeCorrected * section
+            labelText = f'{parameters["Section_Label_Prefix"]}{value:g}{parameters["Section_Label_Suffix"]}'
+            sectionLabel = _LayoutText(labelText, cubeSize * float(parameters['Section_Label_Height_Multiplier']), 'center', [0, 1, 1, 0, z + cubeSize / 2, leftColumnX])
+
+        # The left and right columns
+        meshes += _SquareColumn(leftColumnX, z, cubeSize, capSize, capHeight, hollowSize, labelDepth, frontLabel=sectionLabel, leftLabel=towerLabel)
+        meshes += _SquareColumn(rightColumnX, z, cubeSize, capSize, capHeight, hollowSize, labelDepth, frontLabel=columnLabel)
+
+        # The bridge between the columns
+        bridgeTop = z + cubeSize - capHeight
+        meshes.append(_Box((-towerWidth / 2 + cubeSize, -cubeSize / 2, bridgeTop - bridgeThickness), (towerWidth / 2 - cubeSize, cubeSize / 2, bridgeTop)))
+
+        # The angled support on the left and the rounded support on the right
+        # The support outlines are given as (z, x) coordinates
+        supportTop = bridgeTop - bridgeThickness
+        supportBottom = supportTop - supportSize
+        leftSupportX = -towerWidth / 2 + cubeSize
+        leftSupport = shapely.geometry.Polygon([(supportBottom, leftSupportX), (supportTop, leftSupportX), (supportTop, leftSupportX + supportSize)])
+        meshes.append(_Prism(leftSupport, 1, -cubeSize / 2, cubeSize / 2))
+
+        rightSupportX = towerWidth / 2 - cubeSize
+        arcSegmentCount = max(1, segmentCount // 4)
+        arc = [(supportBottom + supportSize * math.sin(math.pi / 2 * i / arcSegmentCount), rightSupportX - supportSize + supportSize * math.cos(math.pi / 2 * i / arcSegmentCount)) for i in range(arcSegmentCount - 1, 0, -1)]
+        rightSupport = shapely.geometry.Polygon([(supportBottom, rightSupportX), (supportTop, rightSupportX), (supportTop, rightSupportX - supportSize)] + arc)
+        meshes.append(_Prism(rightSupport, 1, -cubeSize / 2, cubeSize / 2))
+
+    return trimesh.util.concatenate(meshes)
+
+
+
+def _SquareColumn(x, z, cubeSize, capSize, capHeight, hollowSize, labelDepth, frontLabel=None, leftLabel=None)->list:
+    ''' Builds a hollow square column with an inset cap from the four walls of its body and cap
+        The labels are carved into the front and left faces of the body '''
+
+    bodyTop = z + cubeSize - capHeight
+    meshes = []
+    for size, bottom, top, carve in [(cubeSize, z, bodyTop, True), (capSize, bodyTop, bodyTop + capHeight, False)]:
+        outer = size / 2
+        inner = hollowSize / 2
+
+        # The front and back walls span the whole width of the column, the side walls fit between them
+        front = shapely.geometry.box(bottom, x - outer, top, x + outer)
+        meshes += _CarvedPrism(front, 1, -outer, -inner, frontLabel if carve else None, labelDepth)
+        meshes.append(_Prism(front, 1, inner, outer))
+
+        left = shapely.geometry.box(-inner, bottom, inner, top)
+        meshes += _CarvedPrism(left, 0, x - outer, x - inner, leftLabel if carve else None, labelDepth)
+        meshes.append(_Prism(left, 0, x + inner, x + outer))
+
+    return meshes
+
+
+
+def _CarvedPrism(outline, axis, start, end, label, labelDepth)->list:
+    ''' Returns the meshes for a prism with a label carved into its start face '''
+
+    carved = outline.intersection(label) if label is not None else None
+    if carved is None or carved.is_empty:
+        return [_Prism(outline, axis, start, end)]
+
+    return [
+        _Prism(outline.difference(carved), axis, start, start + labelDepth),
+        _Prism(outline, axis, start + labelDepth, end)
+        ]
+
+
+
+def _Prism(outline, axis, start, end):
+    ''' Extrudes a 2D outline along an axis (0 = x, 1 = y, 2 = z) from start to end
+        The outline coordinates are the two following axes in cyclic order - (y, z) for x, (z, x) for y and (x, y) for z '''
+
+    # Cutting a label out of an outline can split it into several pieces
+    polygons = [geometry for geometry in getattr(outline, 'geoms', [outline]) if isinstance(geometry, shapely.geometry.Polygon) and not geometry.is_empty]
+    mesh = trimesh.util.concatenate([trimesh.creation.extrude_polygon(polygon, end - start) for polygon in polygons])
+
+    # Cyclically permute the coordinates so the extrusion runs along the requested axis
+    transform = numpy.eye(4)
+    transform[:3, :3] = numpy.roll(numpy.eye(3), axis + 1, axis=0)
+    transform[axis, 3] = start
+    mesh.apply_transform(transform)
+    return mesh
+
+
+
+def _Box(lower, upper):
+    ''' Returns an axis-aligned box between two corners '''
+
+    return trimesh.creation.box(bounds=[lower, upper])
+
+
+
+def _LayoutText(text, size, halign, transform):
+    ''' Returns the outline of a line of text, aligned the way OpenSCAD aligns text with valign="center"
+        The transform is a shapely affine transform from the text coordinates to the plane of the carved face '''
+
+    glyphFont = _GlyphFont()
+    scale = size * _openScadFontScale / glyphFont['unitsPerEm']
+
+    outlines = []
+    advance = 0
+    for character in str(text):
+        glyph = glyphFont['glyphs'].get(character, glyphFont['glyphs']['?'])
+        outline = _GlyphOutline(character if character in glyphFont['glyphs'] else '?')
+        if not outline.is_empty:
+            outlines.append(shapely.affinity.translate(outline, xoff=advance))
+        advance += glyph['advance']
+
+    if len(outlines) == 0:
+        return None
+
+    # Horizontal alignment is based on the advance of the text and vertical alignment on its outline
+    outline = shapely.ops.unary_union(outlines)
+    _, minY, _, maxY = outline.bounds
+    xOffset = -advance / 2 if halign == 'center' else 0
+    outline = shapely.affinity.affine_transform(outline, [scale, 0, 0, scale, xOffset * scale, -(minY + maxY) / 2 * scale])
+
+    return shapely.affinity.affine_transform(outline, transform)
+
+
+
+@lru_cache(maxsize=None)
+def _GlyphFont()->dict:
+    ''' Loads the glyph outlines '''
+
+    with open(_glyphFilePath, 'r') as glyphFile:
+        return json.load(glyphFile)
+
+
+
+@lru_cache(maxsize=None)
+def _GlyphOutline(character):
+    ''' Returns the outline of a glyph in font units, with holes determined by the even-odd rule '''
+
+    outline = shapely.geometry.Polygon()
+    for contour in _GlyphFont()['glyphs'][character]['contours']:
+        points = list(zip(contour[0::2], contour[1::2]))
+        outline = outline.symmetric_difference(shapely.geometry.Polygon(points).buffer(0))
+    return outline
+
+
+
+def _ReadOpenScadParameters(openScadFilePath)->dict:
+    ''' Reads the default parameter values from the top of an OpenSCAD file '''
+
+    with open(openScadFilePath, 'r') as openScadFile:
+        source = openScadFile.read()
+
+    # The customizable parameters come before the calculated ones
+    source = source.split('/* [Calculated parameters] */')[0]
+
+    parameters = {}
+    for name, value in _parameterRegex.findall(source):
+        if value.startswith('"'):
+            parameters[name] = value.strip('"')
+        else:
+            parameters[name] = value
+    return parameters
+
+
+
+def _ParseBool(value)->bool:
+    return value if isinstance(value, bool) else str(value).lower() == 'true'
+
+
+
+# The towers that can be generated without OpenSCAD, by OpenSCAD file name
+_generators = {
+    'temptower.scad': _GenerateTempTower,
+}
@@ -0,0 +1,55 @@
+# Compares the retraction distance tower post-processing with the line by line scan it replaced
+#
+# Usage: python benchmark_retract_distance_tower.py [--runs N]
+#
+# Cura's UM package must be importable (e.g. through PYTHONPATH), like for the tests.
+# The gcode is generated: a tower of about 23k lines in layers of about 50 lines, and
+# a print of about 330k lines in layers of about 8k lines, with absolute and relative
+# extrusion. The best time of the runs is reported, and the outputs are compared.
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from test_retract_distance_tower import _Execute, _ReferenceExecute, _TowerGcode
+
+
+
+def _BestTime(function, gcode, relative, runs):
+    best_time = None
+    for _ in range(runs):
+        start_time = time.perf_counter()
+        result = function(list(gcode), relative)
+        elapsed = time.perf_counter() - start_time
+        best_time = elapsed if best_time is None else min(best_time, elapsed)
+    return best_time, result
+
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compares the retraction distance tower post-processing with a line by line scan.')
+    parser.add_argument('--runs', type=int, default=5, help='runs of each, the best time is reported')
+    options = parser.parse_args()
+
+    cases = [
+        ('tower, absolute', 440, False, 24),
+        ('tower, relative', 440, True, 24),
+        ('large layers, absolute', 40, False, 5600),
+        ('large layers, relative', 40, True, 5600),
+    ]
+    for name, layer_count, relative, moves_per_island in cases:
+        gcode = _TowerGcode(layer_count, relative, 1, True, moves_per_island)
+        line_count = sum(clump.count('\n') for clump in gcode)
+
+        reference_time, expected = _BestTime(lambda gcode, relative: _ReferenceExecute(gcode, relative, 1.0, 0.5)[1:], gcode, relative, options.runs)
+        script_time, result = _BestTime(_Execute, gcode, relative, options.runs)
+
+        print(f'{name:24} {line_count:7} lines: line by line {reference_time:.3f} s, script {script_time:.3f} s, identical {result == expected}')
+
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+import math
+import os
+import random
+import re
+import sys
+
+import numpy
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from AutoTowersGenerator.Postprocessing import GcodeTokenizer
+from AutoTowersGenerator.Postprocessing import PostProcessingCommon as Common
+
+
+
+# Lines that exercise the corner cases of the string helpers
+_sampleLines = [
+    '', ' ', ';LAYER:0', ';LAYER:12 ', '  ;LAYER:3', ';TYPE:WALL-OUTER', ';MESH:cube.stl', ';End of Gcode',
+    'G0 F6000 X10 Y20 Z0.3', 'G1 X10.5 Y20.25 E0.12345', 'G1 F1500 E-6.5', 'G1 F1500 E6.5 ; unretract',
+    'G1 X1 Y2 E3 F1200', 'G1 F3000 X5 Y6', 'G1 Z1.2 F600', 'G1 E-2 ;X retract in a comment',
+    'G10', 'G11', 'G1X5Y6E7', '  G1 X1 Y1 E1  ', 'G1 X1 Y1 E1\r', '\tM104 S200', 'M109 S210 ; wait',
+    'M104 S0', 'M106 S255', 'M106 S127.5', 'M106', 'M107', 'M107 P1', 'G91', 'G90', 'M82', 'M83 ; relative',
+    'G92 E0', 'G92 E0.0', 'G92 X0 Y0', 'M117 TMP 200 C', 'M220 S90', 'M221 S105', ';BRIDGE', ';Generated with Cura 5.4',
+    'G1 E- X3', 'G1 X1.2.3 Y4', 'G1 X+5 Y-6 E+0.5', 'T0', 'M204 S500', ';comment with é and Y5',
+    'G2 X10 Y10 I5 J0 E1', 'G1 F1800 X10 Y10 E1 ;AutoTowersGenerator: already processed',
+    'G1 X.5 Y5. E-.25', 'G1 X-0 Y0.000 E00012.50', 'G1 X123456.789012345 Y0.12345678901234567 E-98765432109876543210',
+]
+
+_helpers = {
+    'RetractLines': Common.IsRetractLine,
+    'ExtrusionLines': Common.IsExtrusionLine,
+    'RelativeInstructionLines': Common.IsRelativeInstructionLine,
+    'AbsoluteInstructionLines': Common.IsAbsoluteInstructionLine,
+    'ResetExtruderLines': Common.IsResetExtruderLine,
+}
+
+
+
+def _Corpus(line_count=5000, seed=4):
+    rng = random.Random(seed)
+    lines = list(_sampleLines)
+    while len(lines) < line_count:
+        x, y, e = rng.uniform(-10, 250), rng.uniform(-10, 250), rng.uniform(-8, 8)
+        lines.append(rng.choice([
+            f'G1 X{x:.3f} Y{y:.3f} E{e:.5f}',
+            f'G1 F{rng.randint(600, 9000)} X{x:.3f} Y{y:.3f}',
+            f'G0 F9000 X{x:.2f} Y{y:.2f}',
+            f'G1 F2400 E{e:.4f}',
+            f'G1 Z{rng.uniform(0, 50):.2f}',
+            f';TIME_ELAPSED:{rng.uniform(0, 5000):.6f}',
+            rng.choice(_sampleLines),
+            ]))
+    return lines
+
+
+
+def _ReferenceValue(line, letter):
+    match = re.search(letter + r'([0-9.+\-]+)', line.split(';', 1)[0])
+    if match is None:
+        return math.nan
+    try:
+        return float(match.group(1))
+    except ValueError:
+        return math.nan
+
+
+
+def test_masks_match_the_string_helpers():
+    lines = _Corpus()
+    tokens = GcodeTokenizer.TokenizeGcode(lines)
+
+    assert tokens.line_count == len(lines)
+    for method, helper in _helpers.items():
+        mask = getattr(tokens, method)()
+        expected = numpy.array([helper(line) for line in lines])
+        mismatches = [lines[index] for index in numpy.flatnonzero(mask != expected)]
+        assert mismatches == [], method
+
+
+
+def test_axis_values_match_a_regex_reader():
+    lines = _Corpus()
+    tokens = GcodeTokenizer.TokenizeGcode('\n'.join(lines))
+
+    for letter in 'XYZEFS':
+        expected = numpy.array([_ReferenceValue(line, letter) for line in lines])
+        numpy.testing.assert_array_equal(tokens.Values(letter), expected, err_msg=letter)
+        assert (numpy.signbit(tokens.Values(letter)) == numpy.signbit(expected)).all()
+
+
+
+def test_contains_looks_into_comments():
+    lines = ['G1 E-2 ;X retract in a comment', 'G1 E-2']
+    tokens = GcodeTokenizer.TokenizeGcode(lines)
+
+    assert list(tokens.Contains('X')) == [True, False]
+    assert list(tokens.Contains('retract')) == [True, False]
+    assert list(tokens.Contains('not there')) == [False, False]
+
+
+
+def test_empty_gcode():
+    tokens = GcodeTokenizer.TokenizeGcode('')
+
+    assert tokens.line_count == 1
+    assert numpy.isnan(tokens.e[0])
+    assert not tokens.ExtrusionLines()[0]
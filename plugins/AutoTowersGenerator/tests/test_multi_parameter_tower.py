@@ -0,0 +1,180 @@
+import os
+import random
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# The post-processing scripts log through Cura
+pytest.importorskip('UM.Logger')
+
+from AutoTowersGenerator.Postprocessing import FanTower_PostProcessing as FanTower
+from AutoTowersGenerator.Postprocessing import FlowTower_PostProcessing as FlowTower
+from AutoTowersGenerator.Postprocessing import MiscSpeedTower_PostProcessing as MiscSpeedTower
+from AutoTowersGenerator.Postprocessing import MultiParameterTower_PostProcessing as MultiParameterTower
+from AutoTowersGenerator.Postprocessing import PrintSpeedTower_PostProcessing as PrintSpeedTower
+from AutoTowersGenerator.Postprocessing import RetractDistanceTower_PostProcessing as RetractDistanceTower
+from AutoTowersGenerator.Postprocessing import RetractSpeedTower_PostProcessing as RetractSpeedTower
+from AutoTowersGenerator.Postprocessing import TempTower_PostProcessing as TempTower
+
+
+
+base_height = 1.0
+section_height = 1.0
+initial_layer_height = 0.2
+layer_height = 0.2
+
+# Lines that change the extrusion mode or position, or that are not quite well-formed
+_quirks = ['G92 E0', 'M83', 'M82', 'G1 F1500 E1.2.3', '  G1 F2100 E5.', 'G1 X10 Y10 E-0.1', 'G1 F1500 E0.5 ; E9 in a comment', 'M104 S205']
+
+
+
+def _TowerGcode(layer_count, relative, seed, quirks=False):
+    ''' Gcode as Cura slices it, with bridges, fan speed changes and retractions in every layer '''
+    rng = random.Random(seed)
+    gcode = [';FLAVOR:Marlin\n;Generated with Cura_SteamEngine 5.4.0\n', 'M104 S220\nM109 S220\nG28\nG92 E0\n' + ('M83\n' if relative else 'M82\n')]
+    e = 0.0
+    for layer_number in range(layer_count):
+        lines = [f';LAYER:{layer_number}', ';MESH:tower.stl', f'G0 F6000 X100 Y100 Z{0.2 + 0.2 * layer_number:.2f}', ';TYPE:WALL-OUTER']
+        # Some clumps start with gcode that comes before the layer
+        if layer_number % 5 == 4:
+            lines.insert(0, 'M117 Layer')
+        if layer_number == 2:
+            lines.append('M106 S255')
+        if quirks and layer_number % 3 == 1:
+            lines.append(rng.choice(_quirks))
+            if lines[-1] == 'G92 E0':
+                e = 0.0
+        for island in range(3):
+            if island == 1 and layer_number % 4 == 3:
+                lines += [';BRIDGE', 'M106 S127' if layer_number % 8 == 3 else 'M107']
+            lines.append(f'G0 F6000 X{rng.uniform(50, 150):.3f} Y{rng.uniform(50, 150):.3f}')
+            lines.append(f'G1 F2100 E{5.0 if relative else e:.5f}')
+            for _ in range(rng.randint(1, 8)):
+                distance = rng.uniform(0.01, 0.5)
+                e += distance
+                lines.append(f'G1 F1800 X{rng.uniform(50, 150):.3f} Y{rng.uniform(50, 150):.3f} E{distance if relative else e:.5f}')
+            lines.append(f'G1 F2100 E{-5.0 if relative else e - 5.0:.5f}')
+            if island == 1 and layer_number % 4 == 3:
+                lines.append('M106 S255')
+        lines.append(f';TIME_ELAPSED:{layer_number * 10.0:.6f}')
+        # Lines after the end of the printed gcode of a clump are not processed
+        lines.append('G1 F2100 E-1')
+        gcode.append('\n'.join(lines) + '\n')
+    gcode.append(';TIME_ELAPSED:9999\nG91\nG1 E-2 F2700\nG90\nM104 S0\n')
+    gcode.append(';End of Gcode\n;SETTING_3 {"global_quality": ""}\n')
+    return gcode
+
+
+
+def _Engine(gcode, schedules, enable_lcd_messages, enable_advanced_gcode_comments):
+    return MultiParameterTower.execute(gcode, base_height, initial_layer_height, layer_height, schedules, enable_lcd_messages, enable_advanced_gcode_comments)
+
+
+
+# Each case is the single-parameter script, the equivalent schedule and whether the gcode uses relative extrusion
+_cases = {
+    'temperature': (lambda gcode, lcd, comments: TempTower.execute(gcode, base_height, section_height, initial_layer_height, layer_height, 220, -5, lcd, comments),
+        ('Temperature', 220, -5, section_height), False),
+    'fan speed': (lambda gcode, lcd, comments: FanTower.execute(gcode, base_height, section_height, initial_layer_height, layer_height, 0, 20, False, lcd, comments),
+        ('Fan Speed', 0, 20, section_height, {'maintain_bridge_value': False}), False),
+    'fan speed maintaining bridges': (lambda gcode, lcd, comments: FanTower.execute(gcode, base_height, section_height, initial_layer_height, layer_height, 0, 20, True, lcd, comments),
+        ('Fan Speed', 0, 20, section_height, {'maintain_bridge_value': True}), False),
+    'flow rate absolute': (lambda gcode, lcd, comments: FlowTower.execute(gcode, base_height, section_height, initial_layer_height, layer_height, False, 90, 5, 95, lcd, comments),
+        ('Flow Rate', 90, 5, section_height, {'relative_extrusion': False, 'reference_flow_rate': 95}), False),
+    'flow rate relative': (lambda gcode, lcd, comments: FlowTower.execute(gcode, base_height, section_height, initial_layer_height, layer_height, True, 90, 5, 95, lcd, comments),
+        ('Flow Rate', 90, 5, section_height, {'relative_extrusion': True, 'reference_flow_rate': 95}), True),
+    'print speed': (lambda gcode, lcd, comments: PrintSpeedTower.execute(gcode, base_height, section_height, initial_layer_height, layer_height, 20, 10, 50, lcd, comments),
+        ('Print Speed', 20, 10, section_height, {'reference_speed': 50}), False),
+    'retract speed': (lambda gcode, lcd, comments: RetractSpeedTower.execute(gcode, base_height, section_height, initial_layer_height, layer_height, 10, 5, lcd, comments),
+        ('Retract Speed', 10, 5, section_height), False),
+    'retract distance absolute': (lambda gcode, lcd, comments: RetractDistanceTower.execute(gcode, base_height, section_height, initial_layer_height, layer_height, False, 1, 0.5, lcd, comments),
+        ('Retract Distance', 1, 0.5, section_height, {'relative_extrusion': False}), False),
+    'retract distance relative': (lambda gcode, lcd, comments: RetractDistanceTower.execute(gcode, base_height, section_height, initial_layer_height, layer_height, True, 1, 0.5, lcd, comments),
+        ('Retract Distance', 1, 0.5, section_height, {'relative_extrusion': True}), True),
+    **{tower_type.lower(): (lambda gcode, lcd, comments, tower_type=tower_type: MiscSpeedTower.execute(gcode, base_height, section_height, initial_layer_height, layer_height, 500, 100, tower_type, lcd, comments),
+        (tower_type, 500, 100, section_height), False) for tower_type in ['Acceleration', 'Jerk', 'Junction', 'Marlin Linear', 'RepRap Pressure']},
+}
+
+
+
+@pytest.mark.parametrize('case', _cases.keys())
+@pytest.mark.parametrize('enable_lcd_messages', [False, True])
+@pytest.mark.parametrize('enable_advanced_gcode_comments', [False, True])
+@pytest.mark.parametrize('quirks', [False, True])
+def test_single_schedule_matches_its_script(case, enable_lcd_messages, enable_advanced_gcode_comments, quirks):
+    script, schedule, relative = _cases[case]
+    gcode = _TowerGcode(40, relative, 3, quirks)
+
+    expected = script(list(gcode), enable_lcd_messages, enable_advanced_gcode_comments)
+    result = _Engine(list(gcode), [schedule], enable_lcd_messages, enable_advanced_gcode_comments)
+
+    # Only the settings documented in the first clump differ
+    assert result[1:] == expected[1:]
+    assert result[1:] != gcode[1:]
+
+
+
+@pytest.mark.parametrize('first, second', [('temperature', 'fan speed maintaining bridges'), ('flow rate absolute', 'retract speed'), ('retract distance relative', 'fan speed')])
+def test_schedules_match_their_scripts_applied_one_after_the_other(first, second):
+    first_script, first_schedule, relative = _cases[first]
+    second_script, second_schedule, _ = _cases[second]
+    gcode = _TowerGcode(40, relative, 7, True)
+
+    # The lines inserted by a script go before the lines inserted by the scripts run before it
+    expected = first_script(second_script(list(gcode), True, False), True, False)
+    result = _Engine(list(gcode), [first_schedule, second_schedule], True, False)
+
+    assert result[1:] == expected[1:]
+
+
+
+def test_schedules_have_their_own_section_heights():
+    gcode = _TowerGcode(40, False, 11)
+
+    expected = TempTower.execute(FanTower.execute(list(gcode), base_height, 2.0, initial_layer_height, layer_height, 0, 20, False, False, False), base_height, 4.0, initial_layer_height, layer_height, 220, -5, False, False)
+    result = _Engine(list(gcode), [('Temperature', 220, -5, 4.0), ('Fan Speed', 0, 20, 2.0)], False, False)
+
+    assert result[1:] == expected[1:]
+
+    # The lines inserted into each layer, between the ";MESH:" line and the move to the layer height
+    inserted_lines = {}
+    for clump in result[2:-2]:
+        lines = clump.split('\n')
+        if lines[0].startswith(';LAYER:') and not lines[2].startswith('G0'):
+            inserted_lines[lines[0]] = lines[2:lines.index(';TYPE:WALL-OUTER') - 1]
+    assert inserted_lines == {
+        ';LAYER:5': ['M104 S220', 'M109 S220', 'M106 S0'],
+        ';LAYER:15': ['M106 S51'],
+        ';LAYER:25': ['M104 S215', 'M109 S215', 'M106 S102'],
+        ';LAYER:35': ['M106 S153'],
+    }
+
+
+
+def test_combined_sections_are_named_in_the_comments():
+    gcode = _TowerGcode(10, False, 5)
+
+    result = _Engine(gcode, [('Temperature', 220, -5, 1.0), ('Fan Speed', 0, 20, 1.0)], False, True)
+
+    layer_lines = [clump for clump in result if clump.startswith(';LAYER:5')][0].split('\n')
+    assert layer_lines[:7] == [
+        ';LAYER:5',
+        ';AutoTowersGenerator: Starting temperature tower section number 1 at Cura layer number 6 (which is labeled as layer 5 in this gcode file)',
+        ';AutoTowersGenerator: Starting fan speed tower section number 1 at Cura layer number 6 (which is labeled as layer 5 in this gcode file)',
+        ';MESH:tower.stl',
+        'M104 S220 ;AutoTowersGenerator: setting temperature to 220 C for this tower section',
+        'M109 S220 ;AutoTowersGenerator: Wait for the temperature to be reached',
+        'M106 S0 ;AutoTowersGenerator: setting fan speed to 0% for the this tower section',
+    ]
+
+
+
+def test_invalid_schedules_are_skipped():
+    gcode = _TowerGcode(20, False, 2)
+
+    expected = FlowTower.execute(list(gcode), base_height, section_height, initial_layer_height, layer_height, False, 90, 5, 100, False, False)
+    result = _Engine(list(gcode), [('Flow Rate', 90, 5, section_height), ('Flow Rate', 80, 5, section_height), ('Retract Distance', 1, 0.5, section_height), ('Print Speed', 20, 10, section_height), ('Bed Temperature', 60, 5, section_height)], False, False)
+
+    assert result[1:] == expected[1:]
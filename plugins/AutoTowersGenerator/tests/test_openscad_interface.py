@@ -0,0 +1,61 @@
+import os
+import subprocess
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# The OpenSCAD interface logs through Cura
+pytest.importorskip('UM.Logger')
+
+from AutoTowersGenerator.OpenScadInterface import OpenScadInterface
+
+
+
+def _CreateInterface(monkeypatch, defaultPaths, validPaths):
+    ''' Creates an interface that finds the given default paths in turn and considers the given paths valid '''
+    interface = OpenScadInterface('AutoTowersGenerator', '')
+    defaultPaths = iter(defaultPaths)
+    monkeypatch.setattr(interface, '_GetDefaultOpenScadPath', lambda: next(defaultPaths))
+    monkeypatch.setattr(interface, '_GetModificationTime', lambda path: 1)
+
+    def run(command, **kwargs):
+        valid = any(f'"{path}"' in command for path in validPaths)
+        return SimpleNamespace(stderr='OpenSCAD version 2021.01' if valid else 'not found')
+    monkeypatch.setattr(subprocess, 'run', run)
+    return interface
+
+
+
+def test_default_path_is_determined_again_after_failed_validation(monkeypatch):
+    interface = _CreateInterface(monkeypatch, ['/old/openscad', '/new/openscad'], ['/new/openscad'])
+    interface.SetOpenScadPath('')
+
+    assert not interface.OpenScadPathValid
+    assert interface.OpenScadPathValid
+    assert interface.OpenScadPath == '/new/openscad'
+
+
+
+def test_default_path_is_determined_again_when_the_setting_changes(monkeypatch):
+    interface = _CreateInterface(monkeypatch, ['/old/openscad', '/new/openscad'], ['/old/openscad', '/new/openscad', '/manual/openscad'])
+    interface.SetOpenScadPath('')
+    assert interface.OpenScadPath == '/old/openscad'
+
+    interface.SetOpenScadPath('/manual/openscad')
+    assert interface.OpenScadPath == '/manual/openscad'
+
+    interface.SetOpenScadPath('')
+    assert interface.OpenScadPath == '/new/openscad'
+
+
+
+def test_manual_path_is_kept_after_failed_validation(monkeypatch):
+    interface = _CreateInterface(monkeypatch, ['/default/openscad'], [])
+    interface.SetOpenScadPath('/manual/openscad')
+
+    assert not interface.OpenScadPathValid
+    assert not interface.OpenScadPathValid
+    assert interface.OpenScadPath == '/manual/openscad'
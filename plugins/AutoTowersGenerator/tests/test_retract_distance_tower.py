@@ -0,0 +1,122 @@
+import os
+import random
+import re
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# The post-processing scripts log through Cura
+pytest.importorskip('UM.Logger')
+
+from AutoTowersGenerator.Postprocessing import PostProcessingCommon as Common
+from AutoTowersGenerator.Postprocessing import RetractDistanceTower_PostProcessing as RetractDistanceTower
+
+
+
+# Lines that change the extrusion mode or position, or that are not quite well-formed
+_quirks = ['G92 E0', 'M83', 'M82', 'G91', 'G90', 'G1 F1500 E1.2.3', 'G1 F1500 E-', '  G1 F2100 E5.', 'G1 F1500 E0.5 ; E9 in a comment']
+
+
+
+def _TowerGcode(layer_count, relative, seed, quirks=False, moves_per_island=8):
+    rng = random.Random(seed)
+    gcode = [';FLAVOR:Marlin\n', 'G28\nG92 E0\n' + ('M83\n' if relative else 'M82\n')]
+    e = 0.0
+    for layer_number in range(layer_count):
+        lines = [f';LAYER:{layer_number}', f'G0 F6000 X100 Y100 Z{0.2 + 0.2 * layer_number:.2f}', ';TYPE:WALL-OUTER']
+        if quirks and layer_number % 3 == 1:
+            lines.append(rng.choice(_quirks))
+            if lines[-1] == 'G92 E0':
+                e = 0.0
+        for _ in range(3):
+            lines.append(f'G0 F6000 X{rng.uniform(50, 150):.3f} Y{rng.uniform(50, 150):.3f}')
+            lines.append(f'G1 F2100 E{5.0 if relative else e:.5f}')
+            for _ in range(rng.randint(1, moves_per_island)):
+                distance = rng.uniform(0.01, 0.5)
+                e += distance
+                lines.append(f'G1 X{rng.uniform(50, 150):.3f} Y{rng.uniform(50, 150):.3f} E{distance if relative else e:.5f}')
+            lines.append(f'G1 F2100 E{-5.0 if relative else e - 5.0:.5f}')
+        lines.append(f';TIME_ELAPSED:{layer_number * 10.0:.6f}')
+        # Lines after the end of the printed gcode of a clump are not processed
+        lines.append('G1 F2100 E-1')
+        gcode.append('\n'.join(lines) + '\n')
+    gcode.append(';TIME_ELAPSED:9999\nG91\nG1 E-2 F2700\nG90\nM104 S0\n;End of Gcode\n')
+    return gcode
+
+
+
+def _ReferenceExecute(gcode, relative_extrusion, start_retract_distance, retract_distance_change):
+    ''' The retraction distance tower as it was written before, visiting every line '''
+    current_retract_distance = start_retract_distance - retract_distance_change
+    reference_extrusion_position = None
+    for layer in Common.LayerEnumerate(gcode, 1.0, 1.0, 0.2, 0.2, False):
+        if layer.start_of_new_section:
+            current_retract_distance += retract_distance_change
+            layer.InsertLines(2, [f'{Common.comment_prefix} Using a retraction distance of {current_retract_distance} mm for this tower section'])
+
+        for line_index, line in enumerate(layer.lines):
+            if Common.IsRelativeInstructionLine(line):
+                relative_extrusion = True
+            elif Common.IsAbsoluteInstructionLine(line):
+                relative_extrusion = False
+                reference_extrusion_position = None
+            elif Common.IsResetExtruderLine(line):
+                reference_extrusion_position = 0
+            elif Common.IsExtrusionLine(line) or Common.IsRetractLine(line):
+                position_search_results = re.search(r'E([-+]?\d*\.?\d+)', line.split(';')[0])
+                if position_search_results:
+                    position_string = position_search_results.group(1)
+                    position = float(position_string)
+                    if reference_extrusion_position is None and not relative_extrusion:
+                        reference_extrusion_position = position
+                    elif Common.IsExtrusionLine(line) and not relative_extrusion:
+                        reference_extrusion_position = position
+                    elif Common.IsRetractLine(line):
+                        if relative_extrusion:
+                            new_distance = -current_retract_distance if position < 0 else current_retract_distance
+                            layer.ReplaceLine(line_index, line.replace(f'E{position_string}', f'E{new_distance:.5f}'))
+                        elif position < reference_extrusion_position:
+                            layer.ReplaceLine(line_index, line.replace(f'E{position_string}', f'E{reference_extrusion_position - current_retract_distance:.5f}'))
+    return gcode
+
+
+
+def _Execute(gcode, relative_extrusion):
+    gcode = RetractDistanceTower.execute(gcode, 1.0, 1.0, 0.2, 0.2, relative_extrusion, 1.0, 0.5, False, False)
+    # The settings are documented in the first clump
+    return gcode[1:]
+
+
+
+@pytest.mark.parametrize('relative', [False, True])
+@pytest.mark.parametrize('quirks', [False, True])
+def test_matches_a_line_by_line_scan(relative, quirks):
+    gcode = _TowerGcode(40, relative, 5, quirks)
+
+    expected = _ReferenceExecute(list(gcode), relative, 1.0, 0.5)[1:]
+    result = _Execute(list(gcode), relative)
+
+    assert result == expected
+    assert result != gcode[1:]
+
+
+
+def test_retractions_change_in_each_section():
+    result = _Execute(_TowerGcode(12, True, 1), True)
+
+    retractions = [line for clump in result for line in clump.split('\n') if line.startswith('G1 F2100 E-') and not line.endswith('E-1')]
+    # The sections start above 1 mm, every 1 mm
+    assert retractions[:3] == ['G1 F2100 E-0.50000'] * 3
+    assert retractions[-3:] == ['G1 F2100 E-1.50000'] * 3
+
+
+
+def test_empty_layers():
+    # A clump that starts with the end of the printed gcode has an empty layer
+    gcode = [';FLAVOR:Marlin\n', ';TIME_ELAPSED:1\n', ';LAYER:0\nM83\nG1 F2100 E-5\n', '', ';TIME_ELAPSED:2\nG1 F2100 E-5\n']
+
+    result = _Execute(list(gcode), False)
+
+    assert result == [';TIME_ELAPSED:1\n', ';LAYER:0\nM83\nG1 F2100 E-0.50000\n', '', ';TIME_ELAPSED:2\nG1 F2100 E-5\n']
@@ -26,6 +26,8 @@ from UM.Settings.SettingDefinition import SettingDefinition
 from UM.Settings.DefinitionContainer import DefinitionContainer
 from UM.Settings.ContainerRegistry import ContainerRegistry
 from UM.Logger import Logger
+from UM.PluginRegistry import PluginRegistry
+from UM.PluginError import PluginNotFoundError
 
 def is_begin_layer_line(line: str) -> bool:
     """Check if current line is the start of a layer section.
@@ -94,7 +96,16 @@ class CuraSlowZ(Extension):
         }
         ContainerRegistry.getInstance().containerLoadComplete.connect(self._onContainerLoadComplete)
 
-        self._application.getOutputDeviceManager().writeStarted.connect(self._filterGcode)
+        self._application.pluginsLoaded.connect(self._onPluginsLoaded)
+
+        # state of the plate being processed
+        self._slowz_percentage = 0
+        self._slowz_height = 0
+        self._layercount = 0
+        self._currentz = 0
+        self._idl = 0
+        self._startlayer = 0
+        self._layer_speeds = None
 
 
     def _onContainerLoadComplete(self, container_id):
@@ -134,25 +145,24 @@ class CuraSlowZ(Extension):
                 container._definition_cache[setting_key] = definition
                 container._updateRelations(definition)
     
-    def _filterGcode(self, output_device):
-        scene = self._application.getController().getScene()
+    def _getGcodeModel(self):
+        # Shared line/layer model of scene.gcode_dict, if the GcodeModel plugin is installed
+        try:
+            return PluginRegistry.getInstance().getPluginObject("GcodeModel")
+        except PluginNotFoundError:
+            return None
 
-        global_container_stack = self._application.getGlobalContainerStack()
-        if not global_container_stack:
-            return
+    def _onPluginsLoaded(self):
+        gcode_model = self._getGcodeModel()
+        if gcode_model:
+            # processed in the same pass over the layers as the other post-processing plugins
+            gcode_model.registerTransform("CuraSlowZ", 100, begin = self._beginPlate, layer = self._processLayer, end = self._endPlate)
+        else:
+            self._application.getOutputDeviceManager().writeStarted.connect(self._filterGcode)
 
-        # get setting from Cura
-        slowz_percentage = global_container_stack.getProperty("slowz_percentage", "value")
-        slowz_height = global_container_stack.getProperty("slowz_height", "value")
-        slowz_enable = global_container_stack.getProperty("slowz_enable", "value")
-        
-        if slowz_percentage <= 0:
-            return
+    def _filterGcode(self, output_device):
+        scene = self._application.getController().getScene()
 
-        if not slowz_enable:
-            return        
-        
-        
         gcode_dict = getattr(scene, "gcode_dict", {})
         if not gcode_dict: # this also checks for an empty dict
             Logger.log("w", "Scene has no gcode to process")
@@ -160,68 +170,136 @@ class CuraSlowZ(Extension):
 
         dict_changed = False
         
-        speed_value = 100 # start at 100% speed
         for plate_id in gcode_dict:
             gcode_list = gcode_dict[plate_id]
             if len(gcode_list) < 2:
                 Logger.log("w", "G-Code %s does not contain any layers", plate_id)
                 continue
-            
-            if ";SLOWZ\n" not in gcode_list[0]:
-                layercount=0
-                currentlayer=0
-                currentz=0
-                idl=0
-                if ";LAYER_COUNT:" in gcode_list[1]:
-                    if ";LAYER:0\n" in gcode_list[1]:
-                        # layer 0 somehow got appended to the start gcode chunk
-                        # left this in as it appears to be preventative for an error.
-                        chunks = gcode_list[1].split(";LAYER:0\n")
-                        gcode_list[1] = chunks[0]
-                        gcode_list.insert(2, ";LAYER:0\n" + chunks[1])
-                        
-                    #finding layercount                    
-                    flines = gcode_list[1].split("\n")
-                    Logger.log("w", "gcode_list %d", len(gcode_list))
-                    for (fline_nr, fline) in enumerate(flines):
-                        if fline.startswith(";LAYER_COUNT:"):
-                            Logger.log("w", "found LAYER_COUNT %s", fline[13:])
-                            layercount=float(fline[13:])
-                    Logger.log("w", "layercount %f", layercount)
-                    #go through each layer
-                    for i in range(len(gcode_list)):                    
-                        lines = gcode_list[i].split("\n")
-                        for (line_nr, line) in enumerate(lines):
-                            if is_begin_layer_line(line):
-                                currentlayer=float(line[7:])
-                                Logger.log("w", "LAYER %s", line[7:])
-                            
-                                if line.startswith(";LAYER:0"):
-                                    currentz=0
-                                    idl=1    
-                                    
-                                if idl == 1 and currentz >= slowz_height:
-                                    idl=2
-                                    startlayer=currentlayer
-                                    # Logger.log("w", "Z Height %f", currentz)                               
-                                
-                                if idl >= 2 :
-                                    speed_value = 100 - int(float(slowz_percentage)*((currentlayer-startlayer)/(layercount-startlayer)))
-                                    lines.insert(2,"M220 S" + str(speed_value))
-                                    
-                            if idl == 1 and is_z_line(line):
-                                searchZ = re.search(r"Z(\d*\.?\d*)", line)
-                                if searchZ:
-                                    currentz=float(searchZ.group(1))
-                                    # Logger.log('d', 'Current Z     : {:f}'.format(currentz))
-                        
-                        gcode_list[i] = "\n".join(lines)
-                    gcode_list[0] += ";SLOWZ\n"
-                    gcode_dict[plate_id] = gcode_list
-                    dict_changed = True
-            else:
-                Logger.log("d", "G-Code %s has already been processed", plate_id)
+
+            if not self._beginPlate(plate_id, gcode_list):
                 continue
 
+            #go through each layer
+            for i in range(len(gcode_list)):
+                lines = gcode_list[i].split("\n")
+                if self._processLayer(i, lines):
+                    gcode_list[i] = "\n".join(lines)
+
+            self._endPlate(plate_id, gcode_list)
+            gcode_dict[plate_id] = gcode_list
+            dict_changed = True
+
         if dict_changed:
             setattr(scene, "gcode_dict", gcode_dict)
+
+    def _beginPlate(self, plate_id, gcode_list) -> bool:
+        """Reads the settings and the layer count for a plate.
+
+        Returns:
+            bool: True if the plate should be processed
+        """
+        global_container_stack = self._application.getGlobalContainerStack()
+        if not global_container_stack:
+            return False
+
+        # get setting from Cura
+        self._slowz_percentage = global_container_stack.getProperty("slowz_percentage", "value")
+        self._slowz_height = global_container_stack.getProperty("slowz_height", "value")
+        slowz_enable = global_container_stack.getProperty("slowz_enable", "value")
+        
+        if self._slowz_percentage <= 0:
+            return False
+
+        if not slowz_enable:
+            return False
+
+        if ";SLOWZ\n" in gcode_list[0]:
+            Logger.log("d", "G-Code %s has already been processed", plate_id)
+            return False
+
+        if ";LAYER_COUNT:" not in gcode_list[1]:
+            return False
+
+        self._layercount=0
+        self._currentz=0
+        self._idl=0
+        if ";LAYER:0\n" in gcode_list[1]:
+            # layer 0 somehow got appended to the start gcode chunk
+            # left this in as it appears to be preventative for an error.
+            chunks = gcode_list[1].split(";LAYER:0\n")
+            gcode_list[1] = chunks[0]
+            gcode_list.insert(2, ";LAYER:0\n" + chunks[1])
+            
+        #finding layercount                    
+        flines = gcode_list[1].split("\n")
+        Logger.log("w", "gcode_list %d", len(gcode_list))
+        for (fline_nr, fline) in enumerate(flines):
+            if fline.startswith(";LAYER_COUNT:"):
+                Logger.log("w", "found LAYER_COUNT %s", fline[13:])
+                self._layercount=float(fline[13:])
+        Logger.log("w", "layercount %f", self._layercount)
+
+        # with the GcodeModel plate the layers to slow down are looked up once in its layer index
+        self._layer_speeds = None
+        if hasattr(gcode_list, "getLayerIndex"):
+            self._layer_speeds = self._getLayerSpeeds(gcode_list.getLayerIndex())
+        return True
+
+    def _getLayerSpeeds(self, layer_index) -> dict:
+        """Maps the chunks of the layers to slow down to their M220 speed values."""
+        layer_speeds = {}
+        currentz = 0
+        startlayer = None
+        for layer in layer_index.getLayers():
+            if layer.layer_nr < 0:
+                continue
+            if startlayer is None and currentz >= self._slowz_height:
+                startlayer = layer.layer_nr
+            if startlayer is not None:
+                speed_value = 100 - int(float(self._slowz_percentage)*((layer.layer_nr-startlayer)/(self._layercount-startlayer)))
+                layer_speeds.setdefault(layer.chunk, []).append(speed_value)
+            elif layer.z is not None:
+                currentz = layer.z
+        return layer_speeds
+
+    def _processLayer(self, layer_nr, lines) -> bool:
+        """Inserts the M220 speed factor in a layer.
+
+        Returns:
+            bool: True if lines were changed
+        """
+        if self._layer_speeds is not None:
+            speed_values = self._layer_speeds.get(layer_nr, [])
+            for speed_value in speed_values:
+                lines.insert(2,"M220 S" + str(speed_value))
+            return bool(speed_values)
+
+        lines_changed = False
+        for (line_nr, line) in enumerate(lines):
+            if is_begin_layer_line(line):
+                currentlayer=float(line[7:])
+                Logger.log("w", "LAYER %s", line[7:])
+            
+                if line.startswith(";LAYER:0"):
+                    self._currentz=0
+                    self._idl=1    
+                    
+                if self._idl == 1 and self._currentz >= self._slowz_height:
+                    self._idl=2
+                    self._startlayer=currentlayer
+                    # Logger.log("w", "Z Height %f", currentz)                               
+                
+                if self._idl >= 2 :
+                    speed_value = 100 - int(float(self._slowz_percentage)*((currentlayer-self._startlayer)/(self._layercount-self._startlayer)))
+                    lines.insert(2,"M220 S" + str(speed_value))
+                    lines_changed = True
+                    
+            if self._idl == 1 and is_z_line(line):
+                searchZ = re.search(r"Z(\d*\.?\d*)", line)
+                if searchZ:
+                    self._currentz=float(searchZ.group(1))
+                    # Logger.log('d', 'Current Z     : {:f}'.format(currentz))
+        return lines_changed
+
+    def _endPlate(self, plate_id, gcode_list):
+        gcode_list[0] += ";SLOWZ\n"
@@ -0,0 +1,96 @@
+# The GcodeModel plugin for Cura is released under the terms of the AGPLv3 or higher.
+
+from typing import Callable, Dict, Optional
+
+from UM.Extension import Extension
+from UM.Application import Application
+from UM.Logger import Logger
+
+from .GcodePlate import GcodePlate
+from .GcodeScheduler import GcodeScheduler, GcodeTransform
+
+
+class GcodeModel(Extension):
+    """Shares one parsed view of scene.gcode_dict between post-processing plugins.
+
+    The plates are attached to the scene as "gcode_model", next to "gcode_dict".
+    A plate is rebuilt when the gcode list of its build plate is replaced, which
+    happens on every new slice. Other plugins get at this object with
+    PluginRegistry.getInstance().getPluginObject("GcodeModel").
+
+    Plugins that register a transform are run by the scheduler on writeStarted
+    in one fused pass, instead of connecting to writeStarted themselves.
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+
+        self._application = Application.getInstance()
+
+        self._scheduler = GcodeScheduler()
+        self._application.getOutputDeviceManager().writeStarted.connect(self._onWriteStarted)
+
+    def registerTransform(self, name: str, order: int,
+                          begin: Optional[Callable] = None,
+                          line: Optional[Callable] = None,
+                          layer: Optional[Callable] = None,
+                          plate: Optional[Callable] = None,
+                          end: Optional[Callable] = None,
+                          external: Optional[Callable] = None) -> None:
+        """Registers a post-processing transform; see GcodeTransform for the callbacks.
+
+        Transforms run in ascending order. Registering a name again replaces the transform.
+        """
+        self._scheduler.register(GcodeTransform(name, order, begin, line, layer, plate, end, external))
+
+    def unregisterTransform(self, name: str) -> None:
+        self._scheduler.unregister(name)
+
+    def getPlate(self, plate_id: int) -> Optional[GcodePlate]:
+        scene = self._application.getController().getScene()
+
+        gcode_dict = getattr(scene, "gcode_dict", {})
+        if not gcode_dict:
+            return None
+        gcode_list = gcode_dict.get(plate_id)
+        if gcode_list is None:
+            return None
+
+        plates = getattr(scene, "gcode_model", None)  # type: Optional[Dict[int, GcodePlate]]
+        if plates is None:
+            plates = {}
+            setattr(scene, "gcode_model", plates)
+
+        plate = plates.get(plate_id)
+        if plate is None or not plate.isFor(gcode_list):
+            Logger.log("d", "Building g-code model for plate %s", plate_id)
+            plate = GcodePlate(gcode_list)
+            plates[plate_id] = plate
+
+        return plate
+
+    def flush(self) -> bool:
+        """Write pending edits of all plates back to scene.gcode_dict."""
+        scene = self._application.getController().getScene()
+
+        changed = False
+        for plate in getattr(scene, "gcode_model", {}).values():
+            changed = plate.flush() or changed
+        return changed
+
+    def _onWriteStarted(self, output_device) -> None:
+        if not self._scheduler.hasTransforms():
+            return
+
+        scene = self._application.getController().getScene()
+        gcode_dict = getattr(scene, "gcode_dict", {})
+        if not gcode_dict:
+            Logger.log("w", "Scene has no gcode to process")
+            return
+
+        for plate_id in list(gcode_dict):
+            plate = self.getPlate(plate_id)
+            if plate is None or len(plate) < 2:
+                Logger.log("w", "Plate %s does not contain any layers", plate_id)
+                continue
+            self._scheduler.run(plate_id, plate)
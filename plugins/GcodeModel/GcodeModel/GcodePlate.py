@@ -0,0 +1,128 @@
+# The GcodeModel plugin for Cura is released under the terms of the AGPLv3 or higher.
+
+from typing import Dict, Iterator, List, Optional, Set
+
+from .LayerIndex import LayerIndex
+
+
+class GcodePlate:
+    """Line/layer view on the g-code list of a single build plate.
+
+    Chunks of the underlying gcode list are only split into lines the first time
+    a handler asks for them, and the split lines are kept for the next handler.
+    Handlers edit the line lists in place and call markDirty(); flush() joins
+    the edited chunks back into the gcode list.
+
+    Indexing the plate returns chunk strings, so it can stand in for the plain
+    gcode list in code that only reads or replaces whole chunks.
+    """
+
+    def __init__(self, gcode_list: List[str]) -> None:
+        self._gcode_list = gcode_list
+
+        self._lines = {}  # type: Dict[int, List[str]]
+        # Chunk string each cached line list was split from, to notice chunks replaced behind our back
+        self._sources = {}  # type: Dict[int, str]
+        self._dirty = set()  # type: Set[int]
+
+        self._layer_index = None  # type: Optional[LayerIndex]
+
+    @property
+    def gcodeList(self) -> List[str]:
+        return self._gcode_list
+
+    def isFor(self, gcode_list: List[str]) -> bool:
+        return gcode_list is self._gcode_list
+
+    def __len__(self) -> int:
+        return len(self._gcode_list)
+
+    def __getitem__(self, index: int) -> str:
+        index = self._normalizeIndex(index)
+        if index in self._dirty:
+            self._flushChunk(index)
+        return self._gcode_list[index]
+
+    def __setitem__(self, index: int, text: str) -> None:
+        index = self._normalizeIndex(index)
+        self._gcode_list[index] = text
+        self._dropChunk(index)
+
+    def __iter__(self) -> Iterator[str]:
+        for index in range(len(self._gcode_list)):
+            yield self[index]
+
+    def insert(self, index: int, text: str) -> None:
+        """Insert a new chunk, shifting the cached lines of the chunks after it."""
+        index = max(0, min(self._normalizeIndex(index, False), len(self._gcode_list)))
+        self._gcode_list.insert(index, text)
+
+        self._lines = {(i + 1 if i >= index else i): lines for i, lines in self._lines.items()}
+        self._sources = {(i + 1 if i >= index else i): source for i, source in self._sources.items()}
+        self._dirty = {(i + 1 if i >= index else i) for i in self._dirty}
+
+    def getLayerIndex(self) -> LayerIndex:
+        """Returns the index of the layer and feature markers of this plate, built on first use."""
+        if self._layer_index is None:
+            self._layer_index = LayerIndex(self)
+        return self._layer_index
+
+    def getLines(self, index: int) -> List[str]:
+        """Returns the lines of a chunk, without trailing newlines.
+
+        The returned list is shared; edit it in place and call markDirty().
+        """
+        index = self._normalizeIndex(index)
+        lines = self._lines.get(index)
+        if lines is not None and (index in self._dirty or self._sources[index] is self._gcode_list[index]):
+            return lines
+
+        text = self._gcode_list[index]
+        lines = text.split("\n")
+        self._lines[index] = lines
+        self._sources[index] = text
+        self._dirty.discard(index)
+        return lines
+
+    def setLines(self, index: int, lines: List[str]) -> None:
+        index = self._normalizeIndex(index)
+        self._lines[index] = lines
+        self._dirty.add(index)
+
+    def markDirty(self, index: int) -> None:
+        index = self._normalizeIndex(index)
+        if index in self._lines:
+            self._dirty.add(index)
+
+    def isDirty(self) -> bool:
+        return bool(self._dirty)
+
+    def flush(self) -> bool:
+        """Write edited chunks back to the gcode list.
+
+        Returns True if any chunk was changed.
+        """
+        if not self._dirty:
+            return False
+
+        for index in sorted(self._dirty):
+            self._flushChunk(index)
+        return True
+
+    def _flushChunk(self, index: int) -> None:
+        text = "\n".join(self._lines[index])
+        self._gcode_list[index] = text
+        self._sources[index] = text
+        self._dirty.discard(index)
+
+    def _dropChunk(self, index: int) -> None:
+        self._lines.pop(index, None)
+        self._sources.pop(index, None)
+        self._dirty.discard(index)
+
+    def _normalizeIndex(self, index: int, check: bool = True) -> int:
+        if index < 0:
+            index += len(self._gcode_list)
+        if check and not 0 <= index < len(self._gcode_list):
+            raise IndexError("gcode chunk index out of range")
+        return index
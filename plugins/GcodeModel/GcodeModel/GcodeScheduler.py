@@ -0,0 +1,139 @@
+# The GcodeModel plugin for Cura is released under the terms of the AGPLv3 or higher.
+
+from typing import Callable, Dict, List, NamedTuple, Optional, Set
+
+from UM.Logger import Logger
+
+from .GcodePlate import GcodePlate
+
+
+class GcodeTransform(NamedTuple):
+    """Callbacks a plugin registers to post-process the g-code of a plate.
+
+    begin(plate_id, plate) -> bool: prepare for a plate; return False to skip it
+    line(layer_nr, line) -> Optional[str]: return replacement text for a line (may span several lines), or None
+    layer(layer_nr, lines) -> bool: edit the lines of a layer in place; return True if they changed
+    plate(plate_id, plate): process the whole plate at once, in its own walk over the g-code
+    end(plate_id, plate): finish a plate after all layers were processed
+    external(plate_id): run an external tool on scene.gcode_dict, after all other transforms
+    """
+    name: str
+    order: int
+    begin: Optional[Callable] = None
+    line: Optional[Callable] = None
+    layer: Optional[Callable] = None
+    plate: Optional[Callable] = None
+    end: Optional[Callable] = None
+    external: Optional[Callable] = None
+
+
+class GcodeScheduler:
+    """Runs the registered transforms over each plate in declared order.
+
+    Consecutive line and layer transforms are fused: every layer is streamed
+    through all of them in a single pass over the plate. Plate transforms need
+    the complete g-code and get a pass of their own. External transforms run
+    once, last, after the edited layers were written back to the gcode list.
+    A transform is begun right before the pass it belongs to, so its begin
+    callback sees the output of every pass ordered before it.
+    """
+
+    def __init__(self) -> None:
+        self._transforms = {}  # type: Dict[str, GcodeTransform]
+        self._failed = set()  # type: Set[str]
+
+    def register(self, transform: GcodeTransform) -> None:
+        if transform.name in self._transforms:
+            Logger.log("d", "Replacing g-code transform %s", transform.name)
+        self._transforms[transform.name] = transform
+
+    def unregister(self, name: str) -> None:
+        self._transforms.pop(name, None)
+
+    def hasTransforms(self) -> bool:
+        return bool(self._transforms)
+
+    def run(self, plate_id: int, plate: GcodePlate) -> None:
+        self._failed = set()
+
+        ordered = sorted(self._transforms.values(), key = lambda transform: transform.order)
+
+        # Each transform is begun right before the pass it runs in, so it sees the plate
+        # as left by all transforms ordered before it; a plate transform ends a fused pass
+        fused = []  # type: List[GcodeTransform]
+        for transform in ordered:
+            if transform.external is not None:
+                continue
+            if transform.plate is not None:
+                self._runPass(plate_id, plate, fused)
+                fused = []
+                if self._begin(transform, plate_id, plate):
+                    self._runPass(plate_id, plate, [transform])
+            elif self._begin(transform, plate_id, plate):
+                fused.append(transform)
+        self._runPass(plate_id, plate, fused)
+
+        plate.flush()
+
+        for transform in ordered:
+            if transform.external is not None and self._begin(transform, plate_id, plate):
+                self._call(transform, transform.external, plate_id)
+
+    def _begin(self, transform: GcodeTransform, plate_id: int, plate: GcodePlate) -> bool:
+        return transform.begin is None or self._call(transform, transform.begin, plate_id, plate) is True
+
+    def _runPass(self, plate_id: int, plate: GcodePlate, transforms: List[GcodeTransform]) -> None:
+        if not transforms:
+            return
+
+        if transforms[0].plate is not None:
+            self._call(transforms[0], transforms[0].plate, plate_id, plate)
+        else:
+            self._runLayerPass(plate, transforms)
+
+        for transform in transforms:
+            if transform.end is not None and transform.name not in self._failed:
+                self._call(transform, transform.end, plate_id, plate)
+
+    def _runLayerPass(self, plate: GcodePlate, transforms: List[GcodeTransform]) -> None:
+        Logger.log("d", "Streaming plate through %s", ", ".join(transform.name for transform in transforms))
+
+        for layer_nr in range(len(plate)):
+            lines = plate.getLines(layer_nr)
+            changed = False
+
+            for transform in transforms:
+                if transform.name in self._failed or (transform.layer is None and transform.line is None):
+                    continue
+
+                if transform.layer is not None:
+                    changed = self._call(transform, transform.layer, layer_nr, lines) is True or changed
+                    continue
+
+                new_lines = []  # type: List[str]
+                lines_replaced = False
+                for line in lines:
+                    replacement = self._call(transform, transform.line, layer_nr, line)
+                    if transform.name in self._failed:
+                        break
+                    if replacement is None:
+                        new_lines.append(line)
+                    else:
+                        new_lines.extend(replacement.split("\n"))
+                        lines_replaced = True
+                else:
+                    if lines_replaced:
+                        lines[:] = new_lines
+                        changed = True
+
+            if changed:
+                plate.markDirty(layer_nr)
+
+    def _call(self, transform: GcodeTransform, callback: Callable, *args):
+        """Calls a transform callback; a transform that raises is skipped for the rest of the plate."""
+        try:
+            return callback(*args)
+        except Exception:
+            Logger.logException("e", "G-code transform %s failed", transform.name)
+            self._failed.add(transform.name)
+            return None
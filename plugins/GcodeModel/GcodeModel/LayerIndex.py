@@ -0,0 +1,130 @@
+# The GcodeModel plugin for Cura is released under the terms of the AGPLv3 or higher.
+
+import re
+from typing import Dict, List, NamedTuple, Optional, Tuple, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from .GcodePlate import GcodePlate
+
+
+class LayerMarker(NamedTuple):
+    layer_nr: int
+    chunk: int  # index in the gcode list
+    line: int  # line offset in the chunk
+    z: Optional[float]  # first Z move after the marker, None if the layer has none
+
+
+class FeatureMarker(NamedTuple):
+    kind: str  # "TYPE" or "MESH"
+    name: str
+    layer_nr: int  # -1 before the first layer
+    chunk: int
+    line: int
+
+
+class LayerIndex:
+    """Positions of the ;LAYER:, ;TYPE: and ;MESH: markers of a plate.
+
+    Chunks are scanned with a regex over the chunk string instead of line by
+    line. The scan results of a chunk are reused until the chunk string is
+    replaced, so after an edit only that chunk is scanned again. The index
+    belongs to a GcodePlate, which is rebuilt when a new slice replaces the
+    gcode list.
+    """
+
+    _marker_regex = re.compile(r"^;(LAYER|TYPE|MESH):(.*)$", re.MULTILINE)
+    _z_regex = re.compile(r"^G[01] [^;\n]*Z(-?\d*\.?\d+)", re.MULTILINE)
+
+    def __init__(self, plate: "GcodePlate") -> None:
+        self._plate = plate
+
+        # chunk index -> (chunk string that was scanned, markers found in it)
+        self._chunks = {}  # type: Dict[int, Tuple[str, List[Tuple[str, str, int, Optional[float]]]]]
+
+        self._layers = []  # type: List[LayerMarker]
+        self._layer_positions = {}  # type: Dict[int, int]
+        self._chunk_layers = {}  # type: Dict[int, List[LayerMarker]]
+        self._features = []  # type: List[FeatureMarker]
+
+    def getLayers(self) -> List[LayerMarker]:
+        self._update()
+        return self._layers
+
+    def getLayer(self, layer_nr: int) -> Optional[LayerMarker]:
+        self._update()
+        position = self._layer_positions.get(layer_nr)
+        return self._layers[position] if position is not None else None
+
+    def getLayersInChunk(self, chunk: int) -> List[LayerMarker]:
+        self._update()
+        return self._chunk_layers.get(chunk, [])
+
+    def getFeatures(self, layer_nr: Optional[int] = None) -> List[FeatureMarker]:
+        """Returns the ;TYPE: and ;MESH: markers, of a single layer if layer_nr is given."""
+        self._update()
+        if layer_nr is None:
+            return self._features
+        return [feature for feature in self._features if feature.layer_nr == layer_nr]
+
+    def findLayerAtHeight(self, z: float) -> Optional[LayerMarker]:
+        """Returns the first layer printed at or above a height."""
+        for layer in self.getLayers():
+            if layer.z is not None and layer.z >= z:
+                return layer
+        return None
+
+    def _update(self) -> None:
+        changed = False
+        chunk_count = len(self._plate)
+        for chunk in range(chunk_count):
+            text = self._plate[chunk]  # writes back pending line edits of the chunk
+            cached = self._chunks.get(chunk)
+            if cached is None or cached[0] is not text:
+                self._chunks[chunk] = (text, self._scanChunk(text))
+                changed = True
+        for chunk in [chunk for chunk in self._chunks if chunk >= chunk_count]:
+            del self._chunks[chunk]
+            changed = True
+
+        if changed:
+            self._rebuild()
+
+    def _scanChunk(self, text: str) -> List[Tuple[str, str, int, Optional[float]]]:
+        markers = []  # type: List[Tuple[str, str, int, Optional[float]]]
+        line = 0
+        position = 0
+        for match in self._marker_regex.finditer(text):
+            line += text.count("\n", position, match.start())
+            position = match.start()
+
+            kind, value = match.group(1), match.group(2).strip()
+            z = None
+            if kind == "LAYER":
+                z_match = self._z_regex.search(text, match.end())
+                if z_match:
+                    next_layer = text.find("\n;LAYER:", match.end())
+                    if next_layer == -1 or z_match.start() < next_layer:
+                        z = float(z_match.group(1))
+            markers.append((kind, value, line, z))
+        return markers
+
+    def _rebuild(self) -> None:
+        self._layers = []
+        self._layer_positions = {}
+        self._chunk_layers = {}
+        self._features = []
+
+        layer_nr = -1
+        for chunk in sorted(self._chunks):
+            for kind, value, line, z in self._chunks[chunk][1]:
+                if kind == "LAYER":
+                    try:
+                        layer_nr = int(value)
+                    except ValueError:
+                        continue
+                    layer = LayerMarker(layer_nr, chunk, line, z)
+                    self._layer_positions[layer_nr] = len(self._layers)
+                    self._layers.append(layer)
+                    self._chunk_layers.setdefault(chunk, []).append(layer)
+                else:
+                    self._features.append(FeatureMarker(kind, value, layer_nr, chunk, line))
@@ -0,0 +1,11 @@
+# The GcodeModel plugin for Cura is released under the terms of the AGPLv3 or higher.
+
+from . import GcodeModel
+
+
+def getMetaData():
+    return {}
+
+
+def register(app):
+    return {"extension": GcodeModel.GcodeModel()}
@@ -0,0 +1,141 @@
+# The GcodeModel plugin for Cura is released under the terms of the AGPLv3 or higher.
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from GcodeModel.GcodePlate import GcodePlate
+
+
+def _gcodeList():
+    return [
+        ";FLAVOR:Marlin\nM104 S200\n",
+        ";LAYER:0\nG0 X10 Y10 Z0.2\nG1 X20 E1\n",
+        ";LAYER:1\nG0 X10 Y10 Z0.4\nG1 X20 E2\n",
+        ";End of Gcode\nM104 S0\n",
+    ]
+
+
+def test_chunks_are_split_on_first_use():
+    gcode_list = _gcodeList()
+    plate = GcodePlate(gcode_list)
+
+    lines = plate.getLines(1)
+
+    assert lines == gcode_list[1].split("\n")
+    assert plate.getLines(1) is lines
+    assert plate._lines.keys() == {1}
+
+
+def test_indexing_returns_the_original_strings():
+    gcode_list = _gcodeList()
+    plate = GcodePlate(gcode_list)
+    plate.getLines(2)
+
+    assert len(plate) == len(gcode_list)
+    assert all(plate[index] is gcode_list[index] for index in range(len(gcode_list)))
+    assert plate[-1] is gcode_list[-1]
+    assert list(plate) == gcode_list
+
+
+def test_flush_joins_only_edited_chunks():
+    gcode_list = _gcodeList()
+    original = list(gcode_list)
+    plate = GcodePlate(gcode_list)
+
+    plate.getLines(1).insert(1, "M220 S90")
+    plate.markDirty(1)
+    plate.getLines(2)
+
+    assert plate.isDirty()
+    assert plate.flush()
+    assert not plate.isDirty()
+    assert not plate.flush()
+
+    assert gcode_list[1] == ";LAYER:0\nM220 S90\nG0 X10 Y10 Z0.2\nG1 X20 E1\n"
+    assert all(gcode_list[index] is original[index] for index in (0, 2, 3))
+
+
+def test_flushed_output_matches_plain_string_processing():
+    gcode_list = _gcodeList()
+    expected = []
+    for layer in _gcodeList():
+        lines = layer.split("\n")
+        lines = [line.replace("E", "E0") if line.startswith("G1") else line for line in lines]
+        expected.append("\n".join(lines))
+
+    plate = GcodePlate(gcode_list)
+    for index in range(len(plate)):
+        lines = plate.getLines(index)
+        lines[:] = [line.replace("E", "E0") if line.startswith("G1") else line for line in lines]
+        plate.markDirty(index)
+    plate.flush()
+
+    assert gcode_list == expected
+
+
+def test_indexing_writes_back_pending_edits():
+    gcode_list = _gcodeList()
+    plate = GcodePlate(gcode_list)
+
+    plate.getLines(3)[1] = "M104 S0 ; off"
+    plate.markDirty(3)
+
+    assert plate[3] == ";End of Gcode\nM104 S0 ; off\n"
+    assert gcode_list[3] == ";End of Gcode\nM104 S0 ; off\n"
+    assert not plate.isDirty()
+
+
+def test_mark_dirty_ignores_chunks_that_were_not_split():
+    plate = GcodePlate(_gcodeList())
+
+    plate.markDirty(1)
+
+    assert not plate.isDirty()
+
+
+def test_chunks_replaced_behind_the_plate_are_split_again():
+    gcode_list = _gcodeList()
+    plate = GcodePlate(gcode_list)
+    plate.getLines(1)
+
+    gcode_list[1] = ";LAYER:0\nG1 X5 E1\n"
+
+    assert plate.getLines(1) == [";LAYER:0", "G1 X5 E1", ""]
+
+
+def test_setting_a_chunk_drops_its_lines():
+    gcode_list = _gcodeList()
+    plate = GcodePlate(gcode_list)
+    plate.getLines(1).append("G1 X30 E3")
+    plate.markDirty(1)
+
+    plate[1] = ";LAYER:0\n"
+    plate.flush()
+
+    assert gcode_list[1] == ";LAYER:0\n"
+    assert plate.getLines(1) == [";LAYER:0", ""]
+
+
+def test_insert_shifts_the_cached_lines():
+    gcode_list = _gcodeList()
+    plate = GcodePlate(gcode_list)
+    plate.getLines(2).append("G1 X30 E3")
+    plate.markDirty(2)
+
+    plate.insert(1, ";inserted\n")
+    plate.flush()
+
+    assert gcode_list[1] == ";inserted\n"
+    assert gcode_list[3] == ";LAYER:1\nG0 X10 Y10 Z0.4\nG1 X20 E2\n\nG1 X30 E3"
+    assert plate.getLines(3)[-1] == "G1 X30 E3"
+
+
+def test_plate_is_for_its_own_gcode_list():
+    gcode_list = _gcodeList()
+    plate = GcodePlate(gcode_list)
+
+    assert plate.isFor(gcode_list)
+    assert not plate.isFor(list(gcode_list))
+    assert plate.gcodeList is gcode_list
@@ -0,0 +1,166 @@
+# The GcodeModel plugin for Cura is released under the terms of the AGPLv3 or higher.
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from GcodeModel.GcodePlate import GcodePlate
+from GcodeModel.GcodeScheduler import GcodeScheduler, GcodeTransform
+
+
+def _gcodeList():
+    return [
+        ";FLAVOR:Marlin\n",
+        ";LAYER:0\nG1 X10 E1\n",
+        ";LAYER:1\nG1 X20 E2\n",
+        ";End of Gcode\n",
+    ]
+
+
+def test_transforms_run_in_declared_order():
+    calls = []
+    scheduler = GcodeScheduler()
+    for name, order in (("late", 300), ("early", 10), ("middle", 100)):
+        scheduler.register(GcodeTransform(name, order,
+            begin = lambda plate_id, plate, name = name: calls.append(("begin", name)) or True,
+            layer = lambda layer_nr, lines, name = name: calls.append((layer_nr, name)) and False,
+            end = lambda plate_id, plate, name = name: calls.append(("end", name))))
+
+    scheduler.run(0, GcodePlate(_gcodeList()))
+
+    names = ["early", "middle", "late"]
+    assert calls == [("begin", name) for name in names] \
+        + [(layer_nr, name) for layer_nr in range(4) for name in names] \
+        + [("end", name) for name in names]
+
+
+def test_begin_sees_the_output_of_earlier_plate_transforms():
+    seen = []
+
+    def processPlate(plate_id, plate):
+        plate[1] = ";LAYER:0\nM220 S50\nG1 X10 E1\n"
+
+    scheduler = GcodeScheduler()
+    scheduler.register(GcodeTransform("towers", 50, plate = processPlate))
+    scheduler.register(GcodeTransform("slowz", 100,
+        begin = lambda plate_id, plate: seen.append(plate[1]) or True,
+        layer = lambda layer_nr, lines: False))
+
+    scheduler.run(0, GcodePlate(_gcodeList()))
+
+    assert seen == [";LAYER:0\nM220 S50\nG1 X10 E1\n"]
+
+
+def test_begin_after_a_fused_pass_sees_its_edits():
+    seen = []
+
+    def addComment(layer_nr, lines):
+        lines.append(";edited")
+        return True
+
+    scheduler = GcodeScheduler()
+    scheduler.register(GcodeTransform("first", 10, layer = addComment))
+    scheduler.register(GcodeTransform("plate", 20,
+        begin = lambda plate_id, plate: seen.append(plate[1]) or True,
+        plate = lambda plate_id, plate: None))
+
+    scheduler.run(0, GcodePlate(_gcodeList()))
+
+    assert seen == [";LAYER:0\nG1 X10 E1\n\n;edited"]
+
+
+def test_consecutive_layer_transforms_share_one_pass():
+    passes = []
+    scheduler = GcodeScheduler()
+    scheduler._runLayerPass = lambda plate, transforms: passes.append([transform.name for transform in transforms])
+    scheduler.register(GcodeTransform("a", 10, layer = lambda layer_nr, lines: False))
+    scheduler.register(GcodeTransform("b", 20, line = lambda layer_nr, line: None))
+    scheduler.register(GcodeTransform("c", 30, plate = lambda plate_id, plate: None))
+    scheduler.register(GcodeTransform("d", 40, layer = lambda layer_nr, lines: False))
+
+    scheduler.run(0, GcodePlate(_gcodeList()))
+
+    assert passes == [["a", "b"], ["d"]]
+
+
+def test_transforms_whose_begin_returns_false_are_skipped():
+    calls = []
+    scheduler = GcodeScheduler()
+    scheduler.register(GcodeTransform("skipped", 10,
+        begin = lambda plate_id, plate: False,
+        layer = lambda layer_nr, lines: calls.append("layer"),
+        end = lambda plate_id, plate: calls.append("end")))
+    scheduler.register(GcodeTransform("skipped plate", 20,
+        begin = lambda plate_id, plate: False,
+        plate = lambda plate_id, plate: calls.append("plate")))
+
+    scheduler.run(0, GcodePlate(_gcodeList()))
+
+    assert calls == []
+
+
+def test_line_transforms_can_replace_a_line_with_several():
+    gcode_list = _gcodeList()
+    scheduler = GcodeScheduler()
+    scheduler.register(GcodeTransform("split", 10,
+        line = lambda layer_nr, line: "G1 X5\n" + line if line.startswith("G1 X20") else None))
+
+    scheduler.run(0, GcodePlate(gcode_list))
+
+    assert gcode_list[2] == ";LAYER:1\nG1 X5\nG1 X20 E2\n"
+    assert gcode_list[1] == ";LAYER:0\nG1 X10 E1\n"
+
+
+def test_a_failing_transform_does_not_stop_the_others():
+    gcode_list = _gcodeList()
+    calls = []
+
+    def failOnSecondLayer(layer_nr, lines):
+        if layer_nr == 2:
+            raise ValueError("broken")
+        calls.append(layer_nr)
+        return False
+
+    def addComment(layer_nr, lines):
+        lines.append(";ok")
+        return True
+
+    scheduler = GcodeScheduler()
+    scheduler.register(GcodeTransform("broken", 10, layer = failOnSecondLayer, end = lambda plate_id, plate: calls.append("end")))
+    scheduler.register(GcodeTransform("working", 20, layer = addComment))
+
+    scheduler.run(0, GcodePlate(gcode_list))
+
+    assert calls == [0, 1]
+    assert all(layer.endswith("\n;ok") for layer in gcode_list)
+
+
+def test_a_failing_begin_skips_only_that_transform():
+    calls = []
+    scheduler = GcodeScheduler()
+    scheduler.register(GcodeTransform("broken", 10,
+        begin = lambda plate_id, plate: 1 / 0,
+        layer = lambda layer_nr, lines: calls.append("broken")))
+    scheduler.register(GcodeTransform("working", 20, layer = lambda layer_nr, lines: calls.append("working")))
+
+    scheduler.run(0, GcodePlate(_gcodeList()))
+
+    assert calls == ["working"] * 4
+
+
+def test_external_transforms_run_last_on_the_flushed_gcode():
+    gcode_list = _gcodeList()
+    seen = []
+
+    def addComment(layer_nr, lines):
+        lines.append(";edited")
+        return True
+
+    scheduler = GcodeScheduler()
+    scheduler.register(GcodeTransform("external", 1, external = lambda plate_id: seen.append(list(gcode_list))))
+    scheduler.register(GcodeTransform("layers", 100, layer = addComment))
+
+    scheduler.run(0, GcodePlate(gcode_list))
+
+    assert seen == [[layer + "\n;edited" for layer in _gcodeList()]]
@@ -0,0 +1,129 @@
+# The GcodeModel plugin for Cura is released under the terms of the AGPLv3 or higher.
+
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from GcodeModel.GcodePlate import GcodePlate
+from GcodeModel.LayerIndex import FeatureMarker, LayerMarker
+
+
+def _slicedGcode(layer_count = 12, seed = 1):
+    """Cura-like g-code with several layers per chunk in places, meshes, types and travel-only layers."""
+    rng = random.Random(seed)
+    gcode_list = [";FLAVOR:Marlin\n;LAYER_COUNT:%d\nM104 S200\nG28\n" % layer_count]
+    chunk = []
+    for layer_nr in range(layer_count):
+        z = round(0.2 * (layer_nr + 1), 2)
+        lines = [";LAYER:%d" % layer_nr]
+        if layer_nr != 5:  # a layer without a Z move
+            lines.append("G0 F6000 X%.3f Y%.3f Z%s" % (rng.uniform(0, 200), rng.uniform(0, 200), z))
+        for mesh in ("cube.stl", "NONMESH", "cylinder.stl"):
+            lines.append(";MESH:%s" % mesh)
+            for kind in ("WALL-OUTER", "FILL"):
+                lines.append(";TYPE:%s" % kind)
+                for _ in range(rng.randint(1, 4)):
+                    lines.append("G1 X%.3f Y%.3f E%.5f" % (rng.uniform(0, 200), rng.uniform(0, 200), rng.uniform(0, 5)))
+        lines.append(";TIME_ELAPSED:%d" % (layer_nr * 10))
+        chunk.append("\n".join(lines) + "\n")
+        if layer_nr % 3 != 1:  # some chunks hold two layers
+            gcode_list.append("".join(chunk))
+            chunk = []
+    if chunk:
+        gcode_list.append("".join(chunk))
+    gcode_list.append(";End of Gcode\nG1 Z50\nM104 S0\n")
+    return gcode_list
+
+
+def _scanLines(gcode_list):
+    """Reference scan: walk every line of every chunk."""
+    layers = []
+    features = []
+    layer_nr = -1
+    for chunk, text in enumerate(gcode_list):
+        lines = text.split("\n")
+        for line_nr, line in enumerate(lines):
+            if line.startswith(";LAYER:"):
+                layer_nr = int(line[7:])
+                z = None
+                for next_line in lines[line_nr + 1:]:
+                    if next_line.startswith(";LAYER:"):
+                        break
+                    if next_line.startswith(("G0 ", "G1 ")) and " Z" in next_line.split(";")[0]:
+                        z = float(next_line.split(";")[0].split(" Z")[1].split()[0])
+                        break
+                layers.append(LayerMarker(layer_nr, chunk, line_nr, z))
+            elif line.startswith((";TYPE:", ";MESH:")):
+                kind, name = line[1:].split(":", 1)
+                features.append(FeatureMarker(kind, name, layer_nr, chunk, line_nr))
+    return layers, features
+
+
+def _failScan(text):
+    raise AssertionError("chunk was scanned again")
+
+
+def test_index_matches_a_line_by_line_scan():
+    gcode_list = _slicedGcode()
+    index = GcodePlate(gcode_list).getLayerIndex()
+
+    layers, features = _scanLines(gcode_list)
+
+    assert index.getLayers() == layers
+    assert index.getFeatures() == features
+    assert index.getLayer(5).z is None
+
+
+def test_layer_lookups():
+    gcode_list = _slicedGcode()
+    index = GcodePlate(gcode_list).getLayerIndex()
+    layers, features = _scanLines(gcode_list)
+
+    assert index.getLayer(3) == layers[3]
+    assert index.getLayer(99) is None
+    for chunk in range(len(gcode_list)):
+        assert index.getLayersInChunk(chunk) == [layer for layer in layers if layer.chunk == chunk]
+    assert index.getFeatures(4) == [feature for feature in features if feature.layer_nr == 4]
+    assert index.findLayerAtHeight(1.0).layer_nr == 4
+    assert index.findLayerAtHeight(0.9).layer_nr == 4
+    assert index.findLayerAtHeight(100) is None
+
+
+def test_edited_chunks_are_scanned_again():
+    gcode_list = _slicedGcode()
+    plate = GcodePlate(gcode_list)
+    index = plate.getLayerIndex()
+    index.getLayers()
+
+    scanned = []
+    scan_chunk = index._scanChunk
+    index._scanChunk = lambda text: scanned.append(text) or scan_chunk(text)
+
+    chunk = index.getLayer(7).chunk
+    lines = plate.getLines(chunk)
+    lines.insert(0, ";MESH:added.stl")
+    plate.markDirty(chunk)
+
+    assert index.getLayers() == _scanLines(gcode_list)[0]
+    assert index.getFeatures() == _scanLines(gcode_list)[1]
+    assert scanned == [gcode_list[chunk]]
+
+
+def test_unchanged_plate_is_not_scanned_again():
+    plate = GcodePlate(_slicedGcode())
+    index = plate.getLayerIndex()
+    index.getLayers()
+
+    index._scanChunk = _failScan
+
+    index.getLayers()
+    index.getFeatures()
+
+
+def test_index_belongs_to_its_plate():
+    plate = GcodePlate(_slicedGcode())
+
+    assert plate.getLayerIndex() is plate.getLayerIndex()
+    assert GcodePlate(_slicedGcode()).getLayerIndex() is not plate.getLayerIndex()
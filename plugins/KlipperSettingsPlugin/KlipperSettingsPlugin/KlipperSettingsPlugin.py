@@ -62,7 +62,7 @@ v1.0.2  + Setting definition compatibility for older versions
 import os.path, json, re
 import configparser # To parse settings backup in config file
 from collections import OrderedDict # Ensure order of settings in all Cura versions
-from typing import List, Optional, Any, Dict, Set, TYPE_CHECKING
+from typing import List, Optional, Any, Dict, Set, Tuple, Generator, TYPE_CHECKING
 
 try:
     from PyQt6.QtCore import QUrl # Import custom images
@@ -77,6 +77,8 @@ from UM.Extension import Extension
 from UM.Logger import Logger # Debug logging
 from UM.Version import Version # Some features not supported in older versions
 from UM.Resources import Resources # Add local path to plugin resources
+from UM.PluginRegistry import PluginRegistry # Shared gcode model
+from UM.PluginError import PluginNotFoundError
 
 from UM.Settings.SettingDefinition import SettingDefinition    # Create and register setting definitions
 from UM.Settings.DefinitionContainer import DefinitionContainer
@@ -128,6 +130,9 @@ class KlipperSettingsPlugin(Extension):
         # Current firmware retraction values
         self._firmware_retract = {} # type: Dict[str, float]
 
+        # Gcode processor of the plate being post-processed
+        self._plate_processor = None # type: Optional[Generator[bool, Optional[Tuple[int, List[str]]], None]]
+
         try: # Get setting definitions from json
             with open(os.path.join(os.path.dirname(__file__), "klipper_settings.def.json"), encoding = "utf-8") as f:
                 self._settings_dict = json.load(f, object_pairs_hook = OrderedDict)
@@ -145,7 +150,12 @@ class KlipperSettingsPlugin(Extension):
         ## Connect signals
         self._application.getPreferences().preferenceChanged.connect(self._fixCategoryVisibility)
         self._application.getMachineManager().globalContainerChanged.connect(self._onGlobalContainerChanged)
-        self._application.getOutputDeviceManager().writeStarted.connect(self._filterGcode)
+        gcode_model = self._getGcodeModel()
+        if gcode_model: # Single pass over the gcode together with the other post-processing plugins
+            gcode_model.registerTransform("KlipperSettingsPlugin", 200,
+                begin = self._beginPlate, layer = self._processLayer, end = self._endPlate)
+        else:
+            self._application.getOutputDeviceManager().writeStarted.connect(self._filterGcode)
         ## Startup actions
         # Checks user settings backup in Cura config
         self._user_settings = self._getBackup() # type: Dict[str, Any]
@@ -354,10 +364,71 @@ class KlipperSettingsPlugin(Extension):
                 error_checker.startErrorCheckPropertyChanged(setting, "value")
 
 
+    def _getGcodeModel(self) -> Optional[Any]:
+        """Returns the shared gcode line/layer model if the GcodeModel plugin is installed."""
+        try:
+            return PluginRegistry.getInstance().getPluginObject("GcodeModel")
+        except PluginNotFoundError:
+            return None
+
     def _filterGcode(self, output_device: "OutputDevice") -> None:
         """Inserts command strings for enabled Klipper settings into final gcode.
 
         Cura gcode is post-processed at the time of saving a new sliced file.
+        Only connected when the GcodeModel plugin is not installed; otherwise the
+        plate processor runs in its fused pass with the other post-processors.
+        """
+        scene = self._application.getController().getScene()
+
+        gcode_dict = getattr(scene, 'gcode_dict', {})
+        if not gcode_dict:
+            Logger.log('w', "Scene has no gcode to process")
+            return
+
+        for plate_id in gcode_dict:
+            gcode_list = gcode_dict[plate_id]
+            if not self._beginPlate(plate_id, gcode_list):
+                continue
+
+            for layer_nr in range(len(gcode_list)):
+                lines = gcode_list[layer_nr].split("\n")
+                ## Restores gcode layer formatting
+                if self._processLayer(layer_nr, lines):
+                    gcode_list[layer_nr] = "\n".join(lines)
+
+            self._endPlate(plate_id, gcode_list)
+            gcode_dict[plate_id] = gcode_list
+
+        setattr(scene, 'gcode_dict', gcode_dict)
+
+    def _beginPlate(self, plate_id: int, gcode_list: List[str]) -> bool:
+        """Starts the plate processor; returns False if the plate is not processed."""
+        self._plate_processor = self._processPlate(plate_id, gcode_list)
+        try:
+            next(self._plate_processor) # Runs up to the first layer
+        except StopIteration:
+            self._plate_processor = None
+            return False
+        return True
+
+    def _processLayer(self, layer_nr: int, lines: List[str]) -> bool:
+        """Edits the lines of a gcode layer in place; returns True if they changed."""
+        return self._plate_processor.send((layer_nr, lines))
+
+    def _endPlate(self, plate_id: int, gcode_list: List[str]) -> None:
+        try:
+            self._plate_processor.send(None) # Finalizes the plate
+        except StopIteration:
+            pass
+        self._plate_processor = None
+
+    def _processPlate(self, plate_id: int, gcode_list: List[str]) -> Generator[bool, Optional[Tuple[int, List[str]]], None]:
+        """Generator inserting the Klipper setting commands into the gcode of a plate.
+
+        Sets up the start gcode commands, then yields once to receive the layers.
+        Each (layer_nr, lines) sent in is edited in place and answered with True
+        if the lines changed. Sending None adds the start gcode commands and marks
+        the plate as processed.
         """
         scene = self._application.getController().getScene()
         global_stack = self._application.getGlobalContainerStack()
@@ -387,374 +458,367 @@ class KlipperSettingsPlugin(Extension):
         mesh_calibrate_enabled = global_stack.getProperty('klipper_mesh_calibrate_enable', 'value')
         ui_temp_support_enabled = global_stack.getProperty('klipper_ui_temp_support_enable', 'value')
 
-        gcode_dict = getattr(scene, 'gcode_dict', {})
-        if not gcode_dict:
-            Logger.log('w', "Scene has no gcode to process")
+        if len(gcode_list) < 2:
+            Logger.log('w', "Plate %s does not contain any layers", plate_id)
+            return
+        if ";KLIPPERSETTINGSPROCESSED\n" in gcode_list[0]: # Only process new files
+            Logger.log('d', "Plate %s has already been processed", plate_id)
             return
 
         gcode_changed = False
 
         new_gcode_commands = "" # String container for all new commands
 
-        for plate_id in gcode_dict:
-            gcode_list = gcode_dict[plate_id]
-            if len(gcode_list) < 2:
-                Logger.log('w', "Plate %s does not contain any layers", plate_id)
-                continue
-            if ";KLIPPERSETTINGSPROCESSED\n" in gcode_list[0]: # Only process new files
-                Logger.log('d', "Plate %s has already been processed", plate_id)
-                continue
-
-            # Searches start gcode for tool change command
-            # Compatibility for cura versions without getInitialExtruder
-            initial_toolchange = re.search(r"(?m)^T([0-9])+$", gcode_list[1])
+        # Searches start gcode for tool change command
+        # Compatibility for cura versions without getInitialExtruder
+        initial_toolchange = re.search(r"(?m)^T([0-9])+$", gcode_list[1])
 
-            if initial_toolchange: # Set initial extruder number
-                start_extruder_nr = int(initial_toolchange.group(1))
-            else: # Set active extruder number
-                start_extruder_nr = int(self.settingWizard('extruder_nr'))
+        if initial_toolchange: # Set initial extruder number
+            start_extruder_nr = int(initial_toolchange.group(1))
+        else: # Set active extruder number
+            start_extruder_nr = int(self.settingWizard('extruder_nr'))
 
-            start_extruder_stack = extruder_manager.getExtruderStack(start_extruder_nr)
+        start_extruder_stack = extruder_manager.getExtruderStack(start_extruder_nr)
 
-            ## EXPERIMENTAL FEATURES --------------------------------
-            if not experimental_features_enabled:
-                Logger.log('d', "Klipper Experimental Features Disabled")
+        ## EXPERIMENTAL FEATURES --------------------------------
+        if not experimental_features_enabled:
+            Logger.log('d', "Klipper Experimental Features Disabled")
+        else:
+            ## BED MESH CALIBRATE COMMAND
+            if not mesh_calibrate_enabled:
+                Logger.log('d', "Klipper Bed Mesh Calibration is Disabled")
             else:
-                ## BED MESH CALIBRATE COMMAND
-                if not mesh_calibrate_enabled:
-                    Logger.log('d', "Klipper Bed Mesh Calibration is Disabled")
-                else:
-                    # Search start gcode for existing command
-                    mesh_calibrate_exists = self.gcodeSearch(cura_start_gcode, 'BED_MESH_CALIBRATE')
-
-                    if mesh_calibrate_exists: # Do not add commands
-                        self.showMessage(
-                            "<i>Calibration command is already active in Cura start gcode.</i>",
-                            "WARNING", "Bed Mesh Calibrate Not Applied", stack_msg = True)
-
-                    else: # Add mesh calibration command sequence to gcode
-                        preheat_bed_temp = global_stack.getProperty("material_bed_temperature_layer_0", 'value')
-                        gcode_list[1] = "M190 S%s %s\n" % (preheat_bed_temp, self.comment) + (
-                                        "G28 %s\n" % self.comment) + (
-                                        "BED_MESH_CALIBRATE %s\n\n" % self.comment) + gcode_list[1]
-                        gcode_changed = True
-
-                        self.showMessage(
-                            "<i>Calibration will heat bed then run before the start gcode sequence.</i>",
-                            "NEUTRAL", "Klipper Bed Mesh Calibration Enabled")
-
-                ## KLIPPER UI SUPPORT
-                if not ui_temp_support_enabled:
-                    Logger.log('d', "Klipper UI Temp Support is Disabled")
-                else:
-                    # Checks if M190 and M109 commands exist in start gcode
-                    new_gcode_commands += self._gcodeUiSupport(gcode_list[1])
+                # Search start gcode for existing command
+                mesh_calibrate_exists = self.gcodeSearch(cura_start_gcode, 'BED_MESH_CALIBRATE')
+
+                if mesh_calibrate_exists: # Do not add commands
+                    self.showMessage(
+                        "<i>Calibration command is already active in Cura start gcode.</i>",
+                        "WARNING", "Bed Mesh Calibrate Not Applied", stack_msg = True)
+
+                else: # Add mesh calibration command sequence to gcode
+                    preheat_bed_temp = global_stack.getProperty("material_bed_temperature_layer_0", 'value')
+                    gcode_list[1] = "M190 S%s %s\n" % (preheat_bed_temp, self.comment) + (
+                                    "G28 %s\n" % self.comment) + (
+                                    "BED_MESH_CALIBRATE %s\n\n" % self.comment) + gcode_list[1]
+                    gcode_changed = True
 
-            ## FIRMWARE RETRACTION COMMAND --------------------------
-            if not firmware_retract_enabled:
-                Logger.log('d', "Klipper Firmware Retraction is Disabled")
-                extruder_fw_retraction = None
+                    self.showMessage(
+                        "<i>Calibration will heat bed then run before the start gcode sequence.</i>",
+                        "NEUTRAL", "Klipper Bed Mesh Calibration Enabled")
+
+            ## KLIPPER UI SUPPORT
+            if not ui_temp_support_enabled:
+                Logger.log('d', "Klipper UI Temp Support is Disabled")
             else:
-                initial_retraction_settings = {}   # type: Dict[str, float]
-                extruder_fw_retraction = {}  # type: Dict[int, Dict[str, float]]
+                # Checks if M190 and M109 commands exist in start gcode
+                new_gcode_commands += self._gcodeUiSupport(gcode_list[1])
+
+        ## FIRMWARE RETRACTION COMMAND --------------------------
+        if not firmware_retract_enabled:
+            Logger.log('d', "Klipper Firmware Retraction is Disabled")
+            extruder_fw_retraction = None
+        else:
+            initial_retraction_settings = {}   # type: Dict[str, float]
+            extruder_fw_retraction = {}  # type: Dict[int, Dict[str, float]]
 
-                if len(used_extruder_stacks) > 1: # Add empty dict for each extruder
-                    for extruder_nr in range(len(used_extruder_stacks)):
-                        extruder_fw_retraction[extruder_nr] = {} # type: Dict[str, float]
+            if len(used_extruder_stacks) > 1: # Add empty dict for each extruder
+                for extruder_nr in range(len(used_extruder_stacks)):
+                    extruder_fw_retraction[extruder_nr] = {} # type: Dict[str, float]
 
-                for klipper_cmd, setting in self.__firmware_retraction_setting_key.items():
-                    # Gets initial retraction settings for the print
-                    initial_retraction_settings[klipper_cmd] = start_extruder_stack.getProperty(setting, 'value')
+            for klipper_cmd, setting in self.__firmware_retraction_setting_key.items():
+                # Gets initial retraction settings for the print
+                initial_retraction_settings[klipper_cmd] = start_extruder_stack.getProperty(setting, 'value')
 
-                    if extruder_fw_retraction:
-                        for extruder in used_extruder_stacks:
-                            extruder_nr = int(extruder.getProperty('extruder_nr', 'value'))
-                            # Gets settings for each extruder and updates active extruders
-                            extruder_fw_retraction[extruder_nr].update({klipper_cmd: extruder.getProperty(setting, 'value')})
-                            active_extruder_list.add(extruder_nr) # type: Set[int]
+                if extruder_fw_retraction:
+                    for extruder in used_extruder_stacks:
+                        extruder_nr = int(extruder.getProperty('extruder_nr', 'value'))
+                        # Gets settings for each extruder and updates active extruders
+                        extruder_fw_retraction[extruder_nr].update({klipper_cmd: extruder.getProperty(setting, 'value')})
+                        active_extruder_list.add(extruder_nr) # type: Set[int]
 
-                for extruder_nr, settings in extruder_fw_retraction.items(): # Create gcode command for each extruder
-                    extruder_fw_retraction[extruder_nr] = self._gcodeFirmwareRetraction(settings) + self.comment # type: Dict[int, str]
+            for extruder_nr, settings in extruder_fw_retraction.items(): # Create gcode command for each extruder
+                extruder_fw_retraction[extruder_nr] = self._gcodeFirmwareRetraction(settings) + self.comment # type: Dict[int, str]
 
-                try: # Add enabled commands for initial extruder to start gcode
-                    new_gcode_commands += (self._gcodeFirmwareRetraction(initial_retraction_settings) + self.comment + "\n")
+            try: # Add enabled commands for initial extruder to start gcode
+                new_gcode_commands += (self._gcodeFirmwareRetraction(initial_retraction_settings) + self.comment + "\n")
 
-                except TypeError:
-                    Logger.log('d', "Klipper initial firmware retraction was not set.")
+            except TypeError:
+                Logger.log('d', "Klipper initial firmware retraction was not set.")
 
-            ## VELOCITY LIMITS COMMAND ------------------------------
-            if not velocity_limits_enabled:
-                Logger.log('d', "Klipper Velocity Limit Control is Disabled")
-            else:
-                velocity_limits = {} # type: Dict[str, int]
-                # Get all velocity setting values
-                for limit_key, limit_setting in self.__velocity_limit_setting_key.items():
-                    velocity_limits[limit_key] = global_stack.getProperty(limit_setting, 'value')
-                try: # Add enabled commands to gcode
-                    new_gcode_commands += (self._gcodeVelocityLimits(velocity_limits) + self.comment + "\n")
+        ## VELOCITY LIMITS COMMAND ------------------------------
+        if not velocity_limits_enabled:
+            Logger.log('d', "Klipper Velocity Limit Control is Disabled")
+        else:
+            velocity_limits = {} # type: Dict[str, int]
+            # Get all velocity setting values
+            for limit_key, limit_setting in self.__velocity_limit_setting_key.items():
+                velocity_limits[limit_key] = global_stack.getProperty(limit_setting, 'value')
+            try: # Add enabled commands to gcode
+                new_gcode_commands += (self._gcodeVelocityLimits(velocity_limits) + self.comment + "\n")
+
+            except TypeError:
+                Logger.log('d', "Klipper velocity limits were not set.")
+
+        ## INPUT SHAPER COMMAND ---------------------------------
+        if not input_shaper_enabled:
+            Logger.log('d', "Klipper Input Shaper Control is Disabled")
+        else:
+            shaper_settings = {} # type: Dict[str, Any]
+            # Get all input shaper setting values
+            for shaper_key, shaper_setting in self.__input_shaper_setting_key.items():
+                shaper_settings[shaper_key] = global_stack.getProperty(shaper_setting, 'value')
+            try: # Add enabled commands to gcode
+                new_gcode_commands += (self._gcodeInputShaper(shaper_settings) + self.comment + "\n")
 
-                except TypeError:
-                    Logger.log('d', "Klipper velocity limits were not set.")
+            except TypeError:
+                Logger.log('d', "Klipper input shaper settings were not set.")
 
-            ## INPUT SHAPER COMMAND ---------------------------------
-            if not input_shaper_enabled:
-                Logger.log('d', "Klipper Input Shaper Control is Disabled")
-            else:
-                shaper_settings = {} # type: Dict[str, Any]
-                # Get all input shaper setting values
-                for shaper_key, shaper_setting in self.__input_shaper_setting_key.items():
-                    shaper_settings[shaper_key] = global_stack.getProperty(shaper_setting, 'value')
-                try: # Add enabled commands to gcode
-                    new_gcode_commands += (self._gcodeInputShaper(shaper_settings) + self.comment + "\n")
+        ## TUNING TOWER COMMAND ---------------------------------
+        if not tuning_tower_enabled:
+            Logger.log('d', "Klipper Tuning Tower is Disabled")
+        else:
+            tower_settings = OrderedDict() # type: OrderedDict[str, Any]
+            # Get all tuning tower setting values
+            for tower_key, tower_setting in self.__tuning_tower_setting_key.items():
+                tower_settings[tower_key] = global_stack.getProperty(tower_setting, 'value')
+            try: # Add tuning tower sequence to gcode
+                gcode_list[1] += (self._gcodeTuningTower(tower_settings) + self.comment + "\n")
+                gcode_changed = True
 
-                except TypeError:
-                    Logger.log('d', "Klipper input shaper settings were not set.")
+            except TypeError:
+                Logger.log('w', "Klipper tuning tower could not be processed.")
+                return # Stop on error
 
-            ## TUNING TOWER COMMAND ---------------------------------
-            if not tuning_tower_enabled:
-                Logger.log('d', "Klipper Tuning Tower is Disabled")
-            else:
-                tower_settings = OrderedDict() # type: OrderedDict[str, Any]
-                # Get all tuning tower setting values
-                for tower_key, tower_setting in self.__tuning_tower_setting_key.items():
-                    tower_settings[tower_key] = global_stack.getProperty(tower_setting, 'value')
-                try: # Add tuning tower sequence to gcode
-                    gcode_list[1] += (self._gcodeTuningTower(tower_settings) + self.comment + "\n")
-                    gcode_changed = True
+        ## Z OFFSET COMMAND -------------------------------------
+        if not z_offset_enabled:
+            Logger.log('d', "Klipper Z Offset Adjustment is Disabled")
+            z_offset_layer_0 = 0
+        else:
+            z_offset_adjust_pattern = "SET_GCODE_OFFSET Z_ADJUST=%g " + self.comment
+            z_offset_set_pattern = "SET_GCODE_OFFSET Z=%g " + self.comment
 
-                except TypeError:
-                    Logger.log('w', "Klipper tuning tower could not be processed.")
-                    return # Stop on error
+            z_offset_override = global_stack.getProperty('klipper_z_offset_set_enable', 'value')
+            z_offset_layer_0 = global_stack.getProperty('klipper_z_offset_layer_0', 'value')
 
-            ## Z OFFSET COMMAND -------------------------------------
-            if not z_offset_enabled:
-                Logger.log('d', "Klipper Z Offset Adjustment is Disabled")
-                z_offset_layer_0 = 0
+            if not z_offset_override:
+                Logger.log('d', "Klipper total z offset was not changed.")
             else:
-                z_offset_adjust_pattern = "SET_GCODE_OFFSET Z_ADJUST=%g " + self.comment
-                z_offset_set_pattern = "SET_GCODE_OFFSET Z=%g " + self.comment
+                z_offset_total = global_stack.getProperty('klipper_z_offset_set_total', 'value')
+                # Overrides any existing z offset with new value
+                # This will compound with any additional first layer z offset adjustment.
+                gcode_list[1] += z_offset_set_pattern % z_offset_total + "\n" # Applied after start gcode
+                gcode_changed = True
+                # Add z offset override warning
+                self._warning_msg.insert(0, "•  <i>Z Offset Override</i> is set to <b>%s mm</b>" % z_offset_total)
 
-                z_offset_override = global_stack.getProperty('klipper_z_offset_set_enable', 'value')
-                z_offset_layer_0 = global_stack.getProperty('klipper_z_offset_layer_0', 'value')
+            if not z_offset_layer_0:
+                Logger.log('d', "Klipper first layer z offset was not changed.")
+            else:
+                layer_0_height = global_stack.getProperty('layer_height_0', 'value')
+                # Matches z axis coordinate in gcode lines that haven't been processed
+                # Z offset only applies if z axis coordinate equals the layer 0 height;
+                # This is safer and necessary to avoid conflicts with settings such as z hop.
+                z_axis_regex = re.compile(r"^G[01]\s.*Z(%g)(?!.*%s)" % (layer_0_height, self.comment))
 
-                if not z_offset_override:
-                    Logger.log('d', "Klipper total z offset was not changed.")
-                else:
-                    z_offset_total = global_stack.getProperty('klipper_z_offset_set_total', 'value')
-                    # Overrides any existing z offset with new value
-                    # This will compound with any additional first layer z offset adjustment.
-                    gcode_list[1] += z_offset_set_pattern % z_offset_total + "\n" # Applied after start gcode
-                    gcode_changed = True
-                    # Add z offset override warning
-                    self._warning_msg.insert(0, "•  <i>Z Offset Override</i> is set to <b>%s mm</b>" % z_offset_total)
+                self._warning_msg.insert(0, "•  <i>Initial Layer Z Offset</i> will <b>%s</b> nozzle by <b>%s mm</b>" % (
+                    "lower" if z_offset_layer_0 < 0 else "raise", z_offset_layer_0)) # Add to final warning message
+
+        ## PRESSURE ADVANCE COMMAND -----------------------------
+        if not pressure_advance_enabled and not smooth_time_enabled:
+            Logger.log('d', "Klipper Pressure Advance Control is Disabled")
 
-                if not z_offset_layer_0:
-                    Logger.log('d', "Klipper first layer z offset was not changed.")
+        else:
+            # Extruder Settings
+            apply_factor_per_feature = {}  # type: Dict[int, bool]
+            extruder_factors = {}          # type: Dict[(int,str), float]
+            current_factor = {}            # type: Dict[int, float]
+            # Mesh Object Settings
+            per_mesh_factors = {}          # type: Dict[(str,str), float]
+            non_mesh_features = [*self.__pressure_advance_setting_key][8:] # SUPPORT, SKIRT, etc.
+
+            smooth_time_factor = 0
+            pressure_advance_factor = -1
+
+            for extruder_stack in used_extruder_stacks: # Get settings for all active extruders
+                extruder_nr = int(extruder_stack.getProperty('extruder_nr', 'value'))
+
+                if not smooth_time_enabled:
+                    Logger.log('d', "Klipper Pressure Advance Smooth Time is Disabled")
                 else:
-                    layer_0_height = global_stack.getProperty('layer_height_0', 'value')
-                    # Matches z axis coordinate in gcode lines that haven't been processed
-                    # Z offset only applies if z axis coordinate equals the layer 0 height;
-                    # This is safer and necessary to avoid conflicts with settings such as z hop.
-                    z_axis_regex = re.compile(r"^G[01]\s.*Z(%g)(?!.*%s)" % (layer_0_height, self.comment))
+                    smooth_time_factor = extruder_stack.getProperty('klipper_smooth_time_factor', 'value')
 
-                    self._warning_msg.insert(0, "•  <i>Initial Layer Z Offset</i> will <b>%s</b> nozzle by <b>%s mm</b>" % (
-                        "lower" if z_offset_layer_0 < 0 else "raise", z_offset_layer_0)) # Add to final warning message
+                if not pressure_advance_enabled:
+                    Logger.log('d', "Klipper Pressure Advance Factor is Disabled")
+                else:
+                    pressure_advance_factor = extruder_stack.getProperty('klipper_pressure_advance_factor', 'value')
+                    current_factor[extruder_nr] = pressure_advance_factor
 
-            ## PRESSURE ADVANCE COMMAND -----------------------------
-            if not pressure_advance_enabled and not smooth_time_enabled:
-                Logger.log('d', "Klipper Pressure Advance Control is Disabled")
+                    # Gets feature settings for each extruder
+                    for feature_key, setting_key in self.__pressure_advance_setting_key.items():
+                        extruder_factors[(extruder_nr, feature_key)] = extruder_stack.getProperty(setting_key, 'value')
+                        # Checks for unique feature values
+                        if extruder_factors[(extruder_nr, feature_key)] != pressure_advance_factor:
+                            apply_factor_per_feature[extruder_nr] = True # Flag to process gcode
 
-            else:
-                # Extruder Settings
-                apply_factor_per_feature = {}  # type: Dict[int, bool]
-                extruder_factors = {}          # type: Dict[(int,str), float]
-                current_factor = {}            # type: Dict[int, float]
-                # Mesh Object Settings
-                per_mesh_factors = {}          # type: Dict[(str,str), float]
-                non_mesh_features = [*self.__pressure_advance_setting_key][8:] # SUPPORT, SKIRT, etc.
+                try: # Add initial pressure advance command for all active extruders
+                    new_gcode_commands += self._gcodePressureAdvance(
+                        str(extruder_nr).strip('0'), pressure_advance_factor, smooth_time_factor) + "\n"
 
-                smooth_time_factor = 0
-                pressure_advance_factor = -1
+                except TypeError:
+                    Logger.log('w', "Klipper pressure advance values invalid: %s", str(pressure_adv_values))
+                    return
+
+
+            if pressure_advance_enabled:
+                ## Per Object Settings
+                # Gets printable mesh objects that are not support
+                nodes = [node for node in DepthFirstIterator(scene.getRoot())
+                         if node.isSelectable()and not node.callDecoration('isNonThumbnailVisibleMesh')]
+                if not nodes:
+                    Logger.log('w', "No valid objects in scene to process.")
+                    return
+
+                for node in nodes:
+                    mesh_name = node.getName() # Filename of mesh with extension
+                    mesh_settings = node.callDecoration('getStack').getTop()
+                    extruder_nr = int(node.callDecoration('getActiveExtruderPosition'))
+
+                    # Get active feature settings for mesh object
+                    for feature_key, setting_key in self.__pressure_advance_setting_key.items():
+                        if mesh_settings.getInstance(setting_key) is not None:
+                            mesh_setting_value = mesh_settings.getInstance(setting_key).value
+                        else:
+                            continue
+
+                        # Save the children!
+                        for feature in (
+                            ["WALL-OUTER", "WALL-INNER", "SKIN", "FILL"] if feature_key == "_FACTORS"
+                                else ['WALL-OUTER', 'WALL-INNER'] if feature_key == "_WALLS"
+                                else ['SUPPORT', 'SUPPORT-INTERFACE'] if feature_key == "_SUPPORTS"
+                                else [feature_key]):
+
+                                per_mesh_factors[(mesh_name, feature)] = mesh_setting_value
+                                active_mesh_features.add(feature) # All per-object features
+                                apply_factor_per_feature[extruder_nr] = True # Flag to process gcode
 
-                for extruder_stack in used_extruder_stacks: # Get settings for all active extruders
-                    extruder_nr = int(extruder_stack.getProperty('extruder_nr', 'value'))
+            # Set gcode loop parameters
+            if any(apply_factor_per_feature.values()):
+                for extruder_nr in list(apply_factor_per_feature):
+                    active_extruder_list.add(extruder_nr)
+            else:
+                pressure_advance_enabled = False
+
+
+        ## POST-PROCESS GCODE LOOP ------------------------------
+        # Layers are sent in one at a time by _processLayer
+        process_layers = pressure_advance_enabled or (z_offset_layer_0 or extruder_fw_retraction)
+        extruder_nr = start_extruder_nr
+        current_layer_nr = -1
+        current_mesh = None
+        feature_type_error = False
+
+        layer = yield None
+        while layer is not None:
+            layer_nr, lines = layer
+            lines_changed = False
+
+            if process_layers:
+                for line_nr, line in enumerate(lines):
+                    apply_new_factor = False
+
+                    if line.startswith(";LAYER:"):
+                        try:
+                            current_layer_nr = int(line[7:]) # Integer for current gcode layer
+                        except ValueError:
+                            Logger.log('w', "Could not get layer number: %s", line)
+
+                        new_layer = bool(active_mesh_features) # Sanity check for mesh features
+
+                    if z_offset_layer_0 and current_layer_nr == 0:
+                        # Matches new line with z coordinate equal to layer 0 height
+                        z_axis_change = z_axis_regex.fullmatch(line)
+
+                        if z_axis_change:
+                            # Inserts z offset command before matched line, then instructs klipper to
+                            # revert the offset on the next z axis change even if the print is stopped.
+                            lines.insert(line_nr + 1, z_offset_adjust_pattern % -(z_offset_layer_0))
+                            lines[line_nr] = line + self.comment # Append line to prevent infinite match
+                            lines.insert(line_nr, z_offset_adjust_pattern % z_offset_layer_0)
+                            lines_changed = True
+
+                    if len(active_extruder_list) > 1:
+                        # Sets extruder number from tool change commands (T0,T1...)  
+                        if line in ["T" + str(i) for i in active_extruder_list]:
+                            try:
+                                extruder_nr = int(line[1:]) # Active extruder number
+                            except ValueError:
+                                Logger.log('w', "Could not get extruder number: %s", line)
 
-                    if not smooth_time_enabled:
-                        Logger.log('d', "Klipper Pressure Advance Smooth Time is Disabled")
-                    else:
-                        smooth_time_factor = extruder_stack.getProperty('klipper_smooth_time_factor', 'value')
+                            # Applies retraction values for the current extruder
+                            if extruder_fw_retraction and current_layer_nr >= 0:
+                                lines.insert(line_nr + 1, extruder_fw_retraction[extruder_nr])
+                                lines_changed = True
 
                     if not pressure_advance_enabled:
-                        Logger.log('d', "Klipper Pressure Advance Factor is Disabled")
-                    else:
-                        pressure_advance_factor = extruder_stack.getProperty('klipper_pressure_advance_factor', 'value')
-                        current_factor[extruder_nr] = pressure_advance_factor
-
-                        # Gets feature settings for each extruder
-                        for feature_key, setting_key in self.__pressure_advance_setting_key.items():
-                            extruder_factors[(extruder_nr, feature_key)] = extruder_stack.getProperty(setting_key, 'value')
-                            # Checks for unique feature values
-                            if extruder_factors[(extruder_nr, feature_key)] != pressure_advance_factor:
-                                apply_factor_per_feature[extruder_nr] = True # Flag to process gcode
+                        if extruder_fw_retraction or (current_layer_nr <= 0 and z_offset_layer_0):
+                            continue
+                        else:
+                            break
 
-                    try: # Add initial pressure advance command for all active extruders
-                        new_gcode_commands += self._gcodePressureAdvance(
-                            str(extruder_nr).strip('0'), pressure_advance_factor, smooth_time_factor) + "\n"
-
-                    except TypeError:
-                        Logger.log('w', "Klipper pressure advance values invalid: %s", str(pressure_adv_values))
-                        return
-
-
-                if pressure_advance_enabled:
-                    ## Per Object Settings
-                    # Gets printable mesh objects that are not support
-                    nodes = [node for node in DepthFirstIterator(scene.getRoot())
-                             if node.isSelectable()and not node.callDecoration('isNonThumbnailVisibleMesh')]
-                    if not nodes:
-                        Logger.log('w', "No valid objects in scene to process.")
-                        return
-
-                    for node in nodes:
-                        mesh_name = node.getName() # Filename of mesh with extension
-                        mesh_settings = node.callDecoration('getStack').getTop()
-                        extruder_nr = int(node.callDecoration('getActiveExtruderPosition'))
-
-                        # Get active feature settings for mesh object
-                        for feature_key, setting_key in self.__pressure_advance_setting_key.items():
-                            if mesh_settings.getInstance(setting_key) is not None:
-                                mesh_setting_value = mesh_settings.getInstance(setting_key).value
-                            else:
-                                continue
-
-                            # Save the children!
-                            for feature in (
-                                ["WALL-OUTER", "WALL-INNER", "SKIN", "FILL"] if feature_key == "_FACTORS"
-                                    else ['WALL-OUTER', 'WALL-INNER'] if feature_key == "_WALLS"
-                                    else ['SUPPORT', 'SUPPORT-INTERFACE'] if feature_key == "_SUPPORTS"
-                                    else [feature_key]):
-
-                                    per_mesh_factors[(mesh_name, feature)] = mesh_setting_value
-                                    active_mesh_features.add(feature) # All per-object features
-                                    apply_factor_per_feature[extruder_nr] = True # Flag to process gcode
-
-                # Set gcode loop parameters
-                if any(apply_factor_per_feature.values()):
-                    for extruder_nr in list(apply_factor_per_feature):
-                        active_extruder_list.add(extruder_nr)
-                else:
-                    pressure_advance_enabled = False
+                    if line.startswith(";MESH:") and line[6:] != "NONMESH":
+                        current_mesh = line[6:] # String for gcode mesh name 
 
+                        if not feature_type_error:
+                            continue
 
-            ## POST-PROCESS GCODE LOOP ------------------------------
-            # TODO: This should eventually get reworked into a function.
-            if pressure_advance_enabled or (z_offset_layer_0 or extruder_fw_retraction):
-                extruder_nr = start_extruder_nr
-                current_layer_nr = -1
-                current_mesh = None
-                feature_type_error = False
+                        apply_new_factor = True # Command will insert before current line
+                        feature_type_error = False
 
-                for layer_nr, layer in enumerate(gcode_list):
-                    lines = layer.split("\n")
-                    lines_changed = False
-                    for line_nr, line in enumerate(lines):
-                        apply_new_factor = False
+                    if line.startswith(";TYPE:"):
+                        feature_type = line[6:] # String for gcode feature
 
-                        if line.startswith(";LAYER:"):
-                            try:
-                                current_layer_nr = int(line[7:]) # Integer for current gcode layer
-                            except ValueError:
-                                Logger.log('w', "Could not get layer number: %s", line)
+                        if current_layer_nr <= 0 and feature_type != "SKIRT":
+                            feature_type = "LAYER_0"
 
-                            new_layer = bool(active_mesh_features) # Sanity check for mesh features
+                        # Fixes when MESH name is not specified prior to its feature TYPE
+                        # Mostly an issue in older cura versions.
+                        if new_layer and feature_type in active_mesh_features:
+                            feature_type_error = True
+                            continue # Error corrected at next MESH line
 
-                        if z_offset_layer_0 and current_layer_nr == 0:
-                            # Matches new line with z coordinate equal to layer 0 height
-                            z_axis_change = z_axis_regex.fullmatch(line)
+                        apply_new_factor = True
+                        line_nr += 1 # Command will insert after current line
 
-                            if z_axis_change:
-                                # Inserts z offset command before matched line, then instructs klipper to
-                                # revert the offset on the next z axis change even if the print is stopped.
-                                lines.insert(line_nr + 1, z_offset_adjust_pattern % -(z_offset_layer_0))
-                                lines[line_nr] = line + self.comment # Append line to prevent infinite match
-                                lines.insert(line_nr, z_offset_adjust_pattern % z_offset_layer_0)
-                                lines_changed = True
+                    if apply_new_factor:
+                        # Sets current extruder value if no mesh setting exists
+                        pressure_advance_factor = per_mesh_factors.get((current_mesh, feature_type),
+                                                  extruder_factors[(extruder_nr, feature_type)])
+                        new_layer = False
 
-                        if len(active_extruder_list) > 1:
-                            # Sets extruder number from tool change commands (T0,T1...)  
-                            if line in ["T" + str(i) for i in active_extruder_list]:
-                                try:
-                                    extruder_nr = int(line[1:]) # Active extruder number
-                                except ValueError:
-                                    Logger.log('w', "Could not get extruder number: %s", line)
-
-                                # Applies retraction values for the current extruder
-                                if extruder_fw_retraction and current_layer_nr >= 0:
-                                    lines.insert(line_nr + 1, extruder_fw_retraction[extruder_nr])
-                                    lines_changed = True
-
-                        if not pressure_advance_enabled:
-                            if extruder_fw_retraction or (current_layer_nr <= 0 and z_offset_layer_0):
-                                continue
-                            else:
-                                break
-
-                        if line.startswith(";MESH:") and line[6:] != "NONMESH":
-                            current_mesh = line[6:] # String for gcode mesh name 
-
-                            if not feature_type_error:
-                                continue
-
-                            apply_new_factor = True # Command will insert before current line
-                            feature_type_error = False
-
-                        if line.startswith(";TYPE:"):
-                            feature_type = line[6:] # String for gcode feature
-
-                            if current_layer_nr <= 0 and feature_type != "SKIRT":
-                                feature_type = "LAYER_0"
-
-                            # Fixes when MESH name is not specified prior to its feature TYPE
-                            # Mostly an issue in older cura versions.
-                            if new_layer and feature_type in active_mesh_features:
-                                feature_type_error = True
-                                continue # Error corrected at next MESH line
-
-                            apply_new_factor = True
-                            line_nr += 1 # Command will insert after current line
-
-                        if apply_new_factor:
-                            # Sets current extruder value if no mesh setting exists
-                            pressure_advance_factor = per_mesh_factors.get((current_mesh, feature_type),
-                                                      extruder_factors[(extruder_nr, feature_type)])
-                            new_layer = False
-
-                            # Sets new factor if different from the active value
-                            if pressure_advance_factor != current_factor.get(extruder_nr, None):
-                                current_factor[extruder_nr] = pressure_advance_factor
-
-                                lines.insert(line_nr, self._gcodePressureAdvance(
-                                    str(extruder_nr).strip('0'), pressure_advance_factor))
-                                lines_changed = True
+                        # Sets new factor if different from the active value
+                        if pressure_advance_factor != current_factor.get(extruder_nr, None):
+                            current_factor[extruder_nr] = pressure_advance_factor
 
-                    ## Restores gcode layer formatting
-                    if lines_changed:
-                        gcode_list[layer_nr] = "\n".join(lines)
-                        gcode_changed = True
+                            lines.insert(line_nr, self._gcodePressureAdvance(
+                                str(extruder_nr).strip('0'), pressure_advance_factor))
+                            lines_changed = True
 
-            ## Adds new commands to start of gcode
-            if not new_gcode_commands:
-                Logger.log('d', "Klipper start gcode commands were not added.")
-            else:
-                gcode_list[1] = new_gcode_commands + "\n" + gcode_list[1]
+            if lines_changed:
                 gcode_changed = True
+            layer = yield lines_changed
+
+        ## Adds new commands to start of gcode
+        if not new_gcode_commands:
+            Logger.log('d', "Klipper start gcode commands were not added.")
+        else:
+            gcode_list[1] = new_gcode_commands + "\n" + gcode_list[1]
+            gcode_changed = True
 
         ## Finalize processed gcode
         if gcode_changed:
             self._showWarningMessage(60) # Display any active setting warnings
             gcode_list[0] += ";KLIPPERSETTINGSPROCESSED\n"
-            gcode_dict[plate_id] = gcode_list
-            setattr(scene, 'gcode_dict', gcode_dict)
 
 
     def gcodeSearch(self, gcode: str, command: str, ignore_comment: bool=False) -> bool:
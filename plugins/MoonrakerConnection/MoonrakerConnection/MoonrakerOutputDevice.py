@@ -1,11 +1,11 @@
 import json
+import os
 import os.path
 import re
+import tempfile
 import urllib.parse
 from enum import Enum
-from io import BytesIO, StringIO
-from typing import cast
-from time import sleep
+from typing import cast, Union
 
 USE_QT5 = False
 try:
@@ -13,11 +13,11 @@ try:
 except ImportError: # Cura <= 3.6   
     CuraSDKVersion = "6.0.0"
 if CuraSDKVersion >= "8.0.0":
-    from PyQt6.QtCore import QByteArray, QObject, QUrl, QVariant, pyqtSlot, pyqtProperty
+    from PyQt6.QtCore import QByteArray, QFile, QIODevice, QObject, QTimer, QUrl, QVariant, pyqtSlot, pyqtProperty
     from PyQt6.QtGui import QDesktopServices
     from PyQt6.QtNetwork import QNetworkRequest, QNetworkReply, QHttpMultiPart, QHttpPart
 else:
-    from PyQt5.QtCore import QByteArray, QObject, QUrl, QVariant, pyqtSlot, pyqtProperty
+    from PyQt5.QtCore import QByteArray, QFile, QIODevice, QObject, QTimer, QUrl, QVariant, pyqtSlot, pyqtProperty
     from PyQt5.QtGui import QDesktopServices
     from PyQt5.QtNetwork import QNetworkRequest, QNetworkReply, QHttpMultiPart, QHttpPart
     USE_QT5 = True
@@ -40,18 +40,25 @@ try:
 	FormDataType = QHttpMultiPart.ContentType.FormDataType
 	ContentDispositionHeader = QNetworkRequest.KnownHeaders.ContentDispositionHeader
 	ContentTypeHeader = QNetworkRequest.KnownHeaders.ContentTypeHeader
+	ReadOnly = QIODevice.OpenModeFlag.ReadOnly
 except AttributeError:
 	NoError = 0
 	FormDataType = QHttpMultiPart.FormDataType
 	ContentDispositionHeader = QNetworkRequest.ContentDispositionHeader
 	ContentTypeHeader = QNetworkRequest.ContentTypeHeader
+	ReadOnly = QIODevice.ReadOnly
 
 catalog = i18nCatalog("cura")
 spinner = ['⠋', '⠙', '⠹', '⠸', '⠼', '⠴', '⠦', '⠧', '⠇', '⠏']
 
+# retries while waiting for the printer; the retry interval doubles up to the limit
+retryLimit = 20
+retryIntervalLimit = 10.0
+
 class OutputStage(Enum):
     Ready = 0
     Writing = 1
+    Connecting = 2
 
 class MoonrakerOutputDevice(PrinterOutputDevice):
     def __init__(self, deviceId: str, canConnect: bool = True) -> None:
@@ -69,7 +76,13 @@ class MoonrakerOutputDevice(PrinterOutputDevice):
             #self._control_view_qml_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'resources', "qml", 'qt5' if USE_QT5 else 'qt6', "MoonrakerControl.qml")
             globalContainerStack.setMetaDataEntry("group_name", globalContainerStack.getName())
         self._config = None
+        self._file = None
+        self._filePath = None
         self._stage = OutputStage.Ready
+        # waits between status requests without blocking the ui
+        self._retryTimer = QTimer()
+        self._retryTimer.setSingleShot(True)
+        self._retryTimer.timeout.connect(self._getPrinterStatus)
         Logger.log("d", "MoonrakerOutputDevice [canConnect: {}] for printer '{}' created.".format(canConnect, deviceId))
 
     def requestWrite(self, node, fileName: str = None, *args, **kwargs) -> None:
@@ -86,18 +99,31 @@ class MoonrakerOutputDevice(PrinterOutputDevice):
         self.writeStarted.emit(self)
 
         # The presliced print should always be send using `GCodeWriter`
+        # The print is written to a temporary file and streamed from there, so the upload does not hold it in memory
         printInformation = CuraApplication.getInstance().getPrintInformation()
         pluginRegistry = CuraApplication.getInstance().getPluginRegistry()
+        self._removeFile()
         if self._outputFormat != "ufp" or not printInformation or printInformation.preSliced:
             self._outputFormat = "gcode"
             meshWriter = cast(MeshWriter, pluginRegistry.getPluginObject("GCodeWriter"))
-            self._stream = StringIO()
+            # newline = "" keeps the line endings as written
+            stream = tempfile.NamedTemporaryFile(mode = "w", encoding = "utf-8", newline = "", suffix = ".gcode", delete = False)
         else:
             meshWriter = cast(MeshWriter, pluginRegistry.getPluginObject("UFPWriter"))
-            self._stream = BytesIO()
+            stream = tempfile.NamedTemporaryFile(mode = "w+b", suffix = ".ufp", delete = False)
 
-        if not meshWriter.write(self._stream, None):
+        self._filePath = stream.name
+        try:
+            written = meshWriter.write(stream, None)
+        except Exception:
+            Logger.logException("e", "Writing to temporary file '{}' failed.".format(self._filePath))
+            written = False
+        finally:
+            stream.close()
+
+        if not written:
             Logger.log("e", "MeshWriter failed: %s" % meshWriter.getInformation())
+            self._removeFile()
             return
 
         # Prepare filename for upload
@@ -200,21 +226,30 @@ class MoonrakerOutputDevice(PrinterOutputDevice):
                 Logger.log("i", "No valid configuration for printer '{}' found.".format(globalContainerStack.getId()))
 
             self._message = None
-            self._stream = None
             self._resetState()
 
     def _resetState(self) -> None:
         Logger.log("d", "Reset state of device.")
-        if self._stream:
-            self._stream.close()
-        self._stream = None
+        self._retryTimer.stop()
+        self._removeFile()
         self._pathName = None
         self._fileName = None
         self._startPrint = None
-        self._postData = None
         self._errorCounter = 0
         self._stage = OutputStage.Ready
 
+    def _removeFile(self) -> None:
+        # close and delete the temporary file the print was written to
+        if self._file:
+            self._file.close()
+        self._file = None
+        if self._filePath:
+            try:
+                os.remove(self._filePath)
+            except OSError:
+                Logger.log("w", "Could not remove temporary file '{}'.".format(self._filePath))
+        self._filePath = None
+
     def _onUploadPathesChanged(self, pathes: QVariant) -> None:
         if pathes:
             self._uploadPathes = pathes.toVariant()
@@ -297,10 +332,13 @@ class MoonrakerOutputDevice(PrinterOutputDevice):
         Logger.log("d", "StartPrint set to '{}'.".format(self._startPrint))
 
         Logger.log("i", "Connecting to Moonraker at {}.".format(self._url))
+        self._stage = OutputStage.Connecting
         # Show a message with status of connection
         messageText = self._getConnectMessage()
         self._message = Message(catalog.i18nc("@info:status", messageText), 0, False)
         self._message.setTitle("Moonraker - Connect")
+        self._message.addAction("cancel", catalog.i18nc("@action:button", "Cancel"), "", catalog.i18nc("@info:tooltip", "Stop waiting for the printer and cancel the upload."))
+        self._message.actionTriggered.connect(self._onMessageActionTriggered)
         self._message.show()
 
         # Handle power device first
@@ -317,6 +355,8 @@ class MoonrakerOutputDevice(PrinterOutputDevice):
         self._sendRequest('machine/device_power/device?device={}'.format(powerDevice), on_success = self._checkPowerDeviceStatus)
 
     def _checkPowerDeviceStatus(self, reply: QNetworkReply) -> None:
+        if self._stage != OutputStage.Connecting:
+            return # cancelled
         response = self._getResponse(reply)
         powerDevice = list(response['result'].keys())[0]
         powerDeviceStatus = list(response['result'].values())[0]
@@ -337,9 +377,13 @@ class MoonrakerOutputDevice(PrinterOutputDevice):
             self._sendRequest('machine/device_power/device?' + urllib.parse.urlencode({'device': powerDevice, 'action': 'on'}), data = '{}'.encode(), dataIsJSON = True, on_success = self._getPrinterStatus if index == 0 else None)
 
     def _getPrinterStatus(self, reply: QNetworkReply = None) -> None:
+        if self._stage != OutputStage.Connecting:
+            return # cancelled
         self._sendRequest('server/info', on_success = self._checkPrinterStatus, on_error = self._onPrinterError)
 
     def _checkPrinterStatus(self, reply: QNetworkReply) -> None:
+        if self._stage != OutputStage.Connecting:
+            return # cancelled
         response = self._getResponse(reply)
         status = response['result']['klippy_state']
 
@@ -369,26 +413,30 @@ class MoonrakerOutputDevice(PrinterOutputDevice):
             return
 
         Logger.log("i", "Uploading file '{}' [path: {}; format: {}].".format(self._fileName, self._pathName, self._outputFormat))
-        self._stream.seek(0)
-        self._postData = QByteArray()
-        if isinstance(self._stream, BytesIO):
-            self._postData.append(self._stream.getvalue())
-        else:
-            self._postData.append(self._stream.getvalue().encode())
-        self._sendRequest('server/files/upload', pathName = self._pathName, fileName = self._fileName, data = self._postData, on_success = self._onFileUploaded)    
+        # the file is streamed into the request body instead of being copied into memory
+        self._file = QFile(self._filePath)
+        if not self._file.open(ReadOnly):
+            self._onError(None, "Could not read temporary file '{}': {}".format(self._filePath, self._file.errorString()))
+            return
+        self._sendRequest('server/files/upload', pathName = self._pathName, fileName = self._fileName, data = self._file, on_success = self._onFileUploaded)    
     
     def _onPrinterError(self, reply: QNetworkReply = None, error = None) -> None:
+        if self._stage != OutputStage.Connecting:
+            return # cancelled
         self._errorCounter += 1        
-        if self._errorCounter > 20:
+        if self._errorCounter > retryLimit:
             self._onError(reply, error)
         else:
+            # exponential backoff, the next status request is sent by the retry timer
             try:
-                sleep(float(self._retryInterval))
+                retryInterval = float(self._retryInterval)
             except ValueError:
-                sleep(0.5)
+                retryInterval = 0.5
+            retryInterval = min(retryInterval * 2 ** (self._errorCounter - 1), max(retryInterval, retryIntervalLimit))
+            Logger.log("d", "Printer not ready, retry {}/{} in {:.1f}s.".format(self._errorCounter, retryLimit, retryInterval))
             if (self._message):
-                self._message.setText(self._getConnectMessage())
-            self._getPrinterStatus()
+                self._message.setText(self._getConnectMessage(retryInterval))
+            self._retryTimer.start(int(retryInterval * 1000))
 
     def _onFileUploaded(self, reply: QNetworkReply) -> None:
         if self._stage != OutputStage.Writing:
@@ -399,8 +447,7 @@ class MoonrakerOutputDevice(PrinterOutputDevice):
             return
 
         Logger.log("i", "Upload completed.")
-        self._stream.close()
-        self._stream = None
+        self._removeFile()
 
         if self._message:
             self._message.hide()
@@ -416,7 +463,16 @@ class MoonrakerOutputDevice(PrinterOutputDevice):
         self._resetState()
 
     def _onMessageActionTriggered(self, message: Message, action: str) -> None:
-        if action == "open_browser":
+        if action == "cancel":
+            if self._stage != OutputStage.Connecting:
+                return
+            Logger.log("i", "Waiting for printer cancelled after {} retries.".format(self._errorCounter))
+            if self._message:
+                self._message.hide()
+                self._message = None
+            self.writeError.emit(self)
+            self._resetState()
+        elif action == "open_browser":
             QDesktopServices.openUrl(QUrl(self._frontendUrl if self._frontendUrl else self._url))
             if self._message:
                 self._message.hide()
@@ -434,7 +490,7 @@ class MoonrakerOutputDevice(PrinterOutputDevice):
 
         return response
 
-    def _sendRequest(self, path: str, pathName: str = None, fileName: str = None, data: QByteArray = None, dataIsJSON: bool = False, on_success = None, on_error = None) -> None:
+    def _sendRequest(self, path: str, pathName: str = None, fileName: str = None, data: Union[QByteArray, bytes, QIODevice] = None, dataIsJSON: bool = False, on_success = None, on_error = None) -> None:
         url = self._url + path
 
         headers = {'User-Agent': 'Cura Plugin Moonraker', 'Accept': 'application/json, text/plain', 'Connection': 'keep-alive'}
@@ -451,7 +507,11 @@ class MoonrakerOutputDevice(PrinterOutputDevice):
                 part_file = QHttpPart()
                 part_file.setHeader(ContentDispositionHeader, QVariant('form-data; name="file"; filename="' + fileName + '"'))
                 part_file.setHeader(ContentTypeHeader, QVariant('application/octet-stream'))
-                part_file.setBody(data)
+                if isinstance(data, QIODevice):
+                    # an open file is read while the request is sent
+                    part_file.setBodyDevice(data)
+                else:
+                    part_file.setBody(data)
                 parts.append(part_file)
 
                 part_root = QHttpPart()
@@ -503,5 +563,8 @@ class MoonrakerOutputDevice(PrinterOutputDevice):
         self.writeError.emit(self)
         self._resetState()
     
-    def _getConnectMessage(self):
-        return "Connecting to Moonraker at {}     {}".format(self._url, spinner[self._errorCounter % len(spinner)])
+    def _getConnectMessage(self, retryInterval: float = None):
+        messageText = "Connecting to Moonraker at {}     {}".format(self._url, spinner[self._errorCounter % len(spinner)])
+        if retryInterval is not None:
+            messageText += "\n\nPrinter not ready, retry {} of {} in {:.1f} s.".format(self._errorCounter, retryLimit, retryInterval)
+        return messageText
@@ -49,6 +49,8 @@ if CuraSDKVersion >= "8.0.0":
     from PyQt6.QtCore import (
         QUrl,
         QTimer,
+        QFile,
+        QIODevice,
         pyqtSignal,
         pyqtProperty,
         pyqtSlot,
@@ -61,6 +63,7 @@ if CuraSDKVersion >= "8.0.0":
     QNetworkRequestAttributes = QNetworkRequest.Attribute
     QNetworkReplyNetworkErrors = QNetworkReply.NetworkError
     QSslSocketPeerVerifyModes = QSslSocket.PeerVerifyMode
+    QIODeviceOpenModes = QIODevice.OpenModeFlag
 
 else:
     from PyQt5.QtNetwork import (
@@ -72,6 +75,8 @@ else:
     from PyQt5.QtCore import (
         QUrl,
         QTimer,
+        QFile,
+        QIODevice,
         pyqtSignal,
         pyqtProperty,
         pyqtSlot,
@@ -84,19 +89,21 @@ else:
     QNetworkRequestAttributes = QNetworkRequest
     QNetworkReplyNetworkErrors = QNetworkReply
     QSslSocketPeerVerifyModes = QSslSocket
+    QIODeviceOpenModes = QIODevice
 
     USE_QT5 = True
 
 import json
+import os
 import os.path
 import re
+import tempfile
 from time import time
 import base64
-from io import StringIO, BytesIO
 from enum import IntEnum
 from collections import namedtuple
 
-from typing import cast, Any, Callable, Dict, List, Optional, Union, TYPE_CHECKING
+from typing import cast, Any, Callable, Dict, List, Optional, Tuple, Union, TYPE_CHECKING
 
 if TYPE_CHECKING:
     from UM.Scene.SceneNode import SceneNode  # For typing.
@@ -163,7 +170,9 @@ class OctoPrintOutputDevice(NetworkedPrinterOutputDevice):
             for axis in ["x", "y", "z", "e"]
         }
 
-        self._gcode_stream = StringIO()  # type: Union[StringIO, BytesIO]
+        # The job is written to a temporary file and streamed from there, so the upload does not hold it in memory
+        self._gcode_file_path = ""
+        self._upload_files = {}  # type: Dict[QNetworkReply, Tuple[QFile, str]]
 
         self._forced_queue = False
         self._select_and_print_handled_in_upload = False
@@ -567,19 +576,35 @@ class OctoPrintOutputDevice(NetworkedPrinterOutputDevice):
         # This produces the same output as "Save to File", adding the print settings to the bottom of the file
         # The presliced print should always be send using `GCodeWriter`
         print_info = CuraApplication.getInstance().getPrintInformation()
+        self._removeGcodeFile()
         if not self._transfer_as_ufp or not print_info or print_info.preSliced:
             gcode_writer = cast(
                 MeshWriter, PluginRegistry.getInstance().getPluginObject("GCodeWriter")
             )
-            self._gcode_stream = StringIO()
+            # newline="" keeps the line endings as written, like the StringIO that was used before
+            gcode_stream = tempfile.NamedTemporaryFile(
+                mode="w", encoding="utf-8", newline="", suffix=".gcode", delete=False
+            )
         else:
             gcode_writer = cast(
                 MeshWriter, PluginRegistry.getInstance().getPluginObject("UFPWriter")
             )
-            self._gcode_stream = BytesIO()
+            gcode_stream = tempfile.NamedTemporaryFile(
+                mode="w+b", suffix=".ufp", delete=False
+            )
 
-        if not gcode_writer.write(self._gcode_stream, None):
+        self._gcode_file_path = gcode_stream.name
+        try:
+            write_result = gcode_writer.write(gcode_stream, None)
+        except Exception:
+            Logger.logException("e", "Failed to write the print job to %s", self._gcode_file_path)
+            write_result = False
+        finally:
+            gcode_stream.close()
+
+        if not write_result:
             Logger.log("e", "GCodeWrite failed: %s" % gcode_writer.getInformation())
+            self._removeGcodeFile()
             return
 
         if self._error_message:
@@ -755,7 +780,7 @@ class OctoPrintOutputDevice(NetworkedPrinterOutputDevice):
             self._forced_queue = True
             self._sendPrintJob()
         elif action_id == "cancel":
-            self._gcode_stream = StringIO()  # type: Union[StringIO, BytesIO]
+            self._removeGcodeFile()
 
     def _queuePrintJob(self, message: Message, action_id: str) -> None:
         self._error_message = None  # type:Optional[Message]
@@ -817,10 +842,17 @@ class OctoPrintOutputDevice(NetworkedPrinterOutputDevice):
         post_parts = []  # type: List[QHttpPart]
 
         ##  Create parts (to be placed inside multipart)
-        gcode_body = self._gcode_stream.getvalue()
-        if isinstance(gcode_body, str):
-            # encode StringIO result to bytes
-            gcode_body = gcode_body.encode()
+        ##  The job is streamed from the temporary file it was written to
+        gcode_file = QFile(self._gcode_file_path)
+        if not gcode_file.open(QIODeviceOpenModes.ReadOnly):
+            Logger.log("e", "Could not open %s for uploading: %s", self._gcode_file_path, gcode_file.errorString())
+            self._progress_message.hide()
+            self._progress_message = None  # type: Optional[Message]
+            self._showErrorMessage(
+                i18n_catalog.i18nc("@info:status", "Unable to send data to OctoPrint.")
+            )
+            self._removeGcodeFile()
+            return
 
         post_parts.append(
             self._createFormPart(
@@ -830,7 +862,7 @@ class OctoPrintOutputDevice(NetworkedPrinterOutputDevice):
         post_parts.append(
             self._createFormPart(
                 'name="file"; filename="%s"' % file_name,
-                gcode_body,
+                gcode_file,
                 "application/octet-stream",
             )
         )
@@ -870,6 +902,10 @@ class OctoPrintOutputDevice(NetworkedPrinterOutputDevice):
                 on_finished=self._onUploadFinished,
                 on_progress=self._onUploadProgress,
             )
+            if self._post_gcode_reply:
+                # the file is closed and deleted when this upload is finished or cancelled
+                self._upload_files[self._post_gcode_reply] = (gcode_file, self._gcode_file_path)
+                self._gcode_file_path = ""
 
         except Exception as e:
             self._progress_message.hide()
@@ -880,7 +916,9 @@ class OctoPrintOutputDevice(NetworkedPrinterOutputDevice):
             self._error_message.show()
             Logger.log("e", "An exception occurred in network connection: %s" % str(e))
 
-        self._gcode_stream = StringIO()  # type: Union[StringIO, BytesIO]
+        if self._gcode_file_path:
+            gcode_file.close()
+            self._removeGcodeFile()
 
     def _cancelSendGcode(self, message: Message, action_id: str) -> None:
         self._progress_message = None  # type:Optional[Message]
@@ -895,8 +933,29 @@ class OctoPrintOutputDevice(NetworkedPrinterOutputDevice):
                 pass  # The disconnection can fail on mac in some cases. Ignore that.
 
             self._post_gcode_reply.abort()
+            self._removeUploadFile(self._post_gcode_reply)
             self._post_gcode_reply = None  # type:Optional[QNetworkReply]
 
+    ##  Delete the temporary file of a print job that was not uploaded
+    def _removeGcodeFile(self) -> None:
+        if self._gcode_file_path:
+            self._removeTemporaryFile(self._gcode_file_path)
+            self._gcode_file_path = ""
+
+    ##  Close and delete the temporary file an upload was streamed from
+    def _removeUploadFile(self, reply: QNetworkReply) -> None:
+        upload_file = self._upload_files.pop(reply, None)
+        if upload_file:
+            gcode_file, file_path = upload_file
+            gcode_file.close()
+            self._removeTemporaryFile(file_path)
+
+    def _removeTemporaryFile(self, file_path: str) -> None:
+        try:
+            os.remove(file_path)
+        except OSError:
+            Logger.log("w", "Could not remove temporary print job file %s", file_path)
+
     def sendCommand(self, command: str) -> None:
         self._queued_gcode_commands.append(command)
         CuraApplication.getInstance().callLater(self._sendQueuedGcode)
@@ -1563,6 +1622,7 @@ class OctoPrintOutputDevice(NetworkedPrinterOutputDevice):
 
     def _onUploadFinished(self, reply: QNetworkReply) -> None:
         reply.uploadProgress.disconnect(self._onUploadProgress)
+        self._removeUploadFile(reply)
 
         if self._progress_message:
             self._progress_message.hide()
@@ -1837,8 +1897,9 @@ class OctoPrintOutputDevice(NetworkedPrinterOutputDevice):
         return request
 
     # This is a patched version from NetworkedPrinterOutputdevice, which adds "form_data" instead of "form-data"
+    #  The data can also be an open QIODevice, which is streamed instead of copied into the request
     def _createFormPart(
-        self, content_header: str, data: bytes, content_type: Optional[str] = None
+        self, content_header: str, data: Union[bytes, QIODevice], content_type: Optional[str] = None
     ) -> QHttpPart:
         part = QHttpPart()
 
@@ -1848,7 +1909,10 @@ class OctoPrintOutputDevice(NetworkedPrinterOutputDevice):
         if content_type is not None:
             part.setHeader(QNetworkRequestKnownHeaders.ContentTypeHeader, content_type)
 
-        part.setBody(data)
+        if isinstance(data, QIODevice):
+            part.setBodyDevice(data)
+        else:
+            part.setBody(data)
         return part
 
     ## Overloaded from NetworkedPrinterOutputDevice.get() to be permissive of
@@ -8,18 +8,495 @@
 from ..Script import Script
 from UM.Logger import Logger
 from UM.Message import Message
-from tempfile import TemporaryDirectory
-from typing import List, Tuple
+from UM.Resources import Resources
+from tempfile import TemporaryDirectory, mkstemp
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+import configparser
+import hashlib
+import json
+import math
+import numpy
+import re
 import sys
 import subprocess
 import shutil
 import os
+import time
+import warnings
+
+class ObjectOutline:
+    """
+    Center and convex hull of the extrusion moves of an object, merged incrementally.
+    """
+
+    # moves that extrude (E > 0) to an X/Y position
+    _extrusion_regex = re.compile(r"^G[0-3](?= )(?=[^;\n]* E\+?\d*\.?\d*[1-9])(?=[^;\n]* X(-?\d*\.?\d+))(?=[^;\n]* Y(-?\d*\.?\d+))", re.MULTILINE)
+
+    _merge_size = 50000
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+
+        self._hull: List[Tuple[float, float]] = []
+        self._pending: List[Tuple[float, float]] = []
+        self._sum_x = 0.0
+        self._sum_y = 0.0
+        self._count = 0
+
+    def add_moves(self, text: str, start: int, end: int) -> None:
+        for x, y in self._extrusion_regex.findall(text, start, end):
+            point = (float(x), float(y))
+            self._sum_x += point[0]
+            self._sum_y += point[1]
+            self._count += 1
+            self._pending.append(point)
+
+        if len(self._pending) > self._merge_size:
+            self._merge()
+
+    def get_definition(self) -> str:
+        definition = "EXCLUDE_OBJECT_DEFINE NAME=%s" % (self.name,)
+        if self._count:
+            self._merge()
+            definition += " CENTER=%0.3f,%0.3f" % (self._sum_x / self._count, self._sum_y / self._count)
+            polygon = [[round(x, 3), round(y, 3)] for x, y in self._hull + self._hull[:1]]
+            definition += " POLYGON=%s" % (json.dumps(polygon, separators = (',', ':')),)
+        return definition
+
+    def _merge(self) -> None:
+        """
+        Replaces the hull by the convex hull of the hull and the pending points (monotone chain).
+        """
+        points = sorted(set(self._hull + self._pending))
+        self._pending = []
+        if len(points) < 3:
+            self._hull = points
+            return
+
+        def half_hull(points: List[Tuple[float, float]]) -> List[Tuple[float, float]]:
+            hull: List[Tuple[float, float]] = []
+            for point in points:
+                while len(hull) >= 2 and (hull[-1][0] - hull[-2][0]) * (point[1] - hull[-2][1]) - (hull[-1][1] - hull[-2][1]) * (point[0] - hull[-2][0]) <= 0:
+                    hull.pop()
+                hull.append(point)
+            return hull[:-1]
+
+        self._hull = half_hull(points) + half_hull(list(reversed(points)))
+
+
+class PrintTimeEstimator:
+    """
+    Estimates the print time of G-Code by planning its moves the way Klipper does.
+
+    The G-Code is read once into columns of moves, after which the junction speeds, the look-ahead and the
+    trapezoids of all moves are computed with NumPy. Both look-ahead passes are recurrences of the form
+    v[i] = min(limit[i], v[i - 1] + delta[i - 1]), which are solved with a cumulative minimum over prefix sums.
+    Arcs are split into segments like Klipper's gcode_arcs does. Heating and other waits are not timed.
+    """
+
+    _command_regex = re.compile(r"^(G[0-4]|G28|G9[0-2]|M8[23]|M109|M190|M204|M400|SET_VELOCITY_LIMIT|TEMPERATURE_WAIT|;TIME_ELAPSED(?=:))(?=[ \t;:]|$)([^;\n]*)", re.MULTILINE)
+
+    def __init__(self, config: Dict[str, float]) -> None:
+        """
+        The config uses the option names of Klipper's [printer], [extruder] and [gcode_arcs] sections.
+        """
+        self._max_velocity = config.get("max_velocity", 300.0)
+        self._max_accel = config.get("max_accel", 3000.0)
+        self._accel_to_decel: Optional[float] = config.get("max_accel_to_decel")
+        self._minimum_cruise_ratio = config.get("minimum_cruise_ratio", 0.5)
+        self._square_corner_velocity = config.get("square_corner_velocity", 5.0)
+        self._max_z_velocity = config.get("max_z_velocity", self._max_velocity)
+        self._max_z_accel = config.get("max_z_accel", self._max_accel)
+        self._instant_corner_velocity = config.get("instant_corner_velocity", 1.0)
+        self._arc_resolution = config.get("resolution", 1.0)
+
+        nozzle_diameter = config.get("nozzle_diameter", 0.4)
+        filament_diameter = config.get("filament_diameter", 1.75)
+        extrude_ratio = 4.0 * nozzle_diameter ** 2 / (math.pi * (filament_diameter / 2.0) ** 2)
+        self._max_extrude_only_velocity = config.get("max_extrude_only_velocity", self._max_velocity * extrude_ratio)
+        self._max_extrude_only_accel = config.get("max_extrude_only_accel", self._max_accel * extrude_ratio)
+
+    def estimate(self, data: List[str]) -> Tuple[float, List[List[float]]]:
+        """
+        Returns the total time and, for each layer, the elapsed time at each of its ;TIME_ELAPSED: markers.
+        """
+        moves, limits, stops, dwells, markers = self._read_moves(data)
+        move_times = numpy.concatenate(([0.0], numpy.cumsum(self._plan(moves, limits, stops))))
+
+        dwell_times = numpy.zeros(len(move_times))
+        for move_count, duration in dwells:
+            dwell_times[move_count] += duration
+        elapsed = move_times + numpy.cumsum(dwell_times)
+
+        return float(elapsed[-1]), [elapsed[layer_markers].tolist() for layer_markers in markers]
+
+    def _read_moves(self, data: List[str]):
+        """
+        Reads the moves of the layers into a (move, [dx, dy, dz, de, speed, limits]) array.
+
+        The limits column is an index into the returned (limits, [max_velocity, accel, accel_to_decel,
+        square_corner_velocity]) array, which gets a row for each change by M204 or SET_VELOCITY_LIMIT.
+        Also returns the moves after which the toolhead stops, the dwells as (move count, time) and the
+        move count at each ;TIME_ELAPSED: marker, per layer.
+        """
+        rows: List[Tuple[str, str]] = []
+        layer_ends: List[int] = []
+        for layer in data:
+            rows += self._command_regex.findall(layer)
+            layer_ends.append(len(rows))
+        row_count = len(rows)
+        if row_count == 0:
+            return numpy.zeros((0, 6)), numpy.zeros((0, 4)), numpy.zeros(0, dtype = numpy.int64), [], [[] for _ in data]
+
+        commands = numpy.array([command for command, _ in rows])
+        lines = (commands == "G0") | (commands == "G1")
+        arcs = (commands == "G2") | (commands == "G3")
+        markers = commands == ";TIME_ELAPSED"
+        motions = numpy.flatnonzero(lines | arcs)
+        values = self._read_parameters([rows[row][1] for row in motions])
+
+        # the other commands are rare, they are handled one at a time and spread over the rows afterwards
+        limits = [self._get_limits(self._max_velocity, self._max_accel, self._accel_to_decel, self._minimum_cruise_ratio, self._square_corner_velocity)]
+        limits_rows = [-1]
+        mode_rows: List[int] = [-1]
+        modes: List[Tuple[bool, bool]] = [(True, True)]
+        position_rows: List[int] = []
+        positions: List[Tuple[float, float, float, float]] = []
+        stop_rows: List[int] = []
+        dwells: List[Tuple[int, float]] = []
+
+        max_velocity, accel, accel_to_decel, minimum_cruise_ratio, square_corner_velocity = self._max_velocity, self._max_accel, self._accel_to_decel, self._minimum_cruise_ratio, self._square_corner_velocity
+        for row in numpy.flatnonzero(~(lines | arcs | markers)):
+            command, parameters = rows[row]
+            try:
+                if command in ("G90", "G91", "M82", "M83"):
+                    absolute_coordinates, absolute_extrude = modes[-1]
+                    if command[0] == "G":
+                        absolute_coordinates = command == "G90"
+                    else:
+                        absolute_extrude = command == "M82"
+                    mode_rows.append(row)
+                    modes.append((absolute_coordinates, absolute_extrude))
+                elif command in ("G28", "G92"):
+                    words = {word[0]: word[1:] for word in parameters.split()}
+                    if command == "G28":
+                        stop_rows.append(row)
+                        axes = [axis for axis in "XYZ" if axis in words] or ["X", "Y", "Z"]
+                        positions.append(tuple(0.0 if axis in axes else numpy.nan for axis in "XYZE"))
+                    else:
+                        positions.append(tuple(float(words[axis]) if axis in words else (numpy.nan if words else 0.0) for axis in "XYZE"))
+                    position_rows.append(row)
+                elif command == "G4":
+                    words = {word[0]: float(word[1:]) for word in parameters.split()}
+                    stop_rows.append(row)
+                    dwells.append((row, words["S"] if "S" in words else words.get("P", 0.0) / 1000.0))
+                elif command == "M204":
+                    words = {word[0]: float(word[1:]) for word in parameters.split()}
+                    if "S" in words:
+                        accel = words["S"]
+                    elif "P" in words and "T" in words:
+                        accel = min(words["P"], words["T"])
+                    limits_rows.append(row)
+                    limits.append(self._get_limits(max_velocity, accel, accel_to_decel, minimum_cruise_ratio, square_corner_velocity))
+                elif command == "SET_VELOCITY_LIMIT":
+                    words = dict((word.split("=", 1) + [""])[:2] for word in parameters.upper().split())
+                    max_velocity = float(words.get("VELOCITY", max_velocity))
+                    accel = float(words.get("ACCEL", accel))
+                    square_corner_velocity = float(words.get("SQUARE_CORNER_VELOCITY", square_corner_velocity))
+                    if "ACCEL_TO_DECEL" in words:
+                        accel_to_decel = float(words["ACCEL_TO_DECEL"])
+                    if "MINIMUM_CRUISE_RATIO" in words:
+                        minimum_cruise_ratio = float(words["MINIMUM_CRUISE_RATIO"])
+                        accel_to_decel = None
+                    limits_rows.append(row)
+                    limits.append(self._get_limits(max_velocity, accel, accel_to_decel, minimum_cruise_ratio, square_corner_velocity))
+                else:
+                    # waiting for temperatures or for the moves to finish
+                    stop_rows.append(row)
+            except (ValueError, KeyError):
+                Logger.log("w", "Could not estimate the time of %s%s", command, parameters)
+
+        mode_index = self._fill_forward(mode_rows, row_count)
+        modes_array = numpy.array(modes)
+        absolute_coordinates = modes_array[mode_index, 0]
+        absolute_extrude = modes_array[mode_index, 1] & absolute_coordinates
+        limits_index = self._fill_forward(limits_rows, row_count)
+
+        # the position after each row: set by absolute moves, G28 and G92, and moved by relative moves since then
+        position = numpy.zeros((row_count + 1, 4))
+        set_positions = numpy.array(positions).reshape(-1, 4)
+        for axis, letter in enumerate("XYZE"):
+            absolute = absolute_extrude if letter == "E" else absolute_coordinates
+            column = numpy.full(row_count, numpy.nan)
+            column[motions] = values[letter]
+            column[position_rows] = set_positions[:, axis]
+            given = ~numpy.isnan(column)
+            anchors = given & absolute
+            anchors[position_rows] = given[position_rows]
+            relative_sum = numpy.cumsum(numpy.where(given & ~anchors, column, 0.0))
+            last_anchor = numpy.maximum.accumulate(numpy.where(anchors, numpy.arange(row_count), -1))
+            anchor_base = numpy.where(anchors, column - relative_sum, 0.0)
+            position[1:, axis] = numpy.where(last_anchor >= 0, anchor_base[last_anchor], 0.0) + relative_sum
+
+        speed_rows = motions[~numpy.isnan(values["F"])]
+        speed_index = self._fill_forward(speed_rows, row_count)
+        speeds = numpy.concatenate((values["F"][~numpy.isnan(values["F"])] / 60.0, [25.0]))[speed_index]
+
+        # lines are a single move, arcs are split into segments; the moves of a row start at its move offset
+        deltas = position[1:] - position[:-1]
+        move_counts = numpy.where(lines & numpy.any(deltas != 0.0, axis = 1), 1, 0)
+        arc_rows = numpy.flatnonzero(arcs)
+        arc_centers = numpy.stack((values["I"], values["J"]), axis = 1)[numpy.searchsorted(motions, arc_rows)]
+        arc_centers = numpy.nan_to_num(arc_centers)
+        arc_segments = [self._split_arc(position[row], position[row + 1], center, commands[row] == "G2") for row, center in zip(arc_rows, arc_centers)]
+        move_counts[arc_rows] = [len(segments) for segments in arc_segments]
+        move_offsets = numpy.concatenate(([0], numpy.cumsum(move_counts)))
+
+        moves = numpy.empty((move_offsets[-1], 6))
+        line_rows = numpy.flatnonzero(move_counts * lines)
+        moves[move_offsets[line_rows], 0:4] = deltas[line_rows]
+        if arc_segments:
+            arc_moves = numpy.concatenate([numpy.arange(move_offsets[row], move_offsets[row + 1]) for row in arc_rows])
+            moves[arc_moves, 0:4] = numpy.concatenate(arc_segments)
+        move_rows = numpy.repeat(numpy.arange(row_count), move_counts)
+        moves[:, 4] = speeds[move_rows]
+        moves[:, 5] = limits_index[move_rows]
+
+        marker_moves = move_offsets[numpy.flatnonzero(markers)]
+        layer_markers = numpy.split(marker_moves, numpy.searchsorted(numpy.flatnonzero(markers), layer_ends[:-1]))
+        return moves, numpy.array(limits), move_offsets[stop_rows], [(move_offsets[row], duration) for row, duration in dwells], layer_markers
+
+    def _get_limits(self, max_velocity: float, accel: float, accel_to_decel: Optional[float], minimum_cruise_ratio: float, square_corner_velocity: float) -> Tuple[float, float, float, float]:
+        if accel_to_decel is None:
+            accel_to_decel = accel * (1.0 - minimum_cruise_ratio)
+        return (max_velocity, accel, min(accel_to_decel, accel), square_corner_velocity)
+
+    def _fill_forward(self, rows, row_count: int):
+        """
+        Returns for each row the index of the last of the given (sorted) rows at or before it, -1 for the rows before the
+        first one. The first of the rows may be -1 to make that index 0 instead.
+        """
+        indices = numpy.full(row_count, -1, dtype = numpy.int64)
+        rows = numpy.asarray(rows, dtype = numpy.int64)
+        indices[rows[rows >= 0]] = numpy.flatnonzero(rows >= 0)
+        indices = numpy.maximum.accumulate(indices) if row_count else indices
+        if len(rows) and rows[0] < 0:
+            indices = numpy.maximum(indices, 0)
+        return indices
+
+    def _read_parameters(self, parameters: List[str]) -> Dict[str, "numpy.ndarray"]:
+        """
+        Returns the X, Y, Z, E, F, I and J columns of the parameters of moves, NaN where a move does not have the parameter.
+        """
+        text = "\n".join(parameters).encode("ascii", "replace")
+        buffer = numpy.frombuffer(text, dtype = numpy.uint8)
+        letter_offsets = numpy.flatnonzero((buffer >= ord("A")) & (buffer <= ord("Z")))
+        letters = buffer[letter_offsets]
+        numbers = buffer.copy()
+        numbers[letter_offsets] = ord(" ")
+        try:
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore", DeprecationWarning)
+                numbers = numpy.fromstring(numbers.tobytes(), sep = " ")
+        except ValueError:
+            numbers = numpy.zeros(0)
+
+        if len(numbers) != len(letter_offsets):
+            # something like "X" without a number, read the parameters one at a time
+            words = [(row, word[0], word[1:]) for row, line in enumerate(parameters) for word in line.split()]
+            rows = numpy.array([row for row, _, _ in words], dtype = numpy.int64)
+            letters = numpy.array([ord(letter[0]) for _, letter, _ in words], dtype = numpy.uint8)
+            numbers = numpy.array([self._parse_float(number) for _, _, number in words])
+        else:
+            rows = numpy.searchsorted(numpy.flatnonzero(buffer == ord("\n")), letter_offsets)
+
+        values = {}
+        for letter in "XYZEFIJ":
+            selected = letters == ord(letter)
+            column = numpy.full(len(parameters), numpy.nan)
+            column[rows[selected]] = numbers[selected]
+            values[letter] = column
+        return values
+
+    def _parse_float(self, text: str) -> float:
+        try:
+            return float(text)
+        except ValueError:
+            return numpy.nan
+
+    def _split_arc(self, start, end, offset, clockwise: bool):
+        """
+        Returns the (dx, dy, dz, de) of the segments of an arc in the XY plane, as gcode_arcs plans them.
+        """
+        i, j = offset
+        center_x = start[0] + i
+        center_y = start[1] + j
+        angular_travel = math.atan2(-i * (end[1] - center_y) + j * (end[0] - center_x), -i * (end[0] - center_x) - j * (end[1] - center_y))
+        if angular_travel < 0.0:
+            angular_travel += 2.0 * math.pi
+        if clockwise:
+            angular_travel -= 2.0 * math.pi
+        if angular_travel == 0.0 and start[0] == end[0] and start[1] == end[1]:
+            angular_travel = 2.0 * math.pi
+
+        length = math.hypot(math.hypot(i, j) * angular_travel, end[2] - start[2])
+        segment_count = max(1, math.floor(length / self._arc_resolution))
+
+        fractions = numpy.arange(1, segment_count + 1) / segment_count
+        angles = angular_travel * fractions
+        points = start + (end - start) * fractions[:, None]
+        points[:-1, 0] = center_x - i * numpy.cos(angles[:-1]) + j * numpy.sin(angles[:-1])
+        points[:-1, 1] = center_y - i * numpy.sin(angles[:-1]) - j * numpy.cos(angles[:-1])
+        segments = numpy.diff(points, axis = 0, prepend = start[None, :])
+        return segments[numpy.any(segments != 0.0, axis = 1)]
+
+    def _plan(self, moves, limits, stops):
+        """
+        Returns the time of each move.
+        """
+        if len(moves) == 0:
+            return numpy.zeros(0)
+
+        move_limits = limits[moves[:, 5].astype(numpy.int64)]
+        axes_d = moves[:, 0:3]
+        extrude_d = moves[:, 3]
+
+        # moves that do not move the toolhead are limited by the extruder, and always start and end at a stop
+        xyz_d = numpy.sqrt(numpy.einsum("ij,ij->i", axes_d, axes_d))
+        kinematic = xyz_d >= 0.000000001
+        move_d = numpy.where(kinematic, xyz_d, numpy.abs(extrude_d))
+        with numpy.errstate(divide = "ignore", invalid = "ignore"):
+            # multiplied by the inverse like Klipper does, which matters for the junction of reversing moves
+            axes_r = axes_d * (1.0 / xyz_d)[:, None]
+            extrude_r = extrude_d * (1.0 / move_d)
+
+        junction_deviation = move_limits[:, 3] ** 2 * (math.sqrt(2.0) - 1.0) / move_limits[:, 1]
+        max_cruise_v2 = numpy.where(kinematic, numpy.minimum(moves[:, 4], move_limits[:, 0]), moves[:, 4]) ** 2
+        accel = numpy.where(kinematic, move_limits[:, 1], 99999999.9)
+
+        z_moves = kinematic & (axes_d[:, 2] != 0.0)
+        z_ratio = move_d[z_moves] / numpy.abs(axes_d[z_moves, 2])
+        max_cruise_v2[z_moves] = numpy.minimum(max_cruise_v2[z_moves], (self._max_z_velocity * z_ratio) ** 2)
+        accel[z_moves] = numpy.minimum(accel[z_moves], self._max_z_accel * z_ratio)
+
+        # moves that extrude without moving X or Y, and retractions, are limited by the extruder
+        extrude_only = (extrude_d != 0.0) & (((axes_d[:, 0] == 0.0) & (axes_d[:, 1] == 0.0)) | (extrude_r < 0.0))
+        inv_extrude_r = 1.0 / numpy.abs(extrude_r[extrude_only])
+        max_cruise_v2[extrude_only] = numpy.minimum(max_cruise_v2[extrude_only], (self._max_extrude_only_velocity * inv_extrude_r) ** 2)
+        accel[extrude_only] = numpy.minimum(accel[extrude_only], self._max_extrude_only_accel * inv_extrude_r)
+
+        delta_v2 = 2.0 * move_d * accel
+        smooth_delta_v2 = numpy.minimum(2.0 * move_d * move_limits[:, 2], delta_v2)
+
+        # the maximum speed at the start of each move, given the corner with the previous move
+        junction_cos_theta = -numpy.einsum("ij,ij->i", axes_r[1:], axes_r[:-1])
+        sin_theta_d2 = numpy.sqrt(numpy.maximum(0.5 * (1.0 - junction_cos_theta), 0.0))
+        cos_theta_d2 = numpy.sqrt(numpy.maximum(0.5 * (1.0 + junction_cos_theta), 0.0))
+        one_minus_sin_theta_d2 = 1.0 - sin_theta_d2
+        with numpy.errstate(divide = "ignore", invalid = "ignore"):
+            r_jd = sin_theta_d2 / one_minus_sin_theta_d2
+            quarter_tan_theta_d2 = 0.25 * sin_theta_d2 / cos_theta_d2
+            extrude_diff_r = numpy.abs(extrude_r[1:] - extrude_r[:-1])
+            extruder_v2 = numpy.where(extrude_diff_r > 0.0, (self._instant_corner_velocity / extrude_diff_r) ** 2, max_cruise_v2[1:])
+        junction_v2 = numpy.minimum.reduce([
+            extruder_v2,
+            max_cruise_v2[1:],
+            max_cruise_v2[:-1],
+            r_jd * junction_deviation[1:] * accel[1:],
+            r_jd * junction_deviation[:-1] * accel[:-1],
+            delta_v2[1:] * quarter_tan_theta_d2,
+            delta_v2[:-1] * quarter_tan_theta_d2,
+        ])
+        corners = (one_minus_sin_theta_d2 > 0.0) & (cos_theta_d2 > 0.0)
+        junction_v2 = numpy.where(corners, junction_v2, numpy.minimum.reduce([extruder_v2, max_cruise_v2[1:], max_cruise_v2[:-1]]))
+        junction_v2 = numpy.where(kinematic[1:] & kinematic[:-1], junction_v2, 0.0)
+        junction_v2 = numpy.concatenate(([0.0], junction_v2))
+        junction_v2[stops[stops < len(moves)]] = 0.0
+
+        # forward pass: the start speed is also limited by accelerating from the start of the previous move
+        max_start_v2 = self._accumulate_forward(junction_v2, delta_v2)
+        max_smoothed_v2 = self._accumulate_forward(max_start_v2, smooth_delta_v2)
+
+        # backward pass: each move must be able to decelerate to the start speed of the next one, which is 0 at the end
+        start_v2 = self._accumulate_backward(max_start_v2, delta_v2)
+        smoothed_v2 = self._accumulate_backward(max_smoothed_v2, smooth_delta_v2)
+        end_v2 = start_v2[1:]
+        start_v2 = start_v2[:-1]
+        next_smoothed_v2 = smoothed_v2[1:]
+        smoothed_v2 = smoothed_v2[:-1]
+
+        # moves that can accelerate cruise at most at the peak of the following moves,
+        # starting at the last of them that can decelerate; moves that cannot accelerate (a
+        # full deceleration after a peak) cruise at most at the lowest start speed since that peak
+        # speeds are equal where a move fully accelerates or decelerates, up to the rounding of the prefix sums
+        tolerance = 16.0 * numpy.finfo(numpy.float64).eps * (smooth_delta_v2.sum() + max_smoothed_v2.max())
+        reachable_smoothed_v2 = next_smoothed_v2 + smooth_delta_v2
+        can_accelerate = smoothed_v2 < reachable_smoothed_v2 - tolerance
+        after_full_deceleration = numpy.concatenate((~can_accelerate[1:], [False]))
+        peaks = can_accelerate & ((smoothed_v2 + smooth_delta_v2 > next_smoothed_v2 + tolerance) | after_full_deceleration)
+        peak_cruise_v2 = numpy.where(peaks, numpy.minimum(max_cruise_v2, (smoothed_v2 + reachable_smoothed_v2) * 0.5), 0.0)
+
+        indices = numpy.arange(len(moves))
+        next_peak = numpy.minimum.accumulate(numpy.where(peaks, indices, len(moves))[::-1])[::-1]
+        previous_peak = numpy.maximum.accumulate(numpy.where(peaks, indices, -1))
+        peak_cruise_v2 = numpy.concatenate((peak_cruise_v2, [0.0]))
+
+        cruise_v2 = numpy.minimum.reduce([(start_v2 + end_v2 + delta_v2) * 0.5, max_cruise_v2, peak_cruise_v2[next_peak]])
+
+        decelerating = numpy.flatnonzero(~can_accelerate)
+        if len(decelerating):
+            # lowest start speed since the peak, restarting the running minimum at each peak
+            run_start_v2 = start_v2[decelerating]
+            run_peak = previous_peak[decelerating]
+            offset = (run_start_v2.max() + 1.0) * numpy.unique(run_peak, return_inverse = True)[1]
+            run_min_v2 = numpy.minimum.accumulate(run_start_v2 - offset) + offset
+            cruise_v2[decelerating] = numpy.minimum(peak_cruise_v2[run_peak], run_min_v2)
+
+        start_v2 = numpy.minimum(start_v2, cruise_v2)
+        end_v2 = numpy.minimum(end_v2, cruise_v2)
+
+        half_inv_accel = 0.5 / accel
+        accel_d = (cruise_v2 - start_v2) * half_inv_accel
+        decel_d = (cruise_v2 - end_v2) * half_inv_accel
+        cruise_d = move_d - accel_d - decel_d
+        start_v = numpy.sqrt(start_v2)
+        cruise_v = numpy.sqrt(cruise_v2)
+        end_v = numpy.sqrt(end_v2)
+        return accel_d / ((start_v + cruise_v) * 0.5) + cruise_d / cruise_v + decel_d / ((end_v + cruise_v) * 0.5)
+
+    def _accumulate_forward(self, limit_v2, delta_v2):
+        """
+        Solves v2[i] = min(limit_v2[i], v2[i - 1] + delta_v2[i - 1]).
+        """
+        offsets = numpy.concatenate(([0.0], numpy.cumsum(delta_v2[:-1])))
+        return numpy.minimum.accumulate(limit_v2 - offsets) + offsets
+
+    def _accumulate_backward(self, limit_v2, delta_v2):
+        """
+        Solves v2[i] = min(limit_v2[i], v2[i + 1] + delta_v2[i]) with v2[n] = 0, returning n + 1 values.
+        """
+        offsets = numpy.concatenate(([0.0], numpy.cumsum(delta_v2)))
+        values = numpy.concatenate((limit_v2, [0.0])) + offsets
+        return numpy.minimum.accumulate(values[::-1])[::-1] - offsets
+
 
 class KlipperPreprocessor(Script):
     """
     Prepare resulting gcode for Klipper.
     """
 
+    _object_marker_regex = re.compile(r"^;(MESH|TIME_ELAPSED):(.*)$", re.MULTILINE)
+    _first_command_regex = re.compile(r"^[ \t]*[^;\s]", re.MULTILINE)
+    _time_regex = re.compile(r"^;TIME:(\d+(?:\.\d*)?)[ \t]*$", re.MULTILINE)
+    _time_elapsed_regex = re.compile(r"^;TIME_ELAPSED:.*$", re.MULTILINE)
+
+    # options read from printer.cfg by the built-in time estimator
+    _time_estimator_options = {
+        "printer": ("max_velocity", "max_accel", "max_accel_to_decel", "minimum_cruise_ratio", "square_corner_velocity", "max_z_velocity", "max_z_accel"),
+        "extruder": ("nozzle_diameter", "filament_diameter", "instant_corner_velocity", "max_extrude_only_velocity", "max_extrude_only_accel"),
+        "gcode_arcs": ("resolution",),
+    }
+
     def getSettingDataString(self) -> str:
         return """{
             "name": "Klipper Preprocessor v1.4.1",
@@ -42,6 +519,13 @@ class KlipperPreprocessor(Script):
                     "type": "bool",
                     "default_value": true
                 },
+                "add_exclude_object":
+                {
+                    "label": "Add EXCLUDE_OBJECT",
+                    "description": "Enable this to add Klipper's EXCLUDE_OBJECT_DEFINE, EXCLUDE_OBJECT_START and EXCLUDE_OBJECT_END commands to the resulting G-Code, based on the meshes Cura prints. This allows Klipper to cancel any specific single object while printing, without preprocess_cancellation.",
+                    "type": "bool",
+                    "default_value": false
+                },
                 "preprocess_cancellation_enabled": {
                     "label": "Use preprocess_cancellation",
                     "description": "Enable this to will allow the slicer to add object cancellation data to the resulting G-Code, enabling Klipper to cancel any specific single object while printing.",
@@ -129,6 +613,16 @@ class KlipperPreprocessor(Script):
                     "default_value": false,
                     "enabled": "klipper_estimator_enabled and klipper_estimator_config_type == 'moonraker_url'"
                 },
+                "klipper_estimator_config_ttl":
+                {
+                    "label": "Reuse config from Moonraker for",
+                    "description": "The config fetched from Moonraker is reused for this long before it is fetched again. When Moonraker cannot be reached, the last config that was fetched is used. Set to 0 to fetch the config on every run.",
+                    "unit": "min",
+                    "type": "int",
+                    "default_value": 60,
+                    "minimum_value": "0",
+                    "enabled": "klipper_estimator_enabled and klipper_estimator_config_type == 'moonraker_url'"
+                },
                 "klipper_estimator_config_file_path":
                 {
                     "label": "Path to config file",
@@ -136,77 +630,315 @@ class KlipperPreprocessor(Script):
                     "type": "str",
                     "default_value": "",
                     "enabled": "klipper_estimator_enabled and (klipper_estimator_config_type != 'moonraker_url' or klipper_estimator_config_cache)"
+                },
+                "time_estimator_enabled": {
+                    "label": "Use built-in time estimator",
+                    "description": "Enable this to replace the time estimation in the resulting G-Code by one that follows Klipper's motion planning (acceleration, square corner velocity and look-ahead), without an external binary. When klipper_estimator is used as well, its estimation is kept, and the difference is logged.",
+                    "type": "bool",
+                    "default_value": false
+                },
+                "time_estimator_printer_config_path":
+                {
+                    "label": "Path to printer.cfg",
+                    "description": "Optional path to a copy of Klipper's printer.cfg. The limits in its [printer], [extruder] and [gcode_arcs] sections are used instead of the values below. Included files are not read.",
+                    "type": "str",
+                    "default_value": "",
+                    "enabled": "time_estimator_enabled"
+                },
+                "time_estimator_max_velocity":
+                {
+                    "label": "Maximum velocity",
+                    "description": "Klipper's max_velocity.",
+                    "unit": "mm/s",
+                    "type": "float",
+                    "default_value": 300,
+                    "minimum_value": "1",
+                    "enabled": "time_estimator_enabled"
+                },
+                "time_estimator_max_accel":
+                {
+                    "label": "Maximum acceleration",
+                    "description": "Klipper's max_accel. M204 and SET_VELOCITY_LIMIT commands in the G-Code are followed.",
+                    "unit": "mm/s²",
+                    "type": "float",
+                    "default_value": 3000,
+                    "minimum_value": "1",
+                    "enabled": "time_estimator_enabled"
+                },
+                "time_estimator_minimum_cruise_ratio":
+                {
+                    "label": "Minimum cruise ratio",
+                    "description": "Klipper's minimum_cruise_ratio.",
+                    "type": "float",
+                    "default_value": 0.5,
+                    "minimum_value": "0",
+                    "maximum_value": "0.99",
+                    "enabled": "time_estimator_enabled"
+                },
+                "time_estimator_square_corner_velocity":
+                {
+                    "label": "Square corner velocity",
+                    "description": "Klipper's square_corner_velocity.",
+                    "unit": "mm/s",
+                    "type": "float",
+                    "default_value": 5,
+                    "minimum_value": "0",
+                    "enabled": "time_estimator_enabled"
+                },
+                "in_memory_size_limit":
+                {
+                    "label": "In-memory processing limit",
+                    "description": "G-Code up to this size is processed without writing it to disk. When preprocess_cancellation or klipper_estimator is used, the work file is kept in a memory-backed folder if the system has one. Larger G-Code is processed through a temporary file on disk.",
+                    "unit": "MB",
+                    "type": "int",
+                    "default_value": 256,
+                    "minimum_value": "0"
                 }
             }
         }"""
 
     def execute(self, data: List[str]) -> List[str]:
         try:
-            with TemporaryDirectory() as work_dir:
+            if self.getSettingValueByKey("add_exclude_object"):
+                data = self.add_exclude_object(data)
+
+            estimated_time: Optional[float] = None
+            if self.getSettingValueByKey("time_estimator_enabled"):
+                data, estimated_time = self.estimate_print_time(data)
+
+            in_memory_size_limit: int = self.getSettingValueByKey("in_memory_size_limit")
+            in_memory = sum(len(layer) for layer in data) <= in_memory_size_limit * 1024 * 1024
+
+            if in_memory and not self.uses_external_tools():
+                return self.process_in_memory(data)
+
+            with TemporaryDirectory(dir = self.get_memory_work_dir() if in_memory else None) as work_dir:
                 filename, total_layers = self.prepare_temp_file(data, work_dir)
 
                 self.execute_preprocess_cancellation(filename)
 
-                self.execute_klipper_estimator(filename, work_dir)
+                self.execute_klipper_estimator(filename)
+
+                data = self.return_processed_data(filename, total_layers)
 
-                return self.return_processed_data(filename, total_layers)
+            if estimated_time is not None and self.getSettingValueByKey("klipper_estimator_enabled"):
+                self.log_estimated_time_difference(data, estimated_time)
+
+            return data
         except Exception as e:
             self.showWarningMessage("Unhandled exception:\n%s" % (str(e),))
             return data
 
+    def add_exclude_object(self, data: List[str]) -> List[str]:
+        """
+        Adds EXCLUDE_OBJECT commands for the meshes in the layers, in a single pass.
+
+        Objects start at their ;MESH: marker, and end at the next ;MESH: marker or at the end of the layer.
+        The outline of each object is the convex hull of its extrusion moves, which is merged with the
+        new points as the layers are read. The definitions are added before the first G-Code command.
+        """
+        if any("EXCLUDE_OBJECT_DEFINE" in layer for layer in data):
+            Logger.log("d", "G-Code already has EXCLUDE_OBJECT markers")
+            return data
+
+        Logger.log("d", "Adding EXCLUDE_OBJECT markers...")
+
+        objects: Dict[str, ObjectOutline] = {}
+        current_object: Optional[ObjectOutline] = None
+        result: List[str] = []
+
+        for layer in data:
+            pieces: List[str] = []
+            position = 0
+
+            for match in self._object_marker_regex.finditer(layer):
+                if current_object:
+                    current_object.add_moves(layer, position, match.start())
+
+                line_end = match.end() + 1 if match.end() < len(layer) else match.end()
+                pieces.append(layer[position:line_end])
+                if line_end == match.end():
+                    pieces.append("\n")
+                position = line_end
+
+                if current_object:
+                    pieces.append("EXCLUDE_OBJECT_END NAME=%s\n" % (current_object.name,))
+                    current_object = None
+
+                mesh = match.group(2).strip()
+                if match.group(1) == "MESH" and mesh != "NONMESH":
+                    if mesh not in objects:
+                        objects[mesh] = ObjectOutline(re.sub(r"\W+", "_", mesh).strip("_"))
+                    current_object = objects[mesh]
+                    pieces.append("EXCLUDE_OBJECT_START NAME=%s\n" % (current_object.name,))
+
+            if current_object:
+                current_object.add_moves(layer, position, len(layer))
+            pieces.append(layer[position:])
+            result.append("".join(pieces))
+
+        if current_object and result:
+            result[-1] += ("" if result[-1].endswith("\n") else "\n") + "EXCLUDE_OBJECT_END NAME=%s\n" % (current_object.name,)
+
+        definitions = ["; %d known objects" % (len(objects),)]
+        for outline in objects.values():
+            definitions.append(outline.get_definition())
+        definitions = "\n".join(definitions) + "\n"
+
+        for index, layer in enumerate(result):
+            match = self._first_command_regex.search(layer)
+            if match:
+                result[index] = layer[:match.start()] + definitions + layer[match.start():]
+                break
+
+        return result
+
+    def estimate_print_time(self, data: List[str]) -> Tuple[List[str], float]:
+        """
+        Replaces the ;TIME: and ;TIME_ELAPSED: values by the estimation of the built-in time estimator.
+        """
+        Logger.log("d", "Estimating print time...")
+
+        estimator = PrintTimeEstimator(self.get_time_estimator_config())
+        total_time, elapsed_times = estimator.estimate(data)
+
+        Logger.log("d", "Estimated print time: %d s", total_time)
+
+        result: List[str] = []
+        for layer, layer_elapsed_times in zip(data, elapsed_times):
+            if layer_elapsed_times:
+                elapsed_time = iter(layer_elapsed_times)
+                layer = self._time_elapsed_regex.sub(lambda match: ";TIME_ELAPSED:%f" % (next(elapsed_time),), layer)
+            result.append(layer)
+
+        if result:
+            result[0] = self._time_regex.sub(";TIME:%d" % (round(total_time),), result[0], 1)
+
+        return result, total_time
+
+    def get_time_estimator_config(self) -> Dict[str, float]:
+        config = {
+            "max_velocity": self.getSettingValueByKey("time_estimator_max_velocity"),
+            "max_accel": self.getSettingValueByKey("time_estimator_max_accel"),
+            "minimum_cruise_ratio": self.getSettingValueByKey("time_estimator_minimum_cruise_ratio"),
+            "square_corner_velocity": self.getSettingValueByKey("time_estimator_square_corner_velocity"),
+        }
+
+        printer_config_path: str = self.getSettingValueByKey("time_estimator_printer_config_path")
+        if not printer_config_path:
+            return config
+
+        parser = configparser.ConfigParser(strict = False, interpolation = None, inline_comment_prefixes = ("#", ";"))
+        try:
+            with open(printer_config_path, encoding = "utf-8") as printer_config:
+                parser.read_file(printer_config)
+        except (OSError, configparser.Error) as e:
+            self.showWarningMessage("Failed to read printer.cfg, using the configured limits\n%s" % (str(e),))
+            return config
+
+        for section, options in self._time_estimator_options.items():
+            for option in options:
+                if parser.has_option(section, option):
+                    try:
+                        config[option] = parser.getfloat(section, option)
+                    except ValueError:
+                        Logger.log("w", "Ignoring [%s] %s in printer.cfg", section, option)
+
+        # an old max_accel_to_decel is only used if printer.cfg does not have the minimum_cruise_ratio that replaced it
+        if "max_accel_to_decel" in config and parser.has_option("printer", "minimum_cruise_ratio"):
+            del config["max_accel_to_decel"]
+
+        return config
+
+    def log_estimated_time_difference(self, data: List[str], estimated_time: float) -> None:
+        match = self._time_regex.search(data[0]) if data else None
+        if not match or not float(match.group(1)):
+            return
+
+        klipper_estimator_time = float(match.group(1))
+        Logger.log("d", "Built-in time estimator: %d s, klipper_estimator: %d s (%+.2f%%)", estimated_time, klipper_estimator_time, (estimated_time / klipper_estimator_time - 1.0) * 100.0)
+
+    def uses_external_tools(self) -> bool:
+        return self.getSettingValueByKey("preprocess_cancellation_enabled") or self.getSettingValueByKey("klipper_estimator_enabled")
+
+    def get_memory_work_dir(self) -> Optional[str]:
+        # preprocess_cancellation and klipper_estimator rewrite the file they are given, so they cannot work on pipes;
+        # a memory-backed folder keeps their work file off the disk
+        if sys.platform.startswith("linux") and os.path.isdir("/dev/shm") and os.access("/dev/shm", os.W_OK):
+            return "/dev/shm"
+        return None
+
+    def process_in_memory(self, data: List[str]) -> List[str]:
+        Logger.log("d", "Processing in memory...")
+
+        total_layers = sum(layer.startswith(";LAYER:") + layer.count("\n;LAYER:") for layer in data)
+        Logger.log("d", "Total layers found: %d", total_layers)
+
+        return self.rebuild_layers(self.iterate_prepared_lines(data), total_layers)
+
     def prepare_temp_file(self, data: List[str], work_dir: str) -> Tuple[str, int]:
         Logger.log("d", "Initial run...")
 
-        add_timelapse_take_frame: bool = self.getSettingValueByKey("add_timelapse_take_frame")
-
         filename = os.path.join(work_dir, "work.gcode")
         total_layers = 0
 
         with open(filename, 'w') as work_file:
-            for index, layer in enumerate(data):
-                if index:
-                    work_file.write(";CURA_DATA_SPLIT_HERE\n")
-
-                lines = layer.split("\n")
-
-                for line in lines:
-                    if line.startswith(';LAYER:'):
-                        total_layers += 1
-                        if add_timelapse_take_frame:
-                            work_file.write("TIMELAPSE_TAKE_FRAME\n")
-                    work_file.write(line + "\n")
+            for line in self.iterate_prepared_lines(data):
+                if line.startswith(';LAYER:'):
+                    total_layers += 1
+                work_file.write(line)
 
         Logger.log("d", "Total layers found: %d", total_layers)
 
         return filename, total_layers
 
+    def iterate_prepared_lines(self, data: List[str]) -> Iterator[str]:
+        """
+        Yields the lines of the work file: the layers separated by split markers, with timelapse frames added.
+        """
+        add_timelapse_take_frame: bool = self.getSettingValueByKey("add_timelapse_take_frame")
+
+        for index, layer in enumerate(data):
+            if index:
+                yield ";CURA_DATA_SPLIT_HERE\n"
+
+            lines = layer.split("\n")
+
+            for line in lines:
+                if add_timelapse_take_frame and line.startswith(';LAYER:'):
+                    yield "TIMELAPSE_TAKE_FRAME\n"
+                yield line + "\n"
+
     def return_processed_data(self, filename: str, total_layers: int) -> List[str]:
         Logger.log("d", "Return output...")
 
+        with open(filename) as work_file:
+            return self.rebuild_layers(work_file, total_layers)
+
+    def rebuild_layers(self, lines: Iterable[str], total_layers: int) -> List[str]:
         add_set_print_stats_info: bool = self.getSettingValueByKey("add_set_print_stats_info")
 
         data: List[str] = []
         current_layer = 0
 
-        with open(filename) as work_file:
-            layer: List[str] = []
+        layer: List[str] = []
 
-            for line in work_file:
-                line = line.strip()
+        for line in lines:
+            line = line.strip()
 
-                if line == ";CURA_DATA_SPLIT_HERE":
-                    data.append("\n".join(layer))
-                    layer = []
-                else:
-                    layer.append(line)
+            if line == ";CURA_DATA_SPLIT_HERE":
+                data.append("\n".join(layer))
+                layer = []
+            else:
+                layer.append(line)
 
-                    if add_set_print_stats_info:
-                        if line.startswith(';LAYER:'):
-                            current_layer += 1
-                            layer.append("SET_PRINT_STATS_INFO CURRENT_LAYER=%s" % (current_layer,))
-                        elif line.startswith(';LAYER_COUNT:'):
-                            layer.append("SET_PRINT_STATS_INFO TOTAL_LAYER=%s" % (total_layers,))
-            data.append("\n".join(layer))
+                if add_set_print_stats_info:
+                    if line.startswith(';LAYER:'):
+                        current_layer += 1
+                        layer.append("SET_PRINT_STATS_INFO CURRENT_LAYER=%s" % (current_layer,))
+                    elif line.startswith(';LAYER_COUNT:'):
+                        layer.append("SET_PRINT_STATS_INFO TOTAL_LAYER=%s" % (total_layers,))
+        data.append("\n".join(layer))
 
         return data
 
@@ -233,7 +965,7 @@ class KlipperPreprocessor(Script):
             except Exception as e:
                 self.showWarningMessage("Failed to run preprocess_cancellation\n%s" % (str(e),))
 
-    def execute_klipper_estimator(self, filename: str, work_dir: str) -> None:
+    def execute_klipper_estimator(self, filename: str) -> None:
         klipper_estimator_enabled: bool = self.getSettingValueByKey("klipper_estimator_enabled")
 
         if klipper_estimator_enabled:
@@ -243,31 +975,16 @@ class KlipperPreprocessor(Script):
             klipper_estimator_config_file_path: str = self.getSettingValueByKey("klipper_estimator_config_file_path")
             klipper_estimator_path: str = self.getSettingValueByKey("klipper_estimator_path")
 
-            if klipper_estimator_config_type == 'moonraker_url' and self.getSettingValueByKey("klipper_estimator_config_cache"):
-                Logger.log("d", "Running klipper_estimator to get config from Moonraker...")
+            if klipper_estimator_config_type == 'moonraker_url':
+                dumped_config_filename = self.get_moonraker_config(klipper_estimator_path, klipper_estimator_moonraker_url, klipper_estimator_moonraker_api_key)
 
-                klipper_estimator_config_type = 'file'
-
-                args = [
-                    klipper_estimator_path,
-                    "--config_moonraker_url",
-                    klipper_estimator_moonraker_url,
-                    "--config_moonraker_api_key",
-                    klipper_estimator_moonraker_api_key,
-                    "dump-config"
-                ]
-
-                config_filename = os.path.join(work_dir, "config.json")
-
-                with open(config_filename, 'w') as config_file:
-                    try:
-                        ret = subprocess.run(args, stdout = config_file, stderr = subprocess.PIPE, startupinfo = self.getSubprocessStartupinfo(), timeout = 5)
-                        if ret.returncode == 0:
-                            shutil.copy(config_filename, klipper_estimator_config_file_path)
-                        else:
-                            self.showWarningMessage("Failed to run klipper_estimator\n%s" % (ret.stderr.decode().strip(),))
-                    except subprocess.TimeoutExpired:
-                        pass
+                if self.getSettingValueByKey("klipper_estimator_config_cache"):
+                    klipper_estimator_config_type = 'file'
+                    if dumped_config_filename:
+                        shutil.copy(dumped_config_filename, klipper_estimator_config_file_path)
+                elif dumped_config_filename:
+                    klipper_estimator_config_type = 'file'
+                    klipper_estimator_config_file_path = dumped_config_filename
 
             Logger.log("d", "Running klipper_estimator...")
 
@@ -294,6 +1011,62 @@ class KlipperPreprocessor(Script):
             except Exception as e:
                 self.showWarningMessage("Failed to run klipper_estimator\n%s" % (str(e),))
 
+    def get_moonraker_config(self, klipper_estimator_path: str, moonraker_url: str, moonraker_api_key: str) -> Optional[str]:
+        """
+        Returns the path of the config dumped from Moonraker, or None if there is none.
+
+        Dumps are kept per Moonraker URL, and are only fetched again when they are older than the configured time.
+        When Moonraker cannot be reached, the last good dump is used.
+        """
+        config_ttl: int = self.getSettingValueByKey("klipper_estimator_config_ttl")
+
+        cache_dir = os.path.join(Resources.getDataStoragePath(), "klipper_estimator_configs")
+        config_filename = os.path.join(cache_dir, hashlib.sha1(moonraker_url.encode("utf-8")).hexdigest() + ".json")
+
+        try:
+            config_age = time.time() - os.path.getmtime(config_filename)
+        except OSError:
+            config_age = None
+
+        if config_age is not None and config_age < config_ttl * 60:
+            Logger.log("d", "Using config dumped from Moonraker %d s ago...", config_age)
+            return config_filename
+
+        Logger.log("d", "Running klipper_estimator to get config from Moonraker...")
+
+        args = [
+            klipper_estimator_path,
+            "--config_moonraker_url",
+            moonraker_url,
+            "--config_moonraker_api_key",
+            moonraker_api_key,
+            "dump-config"
+        ]
+
+        os.makedirs(cache_dir, exist_ok = True)
+        file_descriptor, temporary_filename = mkstemp(dir = cache_dir, suffix = ".tmp")
+        try:
+            with os.fdopen(file_descriptor, 'w') as config_file:
+                ret = subprocess.run(args, stdout = config_file, stderr = subprocess.PIPE, startupinfo = self.getSubprocessStartupinfo(), timeout = 5)
+            if ret.returncode == 0:
+                os.replace(temporary_filename, config_filename)
+                return config_filename
+
+            error = ret.stderr.decode().strip()
+        except subprocess.TimeoutExpired:
+            error = None
+        finally:
+            if os.path.exists(temporary_filename):
+                os.remove(temporary_filename)
+
+        if config_age is not None:
+            Logger.log("w", "Could not get config from Moonraker, using the config dumped %d s ago", config_age)
+            return config_filename
+
+        if error is not None:
+            self.showWarningMessage("Failed to run klipper_estimator\n%s" % (error,))
+        return None
+
     def getSubprocessStartupinfo(self):
         if sys.platform == "win32":
             startupinfo = subprocess.STARTUPINFO()
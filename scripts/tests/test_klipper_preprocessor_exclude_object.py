@@ -0,0 +1,174 @@
+# Copyright (c) 2023 Pedro Lamas
+# MIT licensed
+
+import importlib.util
+import json
+import math
+import os
+import random
+
+import pytest
+
+# the script is a PostProcessingPlugin script, so Cura's plugins folder must be on the path
+pytest.importorskip("PostProcessingPlugin.Script")
+
+
+def _loadScript():
+    path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "KlipperPreprocessor.py")
+    spec = importlib.util.spec_from_file_location("PostProcessingPlugin.scripts.KlipperPreprocessor", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+KlipperPreprocessor = _loadScript()
+
+
+def _addExcludeObject(data):
+    # only the regexes of the class are used, so the settings of the script are not needed
+    script = KlipperPreprocessor.KlipperPreprocessor.__new__(KlipperPreprocessor.KlipperPreprocessor)
+    return script.add_exclude_object(data)
+
+
+def _slicedGcode(layer_count = 8, seed = 3):
+    """
+    Cura-like G-Code with several meshes, NONMESH sections, travel moves and retractions.
+    """
+    rng = random.Random(seed)
+    meshes = {
+        "cube.stl": lambda: rng.choice([(rng.choice([20.0, 40.0]), 20.0 + 5 * rng.randint(0, 4)), (20.0 + 5 * rng.randint(0, 4), rng.choice([20.0, 40.0]))]),
+        "Cylinder (1).stl": lambda: (150 + 15 * math.cos(rng.uniform(0, 2 * math.pi)), 150 + 15 * math.sin(rng.uniform(0, 2 * math.pi))),
+        "blob.3mf": lambda: (rng.gauss(100, 10), rng.gauss(60, 5)),
+    }
+    data = [";FLAVOR:Marlin\n;TIME:1234\n;Generated with Cura_SteamEngine 5.4.0\nM140 S60\nM104 S200\nG28\n"]
+    e = 0.0
+    for layer_nr in range(layer_count):
+        lines = [";LAYER:%d" % layer_nr, "G0 F6000 X0 Y0 Z%.1f" % (0.2 * (layer_nr + 1))]
+        for mesh in rng.sample(list(meshes) + ["NONMESH"], 4):
+            lines.append(";MESH:%s" % mesh)
+            if mesh == "NONMESH":
+                lines.append("G0 F6000 X%.3f Y%.3f" % (rng.uniform(0, 200), rng.uniform(0, 200)))
+                continue
+            lines.append(";TYPE:WALL-OUTER")
+            x, y = meshes[mesh]()
+            lines.append("G0 F6000 X%.3f Y%.3f" % (x, y))
+            lines.append("G1 F2100 E%.5f" % e)
+            for _ in range(rng.randint(5, 60)):
+                x, y = meshes[mesh]()
+                e += 0.1
+                lines.append("G1 X%.3f Y%.3f E%.5f" % (x, y, e))
+            lines.append("G1 F2100 E%.5f" % (e - 0.8))
+            # a travel far away, which is not part of the outline
+            lines.append("G0 F6000 X%.3f Y%.3f" % (rng.uniform(0, 200), rng.uniform(0, 200)))
+        lines.append(";TIME_ELAPSED:%d" % (layer_nr * 10))
+        data.append("\n".join(lines) + "\n")
+    data.append(";End of Gcode\nM140 S0\nM104 S0\n")
+    return data
+
+
+def _convexHull(points):
+    """
+    Reference hull: gift wrapping, counterclockwise, without collinear points.
+    """
+    points = sorted(set(points))
+    if len(points) < 3:
+        return points
+    hull = []
+    current = points[0]
+    while True:
+        hull.append(current)
+        candidate = points[1] if current == points[0] else points[0]
+        for point in points:
+            cross = (candidate[0] - current[0]) * (point[1] - current[1]) - (candidate[1] - current[1]) * (point[0] - current[0])
+            farther = math.hypot(point[0] - current[0], point[1] - current[1]) > math.hypot(candidate[0] - current[0], candidate[1] - current[1])
+            if cross < 0 or (cross == 0 and farther):
+                candidate = point
+        current = candidate
+        if current == points[0]:
+            return hull
+
+
+def _scanLines(data):
+    """
+    Reference: walks the lines of the G-Code, returning the expected lines without definitions and the points of each object.
+    """
+    lines = []
+    points = {}
+    current = None
+    for line in "".join(data).split("\n"):
+        lines.append(line)
+        if line.startswith((";MESH:", ";TIME_ELAPSED:")):
+            if current:
+                lines.append("EXCLUDE_OBJECT_END NAME=%s" % (current,))
+                current = None
+            mesh = line.split(":", 1)[1].strip()
+            if line.startswith(";MESH:") and mesh != "NONMESH":
+                current = "_".join(word for word in "".join(character if character.isalnum() or character == "_" else " " for character in mesh).split())
+                points.setdefault(current, [])
+                lines.append("EXCLUDE_OBJECT_START NAME=%s" % (current,))
+        elif current and line.split(" ")[0] in ("G0", "G1", "G2", "G3"):
+            words = {word[0]: float(word[1:]) for word in line.split(";")[0].split()[1:]}
+            if words.get("E", 0.0) > 0.0 and "X" in words and "Y" in words:
+                points[current].append((words["X"], words["Y"]))
+    return lines, points
+
+
+def _readDefinitions(lines):
+    definitions = {}
+    for line in lines:
+        if line.startswith("EXCLUDE_OBJECT_DEFINE "):
+            words = dict(word.split("=", 1) for word in line.split()[1:])
+            definitions[words["NAME"]] = words
+    return definitions
+
+
+@pytest.mark.parametrize("merge_size", [50000, 7])
+def test_markers_and_outlines_match_a_line_by_line_scan(monkeypatch, merge_size):
+    # a small merge size merges the hull with new points many times while the layers are read
+    monkeypatch.setattr(KlipperPreprocessor.ObjectOutline, "_merge_size", merge_size)
+    data = _slicedGcode()
+
+    result = _addExcludeObject(data)
+
+    assert len(result) == len(data)
+    lines = "".join(result).split("\n")
+    expected_lines, points = _scanLines(data)
+    definitions = _readDefinitions(lines)
+    assert [line for line in lines if not line.startswith(("EXCLUDE_OBJECT_DEFINE ", "; 3 known objects"))] == expected_lines
+
+    assert sorted(definitions) == sorted(points) == ["Cylinder_1_stl", "blob_3mf", "cube_stl"]
+    for name, object_points in points.items():
+        center = [float(value) for value in definitions[name]["CENTER"].split(",")]
+        assert center == [round(sum(point[axis] for point in object_points) / len(object_points), 3) for axis in (0, 1)]
+
+        polygon = [tuple(point) for point in json.loads(definitions[name]["POLYGON"])]
+        assert polygon[0] == polygon[-1]
+        assert sorted(polygon[:-1]) == sorted(_convexHull(object_points))
+
+    # the cube is a rectangle, its sides have many collinear points
+    assert sorted(json.loads(definitions["cube_stl"]["POLYGON"])[:-1]) == [[20.0, 20.0], [20.0, 40.0], [40.0, 20.0], [40.0, 40.0]]
+
+
+def test_definitions_go_before_the_first_command():
+    result = _addExcludeObject(_slicedGcode())
+
+    lines = result[0].split("\n")
+    assert lines[:3] == [";FLAVOR:Marlin", ";TIME:1234", ";Generated with Cura_SteamEngine 5.4.0"]
+    assert lines[3] == "; 3 known objects"
+    assert all(line.startswith("EXCLUDE_OBJECT_DEFINE ") for line in lines[4:7])
+    assert lines[7] == "M140 S60"
+
+
+def test_an_object_open_at_the_end_is_ended():
+    data = [";FLAVOR:Marlin\nG28\n", ";LAYER:0\n;MESH:part.stl\nG1 X1 Y1 E1\nG1 X2 Y1 E2\nG1 X1 Y2 E3"]
+
+    result = _addExcludeObject(data)
+
+    assert result[1] == ";LAYER:0\n;MESH:part.stl\nEXCLUDE_OBJECT_START NAME=part_stl\nG1 X1 Y1 E1\nG1 X2 Y1 E2\nG1 X1 Y2 E3\nEXCLUDE_OBJECT_END NAME=part_stl\n"
+    assert "EXCLUDE_OBJECT_DEFINE NAME=part_stl CENTER=1.333,1.333 POLYGON=[[1.0,1.0],[2.0,1.0],[1.0,2.0],[1.0,1.0]]\nG28\n" in result[0]
+
+
+def test_gcode_with_markers_is_left_alone():
+    data = [";FLAVOR:Marlin\nEXCLUDE_OBJECT_DEFINE NAME=part\nG28\n", ";LAYER:0\n;MESH:part.stl\nG1 X1 Y1 E1\n"]
+
+    assert _addExcludeObject(data) is data
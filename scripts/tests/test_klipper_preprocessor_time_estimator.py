@@ -0,0 +1,384 @@
+# Copyright (c) 2023 Pedro Lamas
+# MIT licensed
+
+import importlib.util
+import math
+import os
+import random
+
+import numpy
+import pytest
+
+# the script is a PostProcessingPlugin script, so Cura's plugins folder must be on the path
+pytest.importorskip("PostProcessingPlugin.Script")
+
+
+def _loadScript():
+    path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "KlipperPreprocessor.py")
+    spec = importlib.util.spec_from_file_location("PostProcessingPlugin.scripts.KlipperPreprocessor", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+KlipperPreprocessor = _loadScript()
+
+_config = {
+    "max_velocity": 300.0,
+    "max_accel": 3000.0,
+    "minimum_cruise_ratio": 0.5,
+    "square_corner_velocity": 5.0,
+    "max_z_velocity": 15.0,
+    "max_z_accel": 100.0,
+    "instant_corner_velocity": 1.0,
+    "max_extrude_only_velocity": 60.0,
+    "max_extrude_only_accel": 1500.0,
+    "resolution": 0.5,
+}
+
+
+class _Move:
+    """
+    Klipper's toolhead.Move, one move at a time.
+    """
+
+    def __init__(self, toolhead, start_pos, end_pos, speed):
+        self.accel = toolhead.max_accel
+        self.junction_deviation = toolhead.junction_deviation
+        self.speed = speed
+        self.limits = (toolhead.max_velocity, toolhead.max_accel, toolhead.max_accel_to_decel, toolhead.square_corner_velocity)
+        velocity = min(speed, toolhead.max_velocity)
+        self.is_kinematic_move = True
+        self.axes_d = axes_d = [end_pos[i] - start_pos[i] for i in range(4)]
+        self.move_d = move_d = math.sqrt(sum(d * d for d in axes_d[:3]))
+        if move_d < 0.000000001:
+            axes_d[0] = axes_d[1] = axes_d[2] = 0.0
+            self.move_d = move_d = abs(axes_d[3])
+            inv_move_d = 1.0 / move_d if move_d else 0.0
+            self.accel = 99999999.9
+            velocity = speed
+            self.is_kinematic_move = False
+        else:
+            inv_move_d = 1.0 / move_d
+        self.axes_r = [d * inv_move_d for d in axes_d]
+        self.max_start_v2 = 0.0
+        self.max_cruise_v2 = velocity ** 2
+        self.delta_v2 = 2.0 * move_d * self.accel
+        self.max_smoothed_v2 = 0.0
+        self.smooth_delta_v2 = 2.0 * move_d * toolhead.max_accel_to_decel
+        self.time = None
+
+    def limit_speed(self, speed, accel):
+        self.max_cruise_v2 = min(self.max_cruise_v2, speed ** 2)
+        self.accel = min(self.accel, accel)
+        self.delta_v2 = 2.0 * self.move_d * self.accel
+        self.smooth_delta_v2 = min(self.smooth_delta_v2, self.delta_v2)
+
+    def calc_junction(self, prev_move, instant_corner_velocity):
+        if not self.is_kinematic_move or not prev_move.is_kinematic_move:
+            return
+        diff_r = self.axes_r[3] - prev_move.axes_r[3]
+        extruder_v2 = (instant_corner_velocity / abs(diff_r)) ** 2 if diff_r else self.max_cruise_v2
+        max_start_v2 = min(extruder_v2, self.max_cruise_v2, prev_move.max_cruise_v2, prev_move.max_start_v2 + prev_move.delta_v2)
+        junction_cos_theta = -sum(self.axes_r[i] * prev_move.axes_r[i] for i in range(3))
+        sin_theta_d2 = math.sqrt(max(0.5 * (1.0 - junction_cos_theta), 0.0))
+        cos_theta_d2 = math.sqrt(max(0.5 * (1.0 + junction_cos_theta), 0.0))
+        one_minus_sin_theta_d2 = 1.0 - sin_theta_d2
+        if one_minus_sin_theta_d2 > 0.0 and cos_theta_d2 > 0.0:
+            r_jd = sin_theta_d2 / one_minus_sin_theta_d2
+            quarter_tan_theta_d2 = 0.25 * sin_theta_d2 / cos_theta_d2
+            max_start_v2 = min(max_start_v2,
+                r_jd * self.junction_deviation * self.accel,
+                r_jd * prev_move.junction_deviation * prev_move.accel,
+                self.delta_v2 * quarter_tan_theta_d2,
+                prev_move.delta_v2 * quarter_tan_theta_d2)
+        self.max_start_v2 = max_start_v2
+        self.max_smoothed_v2 = min(max_start_v2, prev_move.max_smoothed_v2 + prev_move.smooth_delta_v2)
+
+    def set_junction(self, start_v2, cruise_v2, end_v2):
+        half_inv_accel = 0.5 / self.accel
+        accel_d = (cruise_v2 - start_v2) * half_inv_accel
+        decel_d = (cruise_v2 - end_v2) * half_inv_accel
+        cruise_d = self.move_d - accel_d - decel_d
+        start_v, cruise_v, end_v = math.sqrt(start_v2), math.sqrt(cruise_v2), math.sqrt(end_v2)
+        self.time = accel_d / ((start_v + cruise_v) * 0.5) + cruise_d / cruise_v + decel_d / ((end_v + cruise_v) * 0.5)
+
+
+class _ToolHead:
+    """
+    Reference estimator: reads the G-Code line by line like Klipper's gcode_move and gcode_arcs, and plans the
+    moves with the look-ahead of Klipper's toolhead, one move at a time.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self.set_limits(config["max_velocity"], config["max_accel"], config["square_corner_velocity"], config["minimum_cruise_ratio"])
+        self.position = [0.0, 0.0, 0.0, 0.0]
+        self.absolute_coordinates = True
+        self.absolute_extrude = True
+        self.speed = 25.0
+        self.moves = []
+        self.queue = []
+        self.dwells = []
+
+    def set_limits(self, max_velocity, max_accel, square_corner_velocity, minimum_cruise_ratio):
+        self.max_velocity = max_velocity
+        self.max_accel = max_accel
+        self.square_corner_velocity = square_corner_velocity
+        self.minimum_cruise_ratio = minimum_cruise_ratio
+        self.max_accel_to_decel = max_accel * (1.0 - minimum_cruise_ratio)
+        self.junction_deviation = square_corner_velocity ** 2 * (math.sqrt(2.0) - 1.0) / max_accel
+
+    def move(self, end_pos, speed):
+        move = _Move(self, self.position, end_pos, speed)
+        self.position = list(end_pos)
+        if not move.move_d:
+            return
+        if move.is_kinematic_move and move.axes_d[2]:
+            z_ratio = move.move_d / abs(move.axes_d[2])
+            move.limit_speed(self.config["max_z_velocity"] * z_ratio, self.config["max_z_accel"] * z_ratio)
+        if move.axes_d[3] and ((not move.axes_d[0] and not move.axes_d[1]) or move.axes_r[3] < 0.0):
+            inv_extrude_r = 1.0 / abs(move.axes_r[3])
+            move.limit_speed(self.config["max_extrude_only_velocity"] * inv_extrude_r, self.config["max_extrude_only_accel"] * inv_extrude_r)
+        if self.queue:
+            move.calc_junction(self.queue[-1], self.config["instant_corner_velocity"])
+        self.queue.append(move)
+        self.moves.append(move)
+
+    def flush(self):
+        """
+        LookAheadQueue.flush, without lazy flushing.
+        """
+        delayed = []
+        next_end_v2 = next_smoothed_v2 = peak_cruise_v2 = 0.0
+        for move in reversed(self.queue):
+            reachable_start_v2 = next_end_v2 + move.delta_v2
+            start_v2 = min(move.max_start_v2, reachable_start_v2)
+            reachable_smoothed_v2 = next_smoothed_v2 + move.smooth_delta_v2
+            smoothed_v2 = min(move.max_smoothed_v2, reachable_smoothed_v2)
+            if smoothed_v2 < reachable_smoothed_v2:
+                if smoothed_v2 + move.smooth_delta_v2 > next_smoothed_v2 or delayed:
+                    peak_cruise_v2 = min(move.max_cruise_v2, (smoothed_v2 + reachable_smoothed_v2) * 0.5)
+                    if delayed:
+                        mc_v2 = peak_cruise_v2
+                        for delayed_move, ms_v2, me_v2 in reversed(delayed):
+                            mc_v2 = min(mc_v2, ms_v2)
+                            delayed_move.set_junction(min(ms_v2, mc_v2), mc_v2, min(me_v2, mc_v2))
+                        del delayed[:]
+                cruise_v2 = min((start_v2 + reachable_start_v2) * 0.5, move.max_cruise_v2, peak_cruise_v2)
+                move.set_junction(min(start_v2, cruise_v2), cruise_v2, min(next_end_v2, cruise_v2))
+            else:
+                delayed.append((move, start_v2, next_end_v2))
+            next_end_v2 = start_v2
+            next_smoothed_v2 = smoothed_v2
+        self.queue = []
+
+    def g1(self, words):
+        position = list(self.position)
+        for axis, letter in enumerate("XYZE"):
+            if letter in words:
+                absolute = self.absolute_extrude and self.absolute_coordinates if letter == "E" else self.absolute_coordinates
+                position[axis] = words[letter] if absolute else position[axis] + words[letter]
+        if "F" in words:
+            self.speed = words["F"] / 60.0
+        self.move(position, self.speed)
+
+    def g2(self, words, clockwise):
+        """
+        gcode_arcs: the arc is split into G1 moves with an equal share of the extrusion.
+        """
+        start = self.position
+        target = [words.get(letter, start[axis]) for axis, letter in enumerate("XYZ")]
+        offset = (words.get("I", 0.0), words.get("J", 0.0))
+        r_p, r_q = -offset[0], -offset[1]
+        center_p, center_q = start[0] - r_p, start[1] - r_q
+        rt_alpha, rt_beta = target[0] - center_p, target[1] - center_q
+        angular_travel = math.atan2(r_p * rt_beta - r_q * rt_alpha, r_p * rt_alpha + r_q * rt_beta)
+        if angular_travel < 0.0:
+            angular_travel += 2.0 * math.pi
+        if clockwise:
+            angular_travel -= 2.0 * math.pi
+        if angular_travel == 0.0 and start[0] == target[0] and start[1] == target[1]:
+            angular_travel = 2.0 * math.pi
+        linear_travel = target[2] - start[2]
+        flat_mm = math.hypot(r_p, r_q) * angular_travel
+        mm_of_travel = math.hypot(flat_mm, linear_travel) if linear_travel else abs(flat_mm)
+        segments = max(1, math.floor(mm_of_travel / self.config["resolution"]))
+
+        coords = []
+        for i in range(1, segments):
+            theta = i * angular_travel / segments
+            coords.append([
+                center_p - offset[0] * math.cos(theta) + offset[1] * math.sin(theta),
+                center_q - offset[0] * math.sin(theta) - offset[1] * math.cos(theta),
+                start[2] + i * linear_travel / segments])
+        coords.append(target)
+
+        e_base = start[3] if self.absolute_extrude else 0.0
+        e_per_move = (words["E"] - e_base) / len(coords) if "E" in words else 0.0
+        for coord in coords:
+            g1_words = {"X": coord[0], "Y": coord[1], "Z": coord[2]}
+            if e_per_move:
+                g1_words["E"] = e_base + e_per_move
+                if self.absolute_extrude:
+                    e_base += e_per_move
+            if "F" in words:
+                g1_words["F"] = words["F"]
+            self.g1(g1_words)
+
+    def read(self, data):
+        """
+        Returns the move count at each ;TIME_ELAPSED: marker, per layer.
+        """
+        markers = []
+        for layer in data:
+            layer_markers = []
+            for line in layer.split("\n"):
+                if line.startswith(";TIME_ELAPSED:"):
+                    layer_markers.append(len(self.moves))
+                code = line.split(";")[0].split()
+                if not code:
+                    continue
+                command = code[0]
+                if command == "SET_VELOCITY_LIMIT":
+                    words = dict(word.split("=") for word in code[1:])
+                    self.set_limits(float(words.get("VELOCITY", self.max_velocity)), float(words.get("ACCEL", self.max_accel)), float(words.get("SQUARE_CORNER_VELOCITY", self.square_corner_velocity)), float(words.get("MINIMUM_CRUISE_RATIO", self.minimum_cruise_ratio)))
+                    continue
+                words = {word[0]: float(word[1:]) for word in code[1:]}
+                if command in ("G0", "G1"):
+                    self.g1(words)
+                elif command in ("G2", "G3"):
+                    self.g2(words, command == "G2")
+                elif command in ("G90", "G91"):
+                    self.absolute_coordinates = command == "G90"
+                elif command in ("M82", "M83"):
+                    self.absolute_extrude = command == "M82"
+                elif command == "G92":
+                    for axis, letter in enumerate("XYZE"):
+                        if letter in words:
+                            self.position[axis] = words[letter]
+                elif command == "G28":
+                    self.flush()
+                    for axis, letter in enumerate("XYZ"):
+                        if letter in words or not words:
+                            self.position[axis] = 0.0
+                elif command == "G4":
+                    self.flush()
+                    self.dwells.append((len(self.moves), words.get("P", 0.0) / 1000.0))
+                elif command == "M204":
+                    self.set_limits(self.max_velocity, words["S"], self.square_corner_velocity, self.minimum_cruise_ratio)
+                elif command in ("M400", "M109", "M190"):
+                    self.flush()
+            markers.append(layer_markers)
+        self.flush()
+        return markers
+
+    def elapsed(self, move_count):
+        return sum(move.time for move in self.moves[:move_count]) + sum(duration for count, duration in self.dwells if count <= move_count)
+
+
+def _slicedGcode(layer_count = 6, relative = False, seed = 5):
+    """
+    Cura-like G-Code: walls, infill, retractions, Z hops, arcs and changes of acceleration and speed.
+    """
+    rng = random.Random(seed)
+    data = [";FLAVOR:Marlin\n;TIME:6666\nM190 S60\nM109 S200\nG28\nG90\n%s\nG92 E0\nG1 F300 Z5\nG4 P500\nM400\n" % ("M83" if relative else "M82",)]
+    e = 0.0
+
+    def extrude(distance):
+        nonlocal e
+        e += distance * 0.0332
+        return distance * 0.0332 if relative else e
+
+    def retract(amount):
+        nonlocal e
+        e += amount
+        return "G1 F2400 E%.5f" % (amount if relative else e,)
+
+    x, y = 0.0, 0.0
+    for layer_nr in range(layer_count):
+        z = 0.2 * (layer_nr + 1)
+        lines = [";LAYER:%d" % layer_nr, "G0 F9000 X%.3f Y%.3f Z%.1f" % (x, y, z)]
+        for part in range(3):
+            cx, cy, radius = rng.uniform(60, 160), rng.uniform(60, 160), rng.uniform(5, 30)
+            lines.append("M204 S%d" % rng.choice([500, 1000, 3000]))
+            lines.append(";TYPE:WALL-OUTER")
+            lines.append("G0 F9000 X%.3f Y%.3f" % (cx + radius, cy))
+            lines.append(retract(0.8))
+            x, y = cx + radius, cy
+            for step in range(1, 37):
+                next_x, next_y = round(cx + radius * math.cos(step * math.pi / 18), 3), round(cy + radius * math.sin(step * math.pi / 18), 3)
+                lines.append("G1 F%d X%.3f Y%.3f E%.5f" % (1800 if step == 1 else rng.choice([1800, 1800, 1500]), next_x, next_y, extrude(math.hypot(next_x - x, next_y - y))))
+                x, y = next_x, next_y
+            lines.append(";TYPE:FILL")
+            lines.append("M204 S3000")
+            for row in range(8):
+                next_x, next_y = cx - radius / 2 + (row % 2) * radius, cy - radius / 2 + row * 0.4
+                lines.append("G1 F6000 X%.3f Y%.3f E%.5f" % (next_x, next_y, extrude(math.hypot(next_x - x, next_y - y))))
+                x, y = next_x, next_y
+            # a full arc and a partial one, like ArcWelder writes them
+            lines.append("G2 F2400 X%.3f Y%.3f I%.3f J0 E%.5f" % (x, y, radius / 3, extrude(2 * math.pi * radius / 3)))
+            lines.append("G3 X%.3f Y%.3f I%.3f J%.3f E%.5f" % (x + 4, y + 4, 4, 0, extrude(2 * math.pi)))
+            x, y = x + 4, y + 4
+            lines.append(retract(-0.8))
+            lines.append("G1 F900 Z%.1f" % (z + 0.4,))
+            lines.append("G0 F9000 X%.3f Y%.3f" % (x + rng.uniform(-20, 20), y + rng.uniform(-20, 20)))
+            lines.append("G1 F900 Z%.1f" % (z,))
+            x, y = [float(value[1:]) for value in lines[-2].split()[2:4]]
+            lines.append(";TIME_ELAPSED:%d" % (layer_nr * 10 + part,))
+        if layer_nr == 2:
+            lines.append("SET_VELOCITY_LIMIT VELOCITY=200 ACCEL=2000 SQUARE_CORNER_VELOCITY=8 MINIMUM_CRUISE_RATIO=0.3")
+        if layer_nr == 4:
+            lines.append("G4 P1500")
+        data.append("\n".join(lines) + "\n")
+    data.append(";End of Gcode\nM400\nG91\nG1 F600 Z10\nG90\nM104 S0\n")
+    return data
+
+
+@pytest.mark.parametrize("relative", [False, True])
+def test_moves_match_a_line_by_line_reader(relative):
+    data = _slicedGcode(relative = relative)
+    estimator = KlipperPreprocessor.PrintTimeEstimator(_config)
+
+    moves, limits, stops, dwells, markers = estimator._read_moves(data)
+
+    toolhead = _ToolHead(_config)
+    expected_markers = toolhead.read(data)
+    assert len(moves) == len(toolhead.moves)
+    numpy.testing.assert_allclose(moves[:, 0:4], [move.axes_d for move in toolhead.moves], rtol = 0, atol = 1e-9)
+    numpy.testing.assert_allclose(moves[:, 4], [move.speed for move in toolhead.moves], rtol = 1e-12)
+    assert numpy.sum(moves[:, 3] < 0) > 0
+    assert [layer_markers.tolist() for layer_markers in markers] == expected_markers
+    assert [(int(move_count), duration) for move_count, duration in dwells] == toolhead.dwells
+    assert limits[moves[:, 5].astype(int)].tolist() == [list(move.limits) for move in toolhead.moves]
+
+
+@pytest.mark.parametrize("relative", [False, True])
+def test_times_match_klippers_look_ahead(relative):
+    data = _slicedGcode(relative = relative)
+    total_time, elapsed_times = KlipperPreprocessor.PrintTimeEstimator(_config).estimate(data)
+
+    toolhead = _ToolHead(_config)
+    markers = toolhead.read(data)
+    expected_total = toolhead.elapsed(len(toolhead.moves))
+
+    # the prefix sums round speeds close to 0, which is only noticeable after the junction of reversing Z moves
+    assert total_time == pytest.approx(expected_total, rel = 0, abs = 1e-6)
+    assert len(elapsed_times) == len(data)
+    for layer_elapsed_times, layer_markers in zip(elapsed_times, markers):
+        assert layer_elapsed_times == pytest.approx([toolhead.elapsed(move_count) for move_count in layer_markers], rel = 0, abs = 1e-6)
+
+
+def test_move_times_match_klippers_look_ahead():
+    data = _slicedGcode()
+    estimator = KlipperPreprocessor.PrintTimeEstimator(_config)
+    moves, limits, stops, dwells, markers = estimator._read_moves(data)
+
+    toolhead = _ToolHead(_config)
+    toolhead.read(data)
+
+    numpy.testing.assert_allclose(estimator._plan(moves, limits, stops), [move.time for move in toolhead.moves], rtol = 0, atol = 1e-7)
+
+
+def test_empty_gcode():
+    assert KlipperPreprocessor.PrintTimeEstimator(_config).estimate([";FLAVOR:Marlin\n", ";End of Gcode\n"]) == (0.0, [[], []])